@@ -1,23 +1,16 @@
-import dataclasses
+import asyncio
 import io
 import json
 import logging
 import mimetypes
 import os
+import tempfile
 import time
-import sys
 import uuid
-from collections.abc import AsyncGenerator
+from collections.abc import AsyncGenerator, AsyncIterator
 from pathlib import Path
-from typing import Any, Union, cast
-
-from azure.cognitiveservices.speech import (
-    ResultReason,
-    SpeechConfig,
-    SpeechSynthesisOutputFormat,
-    SpeechSynthesisResult,
-    SpeechSynthesizer,
-)
+from typing import Any, Optional, Union, cast
+
 from azure.core.exceptions import ResourceNotFoundError
 from azure.identity.aio import (
     AzureDeveloperCliCredential,
@@ -49,20 +42,22 @@ from quart import (
     request,
     send_file,
     send_from_directory,
-    Response,
-    request,
-    jsonify,
 )
 from quart_cors import cors
 
-from approaches.approach import Approach
+from approaches.approach import Approach, ExtraInfo, ThoughtStep
 from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
 from approaches.chatreadretrievereadvision import ChatReadRetrieveReadVisionApproach
 from approaches.promptmanager import PromptyManager
+from approaches.promptpacker import DEFAULT_RESERVED_TOKENS, PromptPacker
+from approaches.queryrewritepolicy import QueryRewritePolicy
 from approaches.retrievethenread import RetrieveThenReadApproach
 from approaches.retrievethenreadvision import RetrieveThenReadVisionApproach
 from chat_history.cosmosdb import chat_history_cosmosdb_bp
+from chat_logging.chat_logger import chat_logger
 from config import (
+    CONFIG_ACL_INDEX_TASK,
+    CONFIG_ADMIN_USER_OIDS,
     CONFIG_AGENT_CLIENT,
     CONFIG_AGENTIC_RETRIEVAL_ENABLED,
     CONFIG_ASK_APPROACH,
@@ -73,13 +68,19 @@ from config import (
     CONFIG_CHAT_HISTORY_BROWSER_ENABLED,
     CONFIG_CHAT_HISTORY_COSMOS_ENABLED,
     CONFIG_CHAT_VISION_APPROACH,
+    CONFIG_CONVERSATION_STORE,
     CONFIG_CREDENTIAL,
     CONFIG_DEFAULT_REASONING_EFFORT,
     CONFIG_DEVELOPER_FEATURES_ENABLED,
     CONFIG_GPT4V_DEPLOYED,
     CONFIG_INGESTER,
     CONFIG_LANGUAGE_PICKER_ENABLED,
+    CONFIG_LOOP_LAG_TASK,
+    CONFIG_METRICS_REGISTRY,
     CONFIG_OPENAI_CLIENT,
+    CONFIG_PROFILE_STORE,
+    CONFIG_PROMPT_MANAGER,
+    CONFIG_PROMPT_RELOAD_TASK,
     CONFIG_QUERY_REWRITING_ENABLED,
     CONFIG_REASONING_EFFORT_ENABLED,
     CONFIG_SEARCH_CLIENT,
@@ -91,16 +92,42 @@ from config import (
     CONFIG_SPEECH_SERVICE_LOCATION,
     CONFIG_SPEECH_SERVICE_TOKEN,
     CONFIG_SPEECH_SERVICE_VOICE,
+    CONFIG_SPEECH_SYNTHESIS,
+    CONFIG_STAGE_DURATIONS_IN_THOUGHTS,
+    CONFIG_STREAM_COALESCE_BYTES,
+    CONFIG_STREAM_COALESCE_MS,
     CONFIG_STREAMING_ENABLED,
     CONFIG_USER_BLOB_CONTAINER_CLIENT,
     CONFIG_USER_UPLOAD_ENABLED,
     CONFIG_VECTOR_SEARCH_ENABLED,
 )
+from core.aclindex import AclIndex, watch_acl_index
 from core.authentication import AuthenticationHelper
+from core.conversationstore import ConversationStore, SQLiteConversationBacking
+from core.imageshelper import ImageCache
+from core.instrumentation import (
+    MetricsRegistry,
+    RequestTimings,
+    current_timings,
+    stage,
+    start_request_timings,
+    watch_event_loop_lag,
+)
+from core.ndjsonencoder import NDJSONEncoder, coalesce_frames
+from core.pathauthcache import PathAuthCache
+from core.profiling import (
+    ProfiledStream,
+    ProfileStore,
+    current_profiler,
+    save_request_profile,
+    start_request_profiler,
+    stop_request_profiler,
+)
 from core.sessionhelper import create_session_id
+from core.speechsynthesis import SpeechAudioCache, SpeechSynthesisService
+from core.structuredlogging import configure_logging, parse_category_settings
 from decorators import authenticated, authenticated_path
 from error import error_dict, error_response
-from chat_logging.chat_logger import chat_logger
 from prepdocs import (
     clean_key_if_exists,
     setup_embeddings_service,
@@ -201,25 +228,32 @@ async def ask(auth_claims: dict[str, Any]):
         r = await approach.run(
             request_json["messages"], context=context, session_state=request_json.get("session_state")
         )
+        if current_app.config[CONFIG_STAGE_DURATIONS_IN_THOUGHTS]:
+            add_stage_durations_thought(r.get("context"), current_timings())
         return jsonify(r)
     except Exception as error:
         return error_response(error, "/ask")
 
 
-class JSONEncoder(json.JSONEncoder):
-    def default(self, o):
-        if dataclasses.is_dataclass(o) and not isinstance(o, type):
-            return dataclasses.asdict(o)
-        return super().default(o)
+# Parts of ExtraInfo that do not change while an answer streams, so they are serialized only once per stream
+NDJSON_CACHED_FIELDS = ("data_points", "description")
 
 
-async def format_as_ndjson(r: AsyncGenerator[dict, None]) -> AsyncGenerator[str, None]:
-    try:
-        async for event in r:
-            yield json.dumps(event, ensure_ascii=False, cls=JSONEncoder) + "\n"
-    except Exception as error:
-        logging.exception("Exception while generating response stream: %s", error)
-        yield json.dumps(error_dict(error))
+async def format_as_ndjson(
+    r: AsyncGenerator[dict, None], coalesce_ms: float = 0, coalesce_bytes: int = 0
+) -> AsyncGenerator[bytes, None]:
+    encoder = NDJSONEncoder(cached_fields=NDJSON_CACHED_FIELDS)
+
+    async def frames() -> AsyncGenerator[bytes, None]:
+        try:
+            async for event in r:
+                yield encoder.encode(event)
+        except Exception as error:
+            logging.exception("Exception while generating response stream: %s", error)
+            yield json.dumps(error_dict(error)).encode()
+
+    async for frame in coalesce_frames(frames(), coalesce_ms, coalesce_bytes):
+        yield frame
 
 
 @bp.route("/chat", methods=["POST"])
@@ -233,6 +267,8 @@ async def chat(auth_claims: dict[str, Any]):
     
     # Generăm un ID unic pentru această cerere
     request_id = str(uuid.uuid4())
+    if profiler := current_profiler():
+        profiler.request_id = request_id
     
     try:
         use_gpt4v = context.get("overrides", {}).get("use_gpt4v", False)
@@ -250,6 +286,16 @@ async def chat(auth_claims: dict[str, Any]):
                 current_app.config[CONFIG_CHAT_HISTORY_COSMOS_ENABLED],
                 current_app.config[CONFIG_CHAT_HISTORY_BROWSER_ENABLED],
             )
+
+        # With server-side history the client only sends the new messages, and the stored history is prepended
+        conversation_store: Optional[ConversationStore] = current_app.config.get(CONFIG_CONVERSATION_STORE)
+        use_server_side_history = conversation_store is not None and bool(request_json.get("server_side_history"))
+        chat_messages = request_json["messages"]
+        if conversation_store is not None and use_server_side_history:
+            if session_state is None:
+                session_state = str(uuid.uuid4())
+            conversation_key = ConversationStore.make_key(auth_claims.get("oid"), session_state)
+            chat_messages = await conversation_store.build_messages(conversation_key, request_json["messages"])
         
         # Extragem informațiile pentru logging
         messages = request_json.get("messages", [])
@@ -258,10 +304,12 @@ async def chat(auth_claims: dict[str, Any]):
         overrides = context.get("overrides", {})
         
         result = await approach.run(
-            request_json["messages"],
+            chat_messages,
             context=context,
             session_state=session_state,
         )
+        if current_app.config[CONFIG_STAGE_DURATIONS_IN_THOUGHTS] and isinstance(result, dict):
+            add_stage_durations_thought(result.get("context"), current_timings())
         
         # Finalizăm logging-ul
         answer = result.get("message", {}).get("content", "") if isinstance(result, dict) else ""
@@ -301,27 +349,31 @@ async def chat(auth_claims: dict[str, Any]):
         # Capturăm modelul real din approach (dacă este disponibil)
         actual_model = getattr(approach, 'chatgpt_model', overrides.get("chatgpt_model", "unknown"))
         
-        chat_logger.start_chat_log(
-            request_id=request_id,
-            question=user_question,
-            user_id=user_id,
-            conversation_id=session_state,
-            extra_info_thoughts=thoughts_serialized,
-            agentic_retrival_total_token_usage=agentic_token_usage,
-            prompt_total_token_usage=prompt_token_usage,
-            model_used=actual_model,
-            temperature=overrides.get("temperature"),
-            timestamp_start=real_start_timestamp
-        )
-        
-        # Încercăm să extragem token usage din result pentru finish_chat_log
-        # Tokens_used nu mai e folosit - eliminat din funcție
-        
-        chat_logger.finish_chat_log(
-            request_id=request_id,
-            answer=answer,
-            agentic_retrival_duration_seconds=agentic_duration
-        )
+        with stage("chat_logging"):
+            chat_logger.start_chat_log(
+                request_id=request_id,
+                question=user_question,
+                user_id=user_id,
+                conversation_id=session_state,
+                extra_info_thoughts=thoughts_serialized,
+                agentic_retrival_total_token_usage=agentic_token_usage,
+                prompt_total_token_usage=prompt_token_usage,
+                model_used=actual_model,
+                temperature=overrides.get("temperature"),
+                timestamp_start=real_start_timestamp
+            )
+
+            # Încercăm să extragem token usage din result pentru finish_chat_log
+            # Tokens_used nu mai e folosit - eliminat din funcție
+
+            chat_logger.finish_chat_log(
+                request_id=request_id,
+                answer=answer,
+                agentic_retrival_duration_seconds=agentic_duration
+            )
+
+        if conversation_store is not None and use_server_side_history:
+            await conversation_store.record_turn(conversation_key, request_json["messages"], answer)
         
         # Adăugăm informații de tracking pentru feedback
         if isinstance(result, dict):
@@ -347,6 +399,8 @@ async def chat_stream(auth_claims: dict[str, Any]):
     
     # Generăm un ID unic pentru această cerere
     request_id = str(uuid.uuid4())
+    if profiler := current_profiler():
+        profiler.request_id = request_id
     
     try:
         use_gpt4v = context.get("overrides", {}).get("use_gpt4v", False)
@@ -364,6 +418,16 @@ async def chat_stream(auth_claims: dict[str, Any]):
                 current_app.config[CONFIG_CHAT_HISTORY_COSMOS_ENABLED],
                 current_app.config[CONFIG_CHAT_HISTORY_BROWSER_ENABLED],
             )
+
+        # With server-side history the client only sends the new messages, and the stored history is prepended
+        conversation_store: Optional[ConversationStore] = current_app.config.get(CONFIG_CONVERSATION_STORE)
+        use_server_side_history = conversation_store is not None and bool(request_json.get("server_side_history"))
+        chat_messages = request_json["messages"]
+        if conversation_store is not None and use_server_side_history:
+            if session_state is None:
+                session_state = str(uuid.uuid4())
+            conversation_key = ConversationStore.make_key(auth_claims.get("oid"), session_state)
+            chat_messages = await conversation_store.build_messages(conversation_key, request_json["messages"])
         
         # Extragem informațiile pentru logging
         messages = request_json.get("messages", [])
@@ -372,107 +436,104 @@ async def chat_stream(auth_claims: dict[str, Any]):
         overrides = context.get("overrides", {})
         
         result = await approach.run_stream(
-            request_json["messages"],
+            chat_messages,
             context=context,
             session_state=session_state,
         )
         
+        # The generator runs after the request returns, outside the app context, so it keeps its own reference
+        app_logger = current_app.logger
+        timings = current_timings()
+        add_stage_thought = timings is not None and current_app.config[CONFIG_STAGE_DURATIONS_IN_THOUGHTS]
+        if timings is not None:
+            timings.streaming = True
+        profile_store: ProfileStore = current_app.config[CONFIG_PROFILE_STORE]
+        if profiler is not None:
+            profiler.streaming = True
+
         # Pentru stream, colectăm răspunsul pentru logging
         async def logged_result_generator():
-            full_answer = ""
-            extra_info_received = None
+            # Only buffers what logging needs; the logging itself runs after the stream, in the background,
+            # so extracting token usage and serializing thoughts never delays the first token
+            answer_parts: list[str] = []
+            extra_info_received: Optional[ExtraInfo] = None
             first_item = True
-            logging_started = False
-            streaming_started = False
-            agentic_duration_for_logging = None
-            
-            async for item in result:
-                if isinstance(item, dict):
-                    # Adăugăm tracking info la primul item
-                    if first_item:
-                        item["tracking"] = {
-                            "request_id": request_id,
-                            "session_id": session_state,
-                            "conversation_id": session_state
-                        }
-                        first_item = False
-                    
-                    # Salvăm extra_info și începem logging când primim context
-                    if "context" in item:
-                        extra_info_received = item["context"]
-                        
-                        # Începem logging-ul când avem context cu extra_info
-                        if not logging_started and extra_info_received:
-                            # Extragem informațiile pentru logging extins
-                            agentic_token_usage = None
-                            prompt_token_usage = None
-                            thoughts_serialized = ""
-                            agentic_duration = None
-                            
-                            if hasattr(extra_info_received, 'thoughts'):
-                                # Extragem token usage pentru agentic retrieval
-                                agentic_token_usage = chat_logger._extract_agentic_token_usage(extra_info_received.thoughts)
-                                
-                                # Extragem token usage total pentru prompt-uri
-                                prompt_token_usage = chat_logger._extract_prompt_token_usage(extra_info_received.thoughts)
-                                
-                                # Serializăm thoughts pentru salvare
-                                thoughts_serialized = chat_logger._serialize_thoughts(extra_info_received.thoughts)
-                            
-                            # Extragem durata agentic dacă există
-                            if hasattr(extra_info_received, 'agentic_duration_seconds'):
-                                agentic_duration = extra_info_received.agentic_duration_seconds
-                                agentic_duration_for_logging = agentic_duration
-                            
-                            # Extragem timestamp-ul real de start dacă există
-                            real_start_timestamp = None
-                            if hasattr(extra_info_received, 'real_start_timestamp'):
-                                real_start_timestamp = extra_info_received.real_start_timestamp
-                            
-                            # Capturăm modelul real din approach
-                            actual_model = getattr(approach, 'chatgpt_model', overrides.get("chatgpt_model", "unknown"))
-                            
-                            chat_logger.start_chat_log(
-                                request_id=request_id,
-                                question=user_question,
-                                user_id=user_id,
-                                conversation_id=session_state,
-                                extra_info_thoughts=thoughts_serialized,
-                                agentic_retrival_total_token_usage=agentic_token_usage,
-                                prompt_total_token_usage=prompt_token_usage,
-                                model_used=actual_model,
-                                temperature=overrides.get("temperature"),
-                                timestamp_start=real_start_timestamp
-                            )
-                            logging_started = True
-                    
-                    # Acumulăm răspunsul pentru logging
-                    if "delta" in item and isinstance(item["delta"], dict) and "content" in item["delta"]:
-                        content = item["delta"]["content"]
-                        if content:
+            timestamp_start_streaming = None
+
+            try:
+                async for item in result:
+                    if isinstance(item, dict):
+                        # Adăugăm tracking info la primul item
+                        if first_item:
+                            item["tracking"] = {
+                                "request_id": request_id,
+                                "session_id": session_state,
+                                "conversation_id": session_state,
+                            }
+                            first_item = False
+
+                        # The approach updates the same ExtraInfo in place, so the first one seen is enough
+                        if extra_info_received is None and isinstance(item.get("context"), ExtraInfo):
+                            extra_info_received = item["context"]
+                            if add_stage_thought:
+                                add_stage_durations_thought(extra_info_received, timings)
+
+                        # Acumulăm răspunsul pentru logging
+                        delta = item.get("delta")
+                        if isinstance(delta, dict) and (content := delta.get("content")):
                             # Marcăm începutul streaming-ului la primul content
-                            if not streaming_started and logging_started:
-                                chat_logger.log_streaming_start(request_id=request_id)
-                                streaming_started = True
-                            full_answer += content
-                
-                yield item
-            
-            # La sfârșitul stream-ului, finalizăm logging-ul doar dacă l-am început
-            if logging_started:
-                # Extragem token usage-ul final din ultimul extra_info_received
-                final_prompt_token_usage = None
-                if extra_info_received and hasattr(extra_info_received, 'thoughts'):
-                    final_prompt_token_usage = chat_logger._extract_prompt_token_usage(extra_info_received.thoughts)
-                
-                chat_logger.finish_chat_log(
-                    request_id=request_id,
-                    answer=full_answer,
-                    agentic_retrival_duration_seconds=agentic_duration_for_logging,
-                    final_prompt_token_usage=final_prompt_token_usage
+                            if timestamp_start_streaming is None:
+                                timestamp_start_streaming = chat_logger.get_bucharest_time()
+                            answer_parts.append(content)
+
+                    yield item
+
+                # Sends the thoughts again, now with the answer stages that ran during the stream. Only the thoughts,
+                # since the client merges a context without data_points into the response instead of replacing it
+                if add_stage_thought and extra_info_received is not None:
+                    yield {"context": {"thoughts": extra_info_received.thoughts}}
+            finally:
+                # Also logs streams the client abandoned, with the part of the answer sent so far
+                if extra_info_received is not None:
+                    with stage("chat_logging"):
+                        chat_logger.log_streamed_chat(
+                            request_id=request_id,
+                            question=user_question,
+                            user_id=user_id,
+                            conversation_id=session_state,
+                            extra_info=extra_info_received,
+                            answer_parts=answer_parts,
+                            # Capturăm modelul real din approach
+                            model_used=getattr(approach, "chatgpt_model", overrides.get("chatgpt_model", "unknown")),
+                            temperature=overrides.get("temperature"),
+                            timestamp_start_streaming=timestamp_start_streaming,
+                        )
+                # Abandoned streams keep the part of the answer the user already saw, so the next turn follows it
+                if conversation_store is not None and use_server_side_history:
+                    try:
+                        await conversation_store.record_turn(
+                            conversation_key, request_json["messages"], "".join(answer_parts)
+                        )
+                    except Exception:
+                        app_logger.exception("Could not record the streamed turn of request %s", request_id)
+                if timings is not None:
+                    timings.finish()
+
+            if extra_info_received is not None and extra_info_received.stream_cpu_time_ms is not None:
+                app_logger.info(
+                    "Request %s spent %.3fms CPU on streamed chunks", request_id, extra_info_received.stream_cpu_time_ms
                 )
-        
-        response = await make_response(format_as_ndjson(logged_result_generator()))
+
+        body: AsyncIterator[bytes] = format_as_ndjson(
+            logged_result_generator(),
+            current_app.config[CONFIG_STREAM_COALESCE_MS],
+            current_app.config[CONFIG_STREAM_COALESCE_BYTES],
+        )
+        if profiler is not None:
+            # Stopped when the response body is closed, which also happens when the stream never started
+            body = ProfiledStream(body, profile_store, profiler, f"/chat/stream {request_id}")
+        # make_response only accepts generators, the response class takes any async iterable
+        response = current_app.response_class(body)
         response.timeout = None  # type: ignore
         response.mimetype = "application/json-lines"
         return response
@@ -534,6 +595,146 @@ def config():
     )
 
 
+@bp.before_request
+async def pin_prompt_version():
+    # Requests that were already running when prompts are reloaded finish with the version they started with
+    if prompt_manager := current_app.config.get(CONFIG_PROMPT_MANAGER):
+        prompt_manager.pin_version()
+
+
+@bp.before_request
+async def start_timings():
+    # Without metrics or stage thoughts nothing is timed, and the stages in the approaches cost nothing
+    registry: Optional[MetricsRegistry] = current_app.config.get(CONFIG_METRICS_REGISTRY)
+    if registry is not None or current_app.config.get(CONFIG_STAGE_DURATIONS_IN_THOUGHTS):
+        start_request_timings(request.url_rule.rule if request.url_rule else request.path, registry)
+
+
+@bp.after_request
+async def finish_timings(response):
+    # Streamed responses finish their timings when the stream ends
+    if (timings := current_timings()) and not timings.streaming:
+        timings.finish()
+    return response
+
+
+def add_stage_durations_thought(extra_info: Any, timings: Optional[RequestTimings]) -> None:
+    if timings is not None and isinstance(extra_info, ExtraInfo):
+        # The live dict goes in props, which unlike the description is serialized again every time the
+        # thoughts are sent, so stages that finish later in the stream show up in the last context event
+        thought = ThoughtStep("Stage durations (ms)", "Time spent in each stage of this request.", timings.stages)
+        extra_info.thoughts = (extra_info.thoughts or []) + [thought]
+
+
+@bp.get("/metrics")
+async def metrics():
+    registry: Optional[MetricsRegistry] = current_app.config.get(CONFIG_METRICS_REGISTRY)
+    if registry is None:
+        abort(404)
+    return registry.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+PROFILED_ENDPOINTS = ("routes.chat", "routes.chat_stream")
+
+
+@bp.before_request
+async def start_profiling():
+    if (
+        request.endpoint in PROFILED_ENDPOINTS
+        and current_app.config[CONFIG_DEVELOPER_FEATURES_ENABLED]
+        and request.headers.get("X-Profile-Request", "").lower() == "true"
+    ):
+        start_request_profiler(current_app.config[CONFIG_PROFILE_STORE])
+
+
+@bp.after_request
+async def finish_profiling(response):
+    # Streamed responses are profiled until the stream ends, and saved by the stream itself
+    if (profiler := current_profiler()) and not profiler.streaming:
+        profile_store: ProfileStore = current_app.config[CONFIG_PROFILE_STORE]
+        stop_request_profiler(profile_store, profiler)
+        name = f"{request.path} {profiler.request_id}"
+        if await asyncio.to_thread(save_request_profile, profile_store, profiler, name):
+            response.headers["X-Profile-Url"] = f"/admin/profiles/{profiler.request_id}"
+    return response
+
+
+@bp.get("/admin/profiles/<request_id>")
+@authenticated
+async def get_profile(auth_claims: dict[str, Any], request_id: str):
+    """Returns the profile of a request sent with X-Profile-Request: true, to open in https://www.speedscope.app"""
+    if not current_app.config[CONFIG_DEVELOPER_FEATURES_ENABLED]:
+        return jsonify({"error": "developer features are not enabled"}), 403
+    profile_store: ProfileStore = current_app.config[CONFIG_PROFILE_STORE]
+    profile = await asyncio.to_thread(profile_store.load, request_id)
+    if profile is None:
+        return jsonify({"error": "no profile for this request"}), 404
+    return profile, 200, {
+        "Content-Type": "application/json",
+        "Content-Disposition": f'attachment; filename="{request_id}.speedscope.json"',
+    }
+
+
+@bp.post("/admin/prompts/reload")
+@authenticated
+async def reload_prompts(auth_claims: dict[str, Any]):
+    if not current_app.config[CONFIG_DEVELOPER_FEATURES_ENABLED]:
+        return jsonify({"error": "developer features are not enabled"}), 403
+    prompt_manager: PromptyManager = current_app.config[CONFIG_PROMPT_MANAGER]
+    try:
+        changed_files = prompt_manager.changed_files()
+        version = await asyncio.to_thread(prompt_manager.reload)
+    except Exception as error:
+        return error_response(error, "/admin/prompts/reload")
+    current_app.logger.info("Reloaded prompts as version %d, changed files: %s", version.number, changed_files)
+    return jsonify({"version": version.number, "changed_files": changed_files})
+
+
+@bp.get("/admin/path_auth_cache")
+@authenticated
+async def path_auth_cache_stats(auth_claims: dict[str, Any]):
+    if not current_app.config[CONFIG_DEVELOPER_FEATURES_ENABLED]:
+        return jsonify({"error": "developer features are not enabled"}), 403
+    path_auth_cache: Optional[PathAuthCache] = current_app.config[CONFIG_AUTH_CLIENT].path_auth_cache
+    acl_index = get_acl_index()
+    return jsonify(
+        {
+            "enabled": path_auth_cache is not None,
+            **(path_auth_cache.stats() if path_auth_cache else {}),
+            "acl_index": acl_index.stats() if acl_index else None,
+        }
+    )
+
+
+@bp.post("/admin/path_auth_cache/clear")
+@authenticated
+async def clear_path_auth_cache(auth_claims: dict[str, Any]):
+    """Applies ACL changes made outside the app, such as with scripts/manageacl.py, without waiting for the TTL."""
+    # Clearing forces a rebuild of the ACL index, so only the configured admins may do it
+    if auth_claims.get("oid") not in current_app.config[CONFIG_ADMIN_USER_OIDS]:
+        return jsonify({"error": "only admins can clear the path authorization cache"}), 403
+    path_auth_cache: Optional[PathAuthCache] = current_app.config[CONFIG_AUTH_CLIENT].path_auth_cache
+    if path_auth_cache is not None:
+        path_auth_cache.clear()
+        current_app.logger.info("Cleared the path authorization cache")
+    if acl_index := get_acl_index():
+        try:
+            await acl_index.refresh(current_app.config[CONFIG_SEARCH_CLIENT], force=True)
+        except Exception as error:
+            return error_response(error, "/admin/path_auth_cache/clear")
+    return jsonify({"cleared": path_auth_cache is not None, "acl_index_rebuilt": acl_index is not None})
+
+
+async def watch_prompt_files(prompt_manager: PromptyManager, interval_seconds: float):
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            if version := await asyncio.to_thread(prompt_manager.reload_if_changed):
+                logging.info("Prompt files changed, reloaded prompts as version %d", version.number)
+        except Exception:
+            logging.exception("Failed to reload prompt files, keeping the current version")
+
+
 @bp.route("/speech", methods=["POST"])
 async def speech():
     if not request.is_json:
@@ -548,35 +749,42 @@ async def speech():
 
     request_json = await request.get_json()
     text = request_json["text"]
+    speech_synthesis: SpeechSynthesisService = current_app.config[CONFIG_SPEECH_SYNTHESIS]
+    audio_chunks = speech_synthesis.stream_audio(text, speech_token.token)
     try:
-        # Construct a token as described in documentation:
-        # https://learn.microsoft.com/azure/ai-services/speech-service/how-to-configure-azure-ad-auth?pivots=programming-language-python
-        auth_token = (
-            "aad#"
-            + current_app.config[CONFIG_SPEECH_SERVICE_ID]
-            + "#"
-            + current_app.config[CONFIG_SPEECH_SERVICE_TOKEN].token
-        )
-        speech_config = SpeechConfig(auth_token=auth_token, region=current_app.config[CONFIG_SPEECH_SERVICE_LOCATION])
-        speech_config.speech_synthesis_voice_name = current_app.config[CONFIG_SPEECH_SERVICE_VOICE]
-        speech_config.speech_synthesis_output_format = SpeechSynthesisOutputFormat.Audio16Khz32KBitRateMonoMp3
-        synthesizer = SpeechSynthesizer(speech_config=speech_config, audio_config=None)
-        result: SpeechSynthesisResult = synthesizer.speak_text_async(text).get()
-        if result.reason == ResultReason.SynthesizingAudioCompleted:
-            return result.audio_data, 200, {"Content-Type": "audio/mp3"}
-        elif result.reason == ResultReason.Canceled:
-            cancellation_details = result.cancellation_details
-            current_app.logger.error(
-                "Speech synthesis canceled: %s %s", cancellation_details.reason, cancellation_details.error_details
-            )
-            raise Exception("Speech synthesis canceled. Check logs for details.")
-        else:
-            current_app.logger.error("Unexpected result reason: %s", result.reason)
-            raise Exception("Speech synthesis failed. Check logs for details.")
+        # Waits for the first chunk, so a synthesis that fails right away still gets an error response
+        first_chunk = await audio_chunks.__anext__()
     except Exception as e:
+        await audio_chunks.aclose()
         current_app.logger.exception("Exception in /speech")
         return jsonify({"error": str(e)}), 500
 
+    app_logger = current_app.logger
+
+    async def stream_remaining_audio() -> AsyncGenerator[bytes, None]:
+        yield first_chunk
+        try:
+            async for chunk in audio_chunks:
+                yield chunk
+        except Exception:
+            # The response has started, so the client only sees the audio end early
+            app_logger.exception("Exception while streaming /speech")
+
+    response = await make_response(stream_remaining_audio(), 200, {"Content-Type": "audio/mp3"})
+    response.timeout = None  # type: ignore
+    return response
+
+
+def invalidate_path_auth(user_oid: str):
+    """Uploads and deletions change which files the user can access, so their cached decisions are dropped."""
+    path_auth_cache: Optional[PathAuthCache] = current_app.config[CONFIG_AUTH_CLIENT].path_auth_cache
+    if path_auth_cache is not None:
+        path_auth_cache.invalidate_user(user_oid)
+
+
+def get_acl_index() -> Optional[AclIndex]:
+    return current_app.config[CONFIG_AUTH_CLIENT].acl_index
+
 
 @bp.post("/upload")
 @authenticated
@@ -604,6 +812,9 @@ async def upload(auth_claims: dict[str, Any]):
     file_io.seek(0)
     ingester: UploadUserFileStrategy = current_app.config[CONFIG_INGESTER]
     await ingester.add_file(File(content=file_io, acls={"oids": [user_oid]}, url=file_client.url))
+    invalidate_path_auth(user_oid)
+    if acl_index := get_acl_index():
+        acl_index.invalidate(file.filename)
     return jsonify({"message": "File uploaded successfully"}), 200
 
 
@@ -619,6 +830,9 @@ async def delete_uploaded(auth_claims: dict[str, Any]):
     await file_client.delete_file()
     ingester = current_app.config[CONFIG_INGESTER]
     await ingester.remove_file(filename, user_oid)
+    invalidate_path_auth(user_oid)
+    if acl_index := get_acl_index():
+        acl_index.invalidate(filename)
     return jsonify({"message": f"File {filename} deleted successfully"}), 200
 
 
@@ -669,6 +883,10 @@ async def setup_clients():
     # https://learn.microsoft.com/azure/ai-services/openai/api-version-deprecation#latest-ga-api-release
     AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION") or "2024-10-21"
     AZURE_VISION_ENDPOINT = os.getenv("AZURE_VISION_ENDPOINT", "")
+    # Page images sent to GPT-4V are cached as pre-encoded data URLs, optionally downscaled to save vision tokens
+    VISION_IMAGE_CACHE_SIZE_MB = int(os.getenv("VISION_IMAGE_CACHE_SIZE_MB") or 64)
+    VISION_IMAGE_MAX_RESOLUTION = int(os.getenv("VISION_IMAGE_MAX_RESOLUTION") or 0)
+    VISION_IMAGE_FETCH_CONCURRENCY = int(os.getenv("VISION_IMAGE_FETCH_CONCURRENCY") or 4)
     # Used only with non-Azure OpenAI deployments
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
     OPENAI_ORGANIZATION = os.getenv("OPENAI_ORGANIZATION")
@@ -703,11 +921,61 @@ async def setup_clients():
     USE_SPEECH_INPUT_BROWSER = os.getenv("USE_SPEECH_INPUT_BROWSER", "").lower() == "true"
     USE_SPEECH_OUTPUT_BROWSER = os.getenv("USE_SPEECH_OUTPUT_BROWSER", "").lower() == "true"
     USE_SPEECH_OUTPUT_AZURE = os.getenv("USE_SPEECH_OUTPUT_AZURE", "").lower() == "true"
+    # Threads that run speech synthesis, which bounds how many /speech requests call the speech service at once
+    SPEECH_SYNTHESIS_WORKERS = int(os.getenv("SPEECH_SYNTHESIS_WORKERS") or 4)
+    SPEECH_AUDIO_CACHE_SIZE_MB = int(os.getenv("SPEECH_AUDIO_CACHE_SIZE_MB") or 32)
     USE_CHAT_HISTORY_BROWSER = os.getenv("USE_CHAT_HISTORY_BROWSER", "").lower() == "true"
     USE_CHAT_HISTORY_COSMOS = os.getenv("USE_CHAT_HISTORY_COSMOS", "").lower() == "true"
     USE_AGENTIC_RETRIEVAL = os.getenv("USE_AGENTIC_RETRIEVAL", "").lower() == "true"
     ENABLE_DEBUG_LOGGING = os.getenv("ENABLE_DEBUG_LOGGING", "false").lower() == "true"
+    # Lets the chat approach skip the LLM search query rewrite for short first-turn questions, and cache rewrites
+    QUERY_REWRITE_SKIP_ENABLED = os.getenv("QUERY_REWRITE_SKIP_ENABLED", "").lower() == "true"
+    QUERY_REWRITE_SKIP_MAX_WORDS = int(os.getenv("QUERY_REWRITE_SKIP_MAX_WORDS") or 12)
+    QUERY_REWRITE_CACHE_SIZE = int(os.getenv("QUERY_REWRITE_CACHE_SIZE") or 0)
+    QUERY_REWRITE_CACHE_TURNS = int(os.getenv("QUERY_REWRITE_CACHE_TURNS") or 4)
+    # Input-token budget for the answer prompt; old history turns and low-ranked sources are dropped to fit it
+    PROMPT_MAX_INPUT_TOKENS = int(os.getenv("PROMPT_MAX_INPUT_TOKENS") or 0)
+    PROMPT_RESERVED_TOKENS = int(os.getenv("PROMPT_RESERVED_TOKENS") or DEFAULT_RESERVED_TOKENS)
+    # Groups /chat/stream frames into fewer writes: flush after N milliseconds or M bytes (0 disables both)
+    current_app.config[CONFIG_STREAM_COALESCE_MS] = float(os.getenv("STREAM_COALESCE_MS") or 0)
+    current_app.config[CONFIG_STREAM_COALESCE_BYTES] = int(os.getenv("STREAM_COALESCE_BYTES") or 0)
+    # Exposes Prometheus histograms of the request stages and the event loop lag on /metrics
+    ENABLE_METRICS = os.getenv("ENABLE_METRICS", "").lower() == "true"
+    LOOP_LAG_INTERVAL_SECONDS = float(os.getenv("LOOP_LAG_INTERVAL_SECONDS") or 0.5)
+    # Adds a "Stage durations" thought to each answer, so the developer settings show where the time went
+    current_app.config[CONFIG_STAGE_DURATIONS_IN_THOUGHTS] = (
+        os.getenv("STAGE_DURATIONS_IN_THOUGHTS", "").lower() == "true"
+    )
+    current_app.config[CONFIG_METRICS_REGISTRY] = MetricsRegistry() if ENABLE_METRICS else None
+    # With developer features enabled, /chat requests with an X-Profile-Request: true header are profiled,
+    # and their speedscope files are kept in PROFILE_DIR for /admin/profiles/<request_id>
+    current_app.config[CONFIG_PROFILE_STORE] = ProfileStore(
+        os.getenv("PROFILE_DIR") or os.path.join(tempfile.gettempdir(), "ragapp_profiles"),
+        sample_interval_seconds=float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS") or 1) / 1000,
+    )
+    # Checks the prompt files for changes every N seconds and reloads them without a restart (0 disables)
+    PROMPT_RELOAD_INTERVAL_SECONDS = float(os.getenv("PROMPT_RELOAD_INTERVAL_SECONDS") or 0)
+    # Off by default, since a cached decision outlives an ACL change made in another process for up to the TTL
+    PATH_AUTH_CACHE_TTL_SECONDS = float(os.getenv("PATH_AUTH_CACHE_TTL_SECONDS") or 0)
+    # Replaced by every invalidation, so the workers on this machine clear their caches together
+    PATH_AUTH_CACHE_GENERATION_PATH = os.getenv("PATH_AUTH_CACHE_GENERATION_PATH") or os.path.join(
+        tempfile.gettempdir(), f"path_auth_cache_{AZURE_SEARCH_INDEX}.generation"
+    )
+    # Answers /content authorization from an in-memory index of the ACLs, shared by workers through a snapshot file
+    USE_ACL_INDEX = os.getenv("USE_ACL_INDEX", "").lower() == "true"
+    ACL_INDEX_REFRESH_SECONDS = float(os.getenv("ACL_INDEX_REFRESH_SECONDS") or 600)
+    ACL_INDEX_SNAPSHOT_PATH = os.getenv("ACL_INDEX_SNAPSHOT_PATH") or os.path.join(
+        tempfile.gettempdir(), f"acl_index_{AZURE_SEARCH_INDEX}.bin"
+    )
+    # Keeps conversations on the server, so clients can send only the new message with server_side_history=true
+    USE_SERVER_SIDE_HISTORY = os.getenv("USE_SERVER_SIDE_HISTORY", "").lower() == "true"
+    SERVER_SIDE_HISTORY_MAX_SESSIONS = int(os.getenv("SERVER_SIDE_HISTORY_MAX_SESSIONS") or 1000)
+    SERVER_SIDE_HISTORY_TTL_SECONDS = int(os.getenv("SERVER_SIDE_HISTORY_TTL_SECONDS") or 86400)
+    SERVER_SIDE_HISTORY_MAX_TOKENS = int(os.getenv("SERVER_SIDE_HISTORY_MAX_TOKENS") or 8000)
+    SERVER_SIDE_HISTORY_SQLITE_PATH = os.getenv("SERVER_SIDE_HISTORY_SQLITE_PATH")
     ENABLE_DEVELOPER_FEATURES = os.getenv("ENABLE_DEVELOPER_FEATURES", "false").lower() == "true"
+    # Object IDs of the users who may call the admin endpoints that change the app's state
+    ADMIN_USER_OIDS = {oid.strip() for oid in (os.getenv("ADMIN_USER_OIDS") or "").split(",") if oid.strip()}
 
     # WEBSITE_HOSTNAME is always set by App Service, RUNNING_IN_PRODUCTION is set in main.bicep
     RUNNING_ON_AZURE = os.getenv("WEBSITE_HOSTNAME") is not None or os.getenv("RUNNING_IN_PRODUCTION") is not None
@@ -774,6 +1042,21 @@ async def setup_clients():
         require_access_control=AZURE_ENFORCE_ACCESS_CONTROL,
         enable_global_documents=AZURE_ENABLE_GLOBAL_DOCUMENT_ACCESS,
         enable_unauthenticated_access=AZURE_ENABLE_UNAUTHENTICATED_ACCESS,
+        # Caches /content authorization decisions for this long; 0 runs the search query on every request
+        path_auth_cache=(
+            PathAuthCache(
+                maxsize=int(os.getenv("PATH_AUTH_CACHE_SIZE") or 4096),
+                ttl_seconds=PATH_AUTH_CACHE_TTL_SECONDS,
+                generation_path=PATH_AUTH_CACHE_GENERATION_PATH,
+            )
+            if PATH_AUTH_CACHE_TTL_SECONDS > 0
+            else None
+        ),
+        acl_index=(
+            AclIndex(ACL_INDEX_SNAPSHOT_PATH, max_age_seconds=ACL_INDEX_REFRESH_SECONDS)
+            if USE_ACL_INDEX and AZURE_ENFORCE_ACCESS_CONTROL
+            else None
+        ),
     )
 
     if USE_USER_UPLOAD:
@@ -833,6 +1116,17 @@ async def setup_clients():
         current_app.config[CONFIG_SPEECH_SERVICE_ID] = AZURE_SPEECH_SERVICE_ID
         current_app.config[CONFIG_SPEECH_SERVICE_LOCATION] = AZURE_SPEECH_SERVICE_LOCATION
         current_app.config[CONFIG_SPEECH_SERVICE_VOICE] = AZURE_SPEECH_SERVICE_VOICE
+        current_app.config[CONFIG_SPEECH_SYNTHESIS] = SpeechSynthesisService(
+            resource_id=AZURE_SPEECH_SERVICE_ID,
+            location=AZURE_SPEECH_SERVICE_LOCATION,
+            voice=AZURE_SPEECH_SERVICE_VOICE,
+            max_workers=SPEECH_SYNTHESIS_WORKERS,
+            audio_cache=(
+                SpeechAudioCache(max_bytes=SPEECH_AUDIO_CACHE_SIZE_MB * 1024 * 1024)
+                if SPEECH_AUDIO_CACHE_SIZE_MB > 0
+                else None
+            ),
+        )
         # Wait until token is needed to fetch for the first time
         current_app.config[CONFIG_SPEECH_SERVICE_TOKEN] = None
 
@@ -901,10 +1195,25 @@ async def setup_clients():
     current_app.config[CONFIG_SPEECH_OUTPUT_AZURE_ENABLED] = USE_SPEECH_OUTPUT_AZURE
     current_app.config[CONFIG_CHAT_HISTORY_BROWSER_ENABLED] = USE_CHAT_HISTORY_BROWSER
     current_app.config[CONFIG_CHAT_HISTORY_COSMOS_ENABLED] = USE_CHAT_HISTORY_COSMOS
+
+    if USE_SERVER_SIDE_HISTORY:
+        current_app.logger.info("USE_SERVER_SIDE_HISTORY is true, setting up the server-side conversation store")
+        current_app.config[CONFIG_CONVERSATION_STORE] = ConversationStore(
+            max_sessions=SERVER_SIDE_HISTORY_MAX_SESSIONS,
+            ttl_seconds=SERVER_SIDE_HISTORY_TTL_SECONDS,
+            max_history_tokens=SERVER_SIDE_HISTORY_MAX_TOKENS,
+            backing=(
+                SQLiteConversationBacking(SERVER_SIDE_HISTORY_SQLITE_PATH) if SERVER_SIDE_HISTORY_SQLITE_PATH else None
+            ),
+        )
     current_app.config[CONFIG_AGENTIC_RETRIEVAL_ENABLED] = USE_AGENTIC_RETRIEVAL
     current_app.config[CONFIG_DEVELOPER_FEATURES_ENABLED] = ENABLE_DEVELOPER_FEATURES
+    current_app.config[CONFIG_ADMIN_USER_OIDS] = ADMIN_USER_OIDS
 
     prompt_manager = PromptyManager()
+    current_app.config[CONFIG_PROMPT_MANAGER] = prompt_manager
+    # Shared by all four approaches, so they apply the same prompt budget
+    prompt_packer = PromptPacker(max_input_tokens=PROMPT_MAX_INPUT_TOKENS, reserved_tokens=PROMPT_RESERVED_TOKENS)
 
     # Set up the two default RAG approaches for /ask and /chat
     # RetrieveThenReadApproach is used by /ask for single-turn Q&A
@@ -928,6 +1237,7 @@ async def setup_clients():
         query_speller=AZURE_SEARCH_QUERY_SPELLER,
         prompt_manager=prompt_manager,
         reasoning_effort=OPENAI_REASONING_EFFORT,
+        prompt_packer=prompt_packer,
     )
 
     # ChatReadRetrieveReadApproach is used by /chat for multi-turn conversation
@@ -952,6 +1262,13 @@ async def setup_clients():
         prompt_manager=prompt_manager,
         reasoning_effort=OPENAI_REASONING_EFFORT,
         enable_debug_logging=ENABLE_DEBUG_LOGGING,
+        query_rewrite_policy=QueryRewritePolicy(
+            skip_enabled=QUERY_REWRITE_SKIP_ENABLED,
+            max_skip_words=QUERY_REWRITE_SKIP_MAX_WORDS,
+            history_turns=QUERY_REWRITE_CACHE_TURNS,
+            cache_size=QUERY_REWRITE_CACHE_SIZE,
+        ),
+        prompt_packer=prompt_packer,
     )
 
     if USE_GPT4V:
@@ -973,6 +1290,16 @@ async def setup_clients():
 
         token_provider = get_bearer_token_provider(azure_credential, "https://cognitiveservices.azure.com/.default")
 
+        # Shared by both vision approaches so that the same page image is only downloaded and encoded once
+        image_cache = (
+            ImageCache(
+                max_bytes=VISION_IMAGE_CACHE_SIZE_MB * 1024 * 1024,
+                max_resolution=VISION_IMAGE_MAX_RESOLUTION or None,
+            )
+            if VISION_IMAGE_CACHE_SIZE_MB > 0
+            else None
+        )
+
         current_app.config[CONFIG_ASK_VISION_APPROACH] = RetrieveThenReadVisionApproach(
             search_client=search_client,
             openai_client=openai_client,
@@ -991,6 +1318,9 @@ async def setup_clients():
             query_language=AZURE_SEARCH_QUERY_LANGUAGE,
             query_speller=AZURE_SEARCH_QUERY_SPELLER,
             prompt_manager=prompt_manager,
+            image_cache=image_cache,
+            image_fetch_concurrency=VISION_IMAGE_FETCH_CONCURRENCY,
+            prompt_packer=prompt_packer,
         )
 
         current_app.config[CONFIG_CHAT_VISION_APPROACH] = ChatReadRetrieveReadVisionApproach(
@@ -1013,12 +1343,51 @@ async def setup_clients():
             query_language=AZURE_SEARCH_QUERY_LANGUAGE,
             query_speller=AZURE_SEARCH_QUERY_SPELLER,
             prompt_manager=prompt_manager,
+            image_cache=image_cache,
+            image_fetch_concurrency=VISION_IMAGE_FETCH_CONCURRENCY,
+            prompt_packer=prompt_packer,
+        )
+
+    # The approaches above registered their prompts, so the watcher covers all of them
+    if PROMPT_RELOAD_INTERVAL_SECONDS > 0:
+        current_app.config[CONFIG_PROMPT_RELOAD_TASK] = asyncio.create_task(
+            watch_prompt_files(prompt_manager, PROMPT_RELOAD_INTERVAL_SECONDS)
+        )
+
+    # Built in the background, /content falls back to search queries until the index is ready
+    if auth_helper.acl_index is not None:
+        current_app.config[CONFIG_ACL_INDEX_TASK] = asyncio.create_task(
+            watch_acl_index(auth_helper.acl_index, search_client)
+        )
+
+    if ENABLE_METRICS and LOOP_LAG_INTERVAL_SECONDS > 0:
+        current_app.config[CONFIG_LOOP_LAG_TASK] = asyncio.create_task(
+            watch_event_loop_lag(current_app.config[CONFIG_METRICS_REGISTRY], LOOP_LAG_INTERVAL_SECONDS)
         )
 
 
 @bp.after_app_serving
 async def close_clients():
+    if prompt_reload_task := current_app.config.get(CONFIG_PROMPT_RELOAD_TASK):
+        prompt_reload_task.cancel()
+    if acl_index_task := current_app.config.get(CONFIG_ACL_INDEX_TASK):
+        acl_index_task.cancel()
+        current_app.config[CONFIG_AUTH_CLIENT].acl_index.close()
+    if loop_lag_task := current_app.config.get(CONFIG_LOOP_LAG_TASK):
+        loop_lag_task.cancel()
+    if speech_synthesis := current_app.config.get(CONFIG_SPEECH_SYNTHESIS):
+        speech_synthesis.close()
     await current_app.config[CONFIG_SEARCH_CLIENT].close()
+    for approach_key in (
+        CONFIG_ASK_APPROACH,
+        CONFIG_CHAT_APPROACH,
+        CONFIG_ASK_VISION_APPROACH,
+        CONFIG_CHAT_VISION_APPROACH,
+    ):
+        if approach := current_app.config.get(approach_key):
+            await approach.close()
+    if conversation_store := current_app.config.get(CONFIG_CONVERSATION_STORE):
+        await conversation_store.close()
     await current_app.config[CONFIG_BLOB_CONTAINER_CLIENT].close()
     if current_app.config.get(CONFIG_USER_BLOB_CONTAINER_CLIENT):
         await current_app.config[CONFIG_USER_BLOB_CONTAINER_CLIENT].close()
@@ -1029,6 +1398,21 @@ def create_app():
     app.register_blueprint(bp)
     app.register_blueprint(chat_history_cosmosdb_bp)
 
+    # Log levels should be one of https://docs.python.org/3/library/logging.html#logging-levels
+    # The root level is WARNING to avoid seeing overly verbose logs from SDKS, our own categories default to INFO.
+    # Records go through a queue to a background thread, so request handlers never block writing logs.
+    app_level = os.getenv("APP_LOG_LEVEL", "INFO")
+    configure_logging(
+        app_level=app_level,
+        # For example "approaches.timing=DEBUG,chat_logging=WARNING"
+        category_levels=parse_category_settings(os.getenv("LOG_LEVELS")),
+        # For example "approaches.timing=0.1" keeps one in ten timing lines
+        sampling_rates={
+            category: float(rate) for category, rate in parse_category_settings(os.getenv("LOG_SAMPLING")).items()
+        },
+        json_output=os.getenv("LOG_FORMAT", "text").lower() == "json",
+    )
+
     if os.getenv("APPLICATIONINSIGHTS_CONNECTION_STRING"):
         app.logger.info("APPLICATIONINSIGHTS_CONNECTION_STRING is set, enabling Azure Monitor")
         configure_azure_monitor()
@@ -1041,14 +1425,6 @@ def create_app():
         # This middleware tracks app route requests:
         app.asgi_app = OpenTelemetryMiddleware(app.asgi_app)  # type: ignore[assignment]
 
-    # Log levels should be one of https://docs.python.org/3/library/logging.html#logging-levels
-    # Set root level to WARNING to avoid seeing overly verbose logs from SDKS
-    logging.basicConfig(level=logging.WARNING)
-    # Set our own logger levels to INFO by default
-    app_level = os.getenv("APP_LOG_LEVEL", "INFO")
-    app.logger.setLevel(os.getenv("APP_LOG_LEVEL", app_level))
-    logging.getLogger("scripts").setLevel(app_level)
-
     if allowed_origin := os.getenv("ALLOWED_ORIGIN"):
         allowed_origins = allowed_origin.split(";")
         if len(allowed_origins) > 0:
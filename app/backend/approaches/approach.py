@@ -1,8 +1,11 @@
+import asyncio
 import os
 import sys
+import time
 from abc import ABC
 from collections.abc import AsyncGenerator, Awaitable
 from dataclasses import dataclass
+from datetime import datetime
 from typing import Any, Callable, Optional, TypedDict, Union, cast
 from urllib.parse import urljoin
 
@@ -35,9 +38,13 @@ from openai.types.chat import (
 )
 
 from approaches.promptmanager import PromptManager
+from approaches.promptpacker import PackedPromptInputs, PromptPacker
 from Libra.utils import get_blob_link, AZURE_STORAGE_CONNECTION, CHUNK_STORAGE_CONTAINER_NAME
 from azure.storage.blob.aio import BlobServiceClient
 from core.authentication import AuthenticationHelper
+from core.instrumentation import record_stage, stage
+from core.lrucache import LRUCache
+from core.tokencounter import IMAGE_PART_TOKENS
 
 
 @dataclass
@@ -92,6 +99,80 @@ class ThoughtStep:
         if self.props:
             self.props["token_usage"] = TokenUsageProps.from_completion_usage(usage)
 
+    def update_prompt_budget(self, packed: PackedPromptInputs) -> None:
+        if self.props is not None and packed.max_input_tokens > 0:
+            self.props["prompt_budget"] = packed.to_props()
+
+
+class LinkMapping(dict[str, str]):
+    """
+    Mapping from short link IDs (link1, link2, ...) to the long source URLs they stand for.
+    The prompt cites sources by short ID to save tokens, and clients expand them back when rendering the answer.
+    A reverse index makes the URL -> ID lookup O(1); when several results share a URL, the first ID wins.
+    It serializes as a plain dict, so the wire format of ExtraInfo.link_mapping is unchanged.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._ids_by_link: dict[str, str] = {}
+        self._index()
+
+    def _index(self) -> None:
+        self._ids_by_link.clear()
+        for link_id, link in self.items():
+            self._ids_by_link.setdefault(link, link_id)
+
+    # Every dict method that changes the mapping keeps the reverse index in sync with it.
+    # Removals rebuild the index, since another ID may then be the first one for its URL.
+    def __setitem__(self, link_id: str, link: str) -> None:
+        if link_id in self:
+            super().__setitem__(link_id, link)
+            self._index()
+        else:
+            super().__setitem__(link_id, link)
+            self._ids_by_link.setdefault(link, link_id)
+
+    def __delitem__(self, link_id: str) -> None:
+        super().__delitem__(link_id)
+        self._index()
+
+    def __ior__(self, other: Any) -> "LinkMapping":  # type: ignore[override,misc]
+        self.update(other)
+        return self
+
+    def update(self, *args: Any, **kwargs: Any) -> None:
+        for link_id, link in dict(*args, **kwargs).items():
+            self[link_id] = link
+
+    def setdefault(self, link_id: str, link: str) -> str:  # type: ignore[override]
+        if link_id not in self:
+            self[link_id] = link
+        return self[link_id]
+
+    def pop(self, link_id: str, *default: Any) -> Any:  # type: ignore[override]
+        link = super().pop(link_id, *default)
+        self._index()
+        return link
+
+    def popitem(self) -> tuple[str, str]:
+        item = super().popitem()
+        self._index()
+        return item
+
+    def clear(self) -> None:
+        super().clear()
+        self._ids_by_link.clear()
+
+    @classmethod
+    def from_documents(cls, results: list["Document"]) -> "LinkMapping":
+        return cls(
+            (f"link{index}", sourcepage)
+            for index, sourcepage in enumerate((doc.sourcepage for doc in results if doc.sourcepage), start=1)
+        )
+
+    def get_link_id(self, link: str) -> Optional[str]:
+        return self._ids_by_link.get(link)
+
 
 @dataclass
 class DataPoints:
@@ -104,7 +185,13 @@ class ExtraInfo:
     data_points: DataPoints
     thoughts: Optional[list[ThoughtStep]] = None
     followup_questions: Optional[list[Any]] = None
-    link_mapping: Optional[dict[str, str]] = None
+    link_mapping: Optional[LinkMapping] = None
+
+    def __post_init__(self):
+        # Set by the approaches for logging once the answer is done. They are not dataclass fields,
+        # so they are left out of the serialized response.
+        self.real_start_timestamp: Optional[datetime] = None
+        self.stream_cpu_time_ms: Optional[float] = None
 
 
 @dataclass
@@ -147,6 +234,12 @@ class Approach(ABC):
     # Set a higher token limit for GPT reasoning models
     RESPONSE_DEFAULT_TOKEN_LIMIT = 3000
     RESPONSE_REASONING_DEFAULT_TOKEN_LIMIT = 10000
+    # Number of query texts whose Azure AI Vision embeddings are kept in memory
+    IMAGE_EMBEDDING_CACHE_SIZE = 1024
+    # Not every subclass calls Approach.__init__, so close() relies on this class-level default
+    vision_session: Optional[aiohttp.ClientSession] = None
+    # Packing is off unless an approach is given a budget; the default packer passes prompt inputs through
+    prompt_packer: PromptPacker = PromptPacker()
 
     def __init__(
         self,
@@ -180,6 +273,7 @@ class Approach(ABC):
         self.prompt_manager = prompt_manager
         self.reasoning_effort = reasoning_effort
         self.include_token_usage = True
+        self.image_embedding_cache: LRUCache[str, list[float]] = LRUCache(self.IMAGE_EMBEDDING_CACHE_SIZE)
         import logging
         self.logger = logging.getLogger(self.__class__.__name__)
 
@@ -212,6 +306,7 @@ class Approach(ABC):
     ) -> list[Document]:
         search_text = query_text if use_text_search else ""
         search_vectors = vectors if use_vector_search else []
+        search_start = time.perf_counter()
         if use_semantic_ranker:
             results = await self.search_client.search(
                 search_text=search_text,
@@ -261,6 +356,8 @@ class Approach(ABC):
                 )
             ]
 
+        # Includes reading the result pages, which is where the search client waits for the service
+        record_stage("search", time.perf_counter() - search_start)
         return qualified_documents
 
     async def run_agentic_retrieval(
@@ -275,6 +372,7 @@ class Approach(ABC):
         results_merge_strategy: Optional[str] = None,
     ) -> tuple[KnowledgeAgentRetrievalResponse, list[Document]]:
         # STEP 1: Invoke agentic retrieval
+        retrieval_start = time.perf_counter()
         response = await agent_client.retrieve(
             retrieval_request=KnowledgeAgentRetrievalRequest(
                 messages=[
@@ -295,6 +393,7 @@ class Approach(ABC):
                 ],
             )
         )
+        record_stage("agentic_retrieval", time.perf_counter() - retrieval_start)
 
         # STEP 2: Generate a contextual and content specific answer using the search results and chat history
         activities = response.activity
@@ -380,28 +479,22 @@ class Approach(ABC):
                 pass
         return response, results
 
-    def create_link_mapping(self, results: list[Document]) -> dict[str, str]:
+    def create_link_mapping(self, results: list[Document]) -> LinkMapping:
         """
         Creează un mapping între ID-uri scurte (link1, link2, etc.) și linkurile lungi reale.
-        Returnează un dicționar unde key = ID scurt, value = link lung.
+        Se construiește o singură dată per request și e folosit atât la construirea promptului cât și de clienți.
         """
-        link_mapping = {}
-        link_counter = 1
-        
-        for doc in results:
-            if doc.sourcepage:
-                link_id = f"link{link_counter}"
-                link_mapping[link_id] = doc.sourcepage
-                link_counter += 1
-        
-        # print(f"[DEBUG] Created link mapping: {link_mapping}")
-        return link_mapping
+        return LinkMapping.from_documents(results)
 
     def get_sources_content(
         self, results: list[Document], use_semantic_captions: bool, use_image_citation: bool, 
-        link_mapping: dict[str, str] = None
+        link_mapping: Optional[dict[str, str]] = None
     ) -> list[str]:
 
+        link_ids: Optional[LinkMapping] = None
+        if link_mapping:
+            link_ids = link_mapping if isinstance(link_mapping, LinkMapping) else LinkMapping(link_mapping)
+
         def nonewlines(s: str) -> str:
             return s.replace("\n", " ").replace("\r", " ")
 
@@ -415,15 +508,8 @@ class Approach(ABC):
             original_link = doc.sourcepage or ""
             
             # Dacă avem un mapping de linkuri, folosim ID-ul scurt în loc de linkul lung
-            if link_mapping and original_link:
-                link_id = None
-                for short_id, long_link in link_mapping.items():
-                    if long_link == original_link:
-                        link_id = short_id
-                        break
-                
-                if link_id:
-                    # print(f"[DEBUG] get_sources_content: Replacing {original_link[:50]}... with {link_id}", file=sys.stdout)
+            if link_ids and original_link:
+                if link_id := link_ids.get_link_id(original_link):
                     return f"[{titlu_pagina}]({link_id})"
             
             return f"[{titlu_pagina}]({original_link})"
@@ -464,33 +550,57 @@ class Approach(ABC):
         dimensions_args: ExtraArgs = (
             {"dimensions": self.embedding_dimensions} if SUPPORTED_DIMENSIONS_MODEL[self.embedding_model] else {}
         )
-        embedding = await self.openai_client.embeddings.create(
-            # Azure OpenAI takes the deployment name as the model name
-            model=self.embedding_deployment if self.embedding_deployment else self.embedding_model,
-            input=q,
-            **dimensions_args,
-        )
+        with stage("embedding"):
+            embedding = await self.openai_client.embeddings.create(
+                # Azure OpenAI takes the deployment name as the model name
+                model=self.embedding_deployment if self.embedding_deployment else self.embedding_model,
+                input=q,
+                **dimensions_args,
+            )
         query_vector = embedding.data[0].embedding
         # This performs an oversampling due to how the search index was setup,
         # so we do not need to explicitly pass in an oversampling parameter here
         return VectorizedQuery(vector=query_vector, k_nearest_neighbors=50, fields=self.embedding_field)
 
+    def get_vision_session(self) -> aiohttp.ClientSession:
+        # A single long-lived session keeps connections to the Azure AI Vision endpoint pooled across requests
+        if self.vision_session is None or self.vision_session.closed:
+            self.vision_session = aiohttp.ClientSession()
+        return self.vision_session
+
     async def compute_image_embedding(self, q: str):
-        endpoint = urljoin(self.vision_endpoint, "computervision/retrieval:vectorizeText")
-        headers = {"Content-Type": "application/json"}
-        params = {"api-version": "2024-02-01", "model-version": "2023-04-15"}
-        data = {"text": q}
+        image_query_vector = self.image_embedding_cache.get(q)
+        if image_query_vector is None:
+            image_embedding_start = time.perf_counter()
+            endpoint = urljoin(self.vision_endpoint, "computervision/retrieval:vectorizeText")
+            headers = {"Content-Type": "application/json"}
+            params = {"api-version": "2024-02-01", "model-version": "2023-04-15"}
+            data = {"text": q}
 
-        headers["Authorization"] = "Bearer " + await self.vision_token_provider()
+            headers["Authorization"] = "Bearer " + await self.vision_token_provider()
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
+            async with self.get_vision_session().post(
                 url=endpoint, params=params, headers=headers, json=data, raise_for_status=True
             ) as response:
                 json = await response.json()
                 image_query_vector = json["vector"]
+            self.image_embedding_cache.put(q, image_query_vector)
+            record_stage("image_embedding", time.perf_counter() - image_embedding_start)
         return VectorizedQuery(vector=image_query_vector, k_nearest_neighbors=50, fields="imageEmbedding")
 
+    async def compute_multimodal_embeddings(self, q: str, vector_fields: str) -> list[VectorQuery]:
+        """Computes the text and/or image embeddings selected by vector_fields concurrently, text first."""
+        embedding_coroutines = []
+        if vector_fields == "textEmbeddingOnly" or vector_fields == "textAndImageEmbeddings":
+            embedding_coroutines.append(self.compute_text_embedding(q))
+        if vector_fields == "imageEmbeddingOnly" or vector_fields == "textAndImageEmbeddings":
+            embedding_coroutines.append(self.compute_image_embedding(q))
+        return list(await asyncio.gather(*embedding_coroutines))
+
+    async def close(self) -> None:
+        if self.vision_session is not None and not self.vision_session.closed:
+            await self.vision_session.close()
+
     def get_system_prompt_variables(self, override_prompt: Optional[str]) -> dict[str, str]:
         # Allows client to replace the entire prompt, or to inject into the existing prompt using >>>
         if override_prompt is None:
@@ -553,6 +663,23 @@ class Approach(ABC):
             **params,
         )
 
+    def pack_prompt_inputs(
+        self,
+        past_messages: list[ChatCompletionMessageParam],
+        text_sources: list[str],
+        user_query: Any,
+        overrides: dict[str, Any],
+        image_count: int = 0,
+    ) -> PackedPromptInputs:
+        """Fits past_messages and text_sources into the input-token budget, which overrides can change per request."""
+        return self.prompt_packer.pack(
+            past_messages,
+            text_sources,
+            user_query,
+            overrides.get("max_input_tokens"),
+            fixed_tokens=image_count * IMAGE_PART_TOKENS,
+        )
+
     def format_thought_step_for_chatcompletion(
         self,
         title: str,
@@ -1,5 +1,6 @@
 import json
 import re
+import time
 from abc import ABC, abstractmethod
 from collections.abc import AsyncGenerator, Awaitable
 from typing import Any, Optional, Union, cast
@@ -15,6 +16,46 @@ from approaches.approach import (
     Approach,
     ExtraInfo,
 )
+from core.instrumentation import record_stage, stage
+
+
+class FollowupQuestionSplitter:
+    """
+    Separates the streamed answer from the <<follow-up questions>> the model appends to it.
+    Works incrementally on the streamed content, including when the << marker is split across two chunks.
+    """
+
+    def __init__(self):
+        self.started = False
+        # A trailing "<" that may be the first half of the marker, held back until the next chunk
+        self.pending = ""
+        self.followup_parts: list[str] = []
+
+    def feed(self, content: str) -> str:
+        """Returns the part of content that belongs to the answer."""
+        if self.started:
+            self.followup_parts.append(content)
+            return ""
+        text = self.pending + content
+        self.pending = ""
+        marker_index = text.find("<<")
+        if marker_index != -1:
+            self.started = True
+            self.followup_parts.append(text[marker_index:])
+            return text[:marker_index]
+        if text.endswith("<"):
+            self.pending = "<"
+            return text[:-1]
+        return text
+
+    def flush(self) -> str:
+        """Returns answer content still held back when the stream ends."""
+        pending, self.pending = self.pending, ""
+        return pending
+
+    @property
+    def followup_content(self) -> str:
+        return "".join(self.followup_parts)
 
 
 class ChatApproach(Approach, ABC):
@@ -60,7 +101,8 @@ class ChatApproach(Approach, ABC):
         extra_info, chat_coroutine = await self.run_until_final_call(
             messages, overrides, auth_claims, should_stream=False
         )
-        chat_completion_response: ChatCompletion = await cast(Awaitable[ChatCompletion], chat_coroutine)
+        with stage("answer"):
+            chat_completion_response: ChatCompletion = await cast(Awaitable[ChatCompletion], chat_coroutine)
         content = chat_completion_response.choices[0].message.content
         role = chat_completion_response.choices[0].message.role
         if overrides.get("suggest_followup_questions"):
@@ -89,46 +131,59 @@ class ChatApproach(Approach, ABC):
         chat_coroutine = cast(Awaitable[AsyncStream[ChatCompletionChunk]], chat_coroutine)
         yield {"delta": {"role": "assistant"}, "context": extra_info, "session_state": session_state}
 
-        followup_questions_started = False
-        followup_content = ""
+        followup_splitter = FollowupQuestionSplitter() if overrides.get("suggest_followup_questions") else None
+        stream_cpu_time = 0.0
+        stream_start = time.perf_counter()
+        first_chunk = True
         async for event_chunk in await chat_coroutine:
-            # "2023-07-01-preview" API version has a bug where first response has empty choices
-            event = event_chunk.model_dump()  # Convert pydantic model to dict
-            if event["choices"]:
-                # No usage during streaming
-                completion = {
-                    "delta": {
-                        "content": event["choices"][0]["delta"].get("content"),
-                        "role": event["choices"][0]["delta"]["role"],
-                    }
-                }
-                # if event contains << and not >>, it is start of follow-up question, truncate
-                content = completion["delta"].get("content")
-                content = content or ""  # content may either not exist in delta, or explicitly be None
-                if overrides.get("suggest_followup_questions") and "<<" in content:
-                    followup_questions_started = True
-                    earlier_content = content[: content.index("<<")]
-                    if earlier_content:
-                        completion["delta"]["content"] = earlier_content
-                        yield completion
-                    followup_content += content[content.index("<<") :]
-                elif followup_questions_started:
-                    followup_content += content
-                else:
-                    yield completion
-            else:
+            if first_chunk:
+                record_stage("answer_first_token", time.perf_counter() - stream_start)
+                first_chunk = False
+            cpu_start = time.thread_time()
+            completion = self.process_stream_chunk(event_chunk, followup_splitter)
+            stream_cpu_time += time.thread_time() - cpu_start
+            if completion:
+                yield completion
+            elif not event_chunk.choices:
                 # Final chunk at end of streaming should contain usage
                 # https://cookbook.openai.com/examples/how_to_stream_completions#4-how-to-get-token-usage-data-for-streamed-chat-completion-response
                 if event_chunk.usage and extra_info.thoughts and self.include_token_usage:
                     extra_info.thoughts[-1].update_token_usage(event_chunk.usage)
                     yield {"delta": {"role": "assistant"}, "context": extra_info, "session_state": session_state}
+        record_stage("answer_stream", time.perf_counter() - stream_start)
+        extra_info.stream_cpu_time_ms = stream_cpu_time * 1000
+
+        if followup_splitter is not None:
+            if pending := followup_splitter.flush():
+                yield {"delta": {"content": pending, "role": None}}
+            if followup_content := followup_splitter.followup_content:
+                _, followup_questions = self.extract_followup_questions(followup_content)
+                yield {
+                    "delta": {"role": "assistant"},
+                    "context": {"context": extra_info, "followup_questions": followup_questions},
+                }
 
-        if followup_content:
-            _, followup_questions = self.extract_followup_questions(followup_content)
-            yield {
-                "delta": {"role": "assistant"},
-                "context": {"context": extra_info, "followup_questions": followup_questions},
-            }
+    def process_stream_chunk(
+        self, event_chunk: ChatCompletionChunk, followup_splitter: Optional[FollowupQuestionSplitter]
+    ) -> Optional[dict[str, Any]]:
+        """
+        Turns a streamed chunk into the delta event sent to the client, or None if there is nothing to send.
+        Reads the chunk attributes directly, since converting every chunk with model_dump is costly at high token rates.
+        """
+        # "2023-07-01-preview" API version has a bug where first response has empty choices
+        if not event_chunk.choices:
+            return None
+        delta = event_chunk.choices[0].delta
+        content = delta.content
+        if followup_splitter is not None:
+            if content:
+                content = followup_splitter.feed(content)
+                if not content:
+                    return None
+            elif followup_splitter.started:
+                return None
+        # No usage during streaming
+        return {"delta": {"content": content, "role": delta.role}}
 
     async def run(
         self,
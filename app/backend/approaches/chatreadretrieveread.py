@@ -1,3 +1,5 @@
+import asyncio
+import logging
 from collections.abc import Awaitable, AsyncGenerator
 from typing import Any, Optional, Union, cast
 import time
@@ -16,10 +18,38 @@ from openai.types.chat import (
     ChatCompletionToolParam,
 )
 
-from approaches.approach import DataPoints, ExtraInfo, ThoughtStep
-from approaches.chatapproach import ChatApproach
+from approaches.approach import DataPoints, Document, ExtraInfo, ThoughtStep
+from approaches.chatapproach import ChatApproach, FollowupQuestionSplitter
 from approaches.promptmanager import PromptManager
+from approaches.promptpacker import PromptPacker
+from approaches.queryrewritepolicy import QueryRewritePolicy
 from core.authentication import AuthenticationHelper
+from core.instrumentation import record_stage
+
+
+logger = logging.getLogger(__name__)
+# Verbose per-step timing lines, in their own category so they can be sampled with LOG_SAMPLING
+timing_logger = logging.getLogger("approaches.timing")
+
+
+def normalize_search_query(query: str) -> str:
+    """
+    Lowercases the query, collapses its whitespace and strips surrounding punctuation. The text search
+    ignores those differences, so queries that are equal once normalized retrieve the same results.
+    """
+    return " ".join(query.lower().split()).strip(" ?!.,;:'\"")
+
+
+async def cancel_speculative_task(task: asyncio.Task) -> None:
+    """Cancels a speculative retrieval task and waits for it, so no search call outlives the request."""
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    except Exception:
+        # The speculative result is being thrown away, so its failure is irrelevant
+        pass
 
 
 class ChatReadRetrieveReadApproach(ChatApproach):
@@ -29,13 +59,7 @@ class ChatReadRetrieveReadApproach(ChatApproach):
     def print_feedback(self, feedback_data: dict[str, Any]):
         action = feedback_data.get('feedbackType')
         text = feedback_data.get('feedbackText')
-        print(f"[FEEDBACK] Action: {action}")
-        if text:
-            print(f"[FEEDBACK] Text: {text}")
-
-    def _get_timestamp(self):
-        """Get current timestamp in HH:MM:SS format using Bucharest timezone"""
-        return datetime.now(self.BUCHAREST_TZ).strftime("%H:%M:%S")
+        logger.info("Feedback %s", action, extra={"feedback_text": text})
 
     def _get_bucharest_time(self):
         """Get current datetime in Bucharest timezone"""
@@ -43,14 +67,13 @@ class ChatReadRetrieveReadApproach(ChatApproach):
 
     def _log_timing(self, message: str, duration_s: float = None):
         """Log timing information with timestamp"""
-        if not self.enable_debug_logging:
+        if not self.enable_debug_logging or not timing_logger.isEnabledFor(logging.INFO):
             return
-            
-        timestamp = self._get_timestamp()
+
         if duration_s is not None:
-            print(f"[TIMING {timestamp}] {message}: {duration_s:.3f} s")
+            timing_logger.info("%s: %.3f s", message, duration_s, extra={"duration_seconds": round(duration_s, 3)})
         else:
-            print(f"[TIMING {timestamp}] {message}")
+            timing_logger.info(message)
 
     def _analyze_performance_issues(self, messages: list, response_token_limit: int, temperature: float):
         """Analyze potential performance issues based on request parameters"""
@@ -105,6 +128,8 @@ class ChatReadRetrieveReadApproach(ChatApproach):
         prompt_manager: PromptManager,
         reasoning_effort: Optional[str] = None,
         enable_debug_logging: bool = False,  # New parameter for controlling debug logging
+        query_rewrite_policy: Optional[QueryRewritePolicy] = None,
+        prompt_packer: Optional[PromptPacker] = None,
     ):
         super().__init__(
             search_client=search_client,
@@ -142,6 +167,8 @@ class ChatReadRetrieveReadApproach(ChatApproach):
         self.reasoning_effort = reasoning_effort
         self.include_token_usage = True
         self.enable_debug_logging = enable_debug_logging  # Store the debug logging preference
+        self.query_rewrite_policy = query_rewrite_policy or QueryRewritePolicy()
+        self.prompt_packer = prompt_packer or PromptPacker()
         import logging
         self.logger = logging.getLogger(self.__class__.__name__)
 
@@ -183,13 +210,15 @@ class ChatReadRetrieveReadApproach(ChatApproach):
         self._log_timing("Retrieval approach took", retrieval_duration)
 
         prompt_start_time = time.time()
+        packed = self.pack_prompt_inputs(messages[:-1], extra_info.data_points.text, original_user_query, overrides)
+        extra_info.data_points.text = packed.text_sources
         # print(f"[DEBUG] text_sources being sent to prompt: {extra_info.data_points.text[:3]}", file=sys.stdout)
         messages = self.prompt_manager.render_prompt(
             self.answer_prompt,
             self.get_system_prompt_variables(overrides.get("prompt_template"))
             | {
                 "include_follow_up_questions": bool(overrides.get("suggest_followup_questions")),
-                "past_messages": messages[:-1],
+                "past_messages": packed.past_messages,
                 "user_query": original_user_query,
                 "text_sources": extra_info.data_points.text,
             },
@@ -217,16 +246,16 @@ class ChatReadRetrieveReadApproach(ChatApproach):
                 should_stream,
             ),
         )
-        extra_info.thoughts.append(
-            self.format_thought_step_for_chatcompletion(
-                title="Prompt to generate answer",
-                messages=messages,
-                overrides=overrides,
-                model=self.chatgpt_model,
-                deployment=self.chatgpt_deployment,
-                usage=None,
-            )
+        answer_thought = self.format_thought_step_for_chatcompletion(
+            title="Prompt to generate answer",
+            messages=messages,
+            overrides=overrides,
+            model=self.chatgpt_model,
+            deployment=self.chatgpt_deployment,
+            usage=None,
         )
+        answer_thought.update_prompt_budget(packed)
+        extra_info.thoughts.append(answer_thought)
         
         total_duration = time.time() - start_time
         self._log_timing("run_until_final_call (pre OpenAI send) took", total_duration)
@@ -267,6 +296,7 @@ class ChatReadRetrieveReadApproach(ChatApproach):
         
         openai_duration = time.time() - openai_start_time
         self._log_timing("OpenAI answer generation took", openai_duration)
+        record_stage("answer", openai_duration)
         
         # Debug response details
         if chat_completion_response.usage:
@@ -324,50 +354,31 @@ class ChatReadRetrieveReadApproach(ChatApproach):
         # Time the streaming response
         streaming_start_time = time.time()
         first_token_received = False
-        token_count = 0
+        content_chunk_count = 0
         chunk_count = 0
-        
+        stream_cpu_time = 0.0
+
         self._log_timing("OpenAI streaming API call starting now...")
-        
-        followup_questions_started = False
-        followup_content = ""
+
+        followup_splitter = FollowupQuestionSplitter() if overrides.get("suggest_followup_questions") else None
         async for event_chunk in await chat_coroutine:
+            cpu_start = time.thread_time()
             chunk_count += 1
-            
+
             if not first_token_received:
                 first_token_time = time.time() - streaming_start_time
                 self._log_timing("OpenAI first token received after", first_token_time)
+                record_stage("answer_first_token", first_token_time)
                 first_token_received = True
-                
-            # "2023-07-01-preview" API version has a bug where first response has empty choices
-            event = event_chunk.model_dump()  # Convert pydantic model to dict
-            if event["choices"]:
-                # Count tokens (approximate)
-                content = event["choices"][0]["delta"].get("content")
-                if content:
-                    token_count += len(content.split())
-                
-                # No usage during streaming
-                completion = {
-                    "delta": {
-                        "content": content,
-                        "role": event["choices"][0]["delta"]["role"],
-                    }
-                }
-                # if event contains << and not >>, it is start of follow-up question, truncate
-                content = content or ""  # content may either not exist in delta, or explicitly be None
-                if overrides.get("suggest_followup_questions") and "<<" in content:
-                    followup_questions_started = True
-                    earlier_content = content[: content.index("<<")]
-                    if earlier_content:
-                        completion["delta"]["content"] = earlier_content
-                        yield completion
-                    followup_content += content[content.index("<<") :]
-                elif followup_questions_started:
-                    followup_content += content
-                else:
-                    yield completion
-            else:
+
+            # Each streamed content chunk carries about one token
+            if event_chunk.choices and event_chunk.choices[0].delta.content:
+                content_chunk_count += 1
+            completion = self.process_stream_chunk(event_chunk, followup_splitter)
+            stream_cpu_time += time.thread_time() - cpu_start
+            if completion:
+                yield completion
+            elif not event_chunk.choices:
                 # Final chunk at end of streaming should contain usage
                 # https://cookbook.openai.com/examples/how_to_stream_completions#4-how-to-get-token-usage-data-for-streamed-chat-completion-response
                 if event_chunk.usage and extra_info.thoughts and self.include_token_usage:
@@ -376,19 +387,25 @@ class ChatReadRetrieveReadApproach(ChatApproach):
 
         streaming_total_duration = time.time() - streaming_start_time
         self._log_timing("OpenAI streaming response total took", streaming_total_duration)
+        record_stage("answer_stream", streaming_total_duration)
         self._log_timing(f"Total chunks received: {chunk_count}")
-        self._log_timing(f"Approximate tokens generated: {token_count}")
-        
-        if token_count > 0 and streaming_total_duration > 0:
-            tokens_per_second = token_count / streaming_total_duration
+        self._log_timing(f"Approximate tokens generated: {content_chunk_count}")
+        self._log_timing(f"CPU time spent processing chunks: {stream_cpu_time * 1000:.3f}ms")
+        extra_info.stream_cpu_time_ms = stream_cpu_time * 1000
+
+        if content_chunk_count > 0 and streaming_total_duration > 0:
+            tokens_per_second = content_chunk_count / streaming_total_duration
             self._log_timing(f"Approximate tokens per second: {tokens_per_second:.2f}")
-        
-        if followup_content:
-            _, followup_questions = self.extract_followup_questions(followup_content)
-            yield {
-                "delta": {"role": "assistant"},
-                "context": {"context": extra_info, "followup_questions": followup_questions},
-            }
+
+        if followup_splitter is not None:
+            if pending := followup_splitter.flush():
+                yield {"delta": {"content": pending, "role": None}}
+            if followup_content := followup_splitter.followup_content:
+                _, followup_questions = self.extract_followup_questions(followup_content)
+                yield {
+                    "delta": {"role": "assistant"},
+                    "context": {"context": extra_info, "followup_questions": followup_questions},
+                }
 
     async def run_search_approach(
         self, messages: list[ChatCompletionMessageParam], overrides: dict[str, Any], auth_claims: dict[str, Any]
@@ -410,60 +427,110 @@ class ChatReadRetrieveReadApproach(ChatApproach):
         if not isinstance(original_user_query, str):
             raise ValueError("The most recent message content must be a string.")
 
-        query_messages = self.prompt_manager.render_prompt(
-            self.query_rewrite_prompt, {"user_query": original_user_query, "past_messages": messages[:-1]}
-        )
-        tools: list[ChatCompletionToolParam] = self.query_rewrite_tools
-
-        # STEP 1: Generate an optimized keyword search query based on the chat history and the last question
-        query_generation_start = time.time()
-        chat_completion = cast(
-            ChatCompletion,
-            await self.create_chat_completion(
-                self.chatgpt_deployment,
-                self.chatgpt_model,
-                messages=query_messages,
-                overrides=overrides,
-                response_token_limit=self.get_response_token_limit(
-                    self.chatgpt_model, 100
-                ),  # Setting too low risks malformed JSON, setting too high may affect performance
-                temperature=0.0,  # Minimize creativity for search query generation
-                tools=tools,
-                reasoning_effort="low",  # Minimize reasoning for search query generation
-            ),
-        )
-        query_generation_duration = (time.time() - query_generation_start)
-        self._log_timing("Query generation took", query_generation_duration)
-
-        query_text = self.get_search_query(chat_completion, original_user_query)
+        async def retrieve(search_query: str) -> tuple[list[VectorQuery], list[Document], float]:
+            retrieve_start = time.time()
+            # If retrieval mode includes vectors, compute an embedding for the query
+            vectors: list[VectorQuery] = []
+            if use_vector_search:
+                embedding_start = time.time()
+                vectors.append(await self.compute_text_embedding(search_query))
+                embedding_duration = time.time() - embedding_start
+                self._log_timing("Text embedding computation took", embedding_duration)
+
+            search_start = time.time()
+            results = await self.search(
+                top,
+                search_query,
+                search_index_filter,
+                vectors,
+                use_text_search,
+                use_vector_search,
+                use_semantic_ranker,
+                use_semantic_captions,
+                minimum_search_score,
+                minimum_reranker_score,
+                use_query_rewriting,
+            )
+            search_duration = time.time() - search_start
+            self._log_timing(f"Search call took", search_duration)
+            self._log_timing(f"Search returned {len(results)} docs")
+            return vectors, results, time.time() - retrieve_start
+
+        # STEP 1: Generate an optimized keyword search query based on the chat history and the last question,
+        # unless the rewrite policy decides it can be skipped or a cached rewrite exists
+        past_messages = messages[:-1]
+        policy = self.query_rewrite_policy
+        rewrite_decision = policy.decide(original_user_query, past_messages)
+        prompt_version = self.prompt_manager.version_number()
+        # Stays empty when no rewrite prompt is sent
+        query_messages: list[ChatCompletionMessageParam] = []
+        chat_completion: Optional[ChatCompletion] = None
+        speculative_task: Optional[asyncio.Task] = None
+        if rewrite_decision.skip:
+            policy.skipped += 1
+            rewrite_status = "skipped"
+            query_text = original_user_query
+        elif cached_query_text := policy.get_cached(original_user_query, past_messages, prompt_version):
+            rewrite_status = "cached"
+            query_text = cached_query_text
+        else:
+            policy.executed += 1
+            rewrite_status = "executed"
+            query_messages = self.prompt_manager.render_prompt(
+                self.query_rewrite_prompt, {"user_query": original_user_query, "past_messages": past_messages}
+            )
+            tools: list[ChatCompletionToolParam] = self.prompt_manager.resolve_tools(self.query_rewrite_tools)
+            # Speculatively embed and search the raw question while the rewrite is generated,
+            # the results are kept only if the rewrite turns out to be the same query
+            if overrides.get("speculative_retrieval"):
+                speculative_task = asyncio.create_task(retrieve(original_user_query))
+
+            query_generation_start = time.time()
+            try:
+                chat_completion = cast(
+                    ChatCompletion,
+                    await self.create_chat_completion(
+                        self.chatgpt_deployment,
+                        self.chatgpt_model,
+                        messages=query_messages,
+                        overrides=overrides,
+                        response_token_limit=self.get_response_token_limit(
+                            self.chatgpt_model, 100
+                        ),  # Setting too low risks malformed JSON, setting too high may affect performance
+                        temperature=0.0,  # Minimize creativity for search query generation
+                        tools=tools,
+                        reasoning_effort="low",  # Minimize reasoning for search query generation
+                    ),
+                )
+            except BaseException:
+                if speculative_task is not None:
+                    await cancel_speculative_task(speculative_task)
+                raise
+            query_generation_duration = time.time() - query_generation_start
+            self._log_timing("Query generation took", query_generation_duration)
+            record_stage("query_rewrite", query_generation_duration)
+
+            query_text = self.get_search_query(chat_completion, original_user_query)
+            policy.put_cached(original_user_query, past_messages, query_text, prompt_version)
+        query_generation_end = time.time()
 
         # STEP 2: Retrieve relevant documents from the search index with the GPT optimized query
-
-        # If retrieval mode includes vectors, compute an embedding for the query
-        vectors: list[VectorQuery] = []
-        if use_vector_search:
-            embedding_start = time.time()
-            vectors.append(await self.compute_text_embedding(query_text))
-            embedding_duration = time.time() - embedding_start
-            self._log_timing("Text embedding computation took", embedding_duration)
-
-        search_start = time.time()
-        results = await self.search(
-            top,
-            query_text,
-            search_index_filter,
-            vectors,
-            use_text_search,
-            use_vector_search,
-            use_semantic_ranker,
-            use_semantic_captions,
-            minimum_search_score,
-            minimum_reranker_score,
-            use_query_rewriting,
-        )
-        search_duration = time.time() - search_start
-        self._log_timing(f"Search call took", search_duration)
-        self._log_timing(f"Search returned {len(results)} docs")
+        speculative_props: dict[str, Any] = {}
+        if speculative_task is not None:
+            if normalize_search_query(query_text) == normalize_search_query(original_user_query):
+                vectors, results, speculative_duration = await speculative_task
+                # Whatever part of the retrieval finished while the rewrite was running is time saved
+                waited = time.time() - query_generation_end
+                speculative_props = {
+                    "speculative_retrieval": "reused",
+                    "speculative_time_saved_ms": round(max(0.0, speculative_duration - waited) * 1000),
+                }
+            else:
+                await cancel_speculative_task(speculative_task)
+                speculative_props = {"speculative_retrieval": "discarded", "speculative_time_saved_ms": 0}
+                vectors, results, _ = await retrieve(query_text)
+        else:
+            vectors, results, _ = await retrieve(query_text)
 
         # STEP 3: Generate a contextual and content specific answer using the search results and chat history
         sources_start = time.time()
@@ -476,18 +543,26 @@ class ChatReadRetrieveReadApproach(ChatApproach):
         sources_duration = time.time() - sources_start
         self._log_timing("Search source content assembly took", sources_duration)
 
+        rewrite_thought = self.format_thought_step_for_chatcompletion(
+            title="Prompt to generate search query",
+            messages=query_messages,
+            overrides=overrides,
+            model=self.chatgpt_model,
+            deployment=self.chatgpt_deployment,
+            usage=chat_completion.usage if chat_completion else None,
+            reasoning_effort="low",
+        )
+        if policy.skip_enabled or policy.cache_size > 0:
+            rewrite_thought.props = {
+                **(rewrite_thought.props or {}),
+                "query_rewrite": rewrite_status,
+                "query_rewrite_reason": "cache hit" if rewrite_status == "cached" else rewrite_decision.reason,
+                "query_rewrite_counts": policy.stats(),
+            }
         extra_info = ExtraInfo(
             DataPoints(text=text_sources),
             thoughts=[
-                self.format_thought_step_for_chatcompletion(
-                    title="Prompt to generate search query",
-                    messages=query_messages,
-                    overrides=overrides,
-                    model=self.chatgpt_model,
-                    deployment=self.chatgpt_deployment,
-                    usage=chat_completion.usage,
-                    reasoning_effort="low",
-                ),
+                rewrite_thought,
                 ThoughtStep(
                     "Search using generated search query",
                     query_text,
@@ -499,6 +574,7 @@ class ChatReadRetrieveReadApproach(ChatApproach):
                         "filter": search_index_filter,
                         "use_vector_search": use_vector_search,
                         "use_text_search": use_text_search,
+                        **speculative_props,
                     },
                 ),
                 ThoughtStep(
@@ -2,6 +2,7 @@ from collections.abc import Awaitable
 from typing import Any, Callable, Optional, Union, cast
 
 from azure.search.documents.aio import SearchClient
+from azure.search.documents.models import VectorQuery
 from azure.storage.blob.aio import ContainerClient
 from openai import AsyncOpenAI, AsyncStream
 from openai.types.chat import (
@@ -14,8 +15,11 @@ from openai.types.chat import (
 from approaches.approach import DataPoints, ExtraInfo, ThoughtStep
 from approaches.chatapproach import ChatApproach
 from approaches.promptmanager import PromptManager
+from approaches.promptpacker import PromptPacker
 from core.authentication import AuthenticationHelper
-from core.imageshelper import fetch_image
+from core.imageshelper import ImageCache, fetch_images
+from core.instrumentation import stage
+from core.lrucache import LRUCache
 
 
 class ChatReadRetrieveReadVisionApproach(ChatApproach):
@@ -47,6 +51,9 @@ class ChatReadRetrieveReadVisionApproach(ChatApproach):
         vision_endpoint: str,
         vision_token_provider: Callable[[], Awaitable[str]],
         prompt_manager: PromptManager,
+        image_cache: Optional[ImageCache] = None,
+        image_fetch_concurrency: int = 4,
+        prompt_packer: Optional[PromptPacker] = None,
     ):
         self.search_client = search_client
         self.blob_container_client = blob_container_client
@@ -67,6 +74,10 @@ class ChatReadRetrieveReadVisionApproach(ChatApproach):
         self.vision_endpoint = vision_endpoint
         self.vision_token_provider = vision_token_provider
         self.prompt_manager = prompt_manager
+        self.image_cache = image_cache
+        self.image_fetch_concurrency = image_fetch_concurrency
+        self.prompt_packer = prompt_packer or PromptPacker()
+        self.image_embedding_cache = LRUCache(self.IMAGE_EMBEDDING_CACHE_SIZE)
         self.query_rewrite_prompt = self.prompt_manager.load_prompt("chat_query_rewrite.prompty")
         self.query_rewrite_tools = self.prompt_manager.load_tools("chat_query_rewrite_tools.json")
         self.answer_prompt = self.prompt_manager.load_prompt("chat_answer_question_vision.prompty")
@@ -103,31 +114,29 @@ class ChatReadRetrieveReadVisionApproach(ChatApproach):
         query_messages = self.prompt_manager.render_prompt(
             self.query_rewrite_prompt, {"user_query": original_user_query, "past_messages": messages[:-1]}
         )
-        tools: list[ChatCompletionToolParam] = self.query_rewrite_tools
+        tools: list[ChatCompletionToolParam] = self.prompt_manager.resolve_tools(self.query_rewrite_tools)
 
         # STEP 1: Generate an optimized keyword search query based on the chat history and the last question
-        chat_completion: ChatCompletion = await self.openai_client.chat.completions.create(
-            messages=query_messages,
-            # Azure OpenAI takes the deployment name as the model name
-            model=self.chatgpt_deployment if self.chatgpt_deployment else self.chatgpt_model,
-            temperature=0.0,  # Minimize creativity for search query generation
-            max_tokens=100,
-            n=1,
-            tools=tools,
-            seed=seed,
-        )
+        with stage("query_rewrite"):
+            chat_completion: ChatCompletion = await self.openai_client.chat.completions.create(
+                messages=query_messages,
+                # Azure OpenAI takes the deployment name as the model name
+                model=self.chatgpt_deployment if self.chatgpt_deployment else self.chatgpt_model,
+                temperature=0.0,  # Minimize creativity for search query generation
+                max_tokens=100,
+                n=1,
+                tools=tools,
+                seed=seed,
+            )
 
         query_text = self.get_search_query(chat_completion, original_user_query)
 
         # STEP 2: Retrieve relevant documents from the search index with the GPT optimized query
 
         # If retrieval mode includes vectors, compute an embedding for the query
-        vectors = []
+        vectors: list[VectorQuery] = []
         if use_vector_search:
-            if vector_fields == "textEmbeddingOnly" or vector_fields == "textAndImageEmbeddings":
-                vectors.append(await self.compute_text_embedding(query_text))
-            if vector_fields == "imageEmbeddingOnly" or vector_fields == "textAndImageEmbeddings":
-                vectors.append(await self.compute_image_embedding(query_text))
+            vectors = await self.compute_multimodal_embeddings(query_text, vector_fields)
 
         results = await self.search(
             top,
@@ -151,23 +160,36 @@ class ChatReadRetrieveReadVisionApproach(ChatApproach):
             link_mapping = self.create_link_mapping(results)
             text_sources = self.get_sources_content(results, use_semantic_captions, use_image_citation=True, link_mapping=link_mapping)
         if send_images_to_gptvision:
-            for result in results:
-                url = await fetch_image(self.blob_container_client, result)
-                if url:
-                    image_sources.append(url)
+            image_sources = await fetch_images(
+                self.blob_container_client, results, self.image_cache, self.image_fetch_concurrency
+            )
 
+        packed = self.pack_prompt_inputs(
+            messages[:-1], text_sources, original_user_query, overrides, len(image_sources)
+        )
+        text_sources = packed.text_sources
         messages = self.prompt_manager.render_prompt(
             self.answer_prompt,
             self.get_system_prompt_variables(overrides.get("prompt_template"))
             | {
                 "include_follow_up_questions": bool(overrides.get("suggest_followup_questions")),
-                "past_messages": messages[:-1],
+                "past_messages": packed.past_messages,
                 "user_query": original_user_query,
                 "text_sources": text_sources,
                 "image_sources": image_sources,
             },
         )
 
+        answer_thought = ThoughtStep(
+            "Prompt to generate answer",
+            messages,
+            (
+                {"model": self.gpt4v_model, "deployment": self.gpt4v_deployment}
+                if self.gpt4v_deployment
+                else {"model": self.gpt4v_model}
+            ),
+        )
+        answer_thought.update_prompt_budget(packed)
         extra_info = ExtraInfo(
             DataPoints(text=text_sources, images=image_sources),
             [
@@ -197,15 +219,7 @@ class ChatReadRetrieveReadVisionApproach(ChatApproach):
                     "Search results",
                     [result.serialize_for_results() for result in results],
                 ),
-                ThoughtStep(
-                    "Prompt to generate answer",
-                    messages,
-                    (
-                        {"model": self.gpt4v_model, "deployment": self.gpt4v_deployment}
-                        if self.gpt4v_deployment
-                        else {"model": self.gpt4v_model}
-                    ),
-                ),
+                answer_thought,
             ],
             link_mapping=link_mapping  # Adaugă mapping-ul în extra_info
         )
@@ -1,8 +1,16 @@
 import json
 import pathlib
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Optional
 
 import prompty
+from jinja2 import DictLoader, Environment, Template
 from openai.types.chat import ChatCompletionMessageParam
+from prompty.core import Prompty, param_hoisting
+from prompty.invoker import InvokerFactory
+
+from core.instrumentation import stage
 
 
 class PromptManager:
@@ -16,16 +24,164 @@ class PromptManager:
     def render_prompt(self, prompt, data) -> list[ChatCompletionMessageParam]:
         raise NotImplementedError
 
+    def resolve_tools(self, tools):
+        """Returns the tool definitions for a value returned by load_tools."""
+        return tools
+
+    def version_number(self) -> int:
+        """Number of the prompt version render_prompt uses, which changes whenever the prompts are reloaded."""
+        return 0
+
+
+@dataclass(frozen=True)
+class PromptReference:
+    """Returned by PromptyManager.load_prompt and load_tools, and resolved against a prompt version when used."""
+
+    path: str
+
+
+@dataclass
+class CompiledPrompt:
+    """
+    A prompt with its jinja2 template compiled once. render() gives the same messages as prompty.prepare,
+    which tests/test_promptmanager.py checks for every shipped prompt. Written against prompty 0.1.50:
+    check that test again when upgrading prompty.
+    """
+
+    prompt: Prompty
+    # None for prompts using a renderer other than jinja2, which go through prompty.prepare
+    template: Optional[Template]
+
+    @classmethod
+    def compile(cls, prompt: Prompty) -> "CompiledPrompt":
+        if prompt.template.type != "jinja2":
+            return cls(prompt, None)
+        # Same templates prompty's jinja2 renderer loads: the prompt and its base prompts, by file name
+        templates: dict[str, str] = {}
+        current: Optional[Prompty] = prompt
+        while current is not None:
+            if isinstance(current.content, str):
+                templates[pathlib.Path(current.file).name] = current.content
+            current = current.basePrompty
+        template = Environment(loader=DictLoader(templates)).get_template(pathlib.Path(prompt.file).name)
+        return cls(prompt, template)
+
+    def render(self, data: dict[str, Any]) -> list[ChatCompletionMessageParam]:
+        if self.template is None:
+            return prompty.prepare(self.prompt, data)
+        # Same steps as prompty.prepare, minus building a Jinja environment on every call
+        inputs = param_hoisting(data, self.prompt.sample)
+        return InvokerFactory.run_parser(self.prompt, self.template.render(**inputs))
+
+
+@dataclass(frozen=True)
+class PromptVersion:
+    """An immutable set of compiled prompts and tools. Reloading builds a new version and swaps it in."""
+
+    number: int
+    prompts: dict[str, CompiledPrompt]
+    tools: dict[str, Any]
+    mtimes: dict[str, float]
+
+
+# The version pinned by the running task, with the manager that pinned it
+pinned_prompt_version: ContextVar[Optional[tuple["PromptyManager", PromptVersion]]] = ContextVar(
+    "pinned_prompt_version", default=None
+)
+
 
 class PromptyManager(PromptManager):
+    """
+    Loads prompts and tools from PROMPTS_DIRECTORY into a versioned registry.
+    reload() reads every registered file again and swaps in a new version only if all of them load.
+    A request that pinned a version with pin_version() keeps rendering with it, so a reload never
+    changes the prompts halfway through a request.
+    """
 
     PROMPTS_DIRECTORY = pathlib.Path(__file__).parent / "prompts"
 
+    def __init__(self):
+        self.current = PromptVersion(0, {}, {}, {})
+
+    def file_mtime(self, path: str) -> float:
+        return (self.PROMPTS_DIRECTORY / path).stat().st_mtime
+
+    def read_prompt(self, path: str) -> CompiledPrompt:
+        return CompiledPrompt.compile(prompty.load(self.PROMPTS_DIRECTORY / path))
+
+    def read_tools(self, path: str) -> Any:
+        return json.loads((self.PROMPTS_DIRECTORY / path).read_text())
+
     def load_prompt(self, path: str):
-        return prompty.load(self.PROMPTS_DIRECTORY / path)
+        if path not in self.current.prompts:
+            current = self.current
+            self.current = PromptVersion(
+                current.number,
+                current.prompts | {path: self.read_prompt(path)},
+                current.tools,
+                current.mtimes | {path: self.file_mtime(path)},
+            )
+        return PromptReference(path)
 
     def load_tools(self, path: str):
-        return json.loads(open(self.PROMPTS_DIRECTORY / path).read())
+        if path not in self.current.tools:
+            current = self.current
+            self.current = PromptVersion(
+                current.number,
+                current.prompts,
+                current.tools | {path: self.read_tools(path)},
+                current.mtimes | {path: self.file_mtime(path)},
+            )
+        return PromptReference(path)
+
+    def pin_version(self) -> PromptVersion:
+        """Pins the current version for the rest of the calling task, such as a request handler."""
+        pinned_prompt_version.set((self, self.current))
+        return self.current
+
+    def active_version(self) -> PromptVersion:
+        pinned = pinned_prompt_version.get()
+        if pinned is not None and pinned[0] is self:
+            return pinned[1]
+        return self.current
+
+    def version_number(self) -> int:
+        return self.active_version().number
 
     def render_prompt(self, prompt, data) -> list[ChatCompletionMessageParam]:
-        return prompty.prepare(prompt, data)
+        with stage("prompt_render"):
+            if isinstance(prompt, PromptReference):
+                return self.active_version().prompts[prompt.path].render(data)
+            return prompty.prepare(prompt, data)
+
+    def resolve_tools(self, tools):
+        if isinstance(tools, PromptReference):
+            return self.active_version().tools[tools.path]
+        return tools
+
+    def changed_files(self) -> list[str]:
+        changed = []
+        for path, mtime in self.current.mtimes.items():
+            try:
+                if self.file_mtime(path) != mtime:
+                    changed.append(path)
+            except FileNotFoundError:
+                changed.append(path)
+        return changed
+
+    def reload(self) -> PromptVersion:
+        """
+        Loads every registered prompt and tools file again and swaps in the result as a new version.
+        If any file fails to load, the exception propagates and the current version stays in place.
+        """
+        current = self.current
+        mtimes = {path: self.file_mtime(path) for path in current.mtimes}
+        prompts = {path: self.read_prompt(path) for path in current.prompts}
+        tools = {path: self.read_tools(path) for path in current.tools}
+        self.current = PromptVersion(current.number + 1, prompts, tools, mtimes)
+        return self.current
+
+    def reload_if_changed(self) -> Optional[PromptVersion]:
+        if not self.changed_files():
+            return None
+        return self.reload()
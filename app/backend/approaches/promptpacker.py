@@ -0,0 +1,102 @@
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from openai.types.chat import ChatCompletionMessageParam
+
+from core.requesterror import InvalidRequestError
+from core.tokencounter import DEFAULT_ENCODING, count_message_tokens, count_text_tokens
+
+# Tokens set aside for the system prompt and template text around the history and sources
+DEFAULT_RESERVED_TOKENS = 1000
+
+
+class InvalidPromptBudgetError(InvalidRequestError):
+    """A request asked for a max_input_tokens override that is not a positive integer."""
+
+
+@dataclass
+class PackedPromptInputs:
+    past_messages: list[ChatCompletionMessageParam]
+    text_sources: list[str]
+    max_input_tokens: int
+    tokens_before: int
+    tokens_after: int
+    dropped_messages: int = 0
+    dropped_sources: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+    def to_props(self) -> dict[str, Any]:
+        return {
+            "max_input_tokens": self.max_input_tokens,
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+            "tokens_saved": self.tokens_saved,
+            "dropped_messages": self.dropped_messages,
+            "dropped_sources": self.dropped_sources,
+        }
+
+
+@dataclass
+class PromptPacker:
+    """
+    Fits the chat history and text sources of the answer prompt into an input-token budget.
+    The oldest history turns are dropped first, then the lowest-ranked sources (search results arrive
+    ordered by score, so those are at the end). The user query and the best source are always kept.
+    A max_input_tokens of 0 disables packing, and the inputs are passed through unchanged.
+    A request can lower the budget with its own max_input_tokens, but not raise it above the server's.
+    """
+
+    max_input_tokens: int = 0
+    reserved_tokens: int = DEFAULT_RESERVED_TOKENS
+    encoding_name: str = DEFAULT_ENCODING
+
+    def pack(
+        self,
+        past_messages: list[ChatCompletionMessageParam],
+        text_sources: list[str],
+        user_query: Any,
+        max_input_tokens: Optional[int] = None,
+        fixed_tokens: int = 0,
+    ) -> PackedPromptInputs:
+        budget = self.max_input_tokens
+        if max_input_tokens is not None:
+            if isinstance(max_input_tokens, bool) or not isinstance(max_input_tokens, int) or max_input_tokens <= 0:
+                raise InvalidPromptBudgetError("max_input_tokens must be a positive integer")
+            budget = min(max_input_tokens, budget) if budget > 0 else max_input_tokens
+        if budget <= 0:
+            return PackedPromptInputs(past_messages, text_sources, 0, 0, 0)
+
+        message_tokens = [count_message_tokens(message, self.encoding_name) for message in past_messages]
+        source_tokens = [count_text_tokens(source, self.encoding_name) for source in text_sources]
+        fixed_tokens += self.reserved_tokens + count_message_tokens(
+            {"role": "user", "content": user_query}, self.encoding_name
+        )
+        tokens_before = fixed_tokens + sum(message_tokens) + sum(source_tokens)
+        total = tokens_before
+
+        # Drop the oldest turns, never leaving an assistant answer whose question was dropped at the start
+        first_message = 0
+        while total > budget and first_message < len(past_messages):
+            total -= message_tokens[first_message]
+            first_message += 1
+            while first_message < len(past_messages) and past_messages[first_message]["role"] != "user":
+                total -= message_tokens[first_message]
+                first_message += 1
+
+        kept_sources = len(text_sources)
+        while total > budget and kept_sources > 1:
+            kept_sources -= 1
+            total -= source_tokens[kept_sources]
+
+        return PackedPromptInputs(
+            past_messages=past_messages[first_message:],
+            text_sources=text_sources[:kept_sources],
+            max_input_tokens=budget,
+            tokens_before=tokens_before,
+            tokens_after=total,
+            dropped_messages=first_message,
+            dropped_sources=len(text_sources) - kept_sources,
+        )
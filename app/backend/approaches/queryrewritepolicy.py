@@ -0,0 +1,103 @@
+import re
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from openai.types.chat import ChatCompletionMessageParam
+
+from core.lrucache import LRUCache
+
+# Pronouns and phrases that refer back to earlier turns, so a query containing them needs the history to be rewritten.
+# Only words that are anaphoric in almost every use: common words such as "more", "also" or "mai" would stop
+# nearly every short query from skipping the rewrite. The app serves both English and Romanian users.
+REFERENCE_WORDS = frozenset(
+    [
+        # English
+        "it", "its", "they", "them", "their", "this", "that", "these", "those",
+        "he", "she", "him", "her", "his", "hers", "above", "previous", "same",
+        # Romanian
+        "el", "ea", "ei", "ele", "lui", "lor", "acesta", "aceasta", "acestea", "acestia",
+        "acela", "aceea", "acelea", "aceia", "asta", "aia", "ăsta", "ăla",
+        "același", "aceeași", "anterior", "precedent",
+    ]
+)  # fmt: skip
+
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+# Signature of an optional local classifier: (user_query, past_messages) -> True if the LLM rewrite is needed
+RewriteClassifier = Callable[[str, list[ChatCompletionMessageParam]], bool]
+
+
+@dataclass
+class QueryRewriteDecision:
+    skip: bool
+    reason: str
+
+
+@dataclass
+class QueryRewritePolicy:
+    """
+    Decides whether the LLM query rewrite in ChatReadRetrieveReadApproach can be skipped,
+    and caches the rewrites it does run, keyed on the prompt version and the last history_turns messages.
+    With the default arguments the policy never skips and never caches, so the rewrite always runs.
+    """
+
+    skip_enabled: bool = False
+    max_skip_words: int = 12
+    classifier: Optional[RewriteClassifier] = None
+    history_turns: int = 4
+    cache_size: int = 0
+    skipped: int = 0
+    executed: int = 0
+    cached: int = 0
+    cache: LRUCache[tuple[int, tuple[tuple[str, str], ...]], str] = field(init=False)
+
+    def __post_init__(self):
+        self.cache = LRUCache(self.cache_size)
+
+    def decide(self, user_query: str, past_messages: list[ChatCompletionMessageParam]) -> QueryRewriteDecision:
+        if not self.skip_enabled:
+            return QueryRewriteDecision(skip=False, reason="policy disabled")
+        if self.classifier is not None:
+            if self.classifier(user_query, past_messages):
+                return QueryRewriteDecision(skip=False, reason="classifier")
+            return QueryRewriteDecision(skip=True, reason="classifier")
+        if any(message["role"] == "user" for message in past_messages):
+            return QueryRewriteDecision(skip=False, reason="follow-up turn")
+        words = WORD_PATTERN.findall(user_query.lower())
+        if len(words) > self.max_skip_words:
+            return QueryRewriteDecision(skip=False, reason="long query")
+        if any(word in REFERENCE_WORDS for word in words):
+            return QueryRewriteDecision(skip=False, reason="reference to earlier context")
+        return QueryRewriteDecision(skip=True, reason="short first-turn query")
+
+    def cache_key(
+        self, user_query: str, past_messages: list[ChatCompletionMessageParam], prompt_version: int
+    ) -> tuple[int, tuple[tuple[str, str], ...]]:
+        # A reloaded rewrite prompt may rewrite the same conversation differently, so it gets its own entries
+        recent = past_messages[-self.history_turns :] if self.history_turns > 0 else []
+        messages = tuple((message["role"], str(message.get("content"))) for message in recent)
+        return prompt_version, messages + (("user", user_query),)
+
+    def get_cached(
+        self, user_query: str, past_messages: list[ChatCompletionMessageParam], prompt_version: int = 0
+    ) -> Optional[str]:
+        if self.cache.maxsize <= 0:
+            return None
+        query_text = self.cache.get(self.cache_key(user_query, past_messages, prompt_version))
+        if query_text is not None:
+            self.cached += 1
+        return query_text
+
+    def put_cached(
+        self,
+        user_query: str,
+        past_messages: list[ChatCompletionMessageParam],
+        query_text: str,
+        prompt_version: int = 0,
+    ) -> None:
+        if self.cache.maxsize > 0:
+            self.cache.put(self.cache_key(user_query, past_messages, prompt_version), query_text)
+
+    def stats(self) -> dict[str, Any]:
+        return {"skipped": self.skipped, "executed": self.executed, "cached": self.cached}
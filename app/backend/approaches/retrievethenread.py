@@ -8,7 +8,9 @@ from openai.types.chat import ChatCompletion, ChatCompletionMessageParam
 
 from approaches.approach import Approach, DataPoints, ExtraInfo, ThoughtStep
 from approaches.promptmanager import PromptManager
+from approaches.promptpacker import PromptPacker
 from core.authentication import AuthenticationHelper
+from core.instrumentation import stage
 
 
 class RetrieveThenReadApproach(Approach):
@@ -40,6 +42,7 @@ class RetrieveThenReadApproach(Approach):
         query_speller: str,
         prompt_manager: PromptManager,
         reasoning_effort: Optional[str] = None,
+        prompt_packer: Optional[PromptPacker] = None,
     ):
         self.search_client = search_client
         self.search_index_name = search_index_name
@@ -63,6 +66,7 @@ class RetrieveThenReadApproach(Approach):
         self.answer_prompt = self.prompt_manager.load_prompt("ask_answer_question.prompty")
         self.reasoning_effort = reasoning_effort
         self.include_token_usage = True
+        self.prompt_packer = prompt_packer or PromptPacker()
 
     async def run(
         self,
@@ -83,32 +87,35 @@ class RetrieveThenReadApproach(Approach):
             extra_info = await self.run_search_approach(messages, overrides, auth_claims)
 
         # Process results
+        packed = self.pack_prompt_inputs([], extra_info.data_points.text, q, overrides)
+        extra_info.data_points.text = packed.text_sources
         messages = self.prompt_manager.render_prompt(
             self.answer_prompt,
             self.get_system_prompt_variables(overrides.get("prompt_template"))
             | {"user_query": q, "text_sources": extra_info.data_points.text},
         )
 
-        chat_completion = cast(
-            ChatCompletion,
-            await self.create_chat_completion(
-                self.chatgpt_deployment,
-                self.chatgpt_model,
-                messages=messages,
-                overrides=overrides,
-                response_token_limit=self.get_response_token_limit(self.chatgpt_model, 3000),
-            ),
-        )
-        extra_info.thoughts.append(
-            self.format_thought_step_for_chatcompletion(
-                title="Prompt to generate answer",
-                messages=messages,
-                overrides=overrides,
-                model=self.chatgpt_model,
-                deployment=self.chatgpt_deployment,
-                usage=chat_completion.usage,
+        with stage("answer"):
+            chat_completion = cast(
+                ChatCompletion,
+                await self.create_chat_completion(
+                    self.chatgpt_deployment,
+                    self.chatgpt_model,
+                    messages=messages,
+                    overrides=overrides,
+                    response_token_limit=self.get_response_token_limit(self.chatgpt_model, 3000),
+                ),
             )
+        answer_thought = self.format_thought_step_for_chatcompletion(
+            title="Prompt to generate answer",
+            messages=messages,
+            overrides=overrides,
+            model=self.chatgpt_model,
+            deployment=self.chatgpt_deployment,
+            usage=chat_completion.usage,
         )
+        answer_thought.update_prompt_budget(packed)
+        extra_info.thoughts.append(answer_thought)
         return {
             "message": {
                 "content": chat_completion.choices[0].message.content,
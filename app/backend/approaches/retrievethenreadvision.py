@@ -2,6 +2,7 @@ from collections.abc import Awaitable
 from typing import Any, Callable, Optional
 
 from azure.search.documents.aio import SearchClient
+from azure.search.documents.models import VectorQuery
 from azure.storage.blob.aio import ContainerClient
 from openai import AsyncOpenAI
 from openai.types.chat import (
@@ -10,8 +11,11 @@ from openai.types.chat import (
 
 from approaches.approach import Approach, DataPoints, ExtraInfo, ThoughtStep
 from approaches.promptmanager import PromptManager
+from approaches.promptpacker import PromptPacker
 from core.authentication import AuthenticationHelper
-from core.imageshelper import fetch_image
+from core.imageshelper import ImageCache, fetch_images
+from core.instrumentation import stage
+from core.lrucache import LRUCache
 
 
 class RetrieveThenReadVisionApproach(Approach):
@@ -41,6 +45,9 @@ class RetrieveThenReadVisionApproach(Approach):
         vision_endpoint: str,
         vision_token_provider: Callable[[], Awaitable[str]],
         prompt_manager: PromptManager,
+        image_cache: Optional[ImageCache] = None,
+        image_fetch_concurrency: int = 4,
+        prompt_packer: Optional[PromptPacker] = None,
     ):
         self.search_client = search_client
         self.blob_container_client = blob_container_client
@@ -59,6 +66,10 @@ class RetrieveThenReadVisionApproach(Approach):
         self.vision_endpoint = vision_endpoint
         self.vision_token_provider = vision_token_provider
         self.prompt_manager = prompt_manager
+        self.image_cache = image_cache
+        self.image_fetch_concurrency = image_fetch_concurrency
+        self.prompt_packer = prompt_packer or PromptPacker()
+        self.image_embedding_cache = LRUCache(self.IMAGE_EMBEDDING_CACHE_SIZE)
         self.answer_prompt = self.prompt_manager.load_prompt("ask_answer_question_vision.prompty")
         # Currently disabled due to issues with rendering token usage in the UI
         self.include_token_usage = False
@@ -91,12 +102,9 @@ class RetrieveThenReadVisionApproach(Approach):
         send_images_to_gptvision = overrides.get("gpt4v_input") in ["textAndImages", "images", None]
 
         # If retrieval mode includes vectors, compute an embedding for the query
-        vectors = []
+        vectors: list[VectorQuery] = []
         if use_vector_search:
-            if vector_fields == "textEmbeddingOnly" or vector_fields == "textAndImageEmbeddings":
-                vectors.append(await self.compute_text_embedding(q))
-            if vector_fields == "imageEmbeddingOnly" or vector_fields == "textAndImageEmbeddings":
-                vectors.append(await self.compute_image_embedding(q))
+            vectors = await self.compute_multimodal_embeddings(q, vector_fields)
 
         results = await self.search(
             top,
@@ -120,26 +128,38 @@ class RetrieveThenReadVisionApproach(Approach):
             link_mapping = self.create_link_mapping(results)
             text_sources = self.get_sources_content(results, use_semantic_captions, use_image_citation=True, link_mapping=link_mapping)
         if send_images_to_gptvision:
-            for result in results:
-                url = await fetch_image(self.blob_container_client, result)
-                if url:
-                    image_sources.append(url)
+            image_sources = await fetch_images(
+                self.blob_container_client, results, self.image_cache, self.image_fetch_concurrency
+            )
 
+        packed = self.pack_prompt_inputs([], text_sources, q, overrides, len(image_sources))
+        text_sources = packed.text_sources
         messages = self.prompt_manager.render_prompt(
             self.answer_prompt,
             self.get_system_prompt_variables(overrides.get("prompt_template"))
             | {"user_query": q, "text_sources": text_sources, "image_sources": image_sources},
         )
 
-        chat_completion = await self.openai_client.chat.completions.create(
-            model=self.gpt4v_deployment if self.gpt4v_deployment else self.gpt4v_model,
-            messages=messages,
-            temperature=overrides.get("temperature", 0.3),
-            max_tokens=1024,
-            n=1,
-            seed=seed,
-        )
+        with stage("answer"):
+            chat_completion = await self.openai_client.chat.completions.create(
+                model=self.gpt4v_deployment if self.gpt4v_deployment else self.gpt4v_model,
+                messages=messages,
+                temperature=overrides.get("temperature", 0.3),
+                max_tokens=1024,
+                n=1,
+                seed=seed,
+            )
 
+        answer_thought = ThoughtStep(
+            "Prompt to generate answer",
+            messages,
+            (
+                {"model": self.gpt4v_model, "deployment": self.gpt4v_deployment}
+                if self.gpt4v_deployment
+                else {"model": self.gpt4v_model}
+            ),
+        )
+        answer_thought.update_prompt_budget(packed)
         extra_info = ExtraInfo(
             DataPoints(text=text_sources, images=image_sources),
             [
@@ -161,15 +181,7 @@ class RetrieveThenReadVisionApproach(Approach):
                     "Search results",
                     [result.serialize_for_results() for result in results],
                 ),
-                ThoughtStep(
-                    "Prompt to generate answer",
-                    messages,
-                    (
-                        {"model": self.gpt4v_model, "deployment": self.gpt4v_deployment}
-                        if self.gpt4v_deployment
-                        else {"model": self.gpt4v_model}
-                    ),
-                ),
+                answer_thought,
             ],
             link_mapping=link_mapping  # Adaugă mapping-ul în extra_info
         )
@@ -1,8 +1,15 @@
+import base64
+import json
 import os
 import time
-from typing import Any, Union
+import zlib
+from typing import Any, Optional, Union
 
 from azure.cosmos.aio import ContainerProxy, CosmosClient
+from azure.cosmos.exceptions import (
+    CosmosBatchOperationError,
+    CosmosResourceNotFoundError,
+)
 from azure.identity.aio import AzureDeveloperCliCredential, ManagedIdentityCredential
 from quart import Blueprint, current_app, jsonify, make_response, request
 
@@ -18,6 +25,70 @@ from error import error_response
 
 chat_history_cosmosdb_bp = Blueprint("chat_history_cosmos", __name__, static_folder="static")
 
+# Cosmos DB rejects transactional batches with more than 100 operations
+COSMOS_MAX_BATCH_OPERATIONS = 100
+# Each message pair of a page is an id in the query, so pages are bounded
+MAX_MESSAGE_PAIRS_PAGE_SIZE = 100
+
+
+# Parts of a response context that are only needed to show thoughts and supporting content.
+# They are stored compressed, outside of the response, so listing a conversation can skip them.
+HEAVY_CONTEXT_FIELDS = ("data_points", "thoughts")
+
+
+def compact_response(response: Any) -> tuple[Any, Optional[str]]:
+    """Splits the heavy context fields out of a response and returns them zlib-compressed and base64 encoded."""
+    if not isinstance(response, dict) or not isinstance(response.get("context"), dict):
+        return response, None
+    context = response["context"]
+    heavy_context = {field: context[field] for field in HEAVY_CONTEXT_FIELDS if field in context}
+    if not heavy_context:
+        return response, None
+    light_context = {key: value for key, value in context.items() if key not in HEAVY_CONTEXT_FIELDS}
+    compressed = base64.b64encode(zlib.compress(json.dumps(heavy_context).encode("utf-8"))).decode("ascii")
+    return {**response, "context": light_context}, compressed
+
+
+def decompress_context(compressed_context: Optional[str]) -> dict[str, Any]:
+    if not compressed_context:
+        return {}
+    return json.loads(zlib.decompress(base64.b64decode(compressed_context)).decode("utf-8"))
+
+
+def expand_response(item: dict[str, Any], include_context: bool) -> Any:
+    """Rebuilds the response of a stored message pair, with or without the heavy context fields."""
+    response = item["response"]
+    if not isinstance(response, dict) or not isinstance(response.get("context"), dict):
+        return response
+    if include_context:
+        heavy_context = decompress_context(item.get("compressed_context"))
+        return {**response, "context": {**response["context"], **heavy_context}}
+    # Items stored before compression keep everything inline, so drop the heavy fields here
+    light_context = {key: value for key, value in response["context"].items() if key not in HEAVY_CONTEXT_FIELDS}
+    return {**response, "context": light_context}
+
+
+def message_pair_index(item: dict[str, Any]) -> int:
+    # Message pair IDs are "<session_id>-<index>"
+    return int(item["id"].rsplit("-", 1)[1])
+
+
+def parse_int_arg(value: str, minimum: int, maximum: Optional[int] = None) -> Optional[int]:
+    """Returns value as an integer, or None if it is not one or is out of range."""
+    try:
+        number = int(value)
+    except ValueError:
+        return None
+    if number < minimum or (maximum is not None and number > maximum):
+        return None
+    return number
+
+
+def session_batch_operation(operation: str, args: tuple, etag: Optional[str]) -> tuple:
+    if etag:
+        return (operation, args, {"if_match_etag": etag})
+    return (operation, args)
+
 
 @chat_history_cosmosdb_bp.post("/chat_history")
 @authenticated
@@ -33,45 +104,94 @@ async def post_chat_history(auth_claims: dict[str, Any]):
     if not entra_oid:
         return jsonify({"error": "User OID not found"}), 401
 
+    batch_index = 0
     try:
         request_json = await request.get_json()
         session_id = request_json.get("id")
         message_pairs = request_json.get("answers")
-        first_question = message_pairs[0][0]
-        title = first_question + "..." if len(first_question) > 50 else first_question
+        # Clients that know how many pairs are already stored send only the new ones, starting at start_index,
+        # along with the session ETag returned by their previous save so concurrent writers are detected
+        start_index = request_json.get("start_index", 0)
+        if not isinstance(start_index, int) or isinstance(start_index, bool) or start_index < 0:
+            return jsonify({"error": "start_index must be a non-negative integer"}), 400
+        etag = request_json.get("etag")
+        message_count = start_index + len(message_pairs)
         timestamp = int(time.time() * 1000)
-
-        # Insert the session item:
-        session_item = {
-            "id": session_id,
-            "version": current_app.config[CONFIG_COSMOS_HISTORY_VERSION],
-            "session_id": session_id,
-            "entra_oid": entra_oid,
-            "type": "session",
-            "title": title,
-            "timestamp": timestamp,
-        }
-
-        message_pair_items = []
-        # Now insert a message item for each question/response pair:
-        for ind, message_pair in enumerate(message_pairs):
-            message_pair_items.append(
-                {
-                    "id": f"{session_id}-{ind}",
-                    "version": current_app.config[CONFIG_COSMOS_HISTORY_VERSION],
+        version = current_app.config[CONFIG_COSMOS_HISTORY_VERSION]
+
+        def session_operation(stored_message_count: int) -> tuple:
+            if start_index == 0:
+                first_question = message_pairs[0][0]
+                title = first_question + "..." if len(first_question) > 50 else first_question
+                # Insert the session item:
+                session_item = {
+                    "id": session_id,
+                    "version": version,
                     "session_id": session_id,
                     "entra_oid": entra_oid,
-                    "type": "message_pair",
-                    "question": message_pair[0],
-                    "response": message_pair[1],
+                    "type": "session",
+                    "title": title,
+                    "timestamp": timestamp,
+                    "message_count": stored_message_count,
                 }
-            )
+                return session_batch_operation("upsert", (session_item,), etag)
+            # Appending to an existing session: the title does not change, so only patch the bookkeeping fields
+            patch_operations = [
+                {"op": "set", "path": "/timestamp", "value": timestamp},
+                {"op": "set", "path": "/message_count", "value": stored_message_count},
+            ]
+            return session_batch_operation("patch", (session_id, patch_operations), etag)
 
-        batch_operations = [("upsert", (session_item,))] + [
-            ("upsert", (message_pair_item,)) for message_pair_item in message_pair_items
-        ]
-        await container.execute_item_batch(batch_operations=batch_operations, partition_key=[entra_oid, session_id])
-        return jsonify({}), 201
+        message_pair_items = []
+        # Now insert a message item for each new question/response pair:
+        for ind, message_pair in enumerate(message_pairs, start=start_index):
+            response, compressed_context = compact_response(message_pair[1])
+            message_pair_item = {
+                "id": f"{session_id}-{ind}",
+                "version": version,
+                "session_id": session_id,
+                "entra_oid": entra_oid,
+                "type": "message_pair",
+                "question": message_pair[0],
+                "response": response,
+            }
+            if compressed_context:
+                message_pair_item["compressed_context"] = compressed_context
+            message_pair_items.append(message_pair_item)
+
+        message_operations = [("upsert", (message_pair_item,)) for message_pair_item in message_pair_items]
+        # The session operation is in the first batch, so an ETag conflict fails before any message is written.
+        # When the pairs need more than one batch, the first one keeps the stored message_count and the last one
+        # sets it, so a batch that fails halfway never leaves a session counting pairs that were not stored.
+        if len(message_operations) < COSMOS_MAX_BATCH_OPERATIONS:
+            batches = [[session_operation(message_count)] + message_operations]
+        else:
+            batch_size = COSMOS_MAX_BATCH_OPERATIONS - 1
+            batches = [[session_operation(start_index)] + message_operations[:batch_size]]
+            batches += [
+                message_operations[batch_start : batch_start + batch_size]
+                for batch_start in range(batch_size, len(message_operations), batch_size)
+            ]
+            batches[-1].append(
+                ("patch", (session_id, [{"op": "set", "path": "/message_count", "value": message_count}]))
+            )
+        batch_results: list[dict[str, Any]] = []
+        for batch_index, batch in enumerate(batches):
+            batch_results = (
+                await container.execute_item_batch(batch_operations=batch, partition_key=[entra_oid, session_id]) or []
+            )
+        # The ETag returned is the one of the last write to the session item
+        session_result = (batch_results[0] if len(batches) == 1 else batch_results[-1]) if batch_results else {}
+        new_etag = session_result.get("eTag")
+        return jsonify({"etag": new_etag, "message_count": message_count}), 201
+    except CosmosBatchOperationError as error:
+        failed_status = (error.operation_responses or [{}])[error.error_index or 0].get("statusCode")
+        # Only the session operation, first in the first batch, is conditional or can miss its item
+        if batch_index == 0 and error.error_index == 0 and failed_status == 412:
+            return jsonify({"error": "Chat history was modified by another request"}), 412
+        if batch_index == 0 and error.error_index == 0 and failed_status == 404:
+            return jsonify({"error": "Chat history session not found"}), 404
+        return error_response(error, "/chat_history")
     except Exception as error:
         return error_response(error, "/chat_history")
 
@@ -144,31 +264,83 @@ async def get_chat_history_session(auth_claims: dict[str, Any], session_id: str)
         return jsonify({"error": "User OID not found"}), 401
 
     try:
+        # Without a count the whole conversation is returned, as before. With a count, message pairs are
+        # returned in order, a page at a time, and the heavy context fields are omitted unless requested.
+        count = request.args.get("count")
+        include_context = request.args.get("include_context", "false" if count else "true").lower() == "true"
+        fields = "c.id, c.question, c.response" + (", c.compressed_context" if include_context else "")
+        query = f"SELECT {fields} FROM c WHERE c.session_id = @session_id AND c.type = @type"
+        parameters: list[dict[str, object]] = [
+            dict(name="@session_id", value=session_id),
+            dict(name="@type", value="message_pair"),
+        ]
+
+        continuation_token = None
+        if count:
+            # Pages are ranges of message pair indexes, so the continuation token is simply the next index
+            page_size = parse_int_arg(count, minimum=1, maximum=MAX_MESSAGE_PAIRS_PAGE_SIZE)
+            start = parse_int_arg(request.args.get("continuation_token") or "0", minimum=0)
+            if page_size is None:
+                return jsonify({"error": f"count must be an integer from 1 to {MAX_MESSAGE_PAIRS_PAGE_SIZE}"}), 400
+            if start is None:
+                return jsonify({"error": "continuation_token must be a non-negative integer"}), 400
+            next_start = start + page_size
+            query += " AND ARRAY_CONTAINS(@ids, c.id)"
+            parameters.append(dict(name="@ids", value=[f"{session_id}-{ind}" for ind in range(start, next_start)]))
+
         res = container.query_items(
-            query="SELECT * FROM c WHERE c.session_id = @session_id AND c.type = @type",
-            parameters=[dict(name="@session_id", value=session_id), dict(name="@type", value="message_pair")],
+            query=query,
+            parameters=parameters,
             partition_key=[entra_oid, session_id],
         )
 
-        message_pairs = []
+        items = []
         async for page in res.by_page():
             async for item in page:
-                message_pairs.append([item["question"], item["response"]])
+                items.append(item)
+        items.sort(key=message_pair_index)
+        message_pairs = [[item["question"], expand_response(item, include_context)] for item in items]
 
-        return (
-            jsonify(
-                {
-                    "id": session_id,
-                    "entra_oid": entra_oid,
-                    "answers": message_pairs,
-                }
-            ),
-            200,
-        )
+        result: dict[str, Any] = {
+            "id": session_id,
+            "entra_oid": entra_oid,
+            "answers": message_pairs,
+        }
+        if count:
+            if len(items) == page_size:
+                continuation_token = str(next_start)
+            result["continuation_token"] = continuation_token
+        return jsonify(result), 200
     except Exception as error:
         return error_response(error, f"/chat_history/sessions/{session_id}")
 
 
+@chat_history_cosmosdb_bp.get("/chat_history/sessions/<session_id>/answers/<int:index>/context")
+@authenticated
+async def get_chat_history_answer_context(auth_claims: dict[str, Any], session_id: str, index: int):
+    if not current_app.config[CONFIG_CHAT_HISTORY_COSMOS_ENABLED]:
+        return jsonify({"error": "Chat history not enabled"}), 400
+
+    container: ContainerProxy = current_app.config[CONFIG_COSMOS_HISTORY_CONTAINER]
+    if not container:
+        return jsonify({"error": "Chat history not enabled"}), 400
+
+    entra_oid = auth_claims.get("oid")
+    if not entra_oid:
+        return jsonify({"error": "User OID not found"}), 401
+
+    try:
+        # A point read is the cheapest way to fetch a single message pair
+        item = await container.read_item(item=f"{session_id}-{index}", partition_key=[entra_oid, session_id])
+        response = expand_response(item, include_context=True)
+        context = response.get("context") if isinstance(response, dict) else None
+        return jsonify({"context": context}), 200
+    except CosmosResourceNotFoundError:
+        return jsonify({"error": "Chat history answer not found"}), 404
+    except Exception as error:
+        return error_response(error, f"/chat_history/sessions/{session_id}/answers/{index}/context")
+
+
 @chat_history_cosmosdb_bp.delete("/chat_history/sessions/<session_id>")
 @authenticated
 async def delete_chat_history_session(auth_claims: dict[str, Any], session_id: str):
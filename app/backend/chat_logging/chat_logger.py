@@ -6,9 +6,19 @@ from datetime import datetime
 from typing import Any, Dict, Optional, Set
 from dataclasses import dataclass, asdict
 import asyncio
+import logging
 import pytz
 from .database_logger import azure_sql_logger
 
+logger = logging.getLogger(__name__)
+
+
+def truncate(text: Optional[str], limit: int) -> Optional[str]:
+    """Scurtează textele lungi din log-uri"""
+    if text is None or len(text) <= limit:
+        return text
+    return text[:limit] + "..."
+
 
 @dataclass
 class ChatLogEntry:
@@ -98,16 +108,19 @@ class ChatLogger:
         
         self.active_logs[request_id] = log_entry
         
-        # Log în terminal - doar informațiile care se salvează în DB
-        print(f"\n[DB LOG] 📝 Chat Start | ID: {request_id}")
-        print(f"  Conversation: {conversation_id}")
-        print(f"  User: {user_id or 'Anonymous'}")
-        print(f"  Model: {model_used or 'Unknown'}")
-        print(f"  Question: {question[:100]}{'...' if len(question) > 100 else ''}")
-        if agentic_retrival_total_token_usage:
-            print(f"  Agentic Tokens: {agentic_retrival_total_token_usage}")
-        if prompt_total_token_usage:
-            print(f"  Prompt Token Usage: {prompt_total_token_usage[:100]}{'...' if len(prompt_total_token_usage) > 100 else ''}")
+        # Log structurat - doar informațiile care se salvează în DB
+        logger.info(
+            "Chat start",
+            extra={
+                "request_id": request_id,
+                "conversation_id": conversation_id,
+                "user_id": user_id or "Anonymous",
+                "model": model_used or "Unknown",
+                "question": truncate(question, 100),
+                "agentic_tokens": agentic_retrival_total_token_usage,
+                "prompt_tokens": truncate(prompt_total_token_usage, 100),
+            }
+        )
         
         # Încearcă să salveze în baza de date (asincron, cu retry robust pentru question)
         self._schedule_task(
@@ -151,12 +164,16 @@ class ChatLogger:
         total_duration = (log_entry.timestamp_end - log_entry.timestamp_start).total_seconds()
         log_entry.total_duration_seconds = total_duration
         
-        # Log în terminal - doar informațiile care se salvează în DB
-        print(f"[DB LOG] ✅ Chat End | ID: {request_id}")
-        print(f"  Total Duration: {total_duration:.2f}s")
-        if agentic_retrival_duration_seconds:
-            print(f"  Agentic Duration: {agentic_retrival_duration_seconds:.2f}s")
-        print(f"  Answer: {answer[:100]}{'...' if len(answer) > 100 else ''}")
+        # Log structurat - doar informațiile care se salvează în DB
+        logger.info(
+            "Chat end",
+            extra={
+                "request_id": request_id,
+                "total_duration_seconds": round(total_duration, 2),
+                "agentic_duration_seconds": agentic_retrival_duration_seconds,
+                "answer": truncate(answer, 100),
+            }
+        )
         
         # Salvează log-ul complet (pentru acum doar în terminal)
         self._save_complete_log(log_entry)
@@ -189,8 +206,7 @@ class ChatLogger:
         log_entry = self.active_logs[request_id]
         log_entry.timestamp_start_streaming = self.get_bucharest_time()
         
-        # Log în terminal
-        print(f"[DB LOG] 🚀 Streaming Start | ID: {request_id}")
+        logger.info("Streaming start", extra={"request_id": request_id})
         
         # Încearcă să salveze în baza de date (asincron, fără a bloca aplicația)
         self._schedule_task(
@@ -202,6 +218,46 @@ class ChatLogger:
             is_critical=False
         )
     
+    def log_streamed_chat(
+        self,
+        request_id: str,
+        question: str,
+        user_id: Optional[str],
+        conversation_id: str,
+        extra_info: Any,
+        answer_parts: list[str],
+        model_used: Optional[str] = None,
+        temperature: Optional[float] = None,
+        timestamp_start_streaming: Optional[datetime] = None,
+        timestamp_end: Optional[datetime] = None
+    ) -> None:
+        """
+        Loghează un chat cu streaming după ce stream-ul s-a terminat, pe baza răspunsului acumulat în answer_parts.
+        Extragerea token usage-ului, serializarea thoughts și scrierile în DB rulează într-un task de fundal,
+        astfel încât nu întârzie primul token trimis clientului.
+        """
+        if not self.enable_logging:
+            return
+        if timestamp_end is None:
+            timestamp_end = self.get_bucharest_time()
+
+        self._schedule_task(
+            self._save_streamed_chat(
+                request_id=request_id,
+                question=question,
+                user_id=user_id,
+                conversation_id=conversation_id,
+                extra_info=extra_info,
+                answer_parts=answer_parts,
+                model_used=model_used,
+                temperature=temperature,
+                timestamp_start_streaming=timestamp_start_streaming,
+                timestamp_end=timestamp_end
+            ),
+            task_id=f"stream_{request_id}",
+            is_critical=True
+        )
+
     def log_feedback(
         self,
         conversation_id: str,
@@ -217,12 +273,16 @@ class ChatLogger:
         
         timestamp = datetime.now()
         
-        # Log în terminal - doar informațiile care se salvează în DB
-        print(f"[DB LOG] 👍 Feedback | {feedback.upper()}")
-        print(f"  Conversation: {conversation_id}")
-        print(f"  User: {user_id or 'Anonymous'}")
-        if feedback_text:
-            print(f"  Text: {feedback_text[:80]}{'...' if len(feedback_text) > 80 else ''}")
+        # Log structurat - doar informațiile care se salvează în DB
+        logger.info(
+            "Feedback %s",
+            feedback.upper(),
+            extra={
+                "conversation_id": conversation_id,
+                "user_id": user_id or "Anonymous",
+                "feedback_text": truncate(feedback_text, 80),
+            }
+        )
         
         # Încearcă să salveze în baza de date (asincron, fără a bloca aplicația)
         self._schedule_task(
@@ -240,27 +300,31 @@ class ChatLogger:
     
     def _save_complete_log(self, log_entry: ChatLogEntry) -> None:
         """Salvează log-ul complet - doar un sumar al datelor din DB"""
+        if not logger.isEnabledFor(logging.INFO):
+            return
         total_duration = 0
         if log_entry.timestamp_end:
             total_duration = (log_entry.timestamp_end - log_entry.timestamp_start).total_seconds()
-        
-        print(f"[DB LOG] 💾 Complete | Conv: {log_entry.conversation_id}")
-        print(f"  Q: {log_entry.question[:60]}{'...' if len(log_entry.question) > 60 else ''}")
-        print(f"  A: {log_entry.answer[:60]}{'...' if len(log_entry.answer) > 60 else ''}")
-        print(f"  Model: {log_entry.model_used} | Total Duration: {total_duration:.1f}s")
-        if log_entry.agentic_retrival_duration_seconds:
-            print(f"  Agentic Duration: {log_entry.agentic_retrival_duration_seconds:.1f}s")
-        if log_entry.agentic_retrival_total_token_usage:
-            print(f"  Agentic Tokens: {log_entry.agentic_retrival_total_token_usage}")
-        if log_entry.prompt_total_token_usage:
-            print(f"  Prompt Tokens: {log_entry.prompt_total_token_usage[:60]}{'...' if len(log_entry.prompt_total_token_usage) > 60 else ''}")
-        print("")
+
+        logger.info(
+            "Chat complete",
+            extra={
+                "conversation_id": log_entry.conversation_id,
+                "question": truncate(log_entry.question, 60),
+                "answer": truncate(log_entry.answer, 60),
+                "model": log_entry.model_used,
+                "total_duration_seconds": round(total_duration, 1),
+                "agentic_duration_seconds": log_entry.agentic_retrival_duration_seconds,
+                "agentic_tokens": log_entry.agentic_retrival_total_token_usage,
+                "prompt_tokens": truncate(log_entry.prompt_total_token_usage, 60),
+            }
+        )
     
     def _schedule_task(self, coro, task_id: Optional[str] = None, is_critical: bool = False):
         """Programează o task asincronă, creând un event loop dacă este necesar"""
         with self.shutdown_lock:
             if self.is_shutting_down:
-                print(f"[DATABASE ERROR] Nu se pot programa task-uri în timpul shutdown-ului")
+                logger.error("Nu se pot programa task-uri în timpul shutdown-ului")
                 return
             
             if is_critical and task_id:
@@ -280,7 +344,7 @@ class ChatLogger:
                     try:
                         loop.run_until_complete(self._wrap_critical_task(coro, task_id, is_critical))
                     except Exception as e:
-                        print(f"[DATABASE ERROR] Task background eșuat: {e}")
+                        logger.error("Task background eșuat: %s", e)
                     finally:
                         loop.close()
                         if is_critical and task_id:
@@ -292,11 +356,78 @@ class ChatLogger:
                 thread.start()
                 
             except Exception as e:
-                print(f"[DATABASE ERROR] Nu s-a putut programa task-ul: {e}")
+                logger.error("Nu s-a putut programa task-ul: %s", e)
                 if is_critical and task_id:
                     with self.shutdown_lock:
                         self.pending_tasks.discard(task_id)
     
+    async def _save_streamed_chat(
+        self,
+        request_id: str,
+        question: str,
+        user_id: Optional[str],
+        conversation_id: str,
+        extra_info: Any,
+        answer_parts: list[str],
+        model_used: Optional[str],
+        temperature: Optional[float],
+        timestamp_start_streaming: Optional[datetime],
+        timestamp_end: datetime
+    ) -> None:
+        """Etapa de după stream: serializează o singură dată și scrie start, streaming și end în ordine"""
+        thoughts = getattr(extra_info, 'thoughts', None) or []
+        # Serializarea include toate prompt-urile, așa că rulează pe un thread separat de event loop
+        extra_info_thoughts = await asyncio.to_thread(self._serialize_thoughts, thoughts) if thoughts else ""
+
+        real_start_timestamp: Optional[datetime] = getattr(extra_info, 'real_start_timestamp', None)
+        timestamp_start = (
+            self.ensure_bucharest_timezone(real_start_timestamp) if real_start_timestamp else timestamp_end
+        )
+        log_entry = ChatLogEntry(
+            question=question,
+            answer="".join(answer_parts),
+            user_id=user_id,
+            conversation_id=conversation_id,
+            extra_info_thoughts=extra_info_thoughts,
+            timestamp_start=timestamp_start,
+            timestamp_end=timestamp_end,
+            model_used=model_used,
+            temperature=temperature,
+            agentic_retrival_total_token_usage=self._extract_agentic_token_usage(thoughts),
+            prompt_total_token_usage=self._extract_prompt_token_usage(thoughts),
+            timestamp_start_streaming=timestamp_start_streaming,
+            agentic_retrival_duration_seconds=getattr(extra_info, 'agentic_duration_seconds', None)
+        )
+        log_entry.total_duration_seconds = (timestamp_end - timestamp_start).total_seconds()
+        self._save_complete_log(log_entry)
+
+        # Update-urile au nevoie de rândul creat la start, așa că scrierile nu rulează în paralel
+        await self._save_chat_start_to_db(
+            conversation_id=conversation_id,
+            request_id=request_id,
+            question=question,
+            user_id=user_id,
+            extra_info_thoughts=log_entry.extra_info_thoughts,
+            agentic_retrival_total_token_usage=log_entry.agentic_retrival_total_token_usage,
+            prompt_total_token_usage=log_entry.prompt_total_token_usage,
+            model_used=model_used,
+            temperature=temperature,
+            timestamp_start=log_entry.timestamp_start
+        )
+        if log_entry.timestamp_start_streaming is not None:
+            await self._save_streaming_start_to_db(
+                request_id=request_id,
+                timestamp_start_streaming=log_entry.timestamp_start_streaming
+            )
+        await self._save_chat_end_to_db(
+            request_id=request_id,
+            answer=log_entry.answer,
+            agentic_retrival_duration_seconds=log_entry.agentic_retrival_duration_seconds,
+            timestamp_end=timestamp_end,
+            prompt_total_token_usage=log_entry.prompt_total_token_usage,
+            total_duration_seconds=log_entry.total_duration_seconds
+        )
+
     async def _save_chat_start_to_db(
         self,
         conversation_id: str,
@@ -304,7 +435,7 @@ class ChatLogger:
         question: str,
         user_id: Optional[str],
         extra_info_thoughts: str,
-        agentic_retrival_total_token_usage: Optional[str],
+        agentic_retrival_total_token_usage: Optional[int],
         prompt_total_token_usage: Optional[str],
         model_used: Optional[str],
         temperature: Optional[float],
@@ -326,7 +457,7 @@ class ChatLogger:
             )
         except Exception as e:
             # Aplicația continuă să ruleze chiar dacă baza de date nu este disponibilă
-            print(f"[DATABASE ERROR] Nu s-a putut salva chat start în DB: {e}")
+            logger.error("Nu s-a putut salva chat start în DB: %s", e)
     
     async def _save_chat_end_to_db(
         self,
@@ -350,7 +481,7 @@ class ChatLogger:
             )
         except Exception as e:
             # Aplicația continuă să ruleze chiar dacă baza de date nu este disponibilă
-            print(f"[DATABASE ERROR] Nu s-a putut salva chat end în DB: {e}")
+            logger.error("Nu s-a putut salva chat end în DB: %s", e)
     
     async def _save_streaming_start_to_db(
         self,
@@ -365,7 +496,7 @@ class ChatLogger:
             )
         except Exception as e:
             # Aplicația continuă să ruleze chiar dacă baza de date nu este disponibilă
-            print(f"[DATABASE ERROR] Nu s-a putut salva streaming start în DB: {e}")
+            logger.error("Nu s-a putut salva streaming start în DB: %s", e)
 
     async def _save_feedback_to_db(
         self,
@@ -388,7 +519,7 @@ class ChatLogger:
             )
         except Exception as e:
             # Aplicația continuă să ruleze chiar dacă baza de date nu este disponibilă
-            print(f"[DATABASE ERROR] Nu s-a putut salva feedback în DB: {e}")
+            logger.error("Nu s-a putut salva feedback în DB: %s", e)
     
     def _extract_agentic_token_usage(self, extra_info_thoughts: list) -> Optional[int]:
         """Extrage token usage pentru agentic retrieval din thoughts - doar total_tokens ca int"""
@@ -410,37 +541,41 @@ class ChatLogger:
                                         return input_tokens + output_tokens
             return None
         except Exception as e:
-            print(f"[DATABASE ERROR] Eroare la extragerea agentic token usage: {e}")
+            logger.error("Eroare la extragerea agentic token usage: %s", e)
             return None
     
     def _extract_prompt_token_usage(self, extra_info_thoughts: list) -> Optional[str]:
         """Extrage token usage total pentru generarea răspunsului final (fără agentic retrieval)"""
         try:
-            print(f"[DEBUG] Processing {len(extra_info_thoughts)} thoughts for prompt token extraction")
+            logger.debug("Processing %d thoughts for prompt token extraction", len(extra_info_thoughts))
             
             # Caută în ultimul thought - acolo se salvează token usage-ul final pentru răspuns
             if extra_info_thoughts:
                 last_thought = extra_info_thoughts[-1]
-                print(f"[DEBUG] Last thought: title='{getattr(last_thought, 'title', 'N/A')}', has_props={hasattr(last_thought, 'props')}")
+                logger.debug(
+                    "Last thought: title=%r, has_props=%s",
+                    getattr(last_thought, 'title', 'N/A'),
+                    hasattr(last_thought, 'props')
+                )
                 
                 if hasattr(last_thought, 'props') and last_thought.props:
-                    print(f"[DEBUG] Last thought props keys: {list(last_thought.props.keys()) if last_thought.props else 'None'}")
+                    logger.debug("Last thought props keys: %s", list(last_thought.props.keys()))
                     token_usage = last_thought.props.get('token_usage')
                     if token_usage:
-                        print(f"[DEBUG] Found final token_usage: {token_usage}")
+                        logger.debug("Found final token_usage: %s", token_usage)
                         if hasattr(token_usage, 'total_tokens'):
                             total_tokens = token_usage.total_tokens
-                            print(f"[DEBUG] Final total_tokens: {total_tokens}")
+                            logger.debug("Final total_tokens: %s", total_tokens)
                             return str(total_tokens)  # Returnează doar valoarea total ca string
                         elif hasattr(token_usage, 'prompt_tokens') and hasattr(token_usage, 'completion_tokens'):
                             total_tokens = (token_usage.prompt_tokens or 0) + (token_usage.completion_tokens or 0)
-                            print(f"[DEBUG] Calculated total_tokens: {total_tokens}")
+                            logger.debug("Calculated total_tokens: %s", total_tokens)
                             return str(total_tokens)
             
-            print("[DEBUG] No token usage found in final thought")
+            logger.debug("No token usage found in final thought")
             return None
         except Exception as e:
-            print(f"[DATABASE ERROR] Eroare la extragerea prompt token usage: {e}")
+            logger.error("Eroare la extragerea prompt token usage: %s", e)
             return None
     
     def _serialize_thoughts(self, extra_info_thoughts: list) -> str:
@@ -448,28 +583,26 @@ class ChatLogger:
         try:
             serialized_thoughts = []
             for thought in extra_info_thoughts:
-                thought_dict = {
+                props = getattr(thought, 'props', None) or {}
+                # Convertește props în format serializable
+                try:
+                    # Pentru token_usage, convertește în dict
+                    token_usage = props.get('token_usage')
+                    if hasattr(token_usage, '__dict__'):
+                        # Copie, ca să nu modificăm props-urile thought-ului original
+                        props = {**props, 'token_usage': token_usage.__dict__}
+                except Exception:
+                    pass  # Ignore conversion errors
+
+                serialized_thoughts.append({
                     'title': getattr(thought, 'title', ''),
                     'description': getattr(thought, 'description', ''),
-                    'props': getattr(thought, 'props', {})
-                }
-                # Convertește props în format serializable
-                if thought_dict['props']:
-                    # Încearcă să convertească obiectele complexe în dict-uri
-                    try:
-                        # Pentru token_usage, convertește în dict
-                        if 'token_usage' in thought_dict['props']:
-                            token_usage = thought_dict['props']['token_usage']
-                            if hasattr(token_usage, '__dict__'):
-                                thought_dict['props']['token_usage'] = token_usage.__dict__
-                    except Exception:
-                        pass  # Ignore conversion errors
-                
-                serialized_thoughts.append(thought_dict)
+                    'props': props
+                })
             
             return json.dumps(serialized_thoughts, default=str, ensure_ascii=False)
         except Exception as e:
-            print(f"[DATABASE ERROR] Eroare la serializarea thoughts: {e}")
+            logger.error("Eroare la serializarea thoughts: %s", e)
             return str(extra_info_thoughts)[:1000]  # Fallback la string truncat
 
     async def _wrap_critical_task(self, coro, task_id: Optional[str], is_critical: bool):
@@ -478,7 +611,7 @@ class ChatLogger:
             result = await coro
             return result
         except Exception as e:
-            print(f"[DATABASE ERROR] Task critic eșuat pentru {task_id}: {e}")
+            logger.error("Task critic eșuat pentru %s: %s", task_id, e)
             raise
         finally:
             if is_critical and task_id:
@@ -487,14 +620,14 @@ class ChatLogger:
 
     def _graceful_shutdown(self):
         """Graceful shutdown care așteaptă finalizarea task-urilor critice"""
-        print(f"[DATABASE] Începe graceful shutdown pentru chat logger...")
+        logger.info("Începe graceful shutdown pentru chat logger...")
         
         with self.shutdown_lock:
             self.is_shutting_down = True
             pending_count = len(self.pending_tasks)
         
         if pending_count > 0:
-            print(f"[DATABASE] Așteaptă finalizarea a {pending_count} task-uri critice...")
+            logger.info("Așteaptă finalizarea a %d task-uri critice...", pending_count)
             
             # Așteaptă maximum 30 secunde pentru task-urile critice
             max_wait_time = 30
@@ -505,17 +638,17 @@ class ChatLogger:
                     remaining_tasks = len(self.pending_tasks)
                     
                 if remaining_tasks == 0:
-                    print(f"[DATABASE] ✅ Toate task-urile critice au fost finalizate")
+                    logger.info("Toate task-urile critice au fost finalizate")
                     break
                     
                 elapsed = time.time() - start_time
                 if elapsed >= max_wait_time:
-                    print(f"[DATABASE] ⚠️ Timeout după {max_wait_time}s, încă {remaining_tasks} task-uri în curs")
+                    logger.warning("Timeout după %ds, încă %d task-uri în curs", max_wait_time, remaining_tasks)
                     break
                     
                 time.sleep(0.5)
         
-        print(f"[DATABASE] Graceful shutdown finalizat")
+        logger.info("Graceful shutdown finalizat")
 
 
 # Instanță globală pentru logger
@@ -6,38 +6,36 @@ from datetime import datetime
 from dataclasses import asdict
 import json
 import time
-import sys
 import pytz
 from dotenv import load_dotenv
 
+# Configurarea logger-ului pentru database operations; nivelul vine din categoria "chat_logging"
+db_logger = logging.getLogger(__name__)
+
 # Import opțional pentru pyodbc
 try:
     import pyodbc
     PYODBC_AVAILABLE = True
-    print("🎉 [DATABASE SUCCESS] pyodbc v{} INSTALAT CU SUCCES! Database logging ACTIVAT! 🎉".format(pyodbc.version), file=sys.stdout)
+    db_logger.info("pyodbc v%s instalat, database logging activat", pyodbc.version)
 except ImportError:
     pyodbc = None
     PYODBC_AVAILABLE = False
-    print("⚠️ [DATABASE WARNING] pyodbc nu este instalat. Database logging DEZACTIVAT.", file=sys.stdout)
+    db_logger.warning("pyodbc nu este instalat. Database logging dezactivat.")
 
 # Import tenacity pentru retry logic robust
 try:
     import tenacity
     TENACITY_AVAILABLE = True
-    print("🎉 [DATABASE SUCCESS] tenacity INSTALAT! Retry logic îmbunătățit ACTIVAT! 🎉", file=sys.stdout)
+    db_logger.info("tenacity instalat, retry logic îmbunătățit activat")
 except ImportError:
     tenacity = None
     TENACITY_AVAILABLE = False
-    print("⚠️ [DATABASE WARNING] tenacity nu este instalat. Folosesc retry logic simplu.", file=sys.stdout)
+    db_logger.warning("tenacity nu este instalat. Folosesc retry logic simplu.")
 
 # Încarcă variabilele de mediu la nivel de modul
 env_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))), ".env")
 load_dotenv(env_path, override=True)
 
-# Configurarea logger-ului pentru database operations
-db_logger = logging.getLogger("database_logger")
-db_logger.setLevel(logging.INFO)
-
 
 class AzureSQLLogger:
     """
@@ -54,8 +52,8 @@ class AzureSQLLogger:
         if not PYODBC_AVAILABLE:
             self.enable_db_logging = False
             self.connection_string = None
-            self._log_safely("❌ [DATABASE INIT] pyodbc nu este instalat. Database logging DEZACTIVAT!")
-            self._log_safely("💡 [DATABASE FIX] Pentru a activa logging: pip install pyodbc==5.2.0")
+            self._log_safely("❌ [DATABASE INIT] pyodbc nu este instalat. Database logging DEZACTIVAT!", logging.ERROR)
+            self._log_safely("💡 [DATABASE FIX] Pentru a activa logging: pip install pyodbc==5.2.0", logging.WARNING)
             return
             
         self.enable_db_logging = enable_db_logging
@@ -114,11 +112,11 @@ class AzureSQLLogger:
                     self._log_safely(f"[DATABASE] Driver ODBC detectat: {driver}")
                     return driver
             
-            self._log_safely("[DATABASE] Nu s-a găsit niciun driver ODBC SQL Server compatibil!")
+            self._log_safely("[DATABASE] Nu s-a găsit niciun driver ODBC SQL Server compatibil!", logging.ERROR)
             return None
             
         except Exception as e:
-            self._log_safely(f"[DATABASE] Eroare la detectarea driver-ului ODBC: {e}")
+            self._log_safely(f"[DATABASE] Eroare la detectarea driver-ului ODBC: {e}", logging.ERROR)
             return None
 
     def _build_connection_string(self) -> Optional[str]:
@@ -127,7 +125,7 @@ class AzureSQLLogger:
             # Detectează driver-ul ODBC disponibil
             odbc_driver = self._detect_odbc_driver()
             if not odbc_driver:
-                self._log_safely("[DATABASE] Nu s-a găsit niciun driver ODBC compatibil. Database logging dezactivat.")
+                self._log_safely("[DATABASE] Nu s-a găsit niciun driver ODBC compatibil. Database logging dezactivat.", logging.ERROR)
                 return None
             
             server = os.getenv("AZURE_SQL_SERVER", "mihaiweb.database.windows.net")
@@ -136,7 +134,7 @@ class AzureSQLLogger:
             password = os.getenv("AZURE_SQL_PASSWORD", "")
             
             if not username or not password:
-                self._log_safely("[DATABASE] AZURE_SQL_USERNAME sau AZURE_SQL_PASSWORD nu sunt configurate. Database logging dezactivat.")
+                self._log_safely("[DATABASE] AZURE_SQL_USERNAME sau AZURE_SQL_PASSWORD nu sunt configurate. Database logging dezactivat.", logging.WARNING)
                 return None
             
             # Asigură-te că avem timeout setat înainte de a-l folosi
@@ -158,15 +156,14 @@ class AzureSQLLogger:
             return connection_string
             
         except Exception as e:
-            self._log_safely(f"[DATABASE] Eroare la construirea connection string: {e}")
+            self._log_safely(f"[DATABASE] Eroare la construirea connection string: {e}", logging.ERROR)
             return None
     
-    def _log_safely(self, message: str):
-        """Log message both to logger and stdout"""
-        print(message, file=sys.stdout)
+    def _log_safely(self, message: str, level: int = logging.INFO):
+        """Log message through the database logger, never raising"""
         try:
-            db_logger.info(message)
-        except:
+            db_logger.log(level, message)
+        except Exception:
             pass  # Ignore logging errors
     
     def _schedule_safe_task(self, coro):
@@ -185,7 +182,7 @@ class AzureSQLLogger:
                     try:
                         loop.run_until_complete(coro)
                     except Exception as e:
-                        self._log_safely(f"[DATABASE] Task background eșuat: {e}")
+                        self._log_safely(f"[DATABASE] Task background eșuat: {e}", logging.ERROR)
                     finally:
                         loop.close()
                 
@@ -193,14 +190,14 @@ class AzureSQLLogger:
                 thread.start()
                 
             except Exception as e:
-                self._log_safely(f"[DATABASE] Nu s-a putut programa task-ul: {e}")
+                self._log_safely(f"[DATABASE] Nu s-a putut programa task-ul: {e}", logging.ERROR)
     
     async def _initialize_database(self):
         """Inițializează baza de date și creează tabelele necesare"""
         try:
             await asyncio.to_thread(self._create_tables_if_not_exist)
         except Exception as e:
-            self._log_safely(f"[DATABASE] Eroare la inițializarea bazei de date: {e}")
+            self._log_safely(f"[DATABASE] Eroare la inițializarea bazei de date: {e}", logging.ERROR)
     
     def _create_tables_if_not_exist(self):
         """Creează tabelele necesare dacă nu există"""
@@ -282,7 +279,7 @@ class AzureSQLLogger:
             self._log_safely("✅ [DATABASE] pyodbc + Azure SQL Database funcționează perfect!")
             
         except Exception as e:
-            self._log_safely(f"❌ [DATABASE ERROR] Eroare la crearea tabelei: {e}")
+            self._log_safely(f"❌ [DATABASE ERROR] Eroare la crearea tabelei: {e}", logging.ERROR)
             
         finally:
             if connection:
@@ -326,7 +323,7 @@ class AzureSQLLogger:
                 return await execute_with_tenacity()
             except tenacity.RetryError as e:
                 if self._should_log_connection_error():
-                    self._log_safely(f"[DATABASE] Toate încercările tenacity au eșuat: {e}")
+                    self._log_safely(f"[DATABASE] Toate încercările tenacity au eșuat: {e}", logging.ERROR)
                 return False
         else:
             # Fallback la retry logic simplu dacă tenacity nu e disponibil
@@ -336,7 +333,7 @@ class AzureSQLLogger:
         """Loghează încercările de retry"""
         attempt = retry_state.attempt_number
         if attempt > 1:  # Nu loga prima încercare
-            self._log_safely(f"[DATABASE] Retry attempt {attempt} după {retry_state.idle_for:.1f}s")
+            self._log_safely(f"[DATABASE] Retry attempt {attempt} după {retry_state.idle_for:.1f}s", logging.WARNING)
     
     async def _execute_with_simple_retry(self, sql: str, params: tuple) -> bool:
         """Execută SQL cu retry logic simplu (fallback)"""
@@ -349,7 +346,7 @@ class AzureSQLLogger:
                 if attempt == self.connection_retry_count - 1:
                     # Ultima încercare eșuată
                     if self._should_log_connection_error():
-                        self._log_safely(f"[DATABASE] Toate încercările simple au eșuat: {e}")
+                        self._log_safely(f"[DATABASE] Toate încercările simple au eșuat: {e}", logging.ERROR)
                     return False
                 else:
                     # Încearcă din nou după delay
@@ -370,24 +367,24 @@ class AzureSQLLogger:
             # Erori specifice pyodbc/SQL Server
             error_code = getattr(e, 'args', [None])[0]
             if error_code in [40613, 40615]:  # Erori de serverless paused
-                self._log_safely(f"[DATABASE] Serverless paused detectat (error {error_code}), retry va fi încercat")
+                self._log_safely(f"[DATABASE] Serverless paused detectat (error {error_code}), retry va fi încercat", logging.WARNING)
             raise  # Re-raise pentru retry
             
         except (ConnectionError, TimeoutError) as e:
             # Erori de conexiune generală
-            self._log_safely(f"[DATABASE] Eroare de conexiune detectată: {e}")
+            self._log_safely(f"[DATABASE] Eroare de conexiune detectată: {e}", logging.ERROR)
             raise  # Re-raise pentru retry
             
         except TypeError as e:
             # Erori de tip (ex: float() argument must be a string or a number, not 'list')
-            self._log_safely(f"[DATABASE] Eroare de tip în parametri: {e}")
-            self._log_safely(f"[DATABASE] SQL: {sql}")
-            self._log_safely(f"[DATABASE] Params: {params}")
+            self._log_safely(f"[DATABASE] Eroare de tip în parametri: {e}", logging.ERROR)
+            self._log_safely(f"[DATABASE] SQL: {sql}", logging.DEBUG)
+            self._log_safely(f"[DATABASE] Params: {params}", logging.DEBUG)
             raise  # Re-raise pentru retry
             
         except Exception as e:
             # Alte erori neașteptate
-            self._log_safely(f"[DATABASE] Eroare neașteptată la execuție SQL: {e}")
+            self._log_safely(f"[DATABASE] Eroare neașteptată la execuție SQL: {e}", logging.ERROR)
             raise  # Re-raise pentru retry
             
         finally:
@@ -395,7 +392,7 @@ class AzureSQLLogger:
                 try:
                     connection.close()
                 except Exception as close_error:
-                    self._log_safely(f"[DATABASE] Eroare la închiderea conexiunii: {close_error}")
+                    self._log_safely(f"[DATABASE] Eroare la închiderea conexiunii: {close_error}", logging.ERROR)
     
     async def log_chat_start(
         self,
@@ -417,16 +414,16 @@ class AzureSQLLogger:
         """
         # Validare tipuri parametri
         if agentic_retrival_total_token_usage is not None and not isinstance(agentic_retrival_total_token_usage, int):
-            self._log_safely(f"[DATABASE ERROR] agentic_retrival_total_token_usage trebuie să fie int, primit {type(agentic_retrival_total_token_usage)}: {agentic_retrival_total_token_usage}")
+            self._log_safely(f"[DATABASE ERROR] agentic_retrival_total_token_usage trebuie să fie int, primit {type(agentic_retrival_total_token_usage)}: {agentic_retrival_total_token_usage}", logging.ERROR)
             return False
         if temperature is not None and not isinstance(temperature, (float, int)):
-            self._log_safely(f"[DATABASE ERROR] temperature trebuie să fie float sau int, primit {type(temperature)}: {temperature}")
+            self._log_safely(f"[DATABASE ERROR] temperature trebuie să fie float sau int, primit {type(temperature)}: {temperature}", logging.ERROR)
             return False
         if timestamp_start is not None and not isinstance(timestamp_start, datetime):
-            self._log_safely(f"[DATABASE ERROR] timestamp_start trebuie să fie datetime, primit {type(timestamp_start)}: {timestamp_start}")
+            self._log_safely(f"[DATABASE ERROR] timestamp_start trebuie să fie datetime, primit {type(timestamp_start)}: {timestamp_start}", logging.ERROR)
             return False
         if timestamp_start_streaming is not None and not isinstance(timestamp_start_streaming, datetime):
-            self._log_safely(f"[DATABASE ERROR] timestamp_start_streaming trebuie să fie datetime, primit {type(timestamp_start_streaming)}: {timestamp_start_streaming}")
+            self._log_safely(f"[DATABASE ERROR] timestamp_start_streaming trebuie să fie datetime, primit {type(timestamp_start_streaming)}: {timestamp_start_streaming}", logging.ERROR)
             return False
         
         # Convertește datetime la naive (fără timezone) pentru compatibilitate cu pyodbc
@@ -459,8 +456,8 @@ class AzureSQLLogger:
         
         success = await self._execute_with_retry(insert_sql, params)
         if success:
-            self._log_safely(f"🎉 [DATABASE SUCCESS] Chat start logged pentru request_id: {request_id}")
-            self._log_safely("✅ [DATABASE] pyodbc funcționează perfect! Toate operațiunile sunt salvate în Azure SQL!")
+            self._log_safely(f"🎉 [DATABASE SUCCESS] Chat start logged pentru request_id: {request_id}", logging.DEBUG)
+            self._log_safely("✅ [DATABASE] pyodbc funcționează perfect! Toate operațiunile sunt salvate în Azure SQL!", logging.DEBUG)
         
         return success
     
@@ -477,10 +474,10 @@ class AzureSQLLogger:
         """
         # Validare tipuri parametri
         if agentic_retrival_duration_seconds is not None and not isinstance(agentic_retrival_duration_seconds, (float, int)):
-            self._log_safely(f"[DATABASE ERROR] agentic_retrival_duration_seconds trebuie să fie float sau int, primit {type(agentic_retrival_duration_seconds)}: {agentic_retrival_duration_seconds}")
+            self._log_safely(f"[DATABASE ERROR] agentic_retrival_duration_seconds trebuie să fie float sau int, primit {type(agentic_retrival_duration_seconds)}: {agentic_retrival_duration_seconds}", logging.ERROR)
             return False
         if timestamp_end is not None and not isinstance(timestamp_end, datetime):
-            self._log_safely(f"[DATABASE ERROR] timestamp_end trebuie să fie datetime, primit {type(timestamp_end)}: {timestamp_end}")
+            self._log_safely(f"[DATABASE ERROR] timestamp_end trebuie să fie datetime, primit {type(timestamp_end)}: {timestamp_end}", logging.ERROR)
             return False
         
         # Convertește datetime la naive
@@ -499,7 +496,7 @@ class AzureSQLLogger:
         
         success = await self._execute_with_retry(update_sql, params)
         if success:
-            self._log_safely(f"[DATABASE] Chat end logged pentru request_id: {request_id}")
+            self._log_safely(f"[DATABASE] Chat end logged pentru request_id: {request_id}", logging.DEBUG)
         
         return success
     
@@ -518,16 +515,16 @@ class AzureSQLLogger:
         """
         # Validare tipuri parametri
         if agentic_retrival_duration_seconds is not None and not isinstance(agentic_retrival_duration_seconds, (float, int)):
-            self._log_safely(f"[DATABASE ERROR] agentic_retrival_duration_seconds trebuie să fie float sau int, primit {type(agentic_retrival_duration_seconds)}: {agentic_retrival_duration_seconds}")
+            self._log_safely(f"[DATABASE ERROR] agentic_retrival_duration_seconds trebuie să fie float sau int, primit {type(agentic_retrival_duration_seconds)}: {agentic_retrival_duration_seconds}", logging.ERROR)
             return False
         if total_duration_seconds is not None and not isinstance(total_duration_seconds, (float, int)):
-            self._log_safely(f"[DATABASE ERROR] total_duration_seconds trebuie să fie float sau int, primit {type(total_duration_seconds)}: {total_duration_seconds}")
+            self._log_safely(f"[DATABASE ERROR] total_duration_seconds trebuie să fie float sau int, primit {type(total_duration_seconds)}: {total_duration_seconds}", logging.ERROR)
             return False
         if timestamp_end is not None and not isinstance(timestamp_end, datetime):
-            self._log_safely(f"[DATABASE ERROR] timestamp_end trebuie să fie datetime, primit {type(timestamp_end)}: {timestamp_end}")
+            self._log_safely(f"[DATABASE ERROR] timestamp_end trebuie să fie datetime, primit {type(timestamp_end)}: {timestamp_end}", logging.ERROR)
             return False
         if prompt_total_token_usage is not None and not isinstance(prompt_total_token_usage, str):
-            self._log_safely(f"[DATABASE ERROR] prompt_total_token_usage trebuie să fie str, primit {type(prompt_total_token_usage)}: {prompt_total_token_usage}")
+            self._log_safely(f"[DATABASE ERROR] prompt_total_token_usage trebuie să fie str, primit {type(prompt_total_token_usage)}: {prompt_total_token_usage}", logging.ERROR)
             return False
         
         # Convertește datetime la naive
@@ -548,7 +545,7 @@ class AzureSQLLogger:
         
         success = await self._execute_with_retry(update_sql, params)
         if success:
-            self._log_safely(f"[DATABASE] Chat end with tokens logged pentru request_id: {request_id}")
+            self._log_safely(f"[DATABASE] Chat end with tokens logged pentru request_id: {request_id}", logging.DEBUG)
         
         return success
     
@@ -563,7 +560,7 @@ class AzureSQLLogger:
         """
         # Validare tipuri parametri
         if timestamp_start_streaming is not None and not isinstance(timestamp_start_streaming, datetime):
-            self._log_safely(f"[DATABASE ERROR] timestamp_start_streaming trebuie să fie datetime, primit {type(timestamp_start_streaming)}: {timestamp_start_streaming}")
+            self._log_safely(f"[DATABASE ERROR] timestamp_start_streaming trebuie să fie datetime, primit {type(timestamp_start_streaming)}: {timestamp_start_streaming}", logging.ERROR)
             return False
         
         # Convertește datetime la naive
@@ -580,7 +577,7 @@ class AzureSQLLogger:
         
         success = await self._execute_with_retry(update_sql, params)
         if success:
-            self._log_safely(f"[DATABASE] Streaming start logged pentru request_id: {request_id}")
+            self._log_safely(f"[DATABASE] Streaming start logged pentru request_id: {request_id}", logging.DEBUG)
         
         return success
     
@@ -612,7 +609,7 @@ class AzureSQLLogger:
             
             success = await self._execute_with_retry(update_sql, params)
             if success:
-                self._log_safely(f"[DATABASE] Feedback logged pentru request_id: {request_id}")
+                self._log_safely(f"[DATABASE] Feedback logged pentru request_id: {request_id}", logging.DEBUG)
                 return success
         
         # Fallback: încearcă să actualizeze ultima înregistrare pentru această conversație
@@ -628,7 +625,7 @@ class AzureSQLLogger:
         
         success = await self._execute_with_retry(update_sql, params)
         if success:
-            self._log_safely(f"[DATABASE] Feedback logged pentru conversation_id: {conversation_id} (fallback)")
+            self._log_safely(f"[DATABASE] Feedback logged pentru conversation_id: {conversation_id} (fallback)", logging.DEBUG)
         else:
             # Dacă actualizarea nu a reușit, creează o înregistrare nouă doar pentru feedback
             insert_sql = """
@@ -640,7 +637,7 @@ class AzureSQLLogger:
             feedback_params = (conversation_id, feedback, feedback_text, user_id, timestamp)
             success = await self._execute_with_retry(insert_sql, feedback_params)
             if success:
-                self._log_safely(f"[DATABASE] Feedback înregistrare nouă creată pentru conversation_id: {conversation_id}")
+                self._log_safely(f"[DATABASE] Feedback înregistrare nouă creată pentru conversation_id: {conversation_id}", logging.DEBUG)
         
         return success
     
@@ -669,12 +666,12 @@ class AzureSQLLogger:
         
         try:
             result = await asyncio.to_thread(self._fetch_data, select_sql, (limit, conversation_id))
-            self._log_safely(f"[DATABASE] Recuperat {len(result)} înregistrări pentru conversation_id: {conversation_id}")
+            self._log_safely(f"[DATABASE] Recuperat {len(result)} înregistrări pentru conversation_id: {conversation_id}", logging.DEBUG)
             return result
             
         except Exception as e:
             if self._should_log_connection_error():
-                self._log_safely(f"[DATABASE] Eroare la recuperarea istoricului: {e}")
+                self._log_safely(f"[DATABASE] Eroare la recuperarea istoricului: {e}", logging.ERROR)
             return []
     
     def _fetch_data(self, sql: str, params: tuple) -> list:
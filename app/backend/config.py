@@ -27,6 +27,7 @@ CONFIG_SPEECH_SERVICE_ID = "speech_service_id"
 CONFIG_SPEECH_SERVICE_LOCATION = "speech_service_location"
 CONFIG_SPEECH_SERVICE_TOKEN = "speech_service_token"
 CONFIG_SPEECH_SERVICE_VOICE = "speech_service_voice"
+CONFIG_SPEECH_SYNTHESIS = "speech_synthesis"
 CONFIG_STREAMING_ENABLED = "streaming_enabled"
 CONFIG_CHAT_HISTORY_BROWSER_ENABLED = "chat_history_browser_enabled"
 CONFIG_CHAT_HISTORY_COSMOS_ENABLED = "chat_history_cosmos_enabled"
@@ -35,3 +36,14 @@ CONFIG_DEVELOPER_FEATURES_ENABLED = "developer_features_enabled"
 CONFIG_COSMOS_HISTORY_CLIENT = "cosmos_history_client"
 CONFIG_COSMOS_HISTORY_CONTAINER = "cosmos_history_container"
 CONFIG_COSMOS_HISTORY_VERSION = "cosmos_history_version"
+CONFIG_CONVERSATION_STORE = "conversation_store"
+CONFIG_PROMPT_MANAGER = "prompt_manager"
+CONFIG_PROMPT_RELOAD_TASK = "prompt_reload_task"
+CONFIG_STREAM_COALESCE_MS = "stream_coalesce_ms"
+CONFIG_STREAM_COALESCE_BYTES = "stream_coalesce_bytes"
+CONFIG_ACL_INDEX_TASK = "acl_index_task"
+CONFIG_METRICS_REGISTRY = "metrics_registry"
+CONFIG_LOOP_LAG_TASK = "loop_lag_task"
+CONFIG_STAGE_DURATIONS_IN_THOUGHTS = "stage_durations_in_thoughts"
+CONFIG_PROFILE_STORE = "profile_store"
+CONFIG_ADMIN_USER_OIDS = "admin_user_oids"
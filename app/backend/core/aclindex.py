@@ -0,0 +1,343 @@
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from collections.abc import AsyncIterator, Iterable
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from azure.search.documents.aio import SearchClient
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore[assignment]
+
+logger = logging.getLogger(__name__)
+
+# Chunks read from the search index per query when building a snapshot
+SCAN_PAGE_SIZE = 1000
+BUILD_LOCK_POLL_SECONDS = 0.5
+
+
+@dataclass(frozen=True)
+class AclSet:
+    """The oids and groups of one or more chunks. Chunks without either are global documents."""
+
+    oids: frozenset[str] = frozenset()
+    groups: frozenset[str] = frozenset()
+
+    def allows(self, oid: str, groups: Iterable[str], enable_global_documents: bool) -> bool:
+        # Same rules as the filter built by AuthenticationHelper.build_security_filters for check_path_auth
+        if not self.oids and not self.groups:
+            return enable_global_documents
+        return oid in self.oids or not self.groups.isdisjoint(groups)
+
+
+# magic, string count, path count, path ACL reference count, ACL set count, ACL member count, creation time
+SNAPSHOT_HEADER = struct.Struct("<8s5Id")
+SNAPSHOT_MAGIC = b"ACLIDX01"
+
+
+def write_snapshot(entries: dict[str, set[AclSet]], file_path: str, created_at: float) -> None:
+    """
+    Writes entries as a compact snapshot that AclSnapshot reads through mmap, so every worker process
+    shares the same pages instead of querying the search index and holding its own copy.
+    Paths come first among the strings, sorted by their UTF-8 bytes, so lookups can binary search them.
+    The file is written next to its destination and renamed, so readers never see a partial snapshot.
+    """
+    paths = sorted(entries, key=lambda path: path.encode())
+    strings: list[bytes] = [path.encode() for path in paths]
+    principal_ids: dict[str, int] = {}
+    acl_ids: dict[AclSet, int] = {}
+    path_acl_offsets = array("I", [0])
+    path_acl_ids = array("I")
+    acl_offsets = array("I", [0])
+    acl_members = array("I")
+
+    def principal_id(principal: str) -> int:
+        if principal not in principal_ids:
+            principal_ids[principal] = len(strings)
+            strings.append(principal.encode())
+        return principal_ids[principal]
+
+    for path in paths:
+        for acl in sorted(entries[path], key=lambda acl: (sorted(acl.oids), sorted(acl.groups))):
+            if acl not in acl_ids:
+                acl_ids[acl] = len(acl_ids)
+                # Members are string ids shifted left, with the low bit set for groups
+                acl_members.extend(principal_id(oid) << 1 for oid in sorted(acl.oids))
+                acl_members.extend(principal_id(group) << 1 | 1 for group in sorted(acl.groups))
+                acl_offsets.append(len(acl_members))
+            path_acl_ids.append(acl_ids[acl])
+        path_acl_offsets.append(len(path_acl_ids))
+
+    string_offsets = array("I", [0])
+    for string in strings:
+        string_offsets.append(string_offsets[-1] + len(string))
+
+    temporary_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(
+            SNAPSHOT_HEADER.pack(
+                SNAPSHOT_MAGIC,
+                len(strings),
+                len(paths),
+                len(path_acl_ids),
+                len(acl_ids),
+                len(acl_members),
+                created_at,
+            )
+        )
+        for section in (string_offsets, path_acl_offsets, path_acl_ids, acl_offsets, acl_members):
+            section.tofile(file)
+        file.write(b"".join(strings))
+    os.replace(temporary_path, file_path)
+
+
+class AclSnapshot:
+    """A read-only ACL index over a memory-mapped snapshot written by write_snapshot."""
+
+    def __init__(self, file_path: str):
+        with open(file_path, "rb") as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, string_count, path_count, path_acl_count, acl_count, member_count, created_at = (
+                SNAPSHOT_HEADER.unpack_from(self.mmap)
+            )
+            if magic != SNAPSHOT_MAGIC or sys.byteorder != "little":
+                raise ValueError(f"{file_path} is not an ACL index snapshot for this platform")
+            self.created_at = created_at
+            self.path_count = path_count
+            view = memoryview(self.mmap)
+            offset = SNAPSHOT_HEADER.size
+            sections = []
+            for length in (string_count + 1, path_count + 1, path_acl_count, acl_count + 1, member_count):
+                sections.append(view[offset : offset + length * 4].cast("I"))
+                offset += length * 4
+            self.string_offsets, self.path_acl_offsets, self.path_acl_ids, self.acl_offsets, self.acl_members = sections
+            self.strings = view[offset:]
+        except Exception:
+            self.mmap.close()
+            raise
+        # ACL sets are shared by many paths, so each is decoded once
+        self.acl_sets: dict[int, AclSet] = {}
+
+    def string(self, string_id: int) -> bytes:
+        return bytes(self.strings[self.string_offsets[string_id] : self.string_offsets[string_id + 1]])
+
+    def find_path(self, path: str) -> Optional[int]:
+        target = path.encode()
+        low, high = 0, self.path_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.string(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.path_count and self.string(low) == target:
+            return low
+        return None
+
+    def acl_set(self, acl_id: int) -> AclSet:
+        acl = self.acl_sets.get(acl_id)
+        if acl is None:
+            oids: set[str] = set()
+            groups: set[str] = set()
+            for member in self.acl_members[self.acl_offsets[acl_id] : self.acl_offsets[acl_id + 1]]:
+                (groups if member & 1 else oids).add(self.string(member >> 1).decode())
+            acl = self.acl_sets[acl_id] = AclSet(frozenset(oids), frozenset(groups))
+        return acl
+
+    def lookup(self, path: str) -> Optional[frozenset[AclSet]]:
+        path_id = self.find_path(path)
+        if path_id is None:
+            return None
+        acl_ids = self.path_acl_ids[self.path_acl_offsets[path_id] : self.path_acl_offsets[path_id + 1]]
+        return frozenset(self.acl_set(acl_id) for acl_id in acl_ids)
+
+    def close(self) -> None:
+        for section in (self.string_offsets, self.path_acl_offsets, self.path_acl_ids, self.acl_offsets):
+            section.release()
+        self.acl_members.release()
+        self.strings.release()
+        self.mmap.close()
+
+
+async def collect_acl_entries(search_client: SearchClient, page_size: int = SCAN_PAGE_SIZE) -> dict[str, set[AclSet]]:
+    """
+    Reads the ACLs of every chunk, keyed by both sourcefile and sourcepage like the check_path_auth filter.
+    The chunks are read in pages ordered by their id key, each page starting after the last id of the previous one,
+    since skipping through a single query stops at 100,000 results. That needs a filterable and sortable id field;
+    when the search index rejects the query the error is raised, and the ACL index stays empty rather than incomplete.
+    """
+    entries: dict[str, set[AclSet]] = {}
+    last_id: Optional[str] = None
+    while True:
+        # Replace ' with '' to escape the single quote for the filter
+        id_filter = None if last_id is None else "id gt '{}'".format(last_id.replace("'", "''"))
+        results = await search_client.search(
+            search_text="*",
+            filter=id_filter,
+            order_by=["id asc"],
+            top=page_size,
+            select=["id", "sourcefile", "sourcepage", "oids", "groups"],
+        )
+        page_count = 0
+        async for document in results:
+            page_count += 1
+            last_id = document["id"]
+            acl = AclSet(frozenset(document.get("oids") or []), frozenset(document.get("groups") or []))
+            for field in ("sourcefile", "sourcepage"):
+                if path := document.get(field):
+                    entries.setdefault(path, set()).add(acl)
+        if page_count < page_size:
+            return entries
+
+
+@asynccontextmanager
+async def snapshot_build_lock(snapshot_path: str) -> AsyncIterator[None]:
+    """
+    Holds an exclusive lock on a file next to the snapshot, so only one worker process reads the search index
+    while the others wait and then load the snapshot it wrote. The lock is polled instead of waited on in a
+    thread, so a cancelled refresh never leaves a lock behind. Without fcntl, as on Windows, nothing is locked.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(f"{snapshot_path}.lock", "a") as lock_file:
+        while True:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                await asyncio.sleep(BUILD_LOCK_POLL_SECONDS)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class AclIndex:
+    """
+    Answers check_path_auth from memory with the ACLs of every file in the search index.
+    The ACLs come from a snapshot file shared by the worker processes: refresh() loads a snapshot another worker
+    wrote since, and only reads the whole index and writes a new snapshot once the current one is max_age_seconds
+    old, with one worker building it while the others wait for it.
+    Paths the index cannot answer for return None, so the caller falls back to a search query: paths the snapshot
+    does not know about, paths uploaded or deleted through this worker since the snapshot was read, and every path
+    once the snapshot is twice max_age_seconds old because refreshing it keeps failing.
+    """
+
+    def __init__(self, snapshot_path: str, max_age_seconds: float = 600):
+        self.snapshot_path = snapshot_path
+        self.max_age_seconds = max_age_seconds
+        self.snapshot: Optional[AclSnapshot] = None
+        # Path -> time.time() of a change made through the app, checked before the snapshot
+        self.invalidated: dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, path: str) -> Optional[frozenset[AclSet]]:
+        if self.snapshot is None or path in self.invalidated:
+            return None
+        if self.snapshot.created_at < time.time() - 2 * self.max_age_seconds:
+            return None
+        return self.snapshot.lookup(path)
+
+    def is_allowed(self, path: str, auth_claims: dict[str, Any], enable_global_documents: bool) -> Optional[bool]:
+        acls = self.lookup(path)
+        if acls is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        oid = auth_claims.get("oid") or ""
+        groups = auth_claims.get("groups") or []
+        return any(acl.allows(oid, groups, enable_global_documents) for acl in acls)
+
+    def invalidate(self, path: str) -> None:
+        """Checks path with search queries until a snapshot read from the search index after this change."""
+        self.invalidated[path] = time.time()
+
+    def load_newer_snapshot(self) -> Optional[AclSnapshot]:
+        try:
+            snapshot = AclSnapshot(self.snapshot_path)
+        except (FileNotFoundError, ValueError, struct.error):
+            return None
+        current_created_at = self.snapshot.created_at if self.snapshot else 0
+        if snapshot.created_at <= current_created_at or snapshot.created_at < time.time() - self.max_age_seconds:
+            snapshot.close()
+            return None
+        return snapshot
+
+    def is_fresh(self) -> bool:
+        return self.snapshot is not None and self.snapshot.created_at >= time.time() - self.max_age_seconds
+
+    async def refresh(self, search_client: SearchClient, force: bool = False) -> None:
+        """
+        Loads a snapshot another worker wrote since the last refresh, and builds a new one once the current one
+        is stale, or right away with force. Cheap enough to call often, since it only reads the snapshot header.
+        """
+        if not force:
+            if snapshot := await asyncio.to_thread(self.load_newer_snapshot):
+                self.use_snapshot(snapshot)
+                return
+            if self.is_fresh():
+                return
+        async with snapshot_build_lock(self.snapshot_path):
+            # The worker that held the lock may have just built it
+            if not force and (snapshot := await asyncio.to_thread(self.load_newer_snapshot)):
+                self.use_snapshot(snapshot)
+                return
+            created_at = time.time()
+            entries = await collect_acl_entries(search_client)
+            await asyncio.to_thread(write_snapshot, entries, self.snapshot_path, created_at)
+            snapshot = await asyncio.to_thread(AclSnapshot, self.snapshot_path)
+            logger.info("Built the ACL index with %d paths", snapshot.path_count)
+        self.use_snapshot(snapshot)
+
+    def use_snapshot(self, snapshot: AclSnapshot) -> None:
+        previous, self.snapshot = self.snapshot, snapshot
+        # Changes made after the snapshot was read from the search index still need search queries
+        self.invalidated = {
+            path: changed for path, changed in self.invalidated.items() if changed >= snapshot.created_at
+        }
+        if previous is not None:
+            previous.close()
+
+    def close(self) -> None:
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+
+    def stats(self) -> dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "paths": self.snapshot.path_count if self.snapshot else 0,
+            "invalidated": len(self.invalidated),
+            "snapshot_age_seconds": round(time.time() - self.snapshot.created_at, 1) if self.snapshot else -1,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+async def watch_acl_index(acl_index: AclIndex, search_client: SearchClient, poll_seconds: float = 10):
+    """
+    Refreshes the ACL index every poll_seconds, which loads snapshots written by other workers, such as one rebuilt
+    by POST /admin/path_auth_cache/clear, within poll_seconds and only reads the search index once it is stale.
+    """
+    while True:
+        try:
+            await acl_index.refresh(search_client)
+        except Exception:
+            logger.exception("Failed to refresh the ACL index, keeping the current one")
+            # Such as an index without a sortable id field, which would fail the same way on every poll
+            await asyncio.sleep(acl_index.max_age_seconds)
+            continue
+        await asyncio.sleep(poll_seconds)
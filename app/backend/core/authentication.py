@@ -20,6 +20,9 @@ from tenacity import (
     wait_random_exponential,
 )
 
+from core.aclindex import AclIndex
+from core.pathauthcache import PathAuthCache, normalize_path
+
 
 # AuthError is raised when the authentication token sent by the client UI cannot be parsed or there is an authentication error accessing the graph API
 class AuthError(Exception):
@@ -45,8 +48,12 @@ class AuthenticationHelper:
         require_access_control: bool = False,
         enable_global_documents: bool = False,
         enable_unauthenticated_access: bool = False,
+        path_auth_cache: Optional[PathAuthCache] = None,
+        acl_index: Optional[AclIndex] = None,
     ):
         self.use_authentication = use_authentication
+        self.path_auth_cache = path_auth_cache
+        self.acl_index = acl_index
         self.server_app_id = server_app_id
         self.server_app_secret = server_app_secret
         self.client_app_id = client_app_id
@@ -263,10 +270,22 @@ class AuthenticationHelper:
             return True
 
         # Remove any fragment string from the path before checking
-        fragment_index = path.find("#")
-        if fragment_index != -1:
-            path = path[:fragment_index]
+        path = normalize_path(path)
+
+        # The ACL index answers from memory for the files it knows about
+        if self.acl_index is not None:
+            allowed = self.acl_index.is_allowed(path, auth_claims, self.enable_global_documents)
+            if allowed is not None:
+                return allowed
+
+        if self.path_auth_cache is None:
+            return await self.search_path_auth(path, security_filter, search_client)
+        return await self.path_auth_cache.get_or_check(
+            PathAuthCache.make_key(path, auth_claims),
+            lambda: self.search_path_auth(path, security_filter, search_client),
+        )
 
+    async def search_path_auth(self, path: str, security_filter: str, search_client: SearchClient) -> bool:
         # Filter down to only chunks that are from the specific source file
         # Sourcepage is used for GPT-4V
         # Replace ' with '' to escape the single quote for the filter
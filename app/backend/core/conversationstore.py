@@ -0,0 +1,202 @@
+import asyncio
+import json
+import logging
+import sqlite3
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Optional, Protocol
+
+from core.lrucache import LRUCache
+from core.tokencounter import count_message_tokens
+
+logger = logging.getLogger(__name__)
+
+# Times a turn is added again to a conversation another worker changed while it was being recorded
+SAVE_ATTEMPTS = 3
+
+
+@dataclass
+class Conversation:
+    """
+    History of one conversation, already trimmed to the token budget.
+    Each message keeps its token count, so appending a turn only costs counting the new messages.
+    """
+
+    messages: deque[tuple[dict[str, Any], int]] = field(default_factory=deque)
+    total_tokens: int = 0
+    truncated_messages: int = 0
+    # Version of the backing store row these messages were loaded from or saved as, 0 when not stored
+    version: int = 0
+
+    def append(self, message: dict[str, Any]) -> None:
+        tokens = count_message_tokens(message)
+        self.messages.append((message, tokens))
+        self.total_tokens += tokens
+
+    def truncate(self, max_tokens: int) -> None:
+        """Drops the oldest turns until the history fits in max_tokens, always keeping the latest message."""
+        if max_tokens <= 0:
+            return
+        while self.total_tokens > max_tokens and len(self.messages) > 1:
+            _, tokens = self.messages.popleft()
+            self.total_tokens -= tokens
+            self.truncated_messages += 1
+            # Never start the history with an assistant answer whose question was dropped
+            while len(self.messages) > 1 and self.messages[0][0].get("role") != "user":
+                _, tokens = self.messages.popleft()
+                self.total_tokens -= tokens
+                self.truncated_messages += 1
+
+    def to_list(self) -> list[dict[str, Any]]:
+        return [message for message, _ in self.messages]
+
+
+class ConversationBacking(Protocol):
+    async def load(self, key: str) -> Optional[tuple[list[dict[str, Any]], int]]: ...
+
+    async def version(self, key: str) -> int: ...
+
+    async def save(self, key: str, messages: list[dict[str, Any]], expected_version: int) -> Optional[int]: ...
+
+    async def close(self) -> None: ...
+
+
+class SQLiteConversationBacking:
+    """
+    Persists conversations to a local SQLite file, so they survive restarts and are shared by all
+    worker processes on the same machine. Calls run in a thread to keep the event loop free.
+    Each save increments the version of the conversation, so a worker can tell its cached copy is outdated.
+    """
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = asyncio.Lock()
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS conversations "
+                "(key TEXT PRIMARY KEY, messages TEXT NOT NULL, version INTEGER NOT NULL DEFAULT 1)"
+            )
+            # Files created before conversations had versions, whose rows all count as saved once
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(conversations)")]
+            if "version" not in columns:
+                self.connection.execute("ALTER TABLE conversations ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+
+    def _load(self, key: str) -> Optional[tuple[list[dict[str, Any]], int]]:
+        row = self.connection.execute("SELECT messages, version FROM conversations WHERE key = ?", (key,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def _version(self, key: str) -> int:
+        row = self.connection.execute("SELECT version FROM conversations WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def _save(self, key: str, messages: list[dict[str, Any]], expected_version: int) -> Optional[int]:
+        messages_json = json.dumps(messages, ensure_ascii=False)
+        with self.connection:
+            # Only replaces the version the messages were built from, so a turn another process recorded
+            # in the meantime is never overwritten
+            if expected_version == 0:
+                cursor = self.connection.execute(
+                    "INSERT INTO conversations (key, messages, version) VALUES (?, ?, 1) ON CONFLICT(key) DO NOTHING",
+                    (key, messages_json),
+                )
+            else:
+                cursor = self.connection.execute(
+                    "UPDATE conversations SET messages = ?, version = version + 1 WHERE key = ? AND version = ?",
+                    (messages_json, key, expected_version),
+                )
+        return expected_version + 1 if cursor.rowcount == 1 else None
+
+    async def load(self, key: str) -> Optional[tuple[list[dict[str, Any]], int]]:
+        async with self.lock:
+            return await asyncio.to_thread(self._load, key)
+
+    async def version(self, key: str) -> int:
+        async with self.lock:
+            return await asyncio.to_thread(self._version, key)
+
+    async def save(self, key: str, messages: list[dict[str, Any]], expected_version: int) -> Optional[int]:
+        """Saves messages unless the stored version is no longer expected_version, and returns the new version."""
+        async with self.lock:
+            return await asyncio.to_thread(self._save, key, messages, expected_version)
+
+    async def close(self) -> None:
+        self.connection.close()
+
+
+class ConversationStore:
+    """
+    Server-side conversation history keyed by user and session_state, so clients only send the new user message.
+    Conversations live in an in-memory LRU, optionally backed by a persistent store shared by the worker processes.
+    With a backing store, a cached conversation is only used while its version matches the stored one, so a turn
+    recorded by another worker is loaded again. Without one, each worker has its own histories, so it only suits
+    a single worker process.
+    Histories are trimmed to max_history_tokens as turns are added, and the trimmed history is what gets stored.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        ttl_seconds: Optional[float] = None,
+        max_history_tokens: int = 0,
+        backing: Optional[ConversationBacking] = None,
+    ):
+        self.conversations: LRUCache[str, Conversation] = LRUCache(max_sessions, ttl_seconds)
+        self.max_history_tokens = max_history_tokens
+        self.backing = backing
+
+    @staticmethod
+    def make_key(user_id: Optional[str], session_state: str) -> str:
+        # Scoping by user ID prevents one user from reading another's conversation by reusing its session_state
+        return f"{user_id or ''}:{session_state}"
+
+    async def get(self, key: str) -> Conversation:
+        conversation = self.conversations.get(key)
+        if conversation is not None and self.backing is not None:
+            # Reading the version is much cheaper than reading and counting the tokens of the whole history
+            if await self.backing.version(key) != conversation.version:
+                conversation = None
+        if conversation is None:
+            conversation = Conversation()
+            if self.backing is not None and (stored := await self.backing.load(key)):
+                messages, conversation.version = stored
+                for message in messages:
+                    conversation.append(message)
+            self.conversations.put(key, conversation)
+        return conversation
+
+    async def build_messages(self, key: str, new_messages: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """Returns the stored history followed by the new messages, trimmed to the token budget."""
+        conversation = await self.get(key)
+        working = Conversation(deque(conversation.messages), conversation.total_tokens)
+        for message in new_messages:
+            working.append(message)
+        working.truncate(self.max_history_tokens)
+        return working.to_list()
+
+    async def record_turn(self, key: str, new_messages: list[dict[str, Any]], answer: str) -> Conversation:
+        """
+        Appends the new messages and the assistant answer to the stored history. When another worker recorded
+        a turn of the same conversation in the meantime, the history is loaded again and the turn added to it.
+        """
+        for _ in range(SAVE_ATTEMPTS):
+            stored = await self.get(key)
+            conversation = Conversation(
+                deque(stored.messages), stored.total_tokens, stored.truncated_messages, stored.version
+            )
+            for message in new_messages:
+                conversation.append(message)
+            conversation.append({"role": "assistant", "content": answer})
+            conversation.truncate(self.max_history_tokens)
+            if self.backing is not None:
+                version = await self.backing.save(key, conversation.to_list(), conversation.version)
+                if version is None:
+                    continue
+                conversation.version = version
+            self.conversations.put(key, conversation)
+            return conversation
+        logger.warning("Could not record a turn of conversation %s, it kept changing", key)
+        return stored
+
+    async def close(self) -> None:
+        if self.backing is not None:
+            await self.backing.close()
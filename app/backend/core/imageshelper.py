@@ -1,10 +1,19 @@
+import asyncio
 import base64
+import io
 import logging
 import os
+from collections import OrderedDict
 from typing import Optional
 
-from azure.core.exceptions import ResourceNotFoundError
+from azure.core import MatchConditions
+from azure.core.exceptions import (
+    ResourceModifiedError,
+    ResourceNotFoundError,
+    ResourceNotModifiedError,
+)
 from azure.storage.blob.aio import ContainerClient
+from PIL import Image
 from typing_extensions import Literal, Required, TypedDict
 
 from approaches.approach import Document
@@ -18,23 +27,133 @@ class ImageURL(TypedDict, total=False):
     """Specifies the detail level of the image."""
 
 
-async def download_blob_as_base64(blob_container_client: ContainerClient, file_path: str) -> Optional[str]:
+class ImageCache:
+    """
+    Size-bounded LRU cache of pre-encoded image data URLs, keyed on blob name.
+    Each entry remembers the ETag of the blob it was built from, so callers can issue
+    a conditional download and reuse the cached data URL when the blob has not changed.
+    If max_resolution is set, images larger than that (on their longest side) are downscaled
+    before encoding, which reduces both the bytes held in memory and the vision tokens sent to the model.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_resolution: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.max_resolution = max_resolution
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[str, str]] = OrderedDict()
+
+    def get(self, blob_name: str) -> Optional[tuple[str, str]]:
+        """Returns the (etag, data_url) entry for the blob, marking it as most recently used."""
+        entry = self._entries.get(blob_name)
+        if entry is not None:
+            self._entries.move_to_end(blob_name)
+        return entry
+
+    def put(self, blob_name: str, etag: str, data_url: str) -> None:
+        if len(data_url) > self.max_bytes:
+            return
+        self.remove(blob_name)
+        self._entries[blob_name] = (etag, data_url)
+        self.current_bytes += len(data_url)
+        while self.current_bytes > self.max_bytes and self._entries:
+            _, (_, evicted_url) = self._entries.popitem(last=False)
+            self.current_bytes -= len(evicted_url)
+
+    def remove(self, blob_name: str) -> None:
+        entry = self._entries.pop(blob_name, None)
+        if entry is not None:
+            self.current_bytes -= len(entry[1])
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def downscale_image(image_bytes: bytes, max_resolution: int) -> bytes:
+    """Shrinks a PNG so that its longest side is at most max_resolution pixels, preserving aspect ratio."""
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        if max(img.size) <= max_resolution:
+            return image_bytes
+        img.thumbnail((max_resolution, max_resolution))
+        output = io.BytesIO()
+        img.save(output, format="PNG", optimize=True)
+        return output.getvalue()
+
+
+async def encode_image_as_data_url(image_bytes: bytes, max_resolution: Optional[int] = None) -> str:
+    if max_resolution:
+        # Decoding and re-encoding is CPU bound, so keep it off the event loop
+        image_bytes = await asyncio.to_thread(downscale_image, image_bytes, max_resolution)
+    img = base64.b64encode(image_bytes).decode("utf-8")
+    return f"data:image/png;base64,{img}"
+
+
+async def download_blob_as_base64(
+    blob_container_client: ContainerClient, file_path: str, image_cache: Optional[ImageCache] = None
+) -> Optional[str]:
     base_name, _ = os.path.splitext(file_path)
     image_filename = base_name + ".png"
+    blob_client = blob_container_client.get_blob_client(image_filename)
+    cached = image_cache.get(image_filename) if image_cache is not None else None
     try:
-        blob = await blob_container_client.get_blob_client(image_filename).download_blob()
+        if image_cache is not None and cached:
+            cached_etag, cached_url = cached
+            try:
+                blob = await blob_client.download_blob(etag=cached_etag, match_condition=MatchConditions.IfModified)
+            except ResourceNotModifiedError:
+                # Service returned 304 Not Modified: the cached encoding is still valid
+                image_cache.hits += 1
+                return cached_url
+            except ResourceModifiedError:
+                # Service returned 412 Precondition Failed, which says nothing about the cached encoding,
+                # so the blob is downloaded again without a condition
+                image_cache.remove(image_filename)
+                blob = await blob_client.download_blob()
+        else:
+            blob = await blob_client.download_blob()
         if not blob.properties:
             logging.warning(f"No blob exists for {image_filename}")
             return None
-        img = base64.b64encode(await blob.readall()).decode("utf-8")
-        return f"data:image/png;base64,{img}"
+        data_url = await encode_image_as_data_url(
+            await blob.readall(), image_cache.max_resolution if image_cache is not None else None
+        )
+        if image_cache is not None:
+            image_cache.misses += 1
+            if etag := blob.properties.get("etag"):
+                image_cache.put(image_filename, etag, data_url)
+        return data_url
     except ResourceNotFoundError:
         logging.warning(f"No blob exists for {image_filename}")
+        if image_cache is not None:
+            image_cache.remove(image_filename)
         return None
 
 
-async def fetch_image(blob_container_client: ContainerClient, result: Document) -> Optional[str]:
+async def fetch_image(
+    blob_container_client: ContainerClient, result: Document, image_cache: Optional[ImageCache] = None
+) -> Optional[str]:
     if result.sourcepage:
-        img = await download_blob_as_base64(blob_container_client, result.sourcepage)
+        img = await download_blob_as_base64(blob_container_client, result.sourcepage, image_cache)
         return img
     return None
+
+
+async def fetch_images(
+    blob_container_client: ContainerClient,
+    results: list[Document],
+    image_cache: Optional[ImageCache] = None,
+    max_concurrency: int = 4,
+) -> list[str]:
+    """
+    Fetches the page images for all results concurrently, with at most max_concurrency downloads in flight.
+    Returns the data URLs in the same order as the results, skipping results without an image.
+    """
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def fetch_with_limit(result: Document) -> Optional[str]:
+        async with semaphore:
+            return await fetch_image(blob_container_client, result, image_cache)
+
+    urls = await asyncio.gather(*(fetch_with_limit(result) for result in results))
+    return [url for url in urls if url]
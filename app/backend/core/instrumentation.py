@@ -0,0 +1,173 @@
+import asyncio
+import bisect
+import logging
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Seconds, from a fast cached lookup up to a long answer stream
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+LOOP_LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def format_value(value: float) -> str:
+    return repr(float(value))
+
+
+def format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = ((name, value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for name, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+@dataclass
+class HistogramSeries:
+    bucket_counts: list[int]
+    sum: float = 0.0
+    count: int = 0
+
+
+class Histogram:
+    """A Prometheus histogram, with one series for each combination of label values."""
+
+    def __init__(self, name: str, description: str, buckets: tuple[float, ...] = STAGE_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self.series: dict[tuple[tuple[str, str], ...], HistogramSeries] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = HistogramSeries(bucket_counts=[0] * len(self.buckets))
+        # Buckets are counted individually and made cumulative when rendered
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series.bucket_counts[index] += 1
+        series.sum += value
+        series.count += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self.series.items()):
+            cumulative = 0
+            for upper_bound, bucket_count in zip(self.buckets, series.bucket_counts):
+                cumulative += bucket_count
+                lines.append(
+                    f"{self.name}_bucket{format_labels(labels + (('le', format_value(upper_bound)),))} {cumulative}"
+                )
+            lines.append(f"{self.name}_bucket{format_labels(labels + (('le', '+Inf'),))} {series.count}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(series.sum)}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {series.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Histograms of the app, rendered in the Prometheus text format for the /metrics endpoint.
+    Each worker process has its own registry, so a scraper sees the process that answered.
+    """
+
+    def __init__(self):
+        self.stage_duration = Histogram(
+            "ragapp_stage_duration_seconds", "Time spent in each stage of a request.", STAGE_BUCKETS
+        )
+        self.request_duration = Histogram(
+            "ragapp_request_duration_seconds",
+            "Time from the start of a request until its response, or its stream, ends.",
+            STAGE_BUCKETS,
+        )
+        self.event_loop_lag = Histogram(
+            "ragapp_event_loop_lag_seconds",
+            "How much later than scheduled the event loop ran a periodic callback.",
+            LOOP_LAG_BUCKETS,
+        )
+
+    def histograms(self) -> list[Histogram]:
+        return [self.stage_duration, self.request_duration, self.event_loop_lag]
+
+    def render(self) -> str:
+        return "\n".join(line for histogram in self.histograms() for line in histogram.render()) + "\n"
+
+
+@dataclass
+class RequestTimings:
+    """
+    Durations of the stages of one request, in milliseconds. Stages that run more than once, such as
+    search with speculative retrieval, add up. The stages dict is updated in place, so a thought that
+    holds it shows every stage that finished before the thought was serialized.
+    """
+
+    route: str
+    registry: Optional[MetricsRegistry] = None
+    stages: dict[str, float] = field(default_factory=dict)
+    start: float = field(default_factory=time.perf_counter)
+    # Set by routes that stream their response, which then call finish once the stream ends
+    streaming: bool = False
+    finished: bool = False
+
+    def record(self, name: str, seconds: float) -> None:
+        self.stages[name] = round(self.stages.get(name, 0.0) + seconds * 1000, 3)
+        if self.registry is not None:
+            self.registry.stage_duration.observe(seconds, stage=name)
+
+    def finish(self) -> None:
+        if self.finished:
+            return
+        self.finished = True
+        if self.registry is not None:
+            self.registry.request_duration.observe(time.perf_counter() - self.start, route=self.route)
+
+
+# Copied into the tasks a request starts, such as the response stream, which then record into the same timings
+request_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def start_request_timings(route: str, registry: Optional[MetricsRegistry]) -> RequestTimings:
+    timings = RequestTimings(route=route, registry=registry)
+    request_timings.set(timings)
+    return timings
+
+
+def current_timings() -> Optional[RequestTimings]:
+    return request_timings.get()
+
+
+def record_stage(name: str, seconds: float) -> None:
+    """Records a stage of the current request, outside of a request this does nothing."""
+    if timings := request_timings.get():
+        timings.record(name, seconds)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    if request_timings.get() is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+async def watch_event_loop_lag(registry: MetricsRegistry, interval_seconds: float):
+    """
+    Sleeps for interval_seconds and records how late it wakes up. Lag means some code blocked the loop,
+    which delays every request served by the process, not just the one that blocked it.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        scheduled = loop.time() + interval_seconds
+        await asyncio.sleep(interval_seconds)
+        lag = max(0.0, loop.time() - scheduled)
+        registry.event_loop_lag.observe(lag)
+        if lag > 0.1:
+            logger.warning("The event loop was blocked for %.0fms", lag * 1000)
@@ -0,0 +1,146 @@
+import asyncio
+import dataclasses
+import json
+from collections.abc import AsyncGenerator, AsyncIterator, Iterable
+from typing import Any, Optional
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt, the fallback covers other installs
+    orjson = None  # type: ignore[assignment]
+
+
+class JSONEncoder(json.JSONEncoder):
+    def default(self, o):
+        if dataclasses.is_dataclass(o) and not isinstance(o, type):
+            return dataclasses.asdict(o)
+        return super().default(o)
+
+
+# Reused, since json.dumps(cls=...) builds a new encoder on every call. Compact like orjson,
+# so a stream is the same bytes with either backend
+STANDARD_ENCODER = JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+def json_dumps(value: Any) -> bytes:
+    return STANDARD_ENCODER.encode(value).encode()
+
+
+def orjson_dumps(value: Any) -> bytes:
+    try:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    except TypeError:
+        # orjson rejects a few values the standard library accepts, such as integers over 64 bits
+        return json_dumps(value)
+
+
+def contains_dataclass(value: Any) -> bool:
+    """Checks dataclasses directly inside value, and inside nested dicts, which is where events put ExtraInfo."""
+    if type(value) is dict:
+        return any(contains_dataclass(item) for item in value.values())
+    if type(value) is list:
+        return any(dataclasses.is_dataclass(item) for item in value)
+    return dataclasses.is_dataclass(value) and not isinstance(value, type)
+
+
+class NDJSONEncoder:
+    """
+    Encodes streamed events as NDJSON lines, one encoder per response stream.
+    Events are serialized like json.dumps(event, cls=JSONEncoder), except that the values of the fields
+    named in cached_fields (on any dataclass, such as ExtraInfo.data_points or ThoughtStep.description) are
+    serialized once per object and reused, so re-sending the context with the final usage event only
+    serializes what can still change. Those values must not be modified once they have been sent.
+    Each line is compact JSON, with no spaces after separators. It is written with orjson when that is
+    installed, and otherwise with the standard library, which gives the same bytes.
+    """
+
+    def __init__(self, cached_fields: Iterable[str] = (), use_orjson: Optional[bool] = None):
+        if use_orjson is None:
+            use_orjson = orjson is not None
+        self.dumps = orjson_dumps if use_orjson else json_dumps
+        self.cached_fields = frozenset(cached_fields)
+        # Keyed by id(), holding the value itself so the id is not reused while the stream lasts
+        self.fragments: dict[int, tuple[Any, bytes]] = {}
+
+    def encode(self, event: Any) -> bytes:
+        return self.encode_value(event) + b"\n"
+
+    def encode_value(self, value: Any) -> bytes:
+        if type(value) is dict and not contains_dataclass(value):
+            # Plain events, like the content deltas that make up most of a stream, take a single call
+            return self.dumps(value)
+        if dataclasses.is_dataclass(value) and not isinstance(value, type):
+            return self.encode_items((field.name, getattr(value, field.name)) for field in dataclasses.fields(value))
+        if type(value) is dict and all(type(key) is str for key in value):
+            return self.encode_items(value.items())
+        if type(value) is list and contains_dataclass(value):
+            return b"[" + b",".join(self.encode_value(item) for item in value) + b"]"
+        return self.dumps(value)
+
+    def encode_items(self, items: Iterable[tuple[str, Any]]) -> bytes:
+        parts = []
+        for key, value in items:
+            encoded = self.encode_cached(value) if key in self.cached_fields else self.encode_value(value)
+            parts.append(self.dumps(key) + b":" + encoded)
+        return b"{" + b",".join(parts) + b"}"
+
+    def encode_cached(self, value: Any) -> bytes:
+        if value is None or isinstance(value, (str, int, float)):
+            return self.encode_value(value)
+        fragment = self.fragments.get(id(value))
+        if fragment is None or fragment[0] is not value:
+            fragment = (value, self.encode_value(value))
+            self.fragments[id(value)] = fragment
+        return fragment[1]
+
+
+async def coalesce_frames(
+    frames: AsyncIterator[bytes], max_delay_ms: float = 0, max_bytes: int = 0
+) -> AsyncGenerator[bytes, None]:
+    """
+    Groups consecutive frames into larger writes, to save a send call per token on fast streams.
+    A group is written once it reaches max_bytes, or max_delay_ms after its first frame arrived,
+    whichever comes first. With both limits at 0 every frame is written as soon as it arrives.
+    """
+    if max_delay_ms <= 0 and max_bytes <= 0:
+        async for frame in frames:
+            yield frame
+        return
+
+    loop = asyncio.get_running_loop()
+    iterator = frames.__aiter__()
+    buffer: list[bytes] = []
+    buffered_bytes = 0
+    deadline = 0.0
+    # The next frame is awaited in a task, so a timed flush does not have to cancel the upstream generator
+    next_frame: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if next_frame is None:
+                next_frame = asyncio.ensure_future(iterator.__anext__())
+            if buffer and max_delay_ms > 0:
+                done, _ = await asyncio.wait({next_frame}, timeout=max(0.0, deadline - loop.time()))
+                if not done:
+                    yield b"".join(buffer)
+                    buffer.clear()
+                    buffered_bytes = 0
+                    continue
+            try:
+                frame = await next_frame
+            except StopAsyncIteration:
+                next_frame = None
+                break
+            next_frame = None
+            if not buffer:
+                deadline = loop.time() + max_delay_ms / 1000
+            buffer.append(frame)
+            buffered_bytes += len(frame)
+            if max_bytes > 0 and buffered_bytes >= max_bytes:
+                yield b"".join(buffer)
+                buffer.clear()
+                buffered_bytes = 0
+        if buffer:
+            yield b"".join(buffer)
+    finally:
+        if next_frame is not None and not next_frame.done():
+            next_frame.cancel()
@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import os
+import uuid
+from collections.abc import Awaitable, Callable
+from typing import Any, Optional
+
+from core.lrucache import LRUCache
+
+# Cache key: (user oid, hash of the user's groups, normalized path)
+PathAuthKey = tuple[str, str, str]
+
+
+def normalize_path(path: str) -> str:
+    """Strips the fragment, like check_path_auth does, so links to different pages of a file share a decision."""
+    fragment_index = path.find("#")
+    if fragment_index != -1:
+        path = path[:fragment_index]
+    return path
+
+
+def groups_hash(groups: Optional[list[str]]) -> str:
+    return hashlib.sha256("\n".join(sorted(groups or [])).encode()).hexdigest()[:16]
+
+
+class PathAuthCache:
+    """
+    Caches the decisions of AuthenticationHelper.check_path_auth, which otherwise runs a search query for
+    every /content request, such as each page a PDF viewer loads for one citation.
+    Decisions expire after ttl_seconds, which bounds how long an ACL change made outside the app,
+    such as with scripts/manageacl.py, takes to apply. Changes made through the app invalidate entries right away.
+    Concurrent checks for the same key share a single search query.
+    Each worker process has its own cache. With generation_path, every invalidation also replaces that file,
+    and the other workers clear their caches once they see it changed, on their next lookup.
+    """
+
+    def __init__(self, maxsize: int = 4096, ttl_seconds: float = 60, generation_path: Optional[str] = None):
+        self.decisions: LRUCache[PathAuthKey, bool] = LRUCache(maxsize, ttl_seconds)
+        self.pending: dict[PathAuthKey, asyncio.Future[bool]] = {}
+        # Bumped by every invalidation, so a check that started before one does not store a stale decision
+        self.generation = 0
+        self.generation_path = generation_path
+        self.shared_generation = self.read_shared_generation()
+        self.shared_checks = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(path: str, auth_claims: dict[str, Any]) -> PathAuthKey:
+        return (auth_claims.get("oid") or "", groups_hash(auth_claims.get("groups")), normalize_path(path))
+
+    async def get_or_check(self, key: PathAuthKey, check: Callable[[], Awaitable[bool]]) -> bool:
+        self.sync_shared_generation()
+        allowed = self.decisions.get(key)
+        if allowed is not None:
+            return allowed
+        task = self.pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.run_check(key, check, self.generation))
+            # Keeps an unobserved failure from being reported when every waiting request went away
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+            self.pending[key] = task
+        else:
+            self.shared_checks += 1
+        # Shielded, so a client disconnecting does not cancel the check other requests are waiting for
+        return await asyncio.shield(task)
+
+    async def run_check(self, key: PathAuthKey, check: Callable[[], Awaitable[bool]], generation: int) -> bool:
+        try:
+            allowed = await check()
+        finally:
+            # An invalidation may have replaced this check with a newer one for the same key
+            if self.pending.get(key) is asyncio.current_task():
+                del self.pending[key]
+        if generation == self.generation:
+            self.decisions.put(key, allowed)
+        return allowed
+
+    def invalidate_path(self, path: str) -> None:
+        """Drops the decisions of every user for a file, for example after it was uploaded or deleted."""
+        path = normalize_path(path)
+        self.invalidate(lambda key: key[2] == path)
+
+    def invalidate_user(self, oid: str) -> None:
+        self.invalidate(lambda key: key[0] == oid)
+
+    def invalidate(self, matches: Callable[[PathAuthKey], bool]) -> None:
+        self.invalidate_locally(matches)
+        # The other workers can't tell which decisions changed, so they clear all of theirs
+        self.bump_shared_generation()
+
+    def clear(self) -> None:
+        self.invalidate(lambda key: True)
+
+    def invalidate_locally(self, matches: Callable[[PathAuthKey], bool]) -> None:
+        self.generation += 1
+        self.invalidations += 1
+        for key in self.decisions.keys():
+            if matches(key):
+                self.decisions.pop(key)
+        # Requests arriving from now on start a new check instead of waiting for one that started before
+        for key in [key for key in self.pending if matches(key)]:
+            del self.pending[key]
+
+    def read_shared_generation(self) -> Optional[tuple[int, int]]:
+        if self.generation_path is None:
+            return None
+        try:
+            # The file is replaced rather than written, so its inode changes even within one mtime tick
+            stat = os.stat(self.generation_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def sync_shared_generation(self) -> None:
+        """Clears this worker's decisions if another worker invalidated its cache since the last lookup."""
+        if self.generation_path is None:
+            return
+        shared_generation = self.read_shared_generation()
+        if shared_generation != self.shared_generation:
+            self.shared_generation = shared_generation
+            self.invalidate_locally(lambda key: True)
+
+    def bump_shared_generation(self) -> None:
+        if self.generation_path is None:
+            return
+        temporary_path = f"{self.generation_path}.{uuid.uuid4().hex}.tmp"
+        with open(temporary_path, "w") as file:
+            file.write(str(self.generation))
+        os.replace(temporary_path, self.generation_path)
+        # This worker already applied its own invalidation
+        self.shared_generation = self.read_shared_generation()
+
+    def stats(self) -> dict[str, float]:
+        return self.decisions.stats() | {"shared_checks": self.shared_checks, "invalidations": self.invalidations}
@@ -0,0 +1,223 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections.abc import AsyncIterator
+from contextvars import ContextVar
+from pathlib import Path
+from types import FrameType
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+# Request ids are uuid4 strings, which also keeps them safe to use as file names
+REQUEST_ID_PATTERN = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+
+class RequestProfiler:
+    """
+    Samples the stack of the event loop thread from a background thread, like py-spy does from outside
+    the process. A coroutine that is running has the coroutines awaiting it as its parent frames, so the
+    samples follow async call chains, and samples taken while the loop waits in select() show the time
+    spent waiting for I/O. The loop thread is shared by every request of the worker, so samples of
+    concurrent requests are mixed in; profile on a worker that serves nothing else for a clean profile.
+    """
+
+    def __init__(self, interval_seconds: float = 0.001, max_duration_seconds: float = 120):
+        self.interval_seconds = interval_seconds
+        self.max_duration_seconds = max_duration_seconds
+        self.request_id: Optional[str] = None
+        # Set by routes that stream their response, which then stop the profiler once the stream ends
+        self.streaming = False
+        self.frames: list[dict[str, Any]] = []
+        self.frame_indexes: dict[tuple[str, str, int], int] = {}
+        self.samples: list[list[int]] = []
+        self.weights: list[float] = []
+        self.start_time = 0.0
+        self.target_thread_id = 0
+        self.previous_switch_interval: Optional[float] = None
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.target_thread_id = threading.get_ident()
+        # The sampling thread needs the GIL, which a busy event loop thread only hands over every switch
+        # interval (5ms by default), so it is shortened to the sampling interval while profiling
+        self.previous_switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self.previous_switch_interval, self.interval_seconds))
+        self.start_time = time.perf_counter()
+        self.thread = threading.Thread(target=self.sample_loop, name="request-profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def is_sampling(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def sample_loop(self) -> None:
+        last_sample = self.start_time
+        try:
+            while not self.stop_event.wait(self.interval_seconds):
+                frame = sys._current_frames().get(self.target_thread_id)
+                now = time.perf_counter()
+                if frame is None:
+                    break
+                self.samples.append(self.stack_indexes(frame))
+                # Weighted by the time since the previous sample, so the profile adds up to the wall time
+                self.weights.append((now - last_sample) * 1000)
+                last_sample = now
+                if now - self.start_time > self.max_duration_seconds:
+                    logger.warning("Stopped profiling request %s after %ds", self.request_id, self.max_duration_seconds)
+                    break
+        finally:
+            # Restored here rather than in stop, so it also happens for a request that never calls stop,
+            # such as a stream the client abandoned before it started
+            if self.previous_switch_interval is not None:
+                sys.setswitchinterval(self.previous_switch_interval)
+
+    def stack_indexes(self, frame: Optional[FrameType]) -> list[int]:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            # co_qualname was added in Python 3.11
+            key = (getattr(code, "co_qualname", code.co_name), code.co_filename, code.co_firstlineno)
+            index = self.frame_indexes.get(key)
+            if index is None:
+                index = self.frame_indexes[key] = len(self.frames)
+                self.frames.append({"name": key[0], "file": key[1], "line": key[2]})
+            stack.append(index)
+            frame = frame.f_back
+        # Speedscope expects the outermost frame first
+        stack.reverse()
+        return stack
+
+    def to_speedscope(self, name: str) -> dict[str, Any]:
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "name": name,
+            "exporter": "azure-search-openai-demo",
+            "activeProfileIndex": 0,
+            "shared": {"frames": self.frames},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": name,
+                    "unit": "milliseconds",
+                    "startValue": 0,
+                    "endValue": round(sum(self.weights), 3),
+                    "samples": self.samples,
+                    "weights": [round(weight, 3) for weight in self.weights],
+                }
+            ],
+        }
+
+
+class ProfileStore:
+    """Keeps the speedscope files of the last max_files profiled requests in a directory, named by request id."""
+
+    def __init__(self, directory: str, max_files: int = 20, sample_interval_seconds: float = 0.001):
+        self.directory = Path(directory)
+        self.max_files = max_files
+        self.sample_interval_seconds = sample_interval_seconds
+        # One profile at a time, since the profiler samples the whole event loop thread
+        self.active: Optional[RequestProfiler] = None
+
+    def path_for(self, request_id: str) -> Optional[Path]:
+        if not REQUEST_ID_PATTERN.match(request_id):
+            return None
+        return self.directory / f"{request_id}.speedscope.json"
+
+    def save(self, request_id: str, profile: dict[str, Any]) -> Optional[Path]:
+        path = self.path_for(request_id)
+        if path is None:
+            return None
+        self.directory.mkdir(parents=True, exist_ok=True)
+        temporary_path = path.with_suffix(".tmp")
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump(profile, file)
+        os.replace(temporary_path, path)
+        profiles = sorted(self.directory.glob("*.speedscope.json"), key=lambda profile: profile.stat().st_mtime)
+        for old_profile in profiles[: -self.max_files]:
+            old_profile.unlink(missing_ok=True)
+        return path
+
+    def load(self, request_id: str) -> Optional[bytes]:
+        path = self.path_for(request_id)
+        if path is None or not path.exists():
+            return None
+        return path.read_bytes()
+
+
+request_profiler: ContextVar[Optional[RequestProfiler]] = ContextVar("request_profiler", default=None)
+
+
+def current_profiler() -> Optional[RequestProfiler]:
+    return request_profiler.get()
+
+
+def start_request_profiler(store: ProfileStore) -> Optional[RequestProfiler]:
+    """Starts profiling the current request, unless another request of this worker is being profiled."""
+    if store.active is not None and store.active.is_sampling():
+        logger.warning("Another request is being profiled, not profiling this one")
+        return None
+    profiler = RequestProfiler(store.sample_interval_seconds)
+    profiler.start()
+    store.active = profiler
+    request_profiler.set(profiler)
+    return profiler
+
+
+def stop_request_profiler(store: ProfileStore, profiler: RequestProfiler) -> None:
+    profiler.stop()
+    if store.active is profiler:
+        store.active = None
+
+
+def save_request_profile(store: ProfileStore, profiler: RequestProfiler, name: str) -> Optional[Path]:
+    """Saves the profile of a stopped profiler. This does blocking file I/O, so call it from a thread."""
+    if profiler.request_id is None:
+        return None
+    path = store.save(profiler.request_id, profiler.to_speedscope(name))
+    logger.info("Saved the profile of request %s to %s", profiler.request_id, path)
+    return path
+
+
+class ProfiledStream:
+    """
+    Wraps a streamed response body, and stops and saves its profile when the server closes the body.
+    Closing a generator that never started does not run its finally blocks, so a stream the client
+    abandoned before it started would otherwise keep the profiler, and its shorter switch interval, running.
+    """
+
+    def __init__(self, body: AsyncIterator[bytes], store: ProfileStore, profiler: RequestProfiler, name: str):
+        self.body = body
+        self.store = store
+        self.profiler = profiler
+        self.name = name
+        self.closed = False
+
+    def __aiter__(self) -> "ProfiledStream":
+        return self
+
+    async def __anext__(self) -> bytes:
+        return await self.body.__anext__()
+
+    async def aclose(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if hasattr(self.body, "aclose"):
+                await self.body.aclose()
+        finally:
+            stop_request_profiler(self.store, self.profiler)
+            await asyncio.to_thread(save_request_profile, self.store, self.profiler, self.name)
@@ -0,0 +1,2 @@
+class InvalidRequestError(ValueError):
+    """A request carried a value the app cannot use. Routes answer it with a 400 and the error message."""
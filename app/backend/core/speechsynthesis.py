@@ -0,0 +1,167 @@
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from collections.abc import AsyncGenerator, Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from azure.cognitiveservices.speech import (
+    ResultReason,
+    SpeechConfig,
+    SpeechSynthesisEventArgs,
+    SpeechSynthesisOutputFormat,
+    SpeechSynthesisResult,
+    SpeechSynthesizer,
+)
+
+logger = logging.getLogger(__name__)
+
+# Cache key: (voice, SHA-256 of the text)
+SpeechAudioKey = tuple[str, str]
+
+
+class SpeechSynthesisError(Exception):
+    pass
+
+
+class SpeechAudioCache:
+    """
+    Size-bounded LRU cache of synthesized audio, keyed on the voice and a hash of the text,
+    so playing the same answer again does not call the speech service.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[SpeechAudioKey, bytes] = OrderedDict()
+
+    @staticmethod
+    def make_key(voice: str, text: str) -> SpeechAudioKey:
+        return (voice, hashlib.sha256(text.encode()).hexdigest())
+
+    def get(self, key: SpeechAudioKey) -> Optional[bytes]:
+        audio = self._entries.get(key)
+        if audio is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return audio
+
+    def put(self, key: SpeechAudioKey, audio: bytes) -> None:
+        if len(audio) > self.max_bytes:
+            return
+        if (previous := self._entries.pop(key, None)) is not None:
+            self.current_bytes -= len(previous)
+        self._entries[key] = audio
+        self.current_bytes += len(audio)
+        while self.current_bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= len(evicted)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SpeechSynthesisService:
+    """
+    Runs Azure speech synthesis on a bounded thread pool, since the Speech SDK only offers blocking calls,
+    and streams the audio chunks to the event loop as the service produces them.
+    Each worker thread keeps its synthesizer until the auth token changes, instead of creating one per request.
+    """
+
+    def __init__(
+        self,
+        resource_id: str,
+        location: str,
+        voice: str,
+        max_workers: int = 4,
+        audio_cache: Optional[SpeechAudioCache] = None,
+    ):
+        self.resource_id = resource_id
+        self.location = location
+        self.voice = voice
+        self.audio_cache = audio_cache
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speech")
+        self.thread_state = threading.local()
+
+    def get_synthesizer(self, token: str) -> SpeechSynthesizer:
+        """Returns the synthesizer of the current worker thread, creating it for a new token."""
+        state = self.thread_state
+        if getattr(state, "token", None) != token:
+            # Construct a token as described in documentation:
+            # https://learn.microsoft.com/azure/ai-services/speech-service/how-to-configure-azure-ad-auth?pivots=programming-language-python
+            speech_config = SpeechConfig(auth_token=f"aad#{self.resource_id}#{token}", region=self.location)
+            speech_config.speech_synthesis_voice_name = self.voice
+            speech_config.speech_synthesis_output_format = SpeechSynthesisOutputFormat.Audio16Khz32KBitRateMonoMp3
+            state.synthesizer = SpeechSynthesizer(speech_config=speech_config, audio_config=None)
+            state.token = token
+        return state.synthesizer
+
+    def synthesize(self, text: str, token: str, send_chunk: Callable[[bytes], None]) -> SpeechSynthesisResult:
+        synthesizer = self.get_synthesizer(token)
+
+        # The SDK calls this on its own native thread, so it is bound to this synthesis rather than
+        # looking up the request in thread-local state of the worker thread
+        def on_synthesizing(event: SpeechSynthesisEventArgs) -> None:
+            send_chunk(event.result.audio_data)
+
+        synthesizer.synthesizing.connect(on_synthesizing)
+        try:
+            return synthesizer.speak_text_async(text).get()
+        finally:
+            # The synthesizer is reused by the next request of this worker thread
+            synthesizer.synthesizing.disconnect_all()
+
+    async def stream_audio(self, text: str, token: str) -> AsyncGenerator[bytes, None]:
+        """
+        Yields the audio for text in chunks, from the cache when the same text was synthesized before.
+        Raises SpeechSynthesisError if synthesis was canceled or failed.
+        """
+        cache_key = SpeechAudioCache.make_key(self.voice, text)
+        if self.audio_cache is not None and (audio := self.audio_cache.get(cache_key)) is not None:
+            yield audio
+            return
+
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue[bytes] = asyncio.Queue()
+
+        def send_chunk(chunk: bytes):
+            loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+
+        synthesis = loop.run_in_executor(self.executor, self.synthesize, text, token, send_chunk)
+        streamed_bytes = 0
+        while not synthesis.done() or not chunks.empty():
+            next_chunk = asyncio.ensure_future(chunks.get())
+            await asyncio.wait([next_chunk, synthesis], return_when=asyncio.FIRST_COMPLETED)
+            if not next_chunk.done():
+                next_chunk.cancel()
+                continue
+            if chunk := next_chunk.result():
+                streamed_bytes += len(chunk)
+                yield chunk
+
+        result = synthesis.result()
+        if result.reason == ResultReason.SynthesizingAudioCompleted:
+            audio = result.audio_data or b""
+            if streamed_bytes == 0:
+                # The service sent the audio in one piece, without synthesizing events
+                yield audio
+            if self.audio_cache is not None:
+                self.audio_cache.put(cache_key, audio)
+        elif result.reason == ResultReason.Canceled:
+            cancellation_details = result.cancellation_details
+            logger.error(
+                "Speech synthesis canceled: %s %s", cancellation_details.reason, cancellation_details.error_details
+            )
+            raise SpeechSynthesisError("Speech synthesis canceled. Check logs for details.")
+        else:
+            logger.error("Unexpected result reason: %s", result.reason)
+            raise SpeechSynthesisError("Speech synthesis failed. Check logs for details.")
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
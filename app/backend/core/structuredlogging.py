@@ -0,0 +1,157 @@
+import atexit
+import json
+import logging
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+# Logger names that make up the app's log categories; a category also covers its child loggers,
+# so "approaches" sets the level of "approaches.chatreadretrieveread" and "approaches.timing"
+APP_LOG_CATEGORIES = ("app", "scripts", "approaches", "chat_logging", "core")
+
+# Attributes every LogRecord has, so anything else on a record came from the extra argument
+RESERVED_RECORD_ATTRIBUTES = frozenset(logging.makeLogRecord({}).__dict__) | {"message", "asctime"}
+
+
+def parse_category_settings(value: Optional[str]) -> dict[str, str]:
+    """Parses settings like "approaches.timing=DEBUG,chat_logging=WARNING" into a dict."""
+    settings = {}
+    for item in (value or "").split(","):
+        name, separator, setting = item.partition("=")
+        if separator and name.strip() and setting.strip():
+            settings[name.strip()] = setting.strip()
+    return settings
+
+
+def record_fields(record: logging.LogRecord) -> dict:
+    return {key: value for key, value in record.__dict__.items() if key not in RESERVED_RECORD_ATTRIBUTES}
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Formats records with the fields passed through extra, either as one JSON object per line
+    or as text with key=value pairs after the message.
+    """
+
+    def __init__(self, json_output: bool = False):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+        self.json_output = json_output
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = record_fields(record)
+        if not self.json_output:
+            text = super().format(record)
+            if fields:
+                text += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+            return text
+        entry = {
+            "timestamp": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **fields,
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a fraction of the records of each sampled category, such as 0.1 for one record in ten.
+    Sampling is spread evenly rather than random, so low-traffic logs still show regular samples.
+    Records at WARNING or above are always kept.
+    """
+
+    def __init__(self, rates: dict[str, float]):
+        super().__init__()
+        # Longest names first, so the most specific category decides
+        self.rates = dict(sorted(rates.items(), key=lambda item: len(item[0]), reverse=True))
+        self.credits = {name: 0.0 for name in rates}
+        self.lock = threading.Lock()
+
+    def category(self, name: str) -> Optional[str]:
+        for category in self.rates:
+            if name == category or name.startswith(category + "."):
+                return category
+        return None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        category = self.category(record.name)
+        if category is None:
+            return True
+        with self.lock:
+            self.credits[category] += self.rates[category]
+            if self.credits[category] >= 1:
+                self.credits[category] -= 1
+                return True
+        return False
+
+
+class NonBlockingLogging:
+    """
+    Sends the records of every logger through a queue to a listener thread, which does the formatting
+    and the blocking writes, so logging from a request handler never waits on stdout or stderr.
+    """
+
+    def __init__(self, handler: logging.Handler, sampling_rates: Optional[dict[str, float]] = None):
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.queue_handler = QueueHandler(self.queue)
+        if sampling_rates:
+            # Filtered before the queue, so dropped records cost nothing more
+            self.queue_handler.addFilter(SamplingFilter(sampling_rates))
+        self.listener = QueueListener(self.queue, handler, respect_handler_level=True)
+        self.started = False
+
+    def start(self):
+        logging.getLogger().addHandler(self.queue_handler)
+        self.listener.start()
+        self.started = True
+
+    def stop(self):
+        logging.getLogger().removeHandler(self.queue_handler)
+        if self.started:
+            # Waits for the listener to write the records that are still queued
+            self.listener.stop()
+            self.started = False
+
+
+_active_logging: Optional[NonBlockingLogging] = None
+
+
+def configure_logging(
+    app_level: str = "INFO",
+    category_levels: Optional[dict[str, str]] = None,
+    sampling_rates: Optional[dict[str, float]] = None,
+    json_output: bool = False,
+) -> NonBlockingLogging:
+    """
+    Sets the root logger to WARNING, to avoid overly verbose logs from SDKs, and the app's categories to app_level,
+    then applies category_levels on top. Replaces the logging set up by an earlier call, so it can run once per app.
+    """
+    global _active_logging
+    if _active_logging is not None:
+        _active_logging.stop()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    for category in APP_LOG_CATEGORIES:
+        logging.getLogger(category).setLevel(app_level)
+    for category, level in (category_levels or {}).items():
+        logging.getLogger(category).setLevel(level.upper())
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(StructuredFormatter(json_output=json_output))
+    _active_logging = NonBlockingLogging(handler, sampling_rates)
+    _active_logging.start()
+    return _active_logging
+
+
+@atexit.register
+def stop_logging():
+    global _active_logging
+    if _active_logging is not None:
+        _active_logging.stop()
+        _active_logging = None
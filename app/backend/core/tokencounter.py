@@ -0,0 +1,37 @@
+from functools import lru_cache
+from typing import Any
+
+import tiktoken
+
+# Tokens the chat format adds around every message (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Rough cost of an image part, as sent with detail "low"
+IMAGE_PART_TOKENS = 85
+# cl100k_base is close enough to the newer encodings for budgeting, and is available offline in most installs
+DEFAULT_ENCODING = "cl100k_base"
+
+
+@lru_cache(maxsize=4)
+def get_encoding(encoding_name: str = DEFAULT_ENCODING) -> tiktoken.Encoding:
+    return tiktoken.get_encoding(encoding_name)
+
+
+# History messages are recounted on every turn, so counts are memoized by text
+@lru_cache(maxsize=2048)
+def count_text_tokens(text: str, encoding_name: str = DEFAULT_ENCODING) -> int:
+    return len(get_encoding(encoding_name).encode(text, disallowed_special=()))
+
+
+def count_message_tokens(message: Any, encoding_name: str = DEFAULT_ENCODING) -> int:
+    """Approximates how many prompt tokens a chat message uses, including image parts of vision messages."""
+    content = message.get("content")
+    tokens = MESSAGE_OVERHEAD_TOKENS
+    if isinstance(content, str):
+        tokens += count_text_tokens(content, encoding_name)
+    elif isinstance(content, list):
+        for part in content:
+            if part.get("type") == "text":
+                tokens += count_text_tokens(part.get("text", ""), encoding_name)
+            elif part.get("type") == "image_url":
+                tokens += IMAGE_PART_TOKENS
+    return tokens
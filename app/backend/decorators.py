@@ -6,6 +6,7 @@ from quart import abort, current_app, request
 
 from config import CONFIG_AUTH_CLIENT, CONFIG_SEARCH_CLIENT
 from core.authentication import AuthError
+from core.instrumentation import stage
 from error import error_response
 
 
@@ -21,8 +22,9 @@ def authenticated_path(route_fn: Callable[[str, dict[str, Any]], Any]):
         search_client = current_app.config[CONFIG_SEARCH_CLIENT]
         authorized = False
         try:
-            auth_claims = await auth_helper.get_auth_claims_if_enabled(request.headers)
-            authorized = await auth_helper.check_path_auth(path, auth_claims, search_client)
+            with stage("auth"):
+                auth_claims = await auth_helper.get_auth_claims_if_enabled(request.headers)
+                authorized = await auth_helper.check_path_auth(path, auth_claims, search_client)
         except AuthError:
             abort(403)
         except Exception as error:
@@ -49,7 +51,8 @@ def authenticated(route_fn: _C) -> _C:
     async def auth_handler(*args, **kwargs):
         auth_helper = current_app.config[CONFIG_AUTH_CLIENT]
         try:
-            auth_claims = await auth_helper.get_auth_claims_if_enabled(request.headers)
+            with stage("auth"):
+                auth_claims = await auth_helper.get_auth_claims_if_enabled(request.headers)
         except AuthError:
             abort(403)
 
@@ -21,6 +21,7 @@ export type ChatAppRequestOverrides = {
     semantic_ranker?: boolean;
     semantic_captions?: boolean;
     query_rewriting?: boolean;
+    speculative_retrieval?: boolean;
     reasoning_effort?: string;
     include_category?: string;
     exclude_category?: string;
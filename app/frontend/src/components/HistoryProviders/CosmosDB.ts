@@ -6,6 +6,8 @@ export class CosmosDBProvider implements IHistoryProvider {
 
     private continuationToken: string | undefined;
     private isItemEnd: boolean = false;
+    // Number of message pairs already saved and the session ETag, per session, so later saves only append
+    private savedSessions: Map<string, { count: number; etag: string }> = new Map();
 
     resetContinuationToken() {
         this.continuationToken = undefined;
@@ -35,7 +37,23 @@ export class CosmosDBProvider implements IHistoryProvider {
     }
 
     async addItem(id: string, answers: Answers, idToken?: string): Promise<void> {
-        await postChatHistoryApi({ id, answers }, idToken || "");
+        const saved = this.savedSessions.get(id);
+        const item =
+            saved && answers.length > saved.count
+                ? { id, answers: answers.slice(saved.count), start_index: saved.count, etag: saved.etag }
+                : { id, answers };
+        try {
+            const response = await postChatHistoryApi(item, idToken || "");
+            if (response.etag) {
+                this.savedSessions.set(id, { count: response.message_count, etag: response.etag });
+            } else {
+                this.savedSessions.delete(id);
+            }
+        } catch (e) {
+            // The session changed elsewhere (or the save failed), so the next save rewrites the whole conversation
+            this.savedSessions.delete(id);
+            throw e;
+        }
         return;
     }
 
@@ -45,6 +63,7 @@ export class CosmosDBProvider implements IHistoryProvider {
     }
 
     async deleteItem(id: string, idToken?: string): Promise<void> {
+        this.savedSessions.delete(id);
         await deleteChatHistoryApi(id, idToken || "");
         return;
     }
@@ -0,0 +1,20 @@
+import re
+
+# Citations such as [Benefit_Options.pdf#page=2]
+CITATION_PATTERN = re.compile(r"\[([^\]]+)\.\w{3,4}(#page=\d+)*\]")
+
+
+def any_citation(response: str) -> bool:
+    return bool(CITATION_PATTERN.search(response))
+
+
+def citations_matched(response: str, ground_truth: str) -> float:
+    """
+    Returns the fraction of the citations in the ground truth that are present in the response,
+    or -1 when the ground truth has no citations, which the summary leaves out of the rate.
+    """
+    truth_citations = set(CITATION_PATTERN.findall(ground_truth))
+    if not truth_citations:
+        return -1
+    response_citations = set(CITATION_PATTERN.findall(response))
+    return len(truth_citations.intersection(response_citations)) / len(truth_citations)
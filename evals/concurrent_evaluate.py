@@ -0,0 +1,270 @@
+"""
+Sends the ground truth questions to the app concurrently and records each answer with its latency,
+first token latency and citation metrics. Every answer is appended to a JSONL checkpoint as soon as
+it arrives, so running the same command again after a failure only asks the remaining questions.
+
+The answers are written in the same format as evaluate.py, so the evaltools summary and diff
+commands work on the results. GPT-judged metrics, such as groundedness, still come from evaluate.py.
+
+Usage: python evals/concurrent_evaluate.py --concurrency 8 --resultsdir evals/results/run1
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+import aiohttp
+import citation_metrics
+
+logger = logging.getLogger("ragapp")
+
+CHECKPOINT_FILE_NAME = "eval_results.jsonl"
+
+
+def load_jsonl(path: Path) -> list[dict]:
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def search_path(data: Any, path: str) -> Any:
+    """Resolves a dotted path such as context.data_points.text, mapping over lists like JMESPath projections."""
+    for key in path.split("."):
+        if isinstance(data, list):
+            data = [item.get(key) for item in data if isinstance(item, dict)]
+        elif isinstance(data, dict):
+            data = data.get(key)
+        else:
+            return None
+    return data
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Linearly interpolated percentile, like numpy.percentile"""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def latency_stats(values: list[float]) -> dict[str, float]:
+    values = [value for value in values if value is not None and value >= 0]
+    if not values:
+        return {}
+    return {
+        "mean": round(sum(values) / len(values), 3),
+        "max": round(max(values), 3),
+        "min": round(min(values), 3),
+        "p50": round(percentile(values, 50), 3),
+        "p95": round(percentile(values, 95), 3),
+        "p99": round(percentile(values, 99), 3),
+    }
+
+
+def summarize(results: list[dict], num_failed: int) -> dict:
+    answer_lengths = [result["answer_length"] for result in results]
+    summary = {
+        "latency": latency_stats([result["latency"] for result in results]),
+        "first_token_latency": latency_stats([result.get("first_token_latency") for result in results]),
+        "answer_length": (
+            {
+                "mean": round(sum(answer_lengths) / len(answer_lengths), 2),
+                "max": max(answer_lengths),
+                "min": min(answer_lengths),
+            }
+            if answer_lengths
+            else {}
+        ),
+    }
+    for metric in ("citations_matched", "any_citation"):
+        values = [result[metric] for result in results if result[metric] != -1]
+        summary[metric] = {"total": int(sum(values)), "rate": round(sum(values) / len(values), 2) if values else 0.0}
+    summary["num_questions"] = {"total": len(results), "failed": num_failed}
+    return summary
+
+
+class ConcurrentEvaluator:
+    """
+    Asks questions with at most concurrency requests in flight. With stream set, questions go to the
+    streaming endpoint (the target URL followed by /stream), which also gives the time to the first token.
+    """
+
+    def __init__(
+        self,
+        target_url: str,
+        target_parameters: dict,
+        answer_path: str,
+        context_path: str,
+        concurrency: int = 4,
+        stream: bool = True,
+        timeout_seconds: float = 300,
+    ):
+        self.target_url = target_url.rstrip("/")
+        self.target_parameters = target_parameters
+        self.answer_path = answer_path
+        self.context_path = context_path
+        self.concurrency = concurrency
+        self.stream = stream
+        self.timeout = aiohttp.ClientTimeout(total=timeout_seconds)
+
+    async def ask(self, session: aiohttp.ClientSession, question: str) -> tuple[dict, float, Optional[float]]:
+        """Returns the response, shaped like the /chat response, its latency and its first token latency."""
+        body = {"messages": [{"content": question, "role": "user"}], "context": self.target_parameters}
+        start = time.perf_counter()
+        if not self.stream:
+            async with session.post(self.target_url, json=body) as response:
+                response.raise_for_status()
+                data = await response.json()
+            return data, time.perf_counter() - start, None
+
+        first_token_latency = None
+        answer_parts: list[str] = []
+        context: dict = {}
+
+        def handle_line(line: bytes):
+            nonlocal first_token_latency
+            if not line.strip():
+                return
+            event = json.loads(line)
+            if "error" in event:
+                raise RuntimeError(event["error"])
+            if isinstance(event.get("context"), dict):
+                context.update(event["context"])
+            if content := (event.get("delta") or {}).get("content"):
+                if first_token_latency is None:
+                    first_token_latency = time.perf_counter() - start
+                answer_parts.append(content)
+
+        async with session.post(f"{self.target_url}/stream", json=body) as response:
+            response.raise_for_status()
+            buffer = b""
+            async for data in response.content.iter_any():
+                buffer += data
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    handle_line(line)
+            # The last event has no newline after it when the stream ends without one
+            handle_line(buffer)
+        latency = time.perf_counter() - start
+        return (
+            {"message": {"content": "".join(answer_parts), "role": "assistant"}, "context": context},
+            latency,
+            (first_token_latency),
+        )
+
+    async def evaluate_question(self, session: aiohttp.ClientSession, row: dict) -> dict:
+        response, latency, first_token_latency = await self.ask(session, row["question"])
+        answer = search_path(response, self.answer_path) or ""
+        context = search_path(response, self.context_path)
+        if isinstance(context, list):
+            context = "\n\n".join(str(item) for item in context)
+        return {
+            "question": row["question"],
+            "truth": row["truth"],
+            "answer": answer,
+            "context": context or "",
+            "latency": round(latency, 6),
+            "first_token_latency": round(first_token_latency, 6) if first_token_latency is not None else -1,
+            "answer_length": len(answer),
+            "citations_matched": citation_metrics.citations_matched(answer, row["truth"]),
+            "any_citation": citation_metrics.any_citation(answer),
+        }
+
+    async def run(self, testdata: list[dict], results_dir: Path) -> tuple[list[dict], int]:
+        """
+        Asks every question that has no answer in the checkpoint yet, and returns the answers in
+        the order of testdata, with the number of questions that failed.
+        """
+        results_dir.mkdir(parents=True, exist_ok=True)
+        checkpoint_path = results_dir / CHECKPOINT_FILE_NAME
+        answered = (
+            {result["question"]: result for result in load_jsonl(checkpoint_path)} if checkpoint_path.exists() else {}
+        )
+        remaining = [row for row in testdata if row["question"] not in answered]
+        if answered:
+            logger.info("Resuming: %d questions already answered, %d remaining", len(answered), len(remaining))
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        failed: list[str] = []
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(connector=connector, timeout=self.timeout) as session:
+            with open(checkpoint_path, "a", encoding="utf-8") as checkpoint:
+
+                async def evaluate(row: dict):
+                    async with semaphore:
+                        try:
+                            result = await self.evaluate_question(session, row)
+                        except Exception as error:
+                            # Left out of the checkpoint, so the next run asks it again
+                            logger.warning("Failed to evaluate %r: %s", row["question"], error)
+                            failed.append(row["question"])
+                            return
+                    answered[row["question"]] = result
+                    checkpoint.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    checkpoint.flush()
+                    logger.info("Answered %d/%d questions", len(answered), len(testdata))
+
+                await asyncio.gather(*(evaluate(row) for row in remaining))
+
+        results = [answered[row["question"]] for row in testdata if row["question"] in answered]
+        # Rewritten in question order once the run is done, which the evaltools diff command expects
+        temporary_path = checkpoint_path.with_suffix(".tmp")
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            file.writelines(json.dumps(result, ensure_ascii=False) + "\n" for result in results)
+        os.replace(temporary_path, checkpoint_path)
+        return results, len(failed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ask the ground truth questions concurrently, resuming earlier runs.")
+    parser.add_argument("--targeturl", type=str, help="Specify the target URL.")
+    parser.add_argument("--resultsdir", type=Path, help="Specify the results directory, reuse one to resume its run.")
+    parser.add_argument("--numquestions", type=int, help="Specify the number of questions.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Number of questions asked at the same time.")
+    parser.add_argument("--no-stream", action="store_true", help="Use the /chat endpoint, without first token latency.")
+    args = parser.parse_args()
+
+    working_dir = Path(__file__).parent
+    with open(working_dir / "evaluate_config.json", encoding="utf-8") as file:
+        config = json.load(file)
+    target_url = args.targeturl or config["target_url"]
+    results_dir = args.resultsdir or working_dir / config["results_dir"].replace("<TIMESTAMP>", str(int(time.time())))
+    testdata = load_jsonl(working_dir / config["testdata_path"])[: args.numquestions]
+
+    evaluator = ConcurrentEvaluator(
+        target_url,
+        config.get("target_parameters", {}),
+        answer_path=config["target_response_answer_jmespath"],
+        context_path=config["target_response_context_jmespath"],
+        concurrency=args.concurrency,
+        stream=not args.no_stream,
+    )
+    results, num_failed = asyncio.run(evaluator.run(testdata, results_dir))
+
+    summary = summarize(results, num_failed)
+    with open(results_dir / "summary.json", "w", encoding="utf-8") as file:
+        json.dump(summary, file, indent=4)
+    with open(results_dir / "evaluate_parameters.json", "w", encoding="utf-8") as file:
+        parameters = {
+            "evaluation_timestamp": int(time.time()),
+            "testdata_path": str(working_dir / config["testdata_path"]),
+            "target_url": target_url,
+            "target_parameters": config.get("target_parameters", {}),
+            "num_questions": args.numquestions,
+            "concurrency": args.concurrency,
+        }
+        json.dump(parameters, file, indent=4)
+    logger.info("Summary: %s", json.dumps(summary, indent=4))
+    if num_failed:
+        logger.warning("%d questions failed, run the same command again to retry them", num_failed)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    logger.setLevel(logging.INFO)
+    main()
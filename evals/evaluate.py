@@ -1,9 +1,9 @@
 import argparse
 import logging
 import os
-import re
 from pathlib import Path
 
+import citation_metrics
 from azure.identity import AzureDeveloperCliCredential
 from dotenv_azd import load_azd_env
 from evaltools.eval.evaluate import run_evaluate_from_config
@@ -23,7 +23,7 @@ class AnyCitationMetric(BaseMetric):
             if response is None:
                 logger.warning("Received response of None, can't compute any_citation metric. Setting to -1.")
                 return {cls.METRIC_NAME: -1}
-            return {cls.METRIC_NAME: bool(re.search(r"\[([^\]]+)\.\w{3,4}(#page=\d+)*\]", response))}
+            return {cls.METRIC_NAME: citation_metrics.any_citation(response)}
 
         return any_citation
 
@@ -45,13 +45,7 @@ class CitationsMatchedMetric(BaseMetric):
             if response is None:
                 logger.warning("Received response of None, can't compute citation_match metric. Setting to -1.")
                 return {cls.METRIC_NAME: -1}
-            # Return true if all citations in the truth are present in the response
-            truth_citations = set(re.findall(r"\[([^\]]+)\.\w{3,4}(#page=\d+)*\]", ground_truth))
-            response_citations = set(re.findall(r"\[([^\]]+)\.\w{3,4}(#page=\d+)*\]", response))
-            # Count the percentage of citations that are present in the response
-            num_citations = len(truth_citations)
-            num_matched_citations = len(truth_citations.intersection(response_citations))
-            return {cls.METRIC_NAME: num_matched_citations / num_citations}
+            return {cls.METRIC_NAME: citation_metrics.citations_matched(response, ground_truth)}
 
         return citations_matched
 
@@ -1,8 +1,19 @@
+import json
+import os
 import random
+import re
+import statistics
 import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Optional
 
 from locust import HttpUser, between, task
 
+# Citations are written as [title](linkN), with the URL in context.link_mapping, or as [file.pdf#page=N]
+LINK_CITATION_PATTERN = re.compile(r"\[[^\]]+\]\((link\d+)\)")
+FILE_CITATION_PATTERN = re.compile(r"\[([^\]]+\.\w{3,4}(?:#page=\d+)?)\]")
+
 
 class ChatUser(HttpUser):
     wait_time = between(5, 20)
@@ -74,66 +85,213 @@ class ChatUser(HttpUser):
         )
 
 
-class ChatVisionUser(HttpUser):
+@dataclass
+class StreamResult:
+    answer: str = ""
+    context: dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+class StreamingChatUser(HttpUser):
+    """
+    Reads /chat/stream responses as they arrive and reports, next to the request itself, one STREAM entry
+    per stage: time to the first byte, to the first answer token, and to the end of the stream. The gaps
+    between answer tokens are summarized once per stream, as their median and maximum, so long answers do
+    not add hundreds of entries to the request rate. Set LOCUST_AUTH_TOKEN to send a bearer token when the app requires login.
+    """
+
+    abstract = True
     wait_time = between(5, 20)
+    questions = [
+        "What is included in my Northwind Health Plus plan that is not in standard?",
+        "What does a Product Manager do?",
+        "What happens in a performance review?",
+        "Whats your whistleblower policy?",
+    ]
+    overrides: dict[str, Any] = {
+        "retrieval_mode": "hybrid",
+        "semantic_ranker": True,
+        "semantic_captions": False,
+        "top": 3,
+    }
+    max_citations = 2
+
+    def on_start(self):
+        if token := os.getenv("LOCUST_AUTH_TOKEN"):
+            self.client.headers["Authorization"] = f"Bearer {token}"
+
+    def report(self, name: str, seconds: float, response_length: int = 0, exception: Optional[Exception] = None):
+        self.environment.events.request.fire(
+            request_type="STREAM",
+            name=name,
+            response_time=seconds * 1000,
+            response_length=response_length,
+            exception=exception,
+            context={},
+        )
+
+    def stream_chat(self, name: str, messages: list[dict[str, str]], overrides: dict[str, Any]) -> StreamResult:
+        result = StreamResult()
+        answer_parts: list[str] = []
+        first_byte = first_token = last_token = None
+        token_gaps: list[float] = []
+        response_length = 0
+        start = time.perf_counter()
+        with self.client.post(
+            "/chat/stream",
+            name=name,
+            json={"messages": messages, "context": {"overrides": overrides}, "session_state": None},
+            stream=True,
+            catch_response=True,
+        ) as response:
+            if response.status_code != 200:
+                response.failure(f"HTTP {response.status_code}")
+                return StreamResult(error=f"HTTP {response.status_code}")
+            # chunk_size=None hands over each chunk as it arrives instead of waiting for a full buffer
+            for line in response.iter_lines(chunk_size=None):
+                now = time.perf_counter()
+                if first_byte is None:
+                    first_byte = now
+                if not line:
+                    continue
+                response_length += len(line) + 1
+                event = json.loads(line)
+                if "error" in event:
+                    result.error = event["error"]
+                    break
+                if isinstance(event.get("context"), dict):
+                    result.context.update(event["context"])
+                if content := (event.get("delta") or {}).get("content"):
+                    if first_token is None:
+                        first_token = now
+                    else:
+                        token_gaps.append(now - last_token)
+                    last_token = now
+                    answer_parts.append(content)
+            end = time.perf_counter()
+            if result.error is None and first_token is None:
+                result.error = "The stream ended without an answer"
+            if result.error is not None:
+                response.failure(result.error)
+            else:
+                response.success()
+
+        if first_byte is not None:
+            self.report(f"{name} [first byte]", first_byte - start)
+        if first_token is not None:
+            self.report(f"{name} [first token]", first_token - start)
+        if token_gaps:
+            self.report(f"{name} [inter-token gap p50]", statistics.median(token_gaps))
+            self.report(f"{name} [inter-token gap max]", max(token_gaps))
+        self.report(
+            f"{name} [complete]",
+            end - start,
+            response_length,
+            exception=Exception(result.error) if result.error is not None else None,
+        )
+        result.answer = "".join(answer_parts)
+        return result
+
+    def fetch_citations(self, result: StreamResult):
+        """Opens the first cited sources like a user clicking the citations, through the link mapping if any."""
+        link_mapping = result.context.get("link_mapping") or {}
+        urls = [link_mapping[link] for link in LINK_CITATION_PATTERN.findall(result.answer) if link in link_mapping]
+        urls += [f"/content/{citation}" for citation in FILE_CITATION_PATTERN.findall(result.answer)]
+        for url in list(dict.fromkeys(urls))[: self.max_citations]:
+            self.client.get(url, name="citation content")
+
+    def ask(self, name: str, question: str, history: Optional[list[dict[str, str]]] = None, **overrides):
+        messages = (history or []) + [{"content": question, "role": "user"}]
+        result = self.stream_chat(name, messages, {**self.overrides, **overrides})
+        if result.error is None:
+            messages.append({"content": result.answer, "role": "assistant"})
+        return result, messages
+
+
+class ChatStreamUser(StreamingChatUser):
+    """Asks a question through /chat/stream, opens its citations, then asks one of the follow-up questions."""
 
     @task
     def ask_question(self):
-        self.client.get("/")
+        self.client.get("/", name="home")
         time.sleep(self.wait_time())
-        self.client.post(
-            "/chat/stream",
-            json={
-                "messages": [
-                    {
-                        "content": "Can you identify any correlation between oil prices and stock market trends?",
-                        "role": "user",
-                    }
-                ],
-                "context": {
-                    "overrides": {
-                        "top": 3,
-                        "temperature": 0.3,
-                        "minimum_reranker_score": 0,
-                        "minimum_search_score": 0,
-                        "retrieval_mode": "hybrid",
-                        "semantic_ranker": True,
-                        "semantic_captions": False,
-                        "suggest_followup_questions": False,
-                        "use_oid_security_filter": False,
-                        "use_groups_security_filter": False,
-                        "vector_fields": "textAndImageEmbeddings",
-                        "use_gpt4v": True,
-                        "gpt4v_input": "textAndImages",
-                    }
-                },
-                "session_state": None,
-            },
+        result, history = self.ask(
+            "initial chat stream", random.choice(self.questions), suggest_followup_questions=True
         )
+        if result.error is not None:
+            return
+        self.fetch_citations(result)
         time.sleep(self.wait_time())
-        self.client.post(
-            "/chat/stream",
-            json={
-                "messages": [
-                    {"content": "Compare the impact of interest rates and GDP in financial markets.", "role": "user"}
-                ],
-                "context": {
-                    "overrides": {
-                        "top": 3,
-                        "temperature": 0.3,
-                        "minimum_reranker_score": 0,
-                        "minimum_search_score": 0,
-                        "retrieval_mode": "hybrid",
-                        "semantic_ranker": True,
-                        "semantic_captions": False,
-                        "suggest_followup_questions": False,
-                        "use_oid_security_filter": False,
-                        "use_groups_security_filter": False,
-                        "vector_fields": "textAndImageEmbeddings",
-                        "use_gpt4v": True,
-                        "gpt4v_input": "textAndImages",
-                    }
-                },
-                "session_state": None,
-            },
+        if followup_questions := result.context.get("followup_questions"):
+            self.ask("follow up chat stream", random.choice(followup_questions), history)
+
+
+class AgenticChatStreamUser(StreamingChatUser):
+    """Same conversation as ChatStreamUser, with agentic retrieval instead of the search query rewrite."""
+
+    overrides = {"use_agentic_retrieval": True, "top": 10, "results_merge_strategy": "interleaved"}
+
+    @task
+    def ask_question(self):
+        self.client.get("/", name="home")
+        time.sleep(self.wait_time())
+        result, history = self.ask("agentic chat stream", random.choice(self.questions))
+        if result.error is not None:
+            return
+        self.fetch_citations(result)
+        time.sleep(self.wait_time())
+        self.ask("agentic follow up chat stream", "Can you give more details?", history)
+
+
+class ChatVisionUser(StreamingChatUser):
+    questions = [
+        "Can you identify any correlation between oil prices and stock market trends?",
+        "Compare the impact of interest rates and GDP in financial markets.",
+    ]
+    overrides = {
+        "top": 3,
+        "temperature": 0.3,
+        "minimum_reranker_score": 0,
+        "minimum_search_score": 0,
+        "retrieval_mode": "hybrid",
+        "semantic_ranker": True,
+        "semantic_captions": False,
+        "suggest_followup_questions": False,
+        "use_oid_security_filter": False,
+        "use_groups_security_filter": False,
+        "vector_fields": "textAndImageEmbeddings",
+        "use_gpt4v": True,
+        "gpt4v_input": "textAndImages",
+    }
+
+    @task
+    def ask_question(self):
+        self.client.get("/")
+        time.sleep(self.wait_time())
+        for question in self.questions:
+            result, _ = self.ask("vision chat stream", question)
+            if result.error is None:
+                self.fetch_citations(result)
+            time.sleep(self.wait_time())
+
+
+class UploadUser(StreamingChatUser):
+    """
+    Uploads a document, asks about it and deletes it again. Needs USE_USER_UPLOAD in the app,
+    and LOCUST_AUTH_TOKEN set to an access token for the app's server API.
+    """
+
+    @task
+    def upload_and_ask(self):
+        filename = f"locust-{uuid.uuid4().hex[:8]}.txt"
+        code = uuid.uuid4().hex[:6]
+        document = f"The access code for the load test room is {code}.\n" * 20
+        response = self.client.post(
+            "/upload", name="upload", files={"file": (filename, document.encode(), "text/plain")}
         )
+        if response.status_code != 200:
+            return
+        self.client.get("/list_uploaded", name="list uploaded")
+        time.sleep(self.wait_time())
+        self.ask("chat stream about upload", "What is the access code for the load test room?")
+        self.client.post("/delete_uploaded", name="delete uploaded", json={"filename": filename})
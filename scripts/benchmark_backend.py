@@ -0,0 +1,605 @@
+"""
+Measures the overhead of the backend itself, without Azure OpenAI or Azure AI Search quota: boots create_app()
+with in-process stand-ins for AsyncOpenAI, SearchClient, KnowledgeAgentRetrievalClient, blob storage and the
+SQL chat logger, sends concurrent /chat and /chat/stream requests straight to the ASGI app, and reports
+throughput, first token latency, event loop lag and CPU time per request.
+
+The stand-ins answer after configurable latencies and stream the answer at a configurable token rate,
+so the numbers only move when the code between the services changes. Use --output to keep a JSON
+result per commit and compare them.
+
+Usage: python scripts/benchmark_backend.py --endpoints chat chat-stream agentic --concurrency 1 10 50
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import subprocess
+import sys
+import time
+from collections.abc import AsyncIterator, Iterator
+from contextlib import ExitStack, contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, Optional
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app", "backend"))
+
+from azure.core.credentials import AccessToken  # noqa: E402
+from azure.search.documents.agent.aio import KnowledgeAgentRetrievalClient  # noqa: E402
+from azure.search.documents.agent.models import (  # noqa: E402
+    KnowledgeAgentAzureSearchDocReference,
+    KnowledgeAgentMessage,
+    KnowledgeAgentMessageTextContent,
+    KnowledgeAgentModelQueryPlanningActivityRecord,
+    KnowledgeAgentRetrievalResponse,
+    KnowledgeAgentSearchActivityRecord,
+    KnowledgeAgentSearchActivityRecordQuery,
+)
+from azure.search.documents.aio import SearchClient  # noqa: E402
+from azure.storage.blob import BlobProperties, ContentSettings  # noqa: E402
+from azure.storage.blob.aio import ContainerClient  # noqa: E402
+from openai.resources.chat.completions import AsyncCompletions  # noqa: E402
+from openai.resources.embeddings import AsyncEmbeddings  # noqa: E402
+from openai.types import CreateEmbeddingResponse  # noqa: E402
+from openai.types.chat import ChatCompletion, ChatCompletionChunk  # noqa: E402
+from quart.testing.utils import make_test_scope  # noqa: E402
+from werkzeug.datastructures import Headers  # noqa: E402
+
+import app  # noqa: E402
+from approaches import approach  # noqa: E402
+
+# The package exports the ChatLogger instance under the same name as its module
+chat_logger_module = importlib.import_module("chat_logging.chat_logger")
+
+QUESTIONS = [
+    "Câte zile de concediu de odihnă am pe an?",
+    "Care este procedura pentru decontarea cheltuielilor de deplasare?",
+    "Cum se solicită concediul medical?",
+    "Ce documente sunt necesare pentru angajare?",
+]
+
+# Kept from the caller's environment, everything else comes from benchmark_env
+PASSTHROUGH_ENV = ("PATH", "HOME", "TMPDIR", "TIKTOKEN_CACHE_DIR")
+
+
+@dataclass
+class FakeServiceSettings:
+    """Latencies are in seconds. A tokens_per_second of 0 streams the answer as fast as the app reads it."""
+
+    openai_latency: float = 0.3
+    tokens_per_second: float = 100
+    answer_tokens: int = 150
+    embedding_latency: float = 0.05
+    search_latency: float = 0.1
+    retrieval_latency: float = 0.5
+    blob_latency: float = 0.02
+    sql_latency: float = 0.02
+    documents: int = 5
+    embedding_dimensions: int = 1536
+
+
+def make_usage(prompt_tokens: int, completion_tokens: int) -> dict[str, int]:
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+class FakeServices:
+    """
+    Stand-ins for the Azure services, patched over the SDK methods the app calls.
+    Responses are built once, so the CPU time measured is spent in the app rather than in the fakes.
+    """
+
+    def __init__(self, settings: FakeServiceSettings):
+        self.settings = settings
+        self.calls: dict[str, int] = {}
+        common = {"id": "benchmark", "model": "gpt-4.1-mini", "created": 0}
+        words = [f"Cuvântul{index} " for index in range(settings.answer_tokens - 1)] + ["[Regulament.pdf](link1)."]
+        self.answer_chunks = [
+            ChatCompletionChunk.model_validate(
+                {**common, "object": "chat.completion.chunk", "choices": [{"delta": {"role": "assistant"}, "index": 0}]}
+            ),
+            *(
+                ChatCompletionChunk.model_validate(
+                    {**common, "object": "chat.completion.chunk", "choices": [{"delta": {"content": word}, "index": 0}]}
+                )
+                for word in words
+            ),
+            ChatCompletionChunk.model_validate(
+                {
+                    **common,
+                    "object": "chat.completion.chunk",
+                    "choices": [{"delta": {}, "index": 0, "finish_reason": "stop"}],
+                }
+            ),
+            ChatCompletionChunk.model_validate(
+                {
+                    **common,
+                    "object": "chat.completion.chunk",
+                    "choices": [],
+                    "usage": make_usage(2000, settings.answer_tokens),
+                }
+            ),
+        ]
+        self.answer = ChatCompletion.model_validate(
+            {
+                **common,
+                "object": "chat.completion",
+                "choices": [
+                    {"message": {"role": "assistant", "content": "".join(words)}, "finish_reason": "stop", "index": 0}
+                ],
+                "usage": make_usage(2000, settings.answer_tokens),
+            }
+        )
+        self.search_query = ChatCompletion.model_validate(
+            {
+                **common,
+                "object": "chat.completion",
+                "choices": [
+                    {
+                        "message": {
+                            "role": "assistant",
+                            "content": None,
+                            "tool_calls": [
+                                {
+                                    "id": "call_benchmark",
+                                    "type": "function",
+                                    "function": {
+                                        "name": "search_sources",
+                                        "arguments": json.dumps({"search_query": "concediu de odihnă zile"}),
+                                    },
+                                }
+                            ],
+                        },
+                        "finish_reason": "tool_calls",
+                        "index": 0,
+                    }
+                ],
+                "usage": make_usage(300, 20),
+            }
+        )
+        self.embedding = CreateEmbeddingResponse.model_validate(
+            {
+                "object": "list",
+                "data": [
+                    {"object": "embedding", "index": 0, "embedding": [0.01] * settings.embedding_dimensions},
+                ],
+                "model": "text-embedding-3-large",
+                "usage": {"prompt_tokens": 8, "total_tokens": 8},
+            }
+        )
+        self.search_documents: list[dict[str, Any]] = [
+            {
+                "id": f"chunk-{index}",
+                "chunk": f"Fragmentul {index} din regulamentul intern. " * 40,
+                "link": f"https://account.blob.core.windows.net/content/Regulament.pdf#page={index + 1}",
+                "real_title": "Regulament.pdf",
+                "category": None,
+                "@search.score": 0.03,
+                "@search.reranker_score": 3.0,
+                "@search.captions": None,
+            }
+            for index in range(settings.documents)
+        ]
+        self.retrieval = KnowledgeAgentRetrievalResponse(
+            response=[
+                KnowledgeAgentMessage(
+                    role="assistant",
+                    content=[KnowledgeAgentMessageTextContent(text=json.dumps(self.search_documents[:1]))],
+                )
+            ],
+            activity=[
+                KnowledgeAgentModelQueryPlanningActivityRecord(id=0, input_tokens=800, output_tokens=60, elapsed_ms=0),
+                KnowledgeAgentSearchActivityRecord(
+                    id=1,
+                    target_index="index",
+                    query=KnowledgeAgentSearchActivityRecordQuery(search="concediu de odihnă"),
+                    count=settings.documents,
+                    elapsed_ms=0,
+                ),
+            ],
+            references=[
+                KnowledgeAgentAzureSearchDocReference(
+                    id=str(index),
+                    activity_source=1,
+                    doc_key=document["id"],
+                    source_data={
+                        "chunk": document["chunk"],
+                        "link": document["link"],
+                        "real_title": document["real_title"],
+                        "page_number": str(index + 1),
+                    },
+                )
+                for index, document in enumerate(self.search_documents)
+            ],
+        )
+
+    def count(self, name: str) -> None:
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    async def stream_answer(self) -> AsyncIterator[ChatCompletionChunk]:
+        await asyncio.sleep(self.settings.openai_latency)
+        delay = 1 / self.settings.tokens_per_second if self.settings.tokens_per_second > 0 else 0
+        for chunk in self.answer_chunks:
+            yield chunk
+            await asyncio.sleep(delay)
+
+    async def create_chat_completion(self, *args, **kwargs):
+        self.count("chat_completions")
+        if kwargs.get("stream"):
+            return self.stream_answer()
+        await asyncio.sleep(self.settings.openai_latency)
+        if kwargs.get("tools"):
+            return self.search_query
+        if self.settings.tokens_per_second > 0:
+            await asyncio.sleep(self.settings.answer_tokens / self.settings.tokens_per_second)
+        return self.answer
+
+    async def create_embedding(self, *args, **kwargs) -> CreateEmbeddingResponse:
+        self.count("embeddings")
+        await asyncio.sleep(self.settings.embedding_latency)
+        return self.embedding
+
+    async def search(self, *args, **kwargs) -> "FakeSearchResults":
+        self.count("search")
+        await asyncio.sleep(self.settings.search_latency)
+        return FakeSearchResults(self.search_documents)
+
+    async def retrieve(self, *args, **kwargs) -> KnowledgeAgentRetrievalResponse:
+        self.count("agentic_retrieval")
+        await asyncio.sleep(self.settings.retrieval_latency)
+        return self.retrieval
+
+    def get_blob_client(self, *args, **kwargs) -> "FakeBlobClient":
+        return FakeBlobClient(self)
+
+    async def write_chat_log(self, *args, **kwargs) -> bool:
+        self.count("sql")
+        await asyncio.sleep(self.settings.sql_latency)
+        return True
+
+
+class FakeSearchResults:
+    def __init__(self, documents: list[dict[str, Any]]):
+        self.documents = documents
+
+    async def pages(self) -> AsyncIterator[AsyncIterator[dict[str, Any]]]:
+        yield self.documents_page()
+
+    async def documents_page(self) -> AsyncIterator[dict[str, Any]]:
+        for document in self.documents:
+            yield document
+
+    def by_page(self) -> AsyncIterator[AsyncIterator[dict[str, Any]]]:
+        return self.pages()
+
+    def __aiter__(self) -> AsyncIterator[dict[str, Any]]:
+        return self.documents_page()
+
+    async def get_count(self) -> int:
+        return len(self.documents)
+
+
+class FakeBlobDownloader:
+    def __init__(self, content: bytes):
+        self.content = content
+        self.properties = BlobProperties(content_settings=ContentSettings(content_type="application/pdf"))
+
+    async def readinto(self, stream) -> int:
+        return stream.write(self.content)
+
+    async def readall(self) -> bytes:
+        return self.content
+
+
+class FakeBlobClient:
+    CONTENT = b"%PDF-1.4\n" + b"0" * 200_000
+
+    def __init__(self, services: FakeServices):
+        self.services = services
+
+    async def download_blob(self, *args, **kwargs) -> FakeBlobDownloader:
+        self.services.count("blob")
+        await asyncio.sleep(self.services.settings.blob_latency)
+        return FakeBlobDownloader(self.CONTENT)
+
+
+class FakeSQLLogger:
+    def __init__(self, services: FakeServices):
+        self.log_chat_start = self.log_chat_end = self.log_chat_end_with_tokens = services.write_chat_log
+        self.log_streaming_start = self.log_feedback = services.write_chat_log
+
+
+class FakeCredential:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    async def get_token(self, *scopes, **kwargs) -> AccessToken:
+        return AccessToken("benchmark-token", int(time.time()) + 3600)
+
+    async def close(self) -> None:
+        pass
+
+
+def benchmark_env() -> dict[str, str]:
+    env = {key: os.environ[key] for key in PASSTHROUGH_ENV if key in os.environ}
+    env.update(
+        {
+            "AZURE_STORAGE_ACCOUNT": "benchmark-storage-account",
+            "AZURE_STORAGE_CONTAINER": "benchmark-storage-container",
+            "AZURE_SEARCH_SERVICE": "benchmark-search-service",
+            "AZURE_SEARCH_INDEX": "benchmark-search-index",
+            "AZURE_SEARCH_AGENT": "benchmark-search-agent",
+            "USE_AGENTIC_RETRIEVAL": "true",
+            "OPENAI_HOST": "openai",
+            "OPENAI_API_KEY": "benchmark-key",
+            "AZURE_OPENAI_CHATGPT_MODEL": "gpt-4.1-mini",
+        }
+    )
+    return env
+
+
+@contextmanager
+def fake_azure_services(settings: FakeServiceSettings, env: Optional[dict[str, str]] = None) -> Iterator[FakeServices]:
+    """Patches the Azure and OpenAI SDKs with FakeServices, and sets the environment create_app() reads."""
+    services = FakeServices(settings)
+    with ExitStack() as stack:
+        stack.enter_context(mock.patch.dict(os.environ, {**benchmark_env(), **(env or {})}, clear=True))
+        stack.enter_context(mock.patch.object(app, "AzureDeveloperCliCredential", FakeCredential))
+        stack.enter_context(mock.patch.object(app, "ManagedIdentityCredential", FakeCredential))
+        stack.enter_context(mock.patch.object(AsyncCompletions, "create", services.create_chat_completion))
+        stack.enter_context(mock.patch.object(AsyncEmbeddings, "create", services.create_embedding))
+        stack.enter_context(mock.patch.object(SearchClient, "search", services.search))
+        stack.enter_context(mock.patch.object(KnowledgeAgentRetrievalClient, "retrieve", services.retrieve))
+        stack.enter_context(mock.patch.object(ContainerClient, "get_blob_client", services.get_blob_client))
+        stack.enter_context(mock.patch.object(chat_logger_module, "azure_sql_logger", FakeSQLLogger(services)))
+        # Agentic retrieval would otherwise sign blob links with a real storage account key
+        stack.enter_context(mock.patch.object(approach, "AZURE_STORAGE_CONNECTION", None))
+        yield services
+
+
+@dataclass
+class RequestTiming:
+    status: int = 0
+    latency: float = 0.0
+    first_byte: Optional[float] = None
+    first_token: Optional[float] = None
+    response_bytes: int = 0
+
+
+async def send_request(quart_app, method: str, path: str, body: Optional[dict] = None) -> RequestTiming:
+    """Calls the ASGI app directly, so the timings leave out any HTTP server and client."""
+    data = json.dumps(body).encode() if body is not None else b""
+    headers = Headers({"Content-Type": "application/json", "Content-Length": str(len(data))})
+    scope = make_test_scope("http", path, method, headers, b"", "http", "", "1.1", None)
+    timing = RequestTiming()
+    complete = asyncio.Event()
+    request_sent = False
+    streaming = False
+    # Lines of the NDJSON stream are only parsed until the first answer token arrives
+    pending_lines = b""
+    start = time.perf_counter()
+
+    async def receive() -> dict:
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": data, "more_body": False}
+        await complete.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: dict) -> None:
+        nonlocal pending_lines, streaming
+        if message["type"] == "http.response.start":
+            timing.status = message["status"]
+            streaming = (b"content-type", b"application/json-lines") in message["headers"]
+        elif message["type"] == "http.response.body":
+            chunk = message.get("body", b"")
+            if chunk:
+                now = time.perf_counter() - start
+                timing.response_bytes += len(chunk)
+                if timing.first_byte is None:
+                    timing.first_byte = now
+                if streaming and timing.first_token is None:
+                    *lines, pending_lines = (pending_lines + chunk).split(b"\n")
+                    for line in lines:
+                        if line.strip() and (json.loads(line).get("delta") or {}).get("content"):
+                            timing.first_token = now
+                            break
+            if not message.get("more_body", False):
+                timing.latency = time.perf_counter() - start
+                complete.set()
+
+    await quart_app(scope, receive, send)
+    return timing
+
+
+def make_workload(endpoint: str, index: int) -> tuple[str, str, Optional[dict]]:
+    if endpoint == "content":
+        return "GET", "/content/Regulament.pdf", None
+    question = QUESTIONS[index % len(QUESTIONS)]
+    overrides: dict[str, Any] = {"retrieval_mode": "hybrid", "top": 5}
+    if endpoint == "agentic":
+        overrides["use_agentic_retrieval"] = True
+    body = {"messages": [{"content": question, "role": "user"}], "context": {"overrides": overrides}}
+    return "POST", "/chat" if endpoint == "chat" else "/chat/stream", body
+
+
+def percentile(values: list[float], percent: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+async def monitor_loop_lag(samples: list[float], interval: float = 0.01) -> None:
+    """Records how much later than asked each sleep wakes up, which is the time the loop spent busy elsewhere."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - start - interval)
+
+
+@dataclass
+class PhaseResult:
+    endpoint: str
+    concurrency: int
+    requests: int
+    errors: int
+    duration_seconds: float
+    throughput: float
+    latency_p50: Optional[float]
+    latency_p95: Optional[float]
+    first_token_p50: Optional[float]
+    first_token_p95: Optional[float]
+    loop_lag_p99_ms: Optional[float]
+    loop_lag_max_ms: Optional[float]
+    cpu_ms_per_request: float
+    service_calls: dict[str, int] = field(default_factory=dict)
+
+
+async def run_phase(quart_app, services: FakeServices, endpoint: str, concurrency: int, requests: int) -> PhaseResult:
+    timings: list[RequestTiming] = []
+    lag_samples: list[float] = []
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index
+        while next_index < requests:
+            index = next_index
+            next_index += 1
+            timings.append(await send_request(quart_app, *make_workload(endpoint, index)))
+
+    services.calls.clear()
+    monitor = asyncio.create_task(monitor_loop_lag(lag_samples))
+    cpu_start, start = time.process_time(), time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duration, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+    monitor.cancel()
+
+    succeeded = [timing for timing in timings if timing.status == 200]
+    latencies = [timing.latency for timing in succeeded]
+    first_tokens = [timing.first_token for timing in succeeded if timing.first_token is not None]
+    return PhaseResult(
+        endpoint=endpoint,
+        concurrency=concurrency,
+        requests=len(timings),
+        errors=len(timings) - len(succeeded),
+        duration_seconds=duration,
+        throughput=len(timings) / duration,
+        latency_p50=percentile(latencies, 50),
+        latency_p95=percentile(latencies, 95),
+        first_token_p50=percentile(first_tokens, 50),
+        first_token_p95=percentile(first_tokens, 95),
+        loop_lag_p99_ms=(lag * 1000 if (lag := percentile(lag_samples, 99)) is not None else None),
+        loop_lag_max_ms=max(lag_samples) * 1000 if lag_samples else None,
+        cpu_ms_per_request=cpu * 1000 / max(len(timings), 1),
+        service_calls=dict(services.calls),
+    )
+
+
+async def run_benchmark(
+    settings: FakeServiceSettings,
+    endpoints: list[str],
+    concurrency_levels: list[int],
+    requests: int,
+    warmup: int = 5,
+    env: Optional[dict[str, str]] = None,
+) -> list[PhaseResult]:
+    results = []
+    with fake_azure_services(settings, env) as services:
+        quart_app = app.create_app()
+        async with quart_app.test_app():
+            for endpoint in endpoints:
+                # Warms up caches and lazy imports, so the first phase is not penalized
+                for index in range(warmup):
+                    await send_request(quart_app, *make_workload(endpoint, index))
+                for concurrency in concurrency_levels:
+                    results.append(await run_phase(quart_app, services, endpoint, concurrency, requests))
+    return results
+
+
+def format_seconds(value: Optional[float]) -> str:
+    return f"{value * 1000:.0f}" if value is not None else "-"
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the backend against in-process fakes of the Azure services")
+    parser.add_argument(
+        "--endpoints", nargs="+", default=["chat", "chat-stream"], choices=["chat", "chat-stream", "agentic", "content"]
+    )
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint and concurrency level")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--openai-latency-ms", type=float, default=300, help="Time to the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=100, help="0 streams as fast as possible")
+    parser.add_argument("--answer-tokens", type=int, default=150)
+    parser.add_argument("--embedding-latency-ms", type=float, default=50)
+    parser.add_argument("--search-latency-ms", type=float, default=100)
+    parser.add_argument("--retrieval-latency-ms", type=float, default=500)
+    parser.add_argument("--sql-latency-ms", type=float, default=20)
+    parser.add_argument("--documents", type=int, default=5, help="Search results per query")
+    parser.add_argument("--env", nargs="*", default=[], metavar="KEY=VALUE", help="Extra app settings")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    settings = FakeServiceSettings(
+        openai_latency=args.openai_latency_ms / 1000,
+        tokens_per_second=args.tokens_per_second,
+        answer_tokens=args.answer_tokens,
+        embedding_latency=args.embedding_latency_ms / 1000,
+        search_latency=args.search_latency_ms / 1000,
+        retrieval_latency=args.retrieval_latency_ms / 1000,
+        sql_latency=args.sql_latency_ms / 1000,
+        documents=args.documents,
+    )
+    env = dict(setting.split("=", 1) for setting in args.env)
+    results = asyncio.run(
+        run_benchmark(settings, args.endpoints, args.concurrency, args.requests, warmup=args.warmup, env=env)
+    )
+
+    print(
+        f"{'endpoint':>12} {'conc':>5} {'reqs':>5} {'errors':>6} {'req/s':>7} {'p50 ms':>7} {'p95 ms':>7} "
+        f"{'ttft p50':>9} {'ttft p95':>9} {'lag p99':>8} {'lag max':>8} {'cpu ms/req':>10}"
+    )
+    for result in results:
+        print(
+            f"{result.endpoint:>12} {result.concurrency:>5} {result.requests:>5} {result.errors:>6} "
+            f"{result.throughput:>7.1f} {format_seconds(result.latency_p50):>7} {format_seconds(result.latency_p95):>7} "
+            f"{format_seconds(result.first_token_p50):>9} {format_seconds(result.first_token_p95):>9} "
+            f"{result.loop_lag_p99_ms or 0:>8.1f} {result.loop_lag_max_ms or 0:>8.1f} {result.cpu_ms_per_request:>10.2f}"
+        )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "commit": git_commit(),
+                    "timestamp": int(time.time()),
+                    "settings": asdict(settings),
+                    "env": env,
+                    "results": [asdict(result) for result in results],
+                },
+                file,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
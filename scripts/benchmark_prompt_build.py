@@ -0,0 +1,72 @@
+"""
+Measures how long it takes to build the sources section of the answer prompt
+(link mapping plus get_sources_content) for a growing number of search results,
+comparing the current O(1) link ID lookup against the previous linear scan.
+
+Usage: python scripts/benchmark_prompt_build.py --sources 50 200 1000
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app", "backend"))
+
+from approaches.approach import Approach, Document  # noqa: E402
+
+
+def make_documents(count: int) -> list[Document]:
+    return [
+        Document(
+            id=str(index),
+            content=f"Conținutul documentului {index}. " * 20,
+            sourcepage=(
+                f"https://account.blob.core.windows.net/container/{index}.pdf"
+                f"?se=2025-08-28T12%3A57%3A58Z&sp=r&sv=2024-08-04&sr=b&sig=signature{index}%3D#page=1"
+            ),
+            sourcefile=f"document{index}.pdf",
+        )
+        for index in range(count)
+    ]
+
+
+def linear_sources_content(results: list[Document]) -> list[str]:
+    """The previous implementation: a dict of ID -> URL, scanned for every document."""
+    link_mapping = {}
+    for index, doc in enumerate((doc for doc in results if doc.sourcepage), start=1):
+        link_mapping[f"link{index}"] = doc.sourcepage
+
+    def format_source(doc: Document) -> str:
+        for short_id, long_link in link_mapping.items():
+            if long_link == doc.sourcepage:
+                return f"[{doc.sourcefile}]({short_id})"
+        return f"[{doc.sourcefile}]({doc.sourcepage})"
+
+    return [format_source(doc) + ": " + (doc.content or "").replace("\n", " ") for doc in results]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark prompt source formatting")
+    parser.add_argument("--sources", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    # get_sources_content only needs the instance for get_citation, which is not used when sourcefile is set
+    approach = Approach.__new__(Approach)
+
+    def current_sources_content(results: list[Document]) -> list[str]:
+        link_mapping = approach.create_link_mapping(results)
+        return approach.get_sources_content(results, False, False, link_mapping=link_mapping)
+
+    print(f"{'sources':>8} {'linear (ms)':>12} {'indexed (ms)':>13} {'speedup':>8}")
+    for count in args.sources:
+        results = make_documents(count)
+        assert linear_sources_content(results) == current_sources_content(results)
+        linear = timeit.timeit(lambda: linear_sources_content(results), number=args.repeat) / args.repeat
+        indexed = timeit.timeit(lambda: current_sources_content(results), number=args.repeat) / args.repeat
+        print(f"{count:>8} {linear * 1000:>12.3f} {indexed * 1000:>13.3f} {linear / indexed:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
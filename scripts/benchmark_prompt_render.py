@@ -0,0 +1,59 @@
+"""
+Measures how long it takes to render the query rewrite and answer prompts for a typical chat turn,
+comparing prompty.prepare (which rebuilds the Jinja template on every call) against the templates
+that PromptyManager compiles when the prompt is loaded.
+
+Usage: python scripts/benchmark_prompt_render.py --sources 10 --turns 10
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+import prompty
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app", "backend"))
+
+from approaches.promptmanager import PromptyManager  # noqa: E402
+
+
+def make_inputs(sources: int, turns: int) -> dict:
+    past_messages = []
+    for turn in range(turns):
+        past_messages.append({"role": "user", "content": f"Ce acoperă planul de sănătate pentru situația {turn}?"})
+        past_messages.append(
+            {"role": "assistant", "content": f"Planul acoperă situația {turn} [Plan.pdf](link1). " * 5}
+        )
+    return {
+        "include_follow_up_questions": True,
+        "past_messages": past_messages,
+        "user_query": "Și pentru ochelari?",
+        "text_sources": [
+            f"[document{i}.pdf](link{i}): " + f"Conținutul documentului {i}. " * 40 for i in range(sources)
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark prompt template rendering")
+    parser.add_argument("--sources", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=500)
+    args = parser.parse_args()
+
+    prompt_manager = PromptyManager()
+    data = make_inputs(args.sources, args.turns)
+
+    print(f"{'prompt':>32} {'prepare (ms)':>13} {'compiled (ms)':>14} {'speedup':>8}")
+    for name in ["chat_query_rewrite.prompty", "chat_answer_question.prompty"]:
+        prompt = prompt_manager.load_prompt(name)
+        loaded = prompt_manager.current.prompts[name].prompt
+        assert prompty.prepare(loaded, data) == prompt_manager.render_prompt(prompt, data)
+        prepare = timeit.timeit(lambda: prompty.prepare(loaded, data), number=args.repeat) / args.repeat
+        compiled = timeit.timeit(lambda: prompt_manager.render_prompt(prompt, data), number=args.repeat) / args.repeat
+        print(f"{name:>32} {prepare * 1000:>13.3f} {compiled * 1000:>14.3f} {prepare / compiled:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Measures how long the Teams bot takes to format answers of growing length (link ID replacement
+plus HTML cleanup), comparing the single-pass format_for_teams against the previous chain of re.sub calls.
+
+Usage: python scripts/benchmark_teams_formatting.py --paragraphs 5 50 500
+"""
+
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "teams_bot"))
+
+from teams_formatting import format_for_teams  # noqa: E402
+
+PARAGRAPH = (
+    "<p>Angajatul are dreptul la <strong>21 de zile</strong> de concediu de odihnă pe an<sup>**{n}**</sup>. "
+    "Cererea se depune cu <em>cel puțin 5 zile</em> înainte, conform [Regulament intern.pdf#page={n}](link{n}).<br>"
+    "Pentru situații speciale, consultați <b>managerul direct</b> și <i>departamentul HR</i><sup>**{n}; {m}**</sup>."
+    "</p>\n"
+)
+
+
+def make_answer(paragraphs: int) -> tuple[str, dict[str, str]]:
+    answer = "".join(PARAGRAPH.format(n=index + 1, m=index + 2) for index in range(paragraphs))
+    link_mapping = {
+        f"link{index + 1}": f"https://account.blob.core.windows.net/container/{index}.pdf?sig=signature{index}%3D"
+        for index in range(paragraphs)
+    }
+    return answer, link_mapping
+
+
+def chained_format(answer: str, link_mapping: dict[str, str]) -> str:
+    """The previous implementation: one re.sub call per rule, each compiling its pattern through the re cache."""
+    if link_mapping:
+        answer = re.sub(
+            r"\[([^\]]+)\]\((link\d+)\)",
+            lambda match: f"[{match.group(1)}]({link_mapping.get(match.group(2), match.group(2))})",
+            answer,
+        )
+    superscript_map = {
+        "0": "⁰", "1": "¹", "2": "²", "3": "³", "4": "⁴",
+        "5": "⁵", "6": "⁶", "7": "⁷", "8": "⁸", "9": "⁹",
+        "+": "⁺", "-": "⁻", "=": "⁼", "(": "⁽", ")": "⁾",
+        "/": "⸍", ";": ";", ",": ",", " ": " ",
+    }  # fmt: skip
+
+    def replace_superscript(match):
+        content = match.group(1).strip()
+        result = "".join(superscript_map.get(char, char) for char in content)
+        return f"**{result}**" if result else content
+
+    text = re.sub(r"<sup>(.*?)</sup>", replace_superscript, answer, flags=re.DOTALL)
+    text = re.sub(r"<strong>(.*?)</strong>", r"**\1**", text)
+    text = re.sub(r"<b>(.*?)</b>", r"**\1**", text)
+    text = re.sub(r"<em>(.*?)</em>", r"*\1*", text)
+    text = re.sub(r"<i>(.*?)</i>", r"*\1*", text)
+    text = re.sub(r"<br\s*/?>", "\n", text)
+    text = re.sub(r"</?p>", "\n", text)
+    return re.sub(r"<[^>]+>", "", text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Teams answer formatting")
+    parser.add_argument("--paragraphs", type=int, nargs="+", default=[5, 50, 500])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'paragraphs':>10} {'chars':>8} {'chained (ms)':>13} {'single pass (ms)':>17} {'speedup':>8}")
+    for count in args.paragraphs:
+        answer, link_mapping = make_answer(count)
+        assert chained_format(answer, link_mapping) == format_for_teams(answer, link_mapping)
+        chained = timeit.timeit(lambda: chained_format(answer, link_mapping), number=args.repeat) / args.repeat
+        single = timeit.timeit(lambda: format_for_teams(answer, link_mapping), number=args.repeat) / args.repeat
+        print(f"{count:>10} {len(answer):>8} {chained * 1000:>13.3f} {single * 1000:>17.3f} {chained / single:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,9 @@ import asyncio
 import json
 import logging
 import os
-from typing import Any, Union
+import tempfile
+import uuid
+from typing import Any, Optional, Union
 from urllib.parse import urljoin
 
 from azure.core.credentials import AzureKeyCredential
@@ -35,6 +37,7 @@ class ManageAcl:
         acl_type: str,
         acl: str,
         credentials: Union[AsyncTokenCredential, AzureKeyCredential],
+        path_auth_cache_generation_path: Optional[str] = None,
     ):
         """
         Initializes the command
@@ -55,6 +58,8 @@ class ManageAcl:
             The actual value of the acl, if the acl action is add or remove
         credentials
             Credentials for the azure search service
+        path_auth_cache_generation_path
+            File that the app's workers watch to clear their cached /content authorization decisions
         """
         self.service_name = service_name
         self.index_name = index_name
@@ -63,6 +68,7 @@ class ManageAcl:
         self.acl_action = acl_action
         self.acl_type = acl_type
         self.acl = acl
+        self.path_auth_cache_generation_path = path_auth_cache_generation_path
 
     async def run(self):
         endpoint = f"https://{self.service_name}.search.windows.net"
@@ -77,15 +83,31 @@ class ManageAcl:
                 await self.view_acl(search_client)
             elif self.acl_action == "remove":
                 await self.remove_acl(search_client)
+                self.invalidate_path_auth_cache()
             elif self.acl_action == "remove_all":
                 await self.remove_all_acls(search_client)
+                self.invalidate_path_auth_cache()
             elif self.acl_action == "add":
                 await self.add_acl(search_client)
+                self.invalidate_path_auth_cache()
             elif self.acl_action == "update_storage_urls":
                 await self.update_storage_urls(search_client)
             else:
                 raise Exception(f"Unknown action {self.acl_action}")
 
+    def invalidate_path_auth_cache(self):
+        """
+        Replaces the generation file of the app's path authorization cache, so the app workers on this machine
+        stop using decisions cached before the ACL change. Workers on other machines wait for the cache TTL.
+        """
+        if self.path_auth_cache_generation_path is None:
+            return
+        temporary_path = f"{self.path_auth_cache_generation_path}.{uuid.uuid4().hex}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            file.write(uuid.uuid4().hex)
+        os.replace(temporary_path, self.path_auth_cache_generation_path)
+        logger.info("Invalidated the path authorization cache through %s", self.path_auth_cache_generation_path)
+
     async def view_acl(self, search_client: SearchClient):
         for document in await self.get_documents(search_client):
             # Assumes the acls are consistent across all sections of the document
@@ -217,14 +239,18 @@ async def main(args: Any):
     if args.search_key is not None:
         search_credential = AzureKeyCredential(args.search_key)
 
+    index_name = os.environ["AZURE_SEARCH_INDEX"]
     command = ManageAcl(
         service_name=os.environ["AZURE_SEARCH_SERVICE"],
-        index_name=os.environ["AZURE_SEARCH_INDEX"],
+        index_name=index_name,
         url=args.url,
         acl_action=args.acl_action,
         acl_type=args.acl_type,
         acl=args.acl,
         credentials=search_credential,
+        # The same default as the app, for an app running on this machine
+        path_auth_cache_generation_path=os.getenv("PATH_AUTH_CACHE_GENERATION_PATH")
+        or os.path.join(tempfile.gettempdir(), f"path_auth_cache_{index_name}.generation"),
     )
     await command.run()
 
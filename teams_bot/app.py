@@ -10,6 +10,7 @@ from aiohttp.web import Request, Response
 from botbuilder.core import BotFrameworkAdapterSettings, BotFrameworkAdapter
 from botbuilder.core.integration import aiohttp_error_middleware
 from botbuilder.schema import Activity
+from backend_client import BackendClient
 from bot import TeamsBot
 
 # Load environment variables from .env file
@@ -28,6 +29,12 @@ APP_PASSWORD = os.environ.get("MICROSOFT_APP_PASSWORD", "")
 APP_TYPE = os.environ.get("MICROSOFT_APP_TYPE", "")  # Can be "UserAssignedMSI"
 APP_TENANTID = os.environ.get("MICROSOFT_APP_TENANTID", "")
 BACKEND_URL = os.environ.get("BACKEND_URL", "http://localhost:50505")
+# Requires USE_SERVER_SIDE_HISTORY=true on the backend
+BACKEND_SERVER_SIDE_HISTORY = os.environ.get("BACKEND_SERVER_SIDE_HISTORY", "").lower() == "true"
+BACKEND_POOL_SIZE = int(os.environ.get("BACKEND_POOL_SIZE", 100))
+BACKEND_CONNECT_TIMEOUT = float(os.environ.get("BACKEND_CONNECT_TIMEOUT", 10))
+BACKEND_READ_TIMEOUT = float(os.environ.get("BACKEND_READ_TIMEOUT", 120))
+STREAM_UPDATE_INTERVAL_SECONDS = float(os.environ.get("STREAM_UPDATE_INTERVAL_SECONDS", 1.0))
 PORT = int(os.environ.get("PORT", 8000))
 
 # Global adapter and bot instances (initialized in create_app)
@@ -91,7 +98,18 @@ def init_bot():
     adapter.on_turn_error = on_error
     
     # Create the bot
-    bot = TeamsBot(BACKEND_URL)
+    backend_client = BackendClient(
+        BACKEND_URL,
+        pool_size=BACKEND_POOL_SIZE,
+        connect_timeout=BACKEND_CONNECT_TIMEOUT,
+        read_timeout=BACKEND_READ_TIMEOUT,
+    )
+    bot = TeamsBot(
+        BACKEND_URL,
+        backend_client=backend_client,
+        server_side_history=BACKEND_SERVER_SIDE_HISTORY,
+        update_interval_seconds=STREAM_UPDATE_INTERVAL_SECONDS,
+    )
     
     ADAPTER = adapter
     BOT = bot
@@ -161,6 +179,12 @@ async def home(req: Request) -> Response:
     )
 
 
+async def close_backend_client(app: web.Application):
+    """Close the pooled connections to the backend when the app shuts down"""
+    if BOT is not None:
+        await BOT.backend_client.close()
+
+
 # Create and configure the app
 def create_app() -> web.Application:
     """
@@ -176,6 +200,7 @@ def create_app() -> web.Application:
     app.router.add_get("/", home)
     app.router.add_post("/api/messages", messages)
     app.router.add_get("/health", health_check)
+    app.on_cleanup.append(close_backend_client)
     return app
 
 
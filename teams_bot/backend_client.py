@@ -1,9 +1,13 @@
 """
 Client for communicating with the existing backend API
 """
-import aiohttp
+import asyncio
+import json
 import logging
-from typing import List, Dict, Any, Optional
+from collections.abc import AsyncGenerator
+from typing import Any, Optional
+
+import aiohttp
 
 logger = logging.getLogger(__name__)
 
@@ -11,17 +15,33 @@ logger = logging.getLogger(__name__)
 class BackendClient:
     """Client to interact with the backend chat API"""
 
-    def __init__(self, backend_url: str, api_key: Optional[str] = None):
+    def __init__(
+        self,
+        backend_url: str,
+        api_key: Optional[str] = None,
+        pool_size: int = 100,
+        connect_timeout: float = 10,
+        read_timeout: float = 120,
+        keepalive_timeout: float = 60,
+    ):
         """
         Initialize the backend client
         
         Args:
             backend_url: Base URL of the backend API
             api_key: Optional API key for authentication
+            pool_size: Maximum number of open connections to the backend
+            connect_timeout: Seconds to wait for a connection, including waiting for a free one in the pool
+            read_timeout: Seconds to wait for the next bytes of a response, such as the next streamed chunk
+            keepalive_timeout: Seconds an idle connection is kept open for the next request
         """
         self.backend_url = backend_url.rstrip('/')
         self.api_key = api_key
-        self.session = None
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        # No total timeout, since a streamed answer takes as long as the model keeps writing
+        self.timeout = aiohttp.ClientTimeout(total=None, connect=connect_timeout, sock_read=read_timeout)
+        self.session: Optional[aiohttp.ClientSession] = None
 
     async def _get_session(self) -> aiohttp.ClientSession:
         """Get or create aiohttp session"""
@@ -29,52 +49,84 @@ class BackendClient:
             headers = {}
             if self.api_key:
                 headers["Authorization"] = f"Bearer {self.api_key}"
-            self.session = aiohttp.ClientSession(headers=headers)
+            # Every request goes to the same backend, so the whole pool can be used for that host
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300,
+            )
+            self.session = aiohttp.ClientSession(headers=headers, connector=connector, timeout=self.timeout)
         return self.session
 
-    async def chat(
-        self, 
-        message: str, 
-        history: List[Dict[str, str]] = None,
-        context: Dict[str, Any] = None
-    ) -> Dict[str, Any]:
+    @staticmethod
+    def _build_payload(
+        message: str,
+        history: Optional[list[dict[str, str]]],
+        context: Optional[dict[str, Any]],
+        session_state: Any = None,
+        server_side_history: bool = False,
+    ) -> dict[str, Any]:
         """
-        Send a chat message to the backend
+        Build the request payload matching the backend API format
         
         Args:
             message: User's message
-            history: Conversation history
+            history: Conversation history, not sent with server-side history
             context: Additional context and overrides
+            session_state: Session state returned by the backend for this conversation
+            server_side_history: Whether the backend keeps the history of the session
             
         Returns:
-            Response from backend API
+            Request payload
         """
-        if history is None:
-            history = []
         if context is None:
             context = {}
 
         # Format history for backend API
         messages = []
-        for exchange in history:
-            if "user" in exchange:
-                messages.append({"role": "user", "content": exchange["user"]})
-            if "assistant" in exchange:
-                messages.append({"role": "assistant", "content": exchange["assistant"]})
+        if not server_side_history:
+            for exchange in history or []:
+                if "user" in exchange:
+                    messages.append({"role": "user", "content": exchange["user"]})
+                if "assistant" in exchange:
+                    messages.append({"role": "assistant", "content": exchange["assistant"]})
         
         # Add current message
         messages.append({"role": "user", "content": message})
 
-        # Prepare request payload matching the backend API format
-        payload = {
+        request_context = dict(context.get("context", {}))
+        payload: dict[str, Any] = {
             "messages": messages,
-            "context": context.get("context", {}),
-            "session_state": context.get("session_state"),
+            "context": request_context,
+            "session_state": session_state if session_state is not None else context.get("session_state"),
         }
+        if server_side_history:
+            payload["server_side_history"] = True
 
         # Add overrides if provided
         if "overrides" in context:
-            payload["context"]["overrides"] = context["overrides"]
+            request_context["overrides"] = context["overrides"]
+        return payload
+
+    async def chat(
+        self, 
+        message: str, 
+        history: Optional[list[dict[str, str]]] = None,
+        context: Optional[dict[str, Any]] = None
+    ) -> dict[str, Any]:
+        """
+        Send a chat message to the backend
+        
+        Args:
+            message: User's message
+            history: Conversation history
+            context: Additional context and overrides
+            
+        Returns:
+            Response from backend API
+        """
+        payload = self._build_payload(message, history, context)
 
         try:
             session = await self._get_session()
@@ -86,18 +138,79 @@ class BackendClient:
                 response.raise_for_status()
                 data = await response.json()
                 
-                logger.info(f"Received response from backend")
+                logger.info("Received response from backend")
                 return data
 
-        except aiohttp.ClientError as e:
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             logger.error(f"Error calling backend API: {e}")
             raise Exception(f"Failed to communicate with backend: {str(e)}")
 
+    async def chat_stream(
+        self,
+        message: str,
+        history: Optional[list[dict[str, str]]] = None,
+        context: Optional[dict[str, Any]] = None,
+        session_state: Any = None,
+        server_side_history: bool = False,
+    ) -> AsyncGenerator[dict[str, Any], None]:
+        """
+        Send a chat message to the streaming endpoint and yield each NDJSON event as it arrives
+        
+        Args:
+            message: User's message
+            history: Conversation history, ignored with server-side history
+            context: Additional context and overrides
+            session_state: Session state returned by the backend for this conversation
+            server_side_history: Send only the new message and let the backend prepend the session's history
+            
+        Yields:
+            Events such as {"delta": {"content": "..."}} and the first event with "context" and "session_state"
+        """
+        payload = self._build_payload(message, history, context, session_state, server_side_history)
+
+        try:
+            session = await self._get_session()
+            url = f"{self.backend_url}/chat/stream"
+            
+            logger.info(f"Sending stream request to {url}")
+            
+            async with session.post(url, json=payload) as response:
+                response.raise_for_status()
+                # Split on newlines ourselves: the first event carries the thoughts and can be
+                # longer than the line limit of aiohttp's readline
+                buffer = b""
+                async for data in response.content.iter_any():
+                    buffer += data
+                    if b"\n" not in data:
+                        continue
+                    *lines, buffer = buffer.split(b"\n")
+                    for line in lines:
+                        if event := self._parse_event(line):
+                            yield event
+                if event := self._parse_event(buffer):
+                    yield event
+
+                logger.info("Received streamed response from backend")
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Error calling backend API: {e}")
+            raise Exception(f"Failed to communicate with backend: {str(e)}")
+
+    @staticmethod
+    def _parse_event(line: bytes) -> Optional[dict[str, Any]]:
+        """Parse one NDJSON line, raising if the backend reported an error in the stream"""
+        if not line.strip():
+            return None
+        event = json.loads(line)
+        if "error" in event:
+            raise Exception(f"Backend error: {event['error']}")
+        return event
+
     async def ask(
         self,
         question: str,
-        context: Dict[str, Any] = None
-    ) -> Dict[str, Any]:
+        context: Optional[dict[str, Any]] = None
+    ) -> dict[str, Any]:
         """
         Send a single question to the backend (Q&A mode)
         
@@ -130,10 +243,10 @@ class BackendClient:
                 response.raise_for_status()
                 data = await response.json()
                 
-                logger.info(f"Received response from backend")
+                logger.info("Received response from backend")
                 return data
 
-        except aiohttp.ClientError as e:
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             logger.error(f"Error calling backend API: {e}")
             raise Exception(f"Failed to communicate with backend: {str(e)}")
 
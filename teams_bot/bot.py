@@ -3,28 +3,92 @@ Microsoft Teams Bot for Azure Search OpenAI Demo
 This bot acts as a Teams frontend for the existing backend API
 """
 import os
+import time
 import logging
-from typing import List
+from typing import List, Optional
 from botbuilder.core import ActivityHandler, TurnContext, MessageFactory
 from botbuilder.schema import ChannelAccount, Activity, ActivityTypes
 from backend_client import BackendClient
+from teams_formatting import format_for_teams
 
 logger = logging.getLogger(__name__)
 
 
+class ProgressiveReply:
+    """Sends the answer as one Teams message and updates it while the answer streams in"""
+
+    def __init__(self, turn_context: TurnContext, update_interval_seconds: float):
+        """
+        Args:
+            turn_context: Context object for the current turn
+            update_interval_seconds: Minimum time between two updates, to stay under the Teams rate limits
+        """
+        self.turn_context = turn_context
+        self.update_interval_seconds = update_interval_seconds
+        self.activity_id = None
+        self.last_update = 0.0
+        self.last_text = ""
+        # Turned off when the channel can't send or update messages, such as when testing locally
+        self.enabled = update_interval_seconds > 0
+
+    def is_due(self) -> bool:
+        """Whether an update would be sent now, so callers can skip formatting text that would be dropped"""
+        return self.enabled and time.monotonic() - self.last_update >= self.update_interval_seconds
+
+    async def update(self, text: str):
+        """Show the partial answer, unless the previous update was too recent"""
+        if not self.is_due():
+            return
+        try:
+            await self._send(text)
+        except Exception as send_error:
+            logger.warning(f"Could not update the message, sending only the final answer: {send_error}")
+            self.enabled = False
+
+    async def finish(self, text: str):
+        """Show the final answer, updating the message if one was already sent"""
+        if text != self.last_text:
+            await self._send(text)
+
+    async def _send(self, text: str):
+        if self.activity_id is None:
+            response = await self.turn_context.send_activity(text)
+            self.activity_id = response.id if response else None
+        else:
+            activity = MessageFactory.text(text)
+            activity.id = self.activity_id
+            await self.turn_context.update_activity(activity)
+        self.last_update = time.monotonic()
+        self.last_text = text
+
+
 class TeamsBot(ActivityHandler):
     """Teams Bot that integrates with the existing backend API"""
 
-    def __init__(self, backend_url: str):
+    def __init__(
+        self,
+        backend_url: str,
+        backend_client: Optional[BackendClient] = None,
+        server_side_history: bool = False,
+        update_interval_seconds: float = 1.0,
+    ):
         """
         Initialize the Teams bot
         
         Args:
             backend_url: URL of the backend API (e.g., the deployed Azure Container App)
+            backend_client: Client to use instead of a default one for backend_url
+            server_side_history: Let the backend keep the conversation history (requires USE_SERVER_SIDE_HISTORY
+                on the backend), so each message sends only the new question
+            update_interval_seconds: Minimum time between updates of a streaming answer, 0 sends only the final answer
         """
-        self.backend_client = BackendClient(backend_url)
+        self.backend_client = backend_client or BackendClient(backend_url)
+        self.server_side_history = server_side_history
+        self.update_interval_seconds = update_interval_seconds
         # Store conversation history per user
         self.conversation_history = {}
+        # Backend session state per conversation, which identifies the history kept by the backend
+        self.conversation_sessions = {}
 
     async def on_message_activity(self, turn_context: TurnContext):
         """
@@ -49,10 +113,16 @@ class TeamsBot(ActivityHandler):
             # Get conversation history for this user
             history = self.conversation_history.get(conversation_id, [])
 
+            reply = ProgressiveReply(turn_context, self.update_interval_seconds)
+            answer_parts = []
+            context_data = {}
+
             # Call backend chat API with exact same defaults as frontend (Chat.tsx)
-            response = await self.backend_client.chat(
+            events = self.backend_client.chat_stream(
                 message=user_message,
                 history=history,
+                session_state=self.conversation_sessions.get(conversation_id),
+                server_side_history=self.server_side_history,
                 context={
                     "overrides": {
                         # Core search parameters
@@ -94,19 +164,32 @@ class TeamsBot(ActivityHandler):
                     }
                 }
             )
+            async for event in events:
+                # The first event has the context with the link mapping, later ones add followup questions
+                if isinstance(event.get("context"), dict):
+                    context_data.update(event["context"])
+                if self.server_side_history and event.get("session_state"):
+                    self.conversation_sessions[conversation_id] = event["session_state"]
+                content = (event.get("delta") or {}).get("content")
+                if content:
+                    answer_parts.append(content)
+                    # Formatting joins the whole answer, so it only happens for the updates that are sent
+                    if reply.is_due():
+                        await reply.update(self._format_streamed_response(answer_parts, context_data))
 
             # Update conversation history
-            answer_text = response.get("message", {}).get("content", "")
-            history.append({"user": user_message, "assistant": answer_text})
-            self.conversation_history[conversation_id] = history[-10:]  # Keep last 10 exchanges
+            answer_text = "".join(answer_parts)
+            if not self.server_side_history:
+                history.append({"user": user_message, "assistant": answer_text})
+                self.conversation_history[conversation_id] = history[-10:]  # Keep last 10 exchanges
 
             # Format response with citations
-            reply_text = self._format_response(response)
+            reply_text = self._format_streamed_response(answer_parts, context_data)
 
             # Send response back to Teams
             # For local testing, wrap in try-catch since Connector might not be available
             try:
-                await turn_context.send_activity(reply_text)
+                await reply.finish(reply_text)
             except Exception as send_error:
                 logger.warning(f"Could not send via Connector (normal for local testing): {send_error}")
                 # Store response for retrieval (local testing workaround)
@@ -157,6 +240,7 @@ class TeamsBot(ActivityHandler):
         conversation_id = turn_context.activity.conversation.id
         if conversation_id in self.conversation_history:
             del self.conversation_history[conversation_id]
+        self.conversation_sessions.pop(conversation_id, None)
         
         return await super().on_conversation_update_activity(turn_context)
 
@@ -171,45 +255,21 @@ class TeamsBot(ActivityHandler):
         Returns:
             Cleaned text for Teams
         """
-        import re
-        
-        # Map pentru caractere superscript Unicode (originale)
-        superscript_map = {
-            '0': '⁰', '1': '¹', '2': '²', '3': '³', '4': '⁴',
-            '5': '⁵', '6': '⁶', '7': '⁷', '8': '⁸', '9': '⁹',
-            '+': '⁺', '-': '⁻', '=': '⁼', '(': '⁽', ')': '⁾',
-            '/': '⸍', ';': ';', ',': ',', ' ': ' '
-        }
-        
-        # Convertește <sup>X</sup> în caractere Unicode superscript cu bold
-        def replace_superscript(match):
-            content = match.group(1).strip()
-            result = ''
-            # Încearcă să convertești fiecare caracter
-            for char in content:
-                if char in superscript_map:
-                    result += superscript_map[char]
-                else:
-                    # Pentru caractere ne-suportate, folosește original
-                    result += char
-            # Întoarce cu bold pentru a evidenția (face numerele să pară mai mari)
-            return f"**{result}**" if result else content
-        
-        # Replace <sup>...</sup> cu Unicode superscript
-        text = re.sub(r'<sup>(.*?)</sup>', replace_superscript, text, flags=re.DOTALL)
-        
-        # Curăță alte tag-uri HTML comune
-        text = re.sub(r'<strong>(.*?)</strong>', r'**\1**', text)
-        text = re.sub(r'<b>(.*?)</b>', r'**\1**', text)
-        text = re.sub(r'<em>(.*?)</em>', r'*\1*', text)
-        text = re.sub(r'<i>(.*?)</i>', r'*\1*', text)
-        text = re.sub(r'<br\s*/?>', '\n', text)
-        text = re.sub(r'</?p>', '\n', text)
-        
-        # Elimină orice alte tag-uri HTML rămase
-        text = re.sub(r'<[^>]+>', '', text)
+        return format_for_teams(text)
+
+    def _format_streamed_response(self, answer_parts: list[str], context_data: dict) -> str:
+        """
+        Format the answer streamed so far for Teams display
         
-        return text
+        Args:
+            answer_parts: Content deltas received from the backend
+            context_data: Context received from the backend
+            
+        Returns:
+            Formatted string for Teams
+        """
+        message = {"content": "".join(answer_parts)} if answer_parts else {}
+        return self._format_response({"message": message, "context": context_data})
 
     def _format_response(self, response: dict) -> str:
         """
@@ -229,19 +289,9 @@ class TeamsBot(ActivityHandler):
         context_data = response.get("context", {})
         link_mapping = context_data.get("link_mapping", {})
         
-        # Replace link IDs (link1, link2, etc.) with actual URLs
-        # This matches the frontend behavior in AnswerParser.tsx
-        if link_mapping:
-            import re
-            # Replace markdown links that use link IDs: [text](linkX) -> [text](actual_url)
-            answer = re.sub(
-                r'\[([^\]]+)\]\((link\d+)\)',
-                lambda match: f"[{match.group(1)}]({link_mapping.get(match.group(2), match.group(2))})",
-                answer
-            )
-        
-        # Clean HTML tags for Teams display
-        answer_clean = self._clean_html_for_teams(answer)
+        # Replace link IDs (link1, link2, etc.) with actual URLs, as the frontend does in AnswerParser.tsx,
+        # and clean HTML tags for Teams display, in one pass over the answer
+        answer_clean = format_for_teams(answer, link_mapping)
         
         # Get thoughts from context
         thoughts = context_data.get("thoughts", [])
@@ -282,6 +332,7 @@ class TeamsBot(ActivityHandler):
         Args:
             conversation_id: ID of the conversation to clear
         """
+        self.conversation_sessions.pop(conversation_id, None)
         if conversation_id in self.conversation_history:
             del self.conversation_history[conversation_id]
             logger.info(f"Cleared conversation history for {conversation_id}")
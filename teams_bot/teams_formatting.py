@@ -0,0 +1,128 @@
+"""
+Formatting of backend answers for Teams display
+"""
+
+import re
+from typing import Optional
+
+# Unicode superscript characters for the characters citations use
+SUPERSCRIPT_TABLE = str.maketrans(
+    {
+        "0": "⁰",
+        "1": "¹",
+        "2": "²",
+        "3": "³",
+        "4": "⁴",
+        "5": "⁵",
+        "6": "⁶",
+        "7": "⁷",
+        "8": "⁸",
+        "9": "⁹",
+        "+": "⁺",
+        "-": "⁻",
+        "=": "⁼",
+        "(": "⁽",
+        ")": "⁾",
+        "/": "⸍",
+    }
+)
+
+# Compiled once: splitting on tags gives text and tag names in alternation, [text, tag, text, ..., text].
+# A tag starts with a letter and holds no "<", so text such as "1<2" or "a < b" is kept as text.
+TAG_PATTERN = re.compile(r"<(/?[A-Za-z][^<>]*)>")
+LINK_PATTERN = re.compile(r"\[([^\]]+)\]\((link\d+)\)")
+LINE_BREAK_PATTERN = re.compile(r"br\s*/?|/?p")
+LINE_BREAK_TAGS = {"br", "br/", "br /", "p", "/p"}
+
+# Tags converted to markdown when they have a closing tag, bold and italic ones on the same line
+PAIRED_TAGS = {"sup": "**", "strong": "**", "b": "**", "em": "*", "i": "*"}
+CLOSING_TAGS = {tag: "/" + tag for tag in PAIRED_TAGS}
+
+
+def format_for_teams(text: str, link_mapping: Optional[dict[str, str]] = None) -> str:
+    """
+    Convert the HTML the model writes to Teams markdown, and replace link IDs with their URLs
+
+    - [text](linkX) becomes [text](url) for the IDs in link_mapping, like AnswerParser.tsx does
+    - <sup>X</sup> becomes bold Unicode superscript, so citation numbers stand out
+    - <strong>, <b> become **bold**, <em>, <i> become *italic*
+    - <br> and <p> become line breaks, any other tag is removed
+
+    After the link IDs, which are only searched for when the answer has some, all tags are rewritten
+    in one pass over the answer instead of one regular expression pass per tag.
+
+    Args:
+        text: Answer text from the backend
+        link_mapping: Link IDs to URLs, from the context of the response
+
+    Returns:
+        Text for Teams
+    """
+    if link_mapping and "](link" in text:
+        text = LINK_PATTERN.sub(
+            lambda match: f"[{match.group(1)}]({link_mapping.get(match.group(2), match.group(2))})", text
+        )
+    # Most streamed partial answers have no tags yet
+    if "<" not in text:
+        return text
+    tokens = TAG_PATTERN.split(text)
+    return _format_tokens(tokens, 0, len(tokens))
+
+
+def _find_closing_tag(tokens: list[str], tag: str, start: int, end: int) -> int:
+    """Index of the first closing tag for tag in tokens[start:end], or -1"""
+    closing_tag = CLOSING_TAGS[tag]
+    index = start
+    while True:
+        try:
+            index = tokens.index(closing_tag, index, end)
+        except ValueError:
+            return -1
+        # Tags are at odd indexes, text that happens to read "/b" is not a tag
+        if index % 2:
+            return index
+        index += 1
+
+
+def _superscript(tokens: list[str]) -> str:
+    """Format the tokens between <sup> and </sup>, which may contain other tags"""
+    tokens = [token.translate(SUPERSCRIPT_TABLE) for token in tokens]
+    tokens[0] = tokens[0].lstrip()
+    tokens[-1] = tokens[-1].rstrip()
+    if len(tokens) == 1 and not tokens[0]:
+        return ""
+    return f"**{_format_tokens(tokens, 0, len(tokens))}**"
+
+
+def _format_tokens(tokens: list[str], start: int, end: int) -> str:
+    """Format tokens[start:end], which starts and ends with text"""
+    parts = [tokens[start]]
+    index = start + 1
+    while index < end:
+        tag = tokens[index]
+        marker = PAIRED_TAGS.get(tag)
+        if marker is not None:
+            # Most paired tags only wrap text, such as <b>text</b>
+            if index + 2 < end and tokens[index + 2] == CLOSING_TAGS[tag]:
+                inner = tokens[index + 1]
+                if tag == "sup":
+                    parts.append(_superscript([inner]))
+                    parts.append(tokens[index + 3])
+                    index += 4
+                    continue
+                if "\n" not in inner:
+                    parts.append(f"{marker}{inner}{marker}{tokens[index + 3]}")
+                    index += 4
+                    continue
+            closing = _find_closing_tag(tokens, tag, index + 1, end)
+            if closing != -1 and tag == "sup":
+                parts.append(_superscript(tokens[index + 1 : closing]))
+                index = closing
+            elif closing != -1 and not any("\n" in token for token in tokens[index + 1 : closing]):
+                parts.append(f"{marker}{_format_tokens(tokens, index + 1, closing)}{marker}")
+                index = closing
+        elif tag in LINE_BREAK_TAGS or LINE_BREAK_PATTERN.fullmatch(tag):
+            parts.append("\n")
+        parts.append(tokens[index + 1])
+        index += 2
+    return "".join(parts)
@@ -0,0 +1,193 @@
+import asyncio
+import time
+
+import pytest
+from azure.search.documents.aio import SearchClient
+
+from core.aclindex import (
+    AclIndex,
+    AclSet,
+    AclSnapshot,
+    collect_acl_entries,
+    write_snapshot,
+)
+from core.authentication import AuthenticationHelper
+
+from .mocks import MockAsyncPageIterator
+from .test_authenticationhelper import MockSearchIndex, create_search_client
+
+HR_GROUP = AclSet(groups=frozenset(["GROUP_HR"]))
+ENTRIES = {
+    "Benefit_Options.pdf": {AclSet(), HR_GROUP},
+    "Salaries.pdf": {HR_GROUP, AclSet(oids=frozenset(["OID_CFO"]))},
+    "Salaries.pdf#page=2": {HR_GROUP},
+    "Plan_ă.pdf": {AclSet(oids=frozenset(["OID_X"]))},
+}
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    path = str(tmp_path / "acl_index.bin")
+    write_snapshot(ENTRIES, path, created_at=time.time())
+    return path
+
+
+def test_snapshot_round_trip(snapshot_path):
+    snapshot = AclSnapshot(snapshot_path)
+    try:
+        assert snapshot.path_count == len(ENTRIES)
+        for path, acls in ENTRIES.items():
+            assert snapshot.lookup(path) == acls
+        assert snapshot.lookup("Unknown.pdf") is None
+        assert snapshot.lookup("") is None
+    finally:
+        snapshot.close()
+
+
+@pytest.mark.parametrize(
+    "path, auth_claims, enable_global_documents, expected",
+    [
+        ("Benefit_Options.pdf", {"oid": "OID_X", "groups": []}, True, True),
+        ("Benefit_Options.pdf", {"oid": "OID_X", "groups": []}, False, False),
+        ("Salaries.pdf", {"oid": "OID_X", "groups": ["GROUP_IT", "GROUP_HR"]}, False, True),
+        ("Salaries.pdf", {"oid": "OID_CFO"}, False, True),
+        ("Salaries.pdf", {"oid": "OID_X", "groups": ["GROUP_IT"]}, True, False),
+        ("Plan_ă.pdf", {}, True, False),
+        ("Unknown.pdf", {"oid": "OID_X"}, True, None),
+    ],
+)
+@pytest.mark.asyncio
+async def test_is_allowed(snapshot_path, path, auth_claims, enable_global_documents, expected):
+    acl_index = AclIndex(snapshot_path)
+    await acl_index.refresh(search_client=None)
+    try:
+        assert acl_index.is_allowed(path, auth_claims, enable_global_documents) is expected
+    finally:
+        acl_index.close()
+
+
+DOCUMENTS = [
+    {
+        "id": "1",
+        "sourcefile": "Benefit_Options.pdf",
+        "sourcepage": "Benefit_Options.pdf#page=1",
+        "oids": [],
+        "groups": [],
+    },
+    {"id": "2", "sourcefile": "Salaries.pdf", "sourcepage": "Salaries.pdf#page=1", "oids": [], "groups": ["GROUP_HR"]},
+    {"id": "3", "sourcefile": "Salaries.pdf", "sourcepage": "Salaries.pdf#page=2", "oids": ["OID_CFO"], "groups": []},
+]
+
+
+def mock_search_documents(monkeypatch) -> list[dict]:
+    """Mocks search queries of the documents ordered by id, and returns the keyword arguments of every query."""
+    queries = []
+
+    async def mock_search(self, *args, **kwargs):
+        queries.append(kwargs)
+        documents = DOCUMENTS
+        if kwargs.get("filter"):
+            last_id = kwargs["filter"].removeprefix("id gt '").removesuffix("'")
+            documents = [document for document in DOCUMENTS if document["id"] > last_id]
+        return MockAsyncPageIterator(data=documents[: kwargs["top"]])
+
+    monkeypatch.setattr(SearchClient, "search", mock_search)
+    return queries
+
+
+@pytest.mark.asyncio
+async def test_collect_acl_entries_pages_by_id(monkeypatch):
+    queries = mock_search_documents(monkeypatch)
+    entries = await collect_acl_entries(create_search_client(), page_size=2)
+    assert [query["filter"] for query in queries] == [None, "id gt '2'"]
+    assert all(query["order_by"] == ["id asc"] for query in queries)
+    assert entries["Salaries.pdf"] == {HR_GROUP, AclSet(oids=frozenset(["OID_CFO"]))}
+    assert entries["Salaries.pdf#page=2"] == {AclSet(oids=frozenset(["OID_CFO"]))}
+    assert len(entries) == 5
+
+
+@pytest.mark.asyncio
+async def test_refresh_builds_snapshot_once_and_loads_it_in_other_workers(tmp_path, monkeypatch):
+    queries = mock_search_documents(monkeypatch)
+    snapshot_path = str(tmp_path / "acl_index.bin")
+    # Workers starting together wait for the one building the snapshot, and load it instead of querying the index
+    other_indexes = [AclIndex(snapshot_path) for _ in range(3)]
+    await asyncio.gather(*(index.refresh(create_search_client()) for index in other_indexes))
+    assert len(queries) == 1
+    assert all(index.lookup("Benefit_Options.pdf") == {AclSet()} for index in other_indexes)
+    # A fresh snapshot is not rebuilt
+    await other_indexes[0].refresh(create_search_client())
+    assert len(queries) == 1
+
+    acl_index = AclIndex(snapshot_path)
+    acl_index.invalidate("Salaries.pdf#page=1")
+    await acl_index.refresh(create_search_client(), force=True)
+    assert len(queries) == 2
+    # Invalidated before the snapshot was read from the search index
+    assert acl_index.lookup("Salaries.pdf#page=1") == {HR_GROUP}
+
+    # A forced rebuild is loaded by the other workers on their next refresh
+    other_snapshot = other_indexes[0].snapshot
+    await other_indexes[0].refresh(create_search_client())
+    assert other_indexes[0].snapshot is not other_snapshot
+    assert other_indexes[0].snapshot.created_at == acl_index.snapshot.created_at
+
+    # A stale snapshot is rebuilt
+    stale_index = AclIndex(snapshot_path, max_age_seconds=-1)
+    await stale_index.refresh(create_search_client())
+    assert len(queries) == 3
+    for index in (acl_index, stale_index, *other_indexes):
+        index.close()
+
+
+@pytest.mark.asyncio
+async def test_changed_and_stale_entries_fall_back_to_search(snapshot_path):
+    acl_index = AclIndex(snapshot_path)
+    await acl_index.refresh(search_client=None)
+    assert acl_index.is_allowed("Salaries.pdf", {"oid": "OID_CFO"}, False) is True
+    # Uploads and deletions through the app change the ACLs of a path until the next snapshot
+    acl_index.invalidate("Salaries.pdf")
+    assert acl_index.is_allowed("Salaries.pdf", {"oid": "OID_CFO"}, False) is None
+    assert acl_index.is_allowed("Salaries.pdf#page=2", {"groups": ["GROUP_HR"]}, False) is True
+
+    # A snapshot that could not be refreshed for too long is no longer trusted
+    acl_index.max_age_seconds = -1
+    assert acl_index.is_allowed("Salaries.pdf#page=2", {"groups": ["GROUP_HR"]}, False) is None
+    assert acl_index.stats()["invalidated"] == 1
+    acl_index.close()
+
+
+@pytest.mark.asyncio
+async def test_check_path_auth_uses_acl_index(
+    snapshot_path, monkeypatch, mock_confidential_client_success, mock_validate_token_success
+):
+    acl_index = AclIndex(snapshot_path)
+    await acl_index.refresh(search_client=None)
+    auth_helper = AuthenticationHelper(
+        search_index=MockSearchIndex,
+        use_authentication=True,
+        server_app_id="SERVER_APP",
+        server_app_secret="SERVER_SECRET",
+        client_app_id="CLIENT_APP",
+        tenant_id="TENANT_ID",
+        require_access_control=True,
+        acl_index=acl_index,
+    )
+    searches = 0
+
+    async def mock_search(self, *args, **kwargs):
+        nonlocal searches
+        searches += 1
+        return MockAsyncPageIterator(data=[{"sourcefile": "New.pdf"}])
+
+    monkeypatch.setattr(SearchClient, "search", mock_search)
+    search_client = create_search_client()
+    auth_claims = {"oid": "OID_X", "groups": ["GROUP_HR"]}
+
+    assert await auth_helper.check_path_auth("Salaries.pdf#page=3", auth_claims, search_client) is True
+    assert await auth_helper.check_path_auth("Plan_ă.pdf", {"oid": "OID_Y", "groups": []}, search_client) is False
+    assert searches == 0
+    assert await auth_helper.check_path_auth("New.pdf", auth_claims, search_client) is True
+    assert searches == 1
+    assert acl_index.stats()["hit_rate"] == round(2 / 3, 3)
+    acl_index.close()
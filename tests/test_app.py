@@ -1,3 +1,4 @@
+import asyncio
 import json
 import os
 from unittest import mock
@@ -1100,4 +1101,67 @@ async def test_format_as_ndjson():
         yield {"b": "Newlines inside \n strings are fine"}
 
     result = [line async for line in app.format_as_ndjson(gen())]
-    assert result == ['{"a": "I ❤️ 🐍"}\n', '{"b": "Newlines inside \\n strings are fine"}\n']
+    assert result == ['{"a":"I ❤️ 🐍"}\n'.encode(), b'{"b":"Newlines inside \\n strings are fine"}\n']
+
+
+@pytest.mark.asyncio
+async def test_reload_prompts(client):
+    response = await client.post("/admin/prompts/reload")
+    assert response.status_code == 403
+
+    client.app.config[app.CONFIG_DEVELOPER_FEATURES_ENABLED] = True
+    response = await client.post("/admin/prompts/reload")
+    assert response.status_code == 200
+    result = await response.get_json()
+    assert result == {"version": 1, "changed_files": []}
+    assert client.app.config[app.CONFIG_PROMPT_MANAGER].current.number == 1
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_abandoned_records_server_side_history(client, monkeypatch):
+    conversation_store = app.ConversationStore(max_sessions=10, ttl_seconds=60, max_history_tokens=1000)
+    client.app.config[app.CONFIG_CONVERSATION_STORE] = conversation_store
+    question = {"content": "What is the capital of France?", "role": "user"}
+
+    async def stalled_stream():
+        yield {"delta": {"role": "assistant", "content": "The capital"}}
+        # The client drops the connection while the rest of the answer is generated
+        await asyncio.sleep(60)
+        yield {"delta": {"role": "assistant", "content": " of France is Paris."}}
+
+    async def mock_run_stream(*args, **kwargs):
+        return stalled_stream()
+
+    monkeypatch.setattr(client.app.config[app.CONFIG_CHAT_APPROACH], "run_stream", mock_run_stream)
+
+    async with client.request("/chat/stream", method="POST", headers={"Content-Type": "application/json"}) as conn:
+        await conn.send(
+            json.dumps(
+                {
+                    "messages": [question],
+                    "context": {"overrides": {"retrieval_mode": "text"}},
+                    "session_state": "abandoned-session",
+                    "server_side_history": True,
+                }
+            ).encode()
+        )
+        await conn.send_complete()
+        while b"The capital" not in await conn.receive():
+            pass
+        await conn.disconnect()
+
+    conversation = await conversation_store.get(app.ConversationStore.make_key(None, "abandoned-session"))
+    assert conversation.to_list() == [question, {"role": "assistant", "content": "The capital"}]
+
+
+@pytest.mark.asyncio
+async def test_chat_invalid_max_input_tokens(client):
+    response = await client.post(
+        "/chat",
+        json={
+            "messages": [{"content": "What is the capital of France?", "role": "user"}],
+            "context": {"overrides": {"retrieval_mode": "text", "max_input_tokens": -1}},
+        },
+    )
+    assert response.status_code == 400
+    assert await response.get_json() == {"error": "max_input_tokens must be a positive integer"}
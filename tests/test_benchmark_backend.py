@@ -0,0 +1,47 @@
+import logging
+
+import pytest
+
+from benchmark_backend import FakeServiceSettings, run_benchmark
+
+INSTANT_SERVICES = FakeServiceSettings(
+    openai_latency=0,
+    tokens_per_second=0,
+    answer_tokens=20,
+    embedding_latency=0,
+    search_latency=0,
+    retrieval_latency=0,
+    blob_latency=0,
+    sql_latency=0,
+)
+
+
+@pytest.mark.asyncio
+async def test_run_benchmark(caplog):
+    with caplog.at_level(logging.ERROR):
+        results = await run_benchmark(
+            INSTANT_SERVICES, ["chat", "chat-stream", "agentic", "content"], [1, 3], requests=6, warmup=1
+        )
+
+    assert [(result.endpoint, result.concurrency) for result in results] == [
+        ("chat", 1),
+        ("chat", 3),
+        ("chat-stream", 1),
+        ("chat-stream", 3),
+        ("agentic", 1),
+        ("agentic", 3),
+        ("content", 1),
+        ("content", 3),
+    ]
+    for result in results:
+        assert result.requests == 6
+        assert result.errors == 0
+        assert result.cpu_ms_per_request > 0
+    streamed = [result for result in results if result.endpoint in ("chat-stream", "agentic")]
+    assert all(result.first_token_p50 is not None for result in streamed)
+    assert results[0].service_calls["search"] == 6
+    assert results[4].service_calls["agentic_retrieval"] == 6
+    assert "search" not in results[4].service_calls
+    assert results[6].service_calls == {"blob": 6}
+    # Streamed responses finish outside the request context, which must not log errors
+    assert not [record for record in caplog.records if record.levelno >= logging.ERROR]
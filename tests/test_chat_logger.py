@@ -0,0 +1,62 @@
+import asyncio
+import json
+import sys
+from datetime import datetime
+
+import pytest
+
+from approaches.approach import DataPoints, ExtraInfo, ThoughtStep, TokenUsageProps
+from chat_logging.chat_logger import ChatLogger
+
+
+class RecordingSQLLogger:
+    def __init__(self):
+        self.calls = []
+
+    async def log_chat_start(self, **kwargs):
+        await asyncio.sleep(0.01)
+        self.calls.append(("start", kwargs))
+
+    async def log_streaming_start(self, **kwargs):
+        self.calls.append(("streaming", kwargs))
+
+    async def log_chat_end_with_tokens(self, **kwargs):
+        self.calls.append(("end", kwargs))
+
+
+@pytest.mark.asyncio
+async def test_log_streamed_chat_writes_in_order(monkeypatch):
+    sql_logger = RecordingSQLLogger()
+    monkeypatch.setattr(sys.modules[ChatLogger.__module__], "azure_sql_logger", sql_logger)
+    chat_logger = ChatLogger(enable_logging=True)
+
+    extra_info = ExtraInfo(
+        DataPoints(text=["Benefit_Options-2.pdf: dental"]),
+        thoughts=[ThoughtStep("Prompt to generate answer", [{"role": "user", "content": "Dental?"}], {"model": "m"})],
+    )
+    extra_info.real_start_timestamp = datetime(2025, 1, 1, 12, 0, 0)
+    token_usage = TokenUsageProps(10, 5, None, 15)
+    extra_info.thoughts[-1].props["token_usage"] = token_usage
+
+    chat_logger.log_streamed_chat(
+        request_id="request-1",
+        question="Dental?",
+        user_id="user-1",
+        conversation_id="conversation-1",
+        extra_info=extra_info,
+        answer_parts=["Yes, ", "dental ", "is covered."],
+        model_used="gpt-4.1-mini",
+        timestamp_start_streaming=chat_logger.get_bucharest_time(),
+    )
+    assert sql_logger.calls == []
+
+    while chat_logger.pending_tasks:
+        await asyncio.sleep(0.01)
+
+    assert [name for name, _ in sql_logger.calls] == ["start", "streaming", "end"]
+    start, end = sql_logger.calls[0][1], sql_logger.calls[2][1]
+    assert start["prompt_total_token_usage"] == "15"
+    assert json.loads(start["extra_info_thoughts"])[0]["props"]["token_usage"]["total_tokens"] == 15
+    assert end["answer"] == "Yes, dental is covered."
+    # Serializing for the log leaves the thoughts sent to the client untouched
+    assert extra_info.thoughts[-1].props["token_usage"] is token_usage
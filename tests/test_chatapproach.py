@@ -1,13 +1,19 @@
+import asyncio
 import json
 
 import pytest
 from azure.core.credentials import AzureKeyCredential
 from azure.search.documents.agent.aio import KnowledgeAgentRetrievalClient
 from azure.search.documents.aio import SearchClient
-from openai.types.chat import ChatCompletion
+from azure.search.documents.models import VectorizedQuery
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
 
+from approaches.approach import DataPoints, Document, ExtraInfo
+from approaches.chatapproach import FollowupQuestionSplitter
 from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
 from approaches.promptmanager import PromptyManager
+from approaches.promptpacker import PromptPacker
+from approaches.queryrewritepolicy import QueryRewritePolicy
 
 from .mocks import (
     MOCK_EMBEDDING_DIMENSIONS,
@@ -161,6 +167,62 @@ def test_extract_followup_questions_no_pre_content(chat_approach):
     assert followup_questions == ["What is the dress code?"]
 
 
+@pytest.mark.parametrize(
+    "chunks",
+    [
+        ["The answer", " is yes. <<What about vision?>>", "<<And dental?>>"],
+        ["The answer is yes. <", "<What about vision?>><", "<And dental?>>"],
+        ["The answer", " is yes. ", "<", "<What about vision?>>", "<<And dental?>>"],
+    ],
+)
+def test_followup_question_splitter(chat_approach, chunks):
+    splitter = FollowupQuestionSplitter()
+    answer = "".join(splitter.feed(chunk) for chunk in chunks) + splitter.flush()
+    assert answer == "The answer is yes. "
+    assert chat_approach.extract_followup_questions(splitter.followup_content)[1] == [
+        "What about vision?",
+        "And dental?",
+    ]
+
+
+def test_followup_question_splitter_releases_single_angle_bracket():
+    splitter = FollowupQuestionSplitter()
+    assert splitter.feed("Deductible <") == "Deductible "
+    assert splitter.feed(" 500") == "< 500"
+    assert splitter.feed(" and <") == " and "
+    assert splitter.flush() == "<"
+    assert not splitter.started
+
+
+def make_chunk(content, role=None, choices=True):
+    return ChatCompletionChunk.model_validate(
+        {
+            "id": "test-123",
+            "object": "chat.completion.chunk",
+            "created": 1,
+            "model": "gpt-4.1-mini",
+            "choices": (
+                [{"index": 0, "delta": {"content": content, "role": role}, "finish_reason": None}] if choices else []
+            ),
+        }
+    )
+
+
+def test_process_stream_chunk(chat_approach):
+    assert chat_approach.process_stream_chunk(make_chunk(None, choices=False), None) is None
+    assert chat_approach.process_stream_chunk(make_chunk(None, role="assistant"), None) == {
+        "delta": {"content": None, "role": "assistant"}
+    }
+
+    splitter = FollowupQuestionSplitter()
+    assert chat_approach.process_stream_chunk(make_chunk("Yes. <"), splitter) == {
+        "delta": {"content": "Yes. ", "role": None}
+    }
+    assert chat_approach.process_stream_chunk(make_chunk("<Vision?>>"), splitter) is None
+    assert chat_approach.process_stream_chunk(make_chunk(None), splitter) is None
+    assert splitter.followup_content == "<<Vision?>>"
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize(
     "minimum_search_score,minimum_reranker_score,expected_result_count",
@@ -300,3 +362,146 @@ async def test_agent_retrieval_results(monkeypatch):
     assert results[0].content == "There is a whistleblower policy."
     assert results[0].sourcepage == "Benefit_Options-2.pdf"
     assert results[0].search_agent_query == "whistleblower query"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "rewritten_query, expected_outcome, expected_search_queries",
+    [
+        ("What is the whistleblower policy?", "reused", ["What is the whistleblower policy?"]),
+        ("what is the  whistleblower policy", "reused", ["What is the whistleblower policy?"]),
+        ("whistleblower policy", "discarded", ["What is the whistleblower policy?", "whistleblower policy"]),
+    ],
+)
+async def test_run_search_approach_speculative_retrieval(
+    chat_approach, monkeypatch, rewritten_query, expected_outcome, expected_search_queries
+):
+    searched_queries = []
+    completed_queries = []
+
+    async def mock_create_chat_completion(*args, **kwargs):
+        await asyncio.sleep(0.05)
+        return ChatCompletion(id="test", choices=[], created=0, model="gpt-4.1-mini", object="chat.completion")
+
+    async def mock_compute_text_embedding(q):
+        return VectorizedQuery(vector=[0.1, 0.2], k_nearest_neighbors=50, fields="embedding3")
+
+    async def mock_search_documents(top, query_text, *args, **kwargs):
+        searched_queries.append(query_text)
+        # A slow search in the discarded case makes sure the speculative call is still in flight when cancelled
+        await asyncio.sleep(0.02 if expected_outcome == "reused" else 0.1)
+        completed_queries.append(query_text)
+        return [Document(id=query_text, content="There is a whistleblower policy.", sourcepage="Benefit_Options-2.pdf")]
+
+    monkeypatch.setattr(chat_approach, "build_filter", lambda overrides, auth_claims: None)
+    monkeypatch.setattr(chat_approach, "create_chat_completion", mock_create_chat_completion)
+    monkeypatch.setattr(chat_approach, "get_search_query", lambda chat_completion, user_query: rewritten_query)
+    monkeypatch.setattr(chat_approach, "compute_text_embedding", mock_compute_text_embedding)
+    monkeypatch.setattr(chat_approach, "search", mock_search_documents)
+
+    extra_info = await chat_approach.run_search_approach(
+        messages=[{"role": "user", "content": "What is the whistleblower policy?"}],
+        overrides={"speculative_retrieval": True},
+        auth_claims={},
+    )
+
+    search_props = extra_info.thoughts[1].props
+    assert search_props["speculative_retrieval"] == expected_outcome
+    assert searched_queries == expected_search_queries
+    assert extra_info.thoughts[2].description[0]["id"] == expected_search_queries[-1]
+    if expected_outcome == "reused":
+        # The speculative search finished while the rewrite was still running
+        assert search_props["speculative_time_saved_ms"] > 0
+    else:
+        assert search_props["speculative_time_saved_ms"] == 0
+        assert completed_queries == [rewritten_query]
+
+
+@pytest.mark.asyncio
+async def test_run_search_approach_query_rewrite_policy(chat_approach, monkeypatch):
+    chat_approach.query_rewrite_policy = QueryRewritePolicy(skip_enabled=True, cache_size=10)
+    rewrite_calls = 0
+    searched_queries = []
+
+    async def mock_create_chat_completion(*args, **kwargs):
+        nonlocal rewrite_calls
+        rewrite_calls += 1
+        return ChatCompletion(id="test", choices=[], created=0, model="gpt-4.1-mini", object="chat.completion")
+
+    async def mock_search_documents(top, query_text, *args, **kwargs):
+        searched_queries.append(query_text)
+        return [Document(id="1", content="There is a whistleblower policy.", sourcepage="Benefit_Options-2.pdf")]
+
+    monkeypatch.setattr(chat_approach, "build_filter", lambda overrides, auth_claims: None)
+    monkeypatch.setattr(chat_approach, "create_chat_completion", mock_create_chat_completion)
+    monkeypatch.setattr(chat_approach, "get_search_query", lambda chat_completion, user_query: "dental coverage")
+    monkeypatch.setattr(chat_approach, "search", mock_search_documents)
+
+    first_turn = [{"role": "user", "content": "What is the whistleblower policy?"}]
+    follow_up = [
+        {"role": "user", "content": "Does my plan cover vision?"},
+        {"role": "assistant", "content": "Yes."},
+        {"role": "user", "content": "Does it cover dental?"},
+    ]
+    overrides = {"retrieval_mode": "text"}
+
+    skipped_info = await chat_approach.run_search_approach(first_turn, overrides, {})
+    executed_info = await chat_approach.run_search_approach(follow_up, overrides, {})
+    cached_info = await chat_approach.run_search_approach(follow_up, overrides, {})
+
+    assert rewrite_calls == 1
+    assert searched_queries == ["What is the whistleblower policy?", "dental coverage", "dental coverage"]
+    assert skipped_info.thoughts[0].props["query_rewrite"] == "skipped"
+    # No rewrite prompt is rendered unless the rewrite runs
+    assert skipped_info.thoughts[0].description == []
+    assert cached_info.thoughts[0].description == []
+    assert executed_info.thoughts[0].description != []
+    assert executed_info.thoughts[0].props["query_rewrite"] == "executed"
+    assert cached_info.thoughts[0].props["query_rewrite"] == "cached"
+    assert cached_info.thoughts[0].props["query_rewrite_counts"] == {"skipped": 1, "executed": 1, "cached": 1}
+
+
+def test_get_sources_content_uses_short_ids(chat_approach):
+    results = [
+        Document(id=str(i), content=f"content {i}", sourcepage=f"https://example.com/{i}.pdf", sourcefile=f"{i}.pdf")
+        for i in range(60)
+    ]
+    link_mapping = chat_approach.create_link_mapping(results)
+    sources = chat_approach.get_sources_content(results, False, False, link_mapping=link_mapping)
+    assert sources[0] == "[0.pdf](link1): content 0"
+    assert sources[59] == "[59.pdf](link60): content 59"
+    # A plain dict, as older callers pass, still works
+    assert chat_approach.get_sources_content(results[:1], False, False, link_mapping=dict(link_mapping)) == [
+        "[0.pdf](link1): content 0"
+    ]
+
+
+@pytest.mark.asyncio
+async def test_run_until_final_call_packs_prompt_inputs(chat_approach, monkeypatch):
+    chat_approach.prompt_packer = PromptPacker(max_input_tokens=100, reserved_tokens=0)
+    sources = [f"[{i}.pdf](link{i}): " + "Northwind Health Plus covers dental. " * 10 for i in range(1, 4)]
+
+    async def mock_run_search_approach(messages, overrides, auth_claims):
+        return ExtraInfo(DataPoints(text=list(sources)), thoughts=[])
+
+    async def mock_create_chat_completion(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(chat_approach, "run_search_approach", mock_run_search_approach)
+    monkeypatch.setattr(chat_approach, "create_chat_completion", mock_create_chat_completion)
+
+    messages = [
+        {"role": "user", "content": "What does my plan cover? " * 20},
+        {"role": "assistant", "content": "It covers medical, vision and dental. " * 20},
+        {"role": "user", "content": "Is dental included?"},
+    ]
+    extra_info, chat_coroutine = await chat_approach.run_until_final_call(messages, {}, {})
+    await chat_coroutine
+
+    prompt_messages = extra_info.thoughts[-1].description
+    assert [message["role"] for message in prompt_messages] == ["system", "user"]
+    assert extra_info.data_points.text == sources[:1]
+    budget = extra_info.thoughts[-1].props["prompt_budget"]
+    assert budget["dropped_messages"] == 2
+    assert budget["dropped_sources"] == 2
+    assert budget["tokens_saved"] == budget["tokens_before"] - budget["tokens_after"]
@@ -151,3 +151,49 @@ async def test_compute_text_embedding(chat_approach, openai_client, mock_openai_
     assert result.vector == [0.0023064255, -0.009327292, -0.0028842222]
     assert result.k_nearest_neighbors == 50
     assert result.fields == "embedding3"
+
+
+@pytest.mark.asyncio
+async def test_compute_image_embedding_cached_and_pooled(chat_approach, mock_azurehttp_calls):
+    token_requests = 0
+
+    async def vision_token_provider():
+        nonlocal token_requests
+        token_requests += 1
+        return "token"
+
+    chat_approach.vision_token_provider = vision_token_provider
+
+    first = await chat_approach.compute_image_embedding("test query")
+    session = chat_approach.vision_session
+    second = await chat_approach.compute_image_embedding("test query")
+
+    assert isinstance(first, VectorizedQuery)
+    assert first.fields == "imageEmbedding"
+    assert first.vector == second.vector
+    assert token_requests == 1
+    assert chat_approach.image_embedding_cache.hits == 1
+
+    await chat_approach.compute_image_embedding("another query")
+    assert chat_approach.vision_session is session
+    assert token_requests == 2
+
+    await chat_approach.close()
+    assert session.closed
+
+
+@pytest.mark.asyncio
+async def test_compute_multimodal_embeddings(chat_approach, openai_client, mock_openai_embedding, mock_azurehttp_calls):
+    mock_openai_embedding(openai_client)
+
+    async def vision_token_provider():
+        return "token"
+
+    chat_approach.vision_token_provider = vision_token_provider
+
+    vectors = await chat_approach.compute_multimodal_embeddings("test query", "textAndImageEmbeddings")
+    assert [vector.fields for vector in vectors] == ["embedding3", "imageEmbedding"]
+
+    vectors = await chat_approach.compute_multimodal_embeddings("test query", "imageEmbeddingOnly")
+    assert [vector.fields for vector in vectors] == ["imageEmbedding"]
+    await chat_approach.close()
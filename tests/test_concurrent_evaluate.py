@@ -0,0 +1,142 @@
+import json
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from citation_metrics import citations_matched
+from concurrent_evaluate import ConcurrentEvaluator, percentile, search_path, summarize
+
+TESTDATA = [
+    {"question": f"Question {index}?", "truth": f"Answer {index} [Benefit_Options.pdf#page={index}]"}
+    for index in range(6)
+]
+
+
+async def start_app(asked: list[str], failing: set[str], trailing_newline: bool = True) -> TestServer:
+    async def chat_stream(request: web.Request) -> web.StreamResponse:
+        question = (await request.json())["messages"][-1]["content"]
+        asked.append(question)
+        if question in failing:
+            return web.Response(status=500)
+        response = web.StreamResponse(headers={"Content-Type": "application/json-lines"})
+        await response.prepare(request)
+        number = question.split()[1].rstrip("?")
+        events = [
+            {"delta": {"role": "assistant"}, "context": {"data_points": {"text": ["Source 1", "Source 2"]}}},
+            {"delta": {"content": f"Answer {number} "}},
+            {"delta": {"content": f"[Benefit_Options.pdf#page={number}]"}},
+        ]
+        body = ("\n".join(json.dumps(event) for event in events) + ("\n" if trailing_newline else "")).encode()
+        for start in range(0, len(body), 20):
+            await response.write(body[start : start + 20])
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_post("/chat/stream", chat_stream)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+def make_evaluator(server: TestServer) -> ConcurrentEvaluator:
+    return ConcurrentEvaluator(
+        str(server.make_url("/chat")),
+        {"overrides": {"top": 3}},
+        answer_path="message.content",
+        context_path="context.data_points.text",
+        concurrency=3,
+    )
+
+
+@pytest.mark.asyncio
+async def test_run_resumes_from_checkpoint(tmp_path):
+    asked: list[str] = []
+    server = await start_app(asked, failing={"Question 2?", "Question 4?"})
+    try:
+        results, num_failed = await make_evaluator(server).run(TESTDATA, tmp_path)
+        assert num_failed == 2
+        assert [result["question"] for result in results] == [
+            "Question 0?",
+            "Question 1?",
+            "Question 3?",
+            "Question 5?",
+        ]
+        result = results[0]
+        assert result["answer"] == "Answer 0 [Benefit_Options.pdf#page=0]"
+        assert result["context"] == "Source 1\n\nSource 2"
+        assert result["citations_matched"] == 1.0
+        assert result["any_citation"] is True
+        assert 0 <= result["first_token_latency"] <= result["latency"]
+
+        asked.clear()
+        server2 = await start_app(asked, failing=set())
+        try:
+            results, num_failed = await make_evaluator(server2).run(TESTDATA, tmp_path)
+        finally:
+            await server2.close()
+    finally:
+        await server.close()
+
+    assert sorted(asked) == ["Question 2?", "Question 4?"]
+    assert num_failed == 0
+    assert [result["question"] for result in results] == [row["question"] for row in TESTDATA]
+    with open(tmp_path / "eval_results.jsonl", encoding="utf-8") as file:
+        assert [json.loads(line)["question"] for line in file] == [row["question"] for row in TESTDATA]
+
+
+@pytest.mark.asyncio
+async def test_stream_without_trailing_newline(tmp_path):
+    server = await start_app([], failing=set(), trailing_newline=False)
+    try:
+        results, num_failed = await make_evaluator(server).run(TESTDATA[:1], tmp_path)
+    finally:
+        await server.close()
+    assert num_failed == 0
+    assert results[0]["answer"] == "Answer 0 [Benefit_Options.pdf#page=0]"
+
+
+def test_citations_matched():
+    truth = "Yes [Benefit_Options.pdf#page=1][Benefit_Options.pdf#page=2]"
+    assert citations_matched("Yes [Benefit_Options.pdf#page=2]", truth) == 0.5
+    # Ground truths without citations are left out of the citation rate
+    assert citations_matched("Yes [Benefit_Options.pdf#page=2]", "Yes") == -1
+
+
+def test_percentile():
+    values = [float(value) for value in range(1, 101)]
+    assert percentile(values, 50) == pytest.approx(50.5)
+    assert percentile(values, 95) == pytest.approx(95.05)
+    assert percentile(values, 99) == pytest.approx(99.01)
+    assert percentile([3.0], 99) == 3.0
+
+
+def test_summarize():
+    results = [
+        {
+            "latency": 1.0,
+            "first_token_latency": 0.5,
+            "answer_length": 10,
+            "citations_matched": 1.0,
+            "any_citation": True,
+        },
+        {
+            "latency": 3.0,
+            "first_token_latency": -1,
+            "answer_length": 20,
+            "citations_matched": 0.0,
+            "any_citation": False,
+        },
+    ]
+    summary = summarize(results, num_failed=1)
+    assert summary["latency"] == {"mean": 2.0, "max": 3.0, "min": 1.0, "p50": 2.0, "p95": 2.9, "p99": 2.98}
+    assert summary["first_token_latency"]["p50"] == 0.5
+    assert summary["any_citation"] == {"total": 1, "rate": 0.5}
+    assert summary["num_questions"] == {"total": 2, "failed": 1}
+
+
+def test_search_path():
+    response = {"message": {"content": "Hi"}, "context": {"data_points": [{"text": "a"}, {"text": "b"}]}}
+    assert search_path(response, "message.content") == "Hi"
+    assert search_path(response, "context.data_points.text") == ["a", "b"]
+    assert search_path(response, "message.content.missing") is None
@@ -0,0 +1,109 @@
+import pytest
+
+from core.conversationstore import (
+    Conversation,
+    ConversationStore,
+    SQLiteConversationBacking,
+)
+from core.tokencounter import count_message_tokens
+
+
+def test_count_message_tokens():
+    assert count_message_tokens({"role": "user", "content": "hello world"}) == 6
+    vision_message = {
+        "role": "user",
+        "content": [
+            {"type": "text", "text": "hello world"},
+            {"type": "image_url", "image_url": {"url": "data:image/png;base64,AAAA"}},
+        ],
+    }
+    assert count_message_tokens(vision_message) == 6 + 85
+
+
+def test_conversation_truncate_keeps_whole_turns():
+    conversation = Conversation()
+    for i in range(3):
+        conversation.append({"role": "user", "content": f"question {i} " + "word " * 20})
+        conversation.append({"role": "assistant", "content": f"answer {i} " + "word " * 20})
+    conversation.append({"role": "user", "content": "latest question"})
+
+    budget = conversation.total_tokens - 1
+    conversation.truncate(budget)
+
+    messages = conversation.to_list()
+    assert messages[0]["content"].startswith("question 1")
+    assert messages[-1]["content"] == "latest question"
+    assert conversation.truncated_messages == 2
+    assert conversation.total_tokens == sum(count_message_tokens(message) for message in messages)
+
+
+@pytest.mark.asyncio
+async def test_conversation_store_appends_history():
+    store = ConversationStore(max_history_tokens=0)
+    key = ConversationStore.make_key("OID_X", "session-1")
+
+    first_turn = [{"role": "user", "content": "What is included in my plan?"}]
+    assert await store.build_messages(key, first_turn) == first_turn
+    await store.record_turn(key, first_turn, "Dental and vision.")
+
+    second_turn = [{"role": "user", "content": "Does it cover glasses?"}]
+    assert await store.build_messages(key, second_turn) == [
+        {"role": "user", "content": "What is included in my plan?"},
+        {"role": "assistant", "content": "Dental and vision."},
+        {"role": "user", "content": "Does it cover glasses?"},
+    ]
+    # Building the prompt does not change the stored history until the turn is recorded
+    assert len((await store.get(key)).messages) == 2
+
+    # Another user reusing the same session_state does not see the conversation
+    other_key = ConversationStore.make_key("OID_Y", "session-1")
+    assert await store.build_messages(other_key, second_turn) == second_turn
+
+
+@pytest.mark.asyncio
+async def test_conversation_store_sqlite_backing(tmp_path):
+    path = str(tmp_path / "conversations.db")
+    key = ConversationStore.make_key("OID_X", "session-1")
+    store = ConversationStore(backing=SQLiteConversationBacking(path))
+    await store.record_turn(key, [{"role": "user", "content": "Hi"}], "Hello!")
+    await store.close()
+
+    # A new process starts with an empty LRU and loads the conversation from the backing store
+    restarted_store = ConversationStore(backing=SQLiteConversationBacking(path))
+    messages = await restarted_store.build_messages(key, [{"role": "user", "content": "Again"}])
+    assert [message["content"] for message in messages] == ["Hi", "Hello!", "Again"]
+    await restarted_store.close()
+
+
+@pytest.mark.asyncio
+async def test_conversation_store_workers_share_sqlite_backing(tmp_path):
+    path = str(tmp_path / "conversations.db")
+    key = ConversationStore.make_key("OID_X", "session-1")
+    # Two worker processes, each with its own LRU
+    first_worker = ConversationStore(backing=SQLiteConversationBacking(path))
+    second_worker = ConversationStore(backing=SQLiteConversationBacking(path))
+    await first_worker.record_turn(key, [{"role": "user", "content": "Hi"}], "Hello!")
+    await second_worker.record_turn(key, [{"role": "user", "content": "Again"}], "Hello again!")
+    assert (await second_worker.get(key)).version == 2
+
+    # The first worker's cached history is outdated, so it is loaded again
+    messages = await first_worker.build_messages(key, [{"role": "user", "content": "Third"}])
+    assert [message["content"] for message in messages] == ["Hi", "Hello!", "Again", "Hello again!", "Third"]
+
+    # A turn recorded from an outdated history is added to the stored one instead of replacing it
+    outdated = await first_worker.get(key)
+    await second_worker.record_turn(key, [{"role": "user", "content": "Fourth"}], "Fourth answer")
+    assert first_worker.conversations.get(key) is outdated
+    conversation = await first_worker.record_turn(key, [{"role": "user", "content": "Fifth"}], "Fifth answer")
+    assert conversation.version == 4
+    assert [message["content"] for message in conversation.to_list()][-4:] == [
+        "Fourth",
+        "Fourth answer",
+        "Fifth",
+        "Fifth answer",
+    ]
+    # Saving over a version that is no longer stored fails, so a concurrent turn is never lost
+    assert await first_worker.backing.save(key, [], expected_version=3) is None
+    assert await first_worker.backing.save(key, [], expected_version=0) is None
+    await first_worker.close()
+    await second_worker.close()
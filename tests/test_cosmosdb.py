@@ -3,6 +3,9 @@ import json
 
 import pytest
 from azure.cosmos.aio import ContainerProxy
+from azure.cosmos.exceptions import CosmosBatchOperationError
+
+from chat_history.cosmosdb import compact_response, decompress_context
 
 from .mocks import MockAsyncPageIterator
 
@@ -132,6 +135,100 @@ async def test_chathistory_newitem(auth_public_documents_client, monkeypatch):
     assert response.status_code == 201
 
 
+@pytest.mark.asyncio
+async def test_chathistory_newitem_append(auth_public_documents_client, monkeypatch):
+
+    async def mock_execute_item_batch(container_proxy, **kwargs):
+        operations = kwargs["batch_operations"]
+        assert len(operations) == 2
+        assert operations[0] == (
+            "patch",
+            (
+                "123",
+                [
+                    {"op": "set", "path": "/timestamp", "value": 1234000},
+                    {"op": "set", "path": "/message_count", "value": 4},
+                ],
+            ),
+            {"if_match_etag": "etag-1"},
+        )
+        message = operations[1][1][0]
+        assert message["id"] == "123-3"
+        assert message["question"] == "Fourth question"
+        return [{"statusCode": 200, "eTag": "etag-2"}, {"statusCode": 200, "eTag": "etag-m"}]
+
+    monkeypatch.setattr(ContainerProxy, "execute_item_batch", mock_execute_item_batch)
+    monkeypatch.setattr("chat_history.cosmosdb.time.time", lambda: 1234)
+
+    response = await auth_public_documents_client.post(
+        "/chat_history",
+        headers={"Authorization": "Bearer MockToken"},
+        json={"id": "123", "answers": [["Fourth question", "Fourth answer"]], "start_index": 3, "etag": "etag-1"},
+    )
+    assert response.status_code == 201
+    assert (await response.get_json()) == {"etag": "etag-2", "message_count": 4}
+
+
+@pytest.mark.asyncio
+async def test_chathistory_newitem_chunked_batches(auth_public_documents_client, monkeypatch):
+    batches = []
+
+    async def mock_execute_item_batch(container_proxy, **kwargs):
+        batches.append(kwargs["batch_operations"])
+        return [{"statusCode": 200, "eTag": f"etag-{len(batches)}"} for _ in kwargs["batch_operations"]]
+
+    monkeypatch.setattr(ContainerProxy, "execute_item_batch", mock_execute_item_batch)
+
+    response = await auth_public_documents_client.post(
+        "/chat_history",
+        headers={"Authorization": "Bearer MockToken"},
+        json={"id": "123", "answers": [[f"Question {i}", f"Answer {i}"] for i in range(150)]},
+    )
+    assert response.status_code == 201
+    assert [len(batch) for batch in batches] == [100, 52]
+    # The message count is only set by the last batch, once every message pair is stored
+    assert batches[0][0][1][0]["message_count"] == 0
+    assert batches[1][-2][1][0]["id"] == "123-149"
+    assert batches[1][-1] == ("patch", ("123", [{"op": "set", "path": "/message_count", "value": 150}]))
+    # The ETag returned is the one of the last write to the session item
+    assert (await response.get_json()) == {"etag": "etag-2", "message_count": 150}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("start_index", [-1, "1", 1.5, True, None])
+async def test_chathistory_newitem_invalid_start_index(auth_public_documents_client, start_index):
+    response = await auth_public_documents_client.post(
+        "/chat_history",
+        headers={"Authorization": "Bearer MockToken"},
+        json={"id": "123", "answers": [["Second question", "Second answer"]], "start_index": start_index},
+    )
+    assert response.status_code == 400
+    assert (await response.get_json()) == {"error": "start_index must be a non-negative integer"}
+
+
+@pytest.mark.asyncio
+async def test_chathistory_newitem_etag_conflict(auth_public_documents_client, monkeypatch):
+
+    async def mock_execute_item_batch(container_proxy, **kwargs):
+        raise CosmosBatchOperationError(
+            error_index=0,
+            headers={},
+            status_code=412,
+            message="Precondition failed",
+            operation_responses=[{"statusCode": 412}, {"statusCode": 424}],
+        )
+
+    monkeypatch.setattr(ContainerProxy, "execute_item_batch", mock_execute_item_batch)
+
+    response = await auth_public_documents_client.post(
+        "/chat_history",
+        headers={"Authorization": "Bearer MockToken"},
+        json={"id": "123", "answers": [["Second question", "Second answer"]], "start_index": 1, "etag": "stale"},
+    )
+    assert response.status_code == 412
+    assert (await response.get_json()) == {"error": "Chat history was modified by another request"}
+
+
 @pytest.mark.asyncio
 async def test_chathistory_newitem_error_disabled(client, monkeypatch):
 
@@ -283,6 +380,136 @@ async def test_chathistory_getitem(auth_public_documents_client, monkeypatch, sn
     snapshot.assert_match(json.dumps(result, indent=4), "result.json")
 
 
+def make_stored_pair(index, compressed_context=None, context=None):
+    return {
+        "id": f"123-{index}",
+        "question": f"Question {index}",
+        "response": {
+            "message": {"content": f"Answer {index}", "role": "assistant"},
+            "context": context or {"followup_questions": [], "link_mapping": {"link1": "https://example.com/a.pdf"}},
+        },
+        **({"compressed_context": compressed_context} if compressed_context else {}),
+    }
+
+
+@pytest.mark.asyncio
+async def test_chathistory_newitem_compresses_context(auth_public_documents_client, monkeypatch):
+    stored = {}
+
+    async def mock_execute_item_batch(container_proxy, **kwargs):
+        stored["item"] = kwargs["batch_operations"][1][1][0]
+        return []
+
+    monkeypatch.setattr(ContainerProxy, "execute_item_batch", mock_execute_item_batch)
+
+    context = {
+        "data_points": {"text": ["[a.pdf](link1): " + "x" * 1000]},
+        "thoughts": [{"title": "Search results", "description": ["y" * 1000]}],
+        "followup_questions": ["What else?"],
+        "link_mapping": {"link1": "https://example.com/a.pdf"},
+    }
+    response = await auth_public_documents_client.post(
+        "/chat_history",
+        headers={"Authorization": "Bearer MockToken"},
+        json={"id": "123", "answers": [["Question", {"message": {"content": "Answer"}, "context": context}]]},
+    )
+    assert response.status_code == 201
+    item = stored["item"]
+    assert "order" not in item
+    assert item["response"]["context"] == {
+        "followup_questions": ["What else?"],
+        "link_mapping": {"link1": "https://example.com/a.pdf"},
+    }
+    assert len(item["compressed_context"]) < 200
+    assert decompress_context(item["compressed_context"]) == {
+        "data_points": context["data_points"],
+        "thoughts": context["thoughts"],
+    }
+
+
+@pytest.mark.asyncio
+async def test_chathistory_getitem_paged(auth_public_documents_client, monkeypatch):
+    queries = []
+    compressed_context = compact_response({"context": {"thoughts": ["heavy"]}})[1]
+
+    def mock_query_items(container_proxy, query, **kwargs):
+        queries.append((query, kwargs["parameters"]))
+        ids = kwargs["parameters"][2]["value"]
+        # Returned out of order, and an older item that still has its thoughts inline
+        stored = [
+            make_stored_pair(3),
+            make_stored_pair(2, compressed_context),
+            make_stored_pair(4, context={"thoughts": ["inline"]}),
+        ]
+        return MockCosmosDBResultsIterator([[item for item in stored if item["id"] in ids]])
+
+    monkeypatch.setattr(ContainerProxy, "query_items", mock_query_items)
+
+    response = await auth_public_documents_client.get(
+        "/chat_history/sessions/123?count=2&continuation_token=2",
+        headers={"Authorization": "Bearer MockToken"},
+    )
+    assert response.status_code == 200
+    result = await response.get_json()
+    assert [pair[0] for pair in result["answers"]] == ["Question 2", "Question 3"]
+    assert "thoughts" not in result["answers"][0][1]["context"]
+    assert result["continuation_token"] == "4"
+    assert "compressed_context" not in queries[0][0]
+    assert queries[0][1][2]["value"] == ["123-2", "123-3"]
+
+    response = await auth_public_documents_client.get(
+        "/chat_history/sessions/123?count=2&continuation_token=4&include_context=true",
+        headers={"Authorization": "Bearer MockToken"},
+    )
+    result = await response.get_json()
+    assert [pair[0] for pair in result["answers"]] == ["Question 4"]
+    assert result["answers"][0][1]["context"] == {"thoughts": ["inline"]}
+    assert result["continuation_token"] is None
+    assert "compressed_context" in queries[1][0]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "query_string, error",
+    [
+        ("count=0", "count must be an integer from 1 to 100"),
+        ("count=-2", "count must be an integer from 1 to 100"),
+        ("count=two", "count must be an integer from 1 to 100"),
+        ("count=1000000", "count must be an integer from 1 to 100"),
+        ("count=2&continuation_token=-1", "continuation_token must be a non-negative integer"),
+        ("count=2&continuation_token=abc", "continuation_token must be a non-negative integer"),
+    ],
+)
+async def test_chathistory_getitem_paged_invalid(auth_public_documents_client, query_string, error):
+    response = await auth_public_documents_client.get(
+        f"/chat_history/sessions/123?{query_string}",
+        headers={"Authorization": "Bearer MockToken"},
+    )
+    assert response.status_code == 400
+    assert (await response.get_json()) == {"error": error}
+
+
+@pytest.mark.asyncio
+async def test_chathistory_getitem_context(auth_public_documents_client, monkeypatch):
+    compressed_context = compact_response({"context": {"thoughts": ["heavy"], "followup_questions": []}})[1]
+
+    async def mock_read_item(container_proxy, item, partition_key, **kwargs):
+        assert item == "123-2"
+        assert partition_key == ["OID_X", "123"]
+        return make_stored_pair(2, compressed_context)
+
+    monkeypatch.setattr(ContainerProxy, "read_item", mock_read_item)
+
+    response = await auth_public_documents_client.get(
+        "/chat_history/sessions/123/answers/2/context",
+        headers={"Authorization": "Bearer MockToken"},
+    )
+    assert response.status_code == 200
+    result = await response.get_json()
+    assert result["context"]["thoughts"] == ["heavy"]
+    assert result["context"]["link_mapping"] == {"link1": "https://example.com/a.pdf"}
+
+
 # Error handling tests for getting an individual chat history item
 @pytest.mark.asyncio
 async def test_chathistory_getitem_error_disabled(client, monkeypatch):
@@ -1,17 +1,25 @@
+import asyncio
+import base64
+import io
 import os
 
 import aiohttp
 import pytest
-from azure.core.exceptions import ResourceNotFoundError
+from azure.core.exceptions import (
+    ResourceModifiedError,
+    ResourceNotFoundError,
+    ResourceNotModifiedError,
+)
 from azure.core.pipeline.transport import (
     AioHttpTransportResponse,
     AsyncHttpTransport,
     HttpRequest,
 )
 from azure.storage.blob.aio import BlobServiceClient
+from PIL import Image
 
 from approaches.approach import Document
-from core.imageshelper import fetch_image
+from core.imageshelper import ImageCache, fetch_image, fetch_images
 
 from .mocks import MockAzureCredential
 
@@ -95,3 +103,123 @@ async def test_content_file(monkeypatch, mock_env, mock_acs_search):
     test_document.sourcepage = ""
     image_url = await fetch_image(blob_container_client, test_document)
     assert image_url is None
+
+
+class MockCachingBlobProperties(dict):
+    pass
+
+
+class MockCachingBlob:
+    def __init__(self, content: bytes, etag: str):
+        self.content = content
+        self.properties = MockCachingBlobProperties(etag=etag)
+
+    async def readall(self):
+        return self.content
+
+
+class MockCachingBlobClient:
+    def __init__(self, container, name):
+        self.container = container
+        self.name = name
+
+    async def download_blob(self, etag=None, match_condition=None):
+        self.container.downloads.append((self.name, etag))
+        self.container.in_flight += 1
+        self.container.max_in_flight = max(self.container.max_in_flight, self.container.in_flight)
+        await asyncio.sleep(0.01)
+        self.container.in_flight -= 1
+        if self.name not in self.container.blobs:
+            raise ResourceNotFoundError("not found")
+        content, current_etag = self.container.blobs[self.name]
+        if etag is not None and self.container.fail_conditional_downloads:
+            raise ResourceModifiedError("precondition failed")
+        if etag is not None and etag == current_etag:
+            raise ResourceNotModifiedError("not modified")
+        return MockCachingBlob(content, current_etag)
+
+
+class MockCachingContainerClient:
+    def __init__(self, blobs):
+        self.blobs = blobs
+        self.downloads = []
+        self.fail_conditional_downloads = False
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def get_blob_client(self, name):
+        return MockCachingBlobClient(self, name)
+
+
+def create_png(width: int, height: int) -> bytes:
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), color="red").save(output, format="PNG")
+    return output.getvalue()
+
+
+@pytest.mark.asyncio
+async def test_fetch_images_concurrent_and_ordered():
+    container = MockCachingContainerClient({f"doc-{i}.png": (f"img{i}".encode(), f"etag{i}") for i in range(6)})
+    results = [Document(sourcepage=f"doc-{i}.pdf") for i in range(6)] + [Document(sourcepage="missing.pdf")]
+
+    urls = await fetch_images(container, results, max_concurrency=3)
+
+    assert urls == [f"data:image/png;base64,{base64.b64encode(f'img{i}'.encode()).decode()}" for i in range(6)]
+    assert container.max_in_flight == 3
+
+
+@pytest.mark.asyncio
+async def test_fetch_images_uses_cache_until_etag_changes():
+    container = MockCachingContainerClient({"doc-1.png": (b"first", "etag1")})
+    image_cache = ImageCache()
+    results = [Document(sourcepage="doc-1.pdf")]
+
+    first = await fetch_images(container, results, image_cache)
+    second = await fetch_images(container, results, image_cache)
+    assert first == second == ["data:image/png;base64,Zmlyc3Q="]
+    assert container.downloads == [("doc-1.png", None), ("doc-1.png", "etag1")]
+    assert (image_cache.hits, image_cache.misses) == (1, 1)
+
+    container.blobs["doc-1.png"] = (b"second", "etag2")
+    third = await fetch_images(container, results, image_cache)
+    assert third == ["data:image/png;base64,c2Vjb25k"]
+    assert image_cache.get("doc-1.png") == ("etag2", "data:image/png;base64,c2Vjb25k")
+
+    # A 412 response does not mean the cached image is current, so the blob is downloaded again
+    container.fail_conditional_downloads = True
+    container.blobs["doc-1.png"] = (b"third", "etag3")
+    container.downloads.clear()
+    fourth = await fetch_images(container, results, image_cache)
+    assert fourth == ["data:image/png;base64,dGhpcmQ="]
+    assert container.downloads == [("doc-1.png", "etag2"), ("doc-1.png", None)]
+    assert image_cache.get("doc-1.png") == ("etag3", "data:image/png;base64,dGhpcmQ=")
+
+
+def test_image_cache_evicts_least_recently_used():
+    image_cache = ImageCache(max_bytes=10)
+    image_cache.put("a.png", "1", "aaaa")
+    image_cache.put("b.png", "1", "bbbb")
+    image_cache.get("a.png")
+    image_cache.put("c.png", "1", "cccc")
+
+    assert image_cache.get("b.png") is None
+    assert image_cache.get("a.png") is not None
+    assert image_cache.get("c.png") is not None
+    assert image_cache.current_bytes == 8
+
+    # Entries larger than the whole cache are never stored
+    image_cache.put("d.png", "1", "d" * 11)
+    assert image_cache.get("d.png") is None
+    assert len(image_cache) == 2
+
+
+@pytest.mark.asyncio
+async def test_fetch_images_downscales_large_images():
+    container = MockCachingContainerClient({"big.png": (create_png(400, 200), "etag")})
+    image_cache = ImageCache(max_resolution=100)
+
+    urls = await fetch_images(container, [Document(sourcepage="big.pdf")], image_cache)
+
+    encoded = urls[0].removeprefix("data:image/png;base64,")
+    with Image.open(io.BytesIO(base64.b64decode(encoded))) as img:
+        assert img.size == (100, 50)
@@ -0,0 +1,124 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+import app
+from core.instrumentation import (
+    Histogram,
+    MetricsRegistry,
+    current_timings,
+    record_stage,
+    stage,
+    start_request_timings,
+    watch_event_loop_lag,
+)
+
+
+def test_histogram_render():
+    histogram = Histogram("test_seconds", "A test histogram.", buckets=(0.1, 1.0))
+    histogram.observe(0.05, stage="search")
+    histogram.observe(0.5, stage="search")
+    histogram.observe(5, stage="search")
+    histogram.observe(0.1, stage='say "hi"')
+    assert histogram.render() == [
+        "# HELP test_seconds A test histogram.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{stage="say \\"hi\\"",le="0.1"} 1',
+        'test_seconds_bucket{stage="say \\"hi\\"",le="1.0"} 1',
+        'test_seconds_bucket{stage="say \\"hi\\"",le="+Inf"} 1',
+        'test_seconds_sum{stage="say \\"hi\\""} 0.1',
+        'test_seconds_count{stage="say \\"hi\\""} 1',
+        'test_seconds_bucket{stage="search",le="0.1"} 1',
+        'test_seconds_bucket{stage="search",le="1.0"} 2',
+        'test_seconds_bucket{stage="search",le="+Inf"} 3',
+        'test_seconds_sum{stage="search"} 5.55',
+        'test_seconds_count{stage="search"} 3',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_stages_are_shared_with_tasks():
+    async def request():
+        registry = MetricsRegistry()
+        timings = start_request_timings("/chat", registry)
+        with stage("search"):
+            await asyncio.sleep(0)
+        # Tasks started by the request, like speculative retrieval, record into the same timings
+        await asyncio.create_task(record_search())
+        timings.finish()
+        timings.finish()
+        return registry, timings
+
+    async def record_search():
+        record_stage("search", 0.25)
+        record_stage("embedding", 0.01)
+
+    registry, timings = await asyncio.create_task(request())
+    assert set(timings.stages) == {"search", "embedding"}
+    assert timings.stages["search"] >= 250
+    assert timings.stages["embedding"] == 10
+    assert registry.stage_duration.series[(("stage", "search"),)].count == 2
+    assert registry.request_duration.series[(("route", "/chat"),)].count == 1
+
+    # Outside of a request, stages are not recorded anywhere
+    assert current_timings() is None
+    with stage("search"):
+        record_stage("search", 1.0)
+
+
+@pytest.mark.asyncio
+async def test_watch_event_loop_lag():
+    registry = MetricsRegistry()
+    task = asyncio.create_task(watch_event_loop_lag(registry, 0.01))
+    await asyncio.sleep(0.005)
+    time.sleep(0.1)
+    await asyncio.sleep(0.03)
+    task.cancel()
+    series = registry.event_loop_lag.series[()]
+    assert series.count >= 2
+    assert series.sum >= 0.05
+
+
+@pytest.mark.asyncio
+async def test_metrics(client):
+    response = await client.get("/metrics")
+    assert response.status_code == 404
+
+    client.app.config[app.CONFIG_METRICS_REGISTRY] = MetricsRegistry()
+    response = await client.post(
+        "/chat",
+        json={"messages": [{"content": "What is the capital of France?", "role": "user"}]},
+    )
+    assert response.status_code == 200
+    result = await response.get_json()
+    assert "Stage durations (ms)" not in [thought["title"] for thought in result["context"]["thoughts"]]
+
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type == "text/plain; version=0.0.4; charset=utf-8"
+    metrics = await response.get_data(as_text=True)
+    for stage_name in ("auth", "query_rewrite", "embedding", "search", "answer", "chat_logging"):
+        assert f'ragapp_stage_duration_seconds_count{{stage="{stage_name}"}} 1' in metrics
+    # The search query prompt and the answer prompt
+    assert 'ragapp_stage_duration_seconds_count{stage="prompt_render"} 2' in metrics
+    assert 'ragapp_request_duration_seconds_count{route="/chat"} 1' in metrics
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_stage_durations_in_thoughts(client):
+    client.app.config[app.CONFIG_STAGE_DURATIONS_IN_THOUGHTS] = True
+    response = await client.post(
+        "/chat/stream",
+        json={"messages": [{"content": "What is the capital of France?", "role": "user"}]},
+    )
+    assert response.status_code == 200
+    events = [json.loads(line) for line in (await response.get_data(as_text=True)).splitlines() if line]
+    first_thoughts = events[0]["context"]["thoughts"]
+    # Only the thoughts are sent again, so the client keeps the follow-up questions it already received
+    assert events[-1] == {"context": {"thoughts": events[-1]["context"]["thoughts"]}}
+    last_thoughts = events[-1]["context"]["thoughts"]
+    assert first_thoughts[-1]["title"] == last_thoughts[-1]["title"] == "Stage durations (ms)"
+    assert {"auth", "query_rewrite", "embedding", "search", "prompt_render"} <= set(first_thoughts[-1]["props"])
+    assert {"answer_first_token", "answer_stream"} <= set(last_thoughts[-1]["props"])
@@ -0,0 +1,52 @@
+import dataclasses
+
+from approaches.approach import DataPoints, Document, ExtraInfo, LinkMapping
+
+
+def test_link_mapping_from_documents():
+    results = [
+        Document(id="1", sourcepage="https://example.com/a.pdf#page=1"),
+        Document(id="2", sourcepage=None),
+        Document(id="3", sourcepage="https://example.com/b.pdf#page=2"),
+        Document(id="4", sourcepage="https://example.com/a.pdf#page=1"),
+    ]
+    link_mapping = LinkMapping.from_documents(results)
+
+    assert link_mapping == {
+        "link1": "https://example.com/a.pdf#page=1",
+        "link2": "https://example.com/b.pdf#page=2",
+        "link3": "https://example.com/a.pdf#page=1",
+    }
+    # Duplicate URLs resolve to the first short ID, as the previous linear scan did
+    assert link_mapping.get_link_id("https://example.com/a.pdf#page=1") == "link1"
+    assert link_mapping.get_link_id("https://example.com/b.pdf#page=2") == "link2"
+    assert link_mapping.get_link_id("https://example.com/c.pdf") is None
+
+
+def test_link_mapping_keeps_reverse_index_in_sync():
+    link_mapping = LinkMapping({"link1": "https://example.com/a.pdf"})
+    link_mapping.update({"link2": "https://example.com/b.pdf"}, link3="https://example.com/a.pdf")
+    assert link_mapping.setdefault("link4", "https://example.com/c.pdf") == "https://example.com/c.pdf"
+    assert link_mapping.setdefault("link4", "https://example.com/d.pdf") == "https://example.com/c.pdf"
+    link_mapping |= {"link5": "https://example.com/e.pdf"}
+    assert link_mapping.get_link_id("https://example.com/b.pdf") == "link2"
+    assert link_mapping.get_link_id("https://example.com/c.pdf") == "link4"
+    assert link_mapping.get_link_id("https://example.com/d.pdf") is None
+    assert link_mapping.get_link_id("https://example.com/e.pdf") == "link5"
+
+    # Once the first ID of a URL is removed or replaced, the next ID with that URL is found
+    del link_mapping["link1"]
+    assert link_mapping.get_link_id("https://example.com/a.pdf") == "link3"
+    link_mapping["link3"] = "https://example.com/f.pdf"
+    assert link_mapping.get_link_id("https://example.com/a.pdf") is None
+    assert link_mapping.get_link_id("https://example.com/f.pdf") == "link3"
+    assert link_mapping.pop("link2") == "https://example.com/b.pdf"
+    assert link_mapping.get_link_id("https://example.com/b.pdf") is None
+    link_mapping.clear()
+    assert link_mapping.get_link_id("https://example.com/c.pdf") is None
+
+
+def test_link_mapping_serializes_as_dict():
+    link_mapping = LinkMapping({"link1": "https://example.com/a.pdf"})
+    extra_info = dataclasses.asdict(ExtraInfo(DataPoints(text=[]), link_mapping=link_mapping))
+    assert extra_info["link_mapping"] == {"link1": "https://example.com/a.pdf"}
@@ -0,0 +1,33 @@
+from core.lrucache import LRUCache
+
+
+def test_lrucache_evicts_least_recently_used():
+    cache: LRUCache[str, int] = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+    assert cache.stats() == {"size": 2, "hits": 3, "misses": 1, "hit_rate": 0.75}
+
+
+def test_lrucache_ttl_expiry(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr("core.lrucache.time.monotonic", lambda: now)
+    cache: LRUCache[str, int] = LRUCache(maxsize=10, ttl_seconds=5)
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+
+    now = 1006.0
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_lrucache_disabled():
+    cache: LRUCache[str, int] = LRUCache(maxsize=0)
+    cache.put("a", 1)
+    assert cache.get("a") is None
@@ -9,6 +9,8 @@ from azure.search.documents.indexes.models import (
     SimpleField,
 )
 
+from core.pathauthcache import PathAuthCache
+
 from .mocks import MockAzureCredential
 from scripts.manageacl import ManageAcl
 
@@ -87,7 +89,20 @@ async def test_remove_acl(monkeypatch, capsys):
 
 
 @pytest.mark.asyncio
-async def test_remove_all_acl(monkeypatch, capsys):
+async def test_remove_all_acl(monkeypatch, capsys, tmp_path):
+    generation_path = str(tmp_path / "path_auth_cache.generation")
+    path_auth_cache = PathAuthCache(generation_path=generation_path)
+    key = PathAuthCache.make_key("a.txt", {"oid": "OID_ACL_TO_REMOVE", "groups": []})
+
+    async def allowed_check():
+        return True
+
+    async def revoked_check():
+        return False
+
+    assert await path_auth_cache.get_or_check(key, allowed_check) is True
+    assert await path_auth_cache.get_or_check(key, revoked_check) is True
+
     async def mock_search(self, *args, **kwargs):
         assert kwargs.get("filter") == "storageUrl eq 'https://test.blob.core.windows.net/content/a.txt'"
         assert kwargs.get("select") == ["id", "oids"]
@@ -115,9 +130,12 @@ async def test_remove_all_acl(monkeypatch, capsys):
         acl_type="oids",
         acl="",
         credentials=MockAzureCredential(),
+        path_auth_cache_generation_path=generation_path,
     )
     await command.run()
     assert merged_documents == [{"id": 2, "oids": []}, {"id": 1, "oids": []}]
+    # The app's workers stop using the decisions they cached before the change
+    assert await path_auth_cache.get_or_check(key, revoked_check) is False
 
 
 @pytest.mark.asyncio
@@ -0,0 +1,89 @@
+import asyncio
+import json
+
+import pytest
+
+from approaches.approach import DataPoints, ExtraInfo, ThoughtStep, TokenUsageProps
+from core.ndjsonencoder import JSONEncoder, NDJSONEncoder, coalesce_frames
+
+CACHED_FIELDS = ("data_points", "description")
+
+
+def make_extra_info() -> ExtraInfo:
+    return ExtraInfo(
+        DataPoints(text=["[Benefit_Options-2.pdf](link1): Northwind Health Plus covers dental. ❤️"]),
+        thoughts=[
+            ThoughtStep("Search using generated search query", "dental coverage", {"top": 3}),
+            ThoughtStep(
+                "Prompt to generate answer",
+                [{"role": "system", "content": "Answer using the sources."}, {"role": "user", "content": "Dental?"}],
+                {"model": "gpt-4.1-mini"},
+            ),
+        ],
+    )
+
+
+def make_events(extra_info: ExtraInfo) -> list[dict]:
+    return [
+        {"delta": {"role": "assistant"}, "context": extra_info, "session_state": None},
+        {"delta": {"content": "Yes, \n dental is covered.", "role": None}},
+        {"delta": {"role": "assistant"}, "context": {"context": extra_info, "followup_questions": ["Vision?"]}},
+    ]
+
+
+@pytest.mark.parametrize("use_orjson", [False, True])
+def test_encoder_matches_json_dumps(use_orjson):
+    if use_orjson:
+        pytest.importorskip("orjson")
+    encoder = NDJSONEncoder(cached_fields=CACHED_FIELDS, use_orjson=use_orjson)
+    for event in make_events(make_extra_info()):
+        # Both backends write the same compact bytes
+        expected = json.dumps(event, ensure_ascii=False, separators=(",", ":"), cls=JSONEncoder)
+        assert encoder.encode(event) == (expected + "\n").encode()
+
+
+def test_encoder_reuses_fragments_but_sees_new_usage():
+    extra_info = make_extra_info()
+    encoder = NDJSONEncoder(cached_fields=CACHED_FIELDS, use_orjson=False)
+    first = encoder.encode({"context": extra_info})
+    fragments = dict(encoder.fragments)
+    assert id(extra_info.data_points) in fragments
+    assert id(extra_info.thoughts[1].description) in fragments
+
+    extra_info.thoughts[-1].props["token_usage"] = TokenUsageProps(10, 5, None, 15)
+    second = encoder.encode({"context": extra_info})
+    assert second != first
+    assert json.loads(second)["context"]["thoughts"][1]["props"]["token_usage"]["total_tokens"] == 15
+    assert encoder.fragments.keys() == fragments.keys()
+
+
+async def frame_source(frames, delay=0.0):
+    for frame in frames:
+        if delay:
+            await asyncio.sleep(delay)
+        yield frame
+
+
+@pytest.mark.asyncio
+async def test_coalesce_frames_disabled_passes_frames_through():
+    frames = [b"a\n", b"b\n", b"c\n"]
+    assert [frame async for frame in coalesce_frames(frame_source(frames))] == frames
+
+
+@pytest.mark.asyncio
+async def test_coalesce_frames_by_size():
+    frames = [b"aa\n", b"bb\n", b"cc\n", b"dd\n", b"e\n"]
+    result = [frame async for frame in coalesce_frames(frame_source(frames), max_bytes=6)]
+    assert result == [b"aa\nbb\n", b"cc\ndd\n", b"e\n"]
+
+
+@pytest.mark.asyncio
+async def test_coalesce_frames_flushes_after_delay():
+    async def slow_source():
+        yield b"a\n"
+        yield b"b\n"
+        await asyncio.sleep(0.1)
+        yield b"c\n"
+
+    result = [frame async for frame in coalesce_frames(slow_source(), max_delay_ms=20)]
+    assert result == [b"a\nb\n", b"c\n"]
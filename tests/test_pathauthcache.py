@@ -0,0 +1,179 @@
+import asyncio
+
+import pytest
+from azure.search.documents.aio import SearchClient
+
+import app
+from core.authentication import AuthenticationHelper
+from core.pathauthcache import PathAuthCache
+
+from .mocks import MockAsyncPageIterator
+from .test_authenticationhelper import MockSearchIndex, create_search_client
+
+AUTH_CLAIMS = {"oid": "OID_X", "groups": ["GROUP_Z", "GROUP_Y"]}
+
+
+def test_make_key_ignores_fragment_and_group_order():
+    key = PathAuthCache.make_key("Benefit_Options.pdf#page=2", AUTH_CLAIMS)
+    assert key == PathAuthCache.make_key(
+        "Benefit_Options.pdf#page=7", {"oid": "OID_X", "groups": ["GROUP_Y", "GROUP_Z"]}
+    )
+    assert key != PathAuthCache.make_key("Benefit_Options.pdf", {"oid": "OID_X", "groups": ["GROUP_Y"]})
+    assert key[2] == "Benefit_Options.pdf"
+
+
+@pytest.mark.asyncio
+async def test_concurrent_checks_share_one_query():
+    cache = PathAuthCache()
+    calls = 0
+
+    async def check():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return True
+
+    key = PathAuthCache.make_key("Benefit_Options.pdf", AUTH_CLAIMS)
+    assert await asyncio.gather(*[cache.get_or_check(key, check) for _ in range(3)]) == [True, True, True]
+    assert await cache.get_or_check(key, check) is True
+    assert calls == 1
+    assert cache.stats() == {
+        "size": 1,
+        "hits": 1,
+        "misses": 3,
+        "hit_rate": 0.25,
+        "shared_checks": 2,
+        "invalidations": 0,
+    }
+
+
+@pytest.mark.asyncio
+async def test_invalidation_during_check_is_not_cached():
+    cache = PathAuthCache()
+    key = PathAuthCache.make_key("Benefit_Options.pdf", AUTH_CLAIMS)
+
+    async def check():
+        cache.invalidate_user("OID_X")
+        return False
+
+    assert await cache.get_or_check(key, check) is False
+    assert len(cache.decisions) == 0
+
+
+@pytest.mark.asyncio
+async def test_requests_after_invalidation_do_not_wait_for_an_earlier_check():
+    cache = PathAuthCache()
+    key = PathAuthCache.make_key("Benefit_Options.pdf", AUTH_CLAIMS)
+    release_first_check = asyncio.Event()
+
+    async def first_check():
+        await release_first_check.wait()
+        return True
+
+    async def second_check():
+        return False
+
+    first_request = asyncio.create_task(cache.get_or_check(key, first_check))
+    await asyncio.sleep(0)
+    cache.invalidate_user("OID_X")
+    # Started after the invalidation, so it runs its own check instead of sharing the earlier one
+    assert await cache.get_or_check(key, second_check) is False
+    release_first_check.set()
+    assert await first_request is True
+    assert cache.decisions.get(key) is False
+    assert cache.pending == {}
+
+
+@pytest.mark.asyncio
+async def test_invalidation_clears_other_workers(tmp_path):
+    generation_path = str(tmp_path / "path_auth_cache.generation")
+    # Two worker processes sharing the generation file
+    first_worker = PathAuthCache(generation_path=generation_path)
+    second_worker = PathAuthCache(generation_path=generation_path)
+    key = PathAuthCache.make_key("Benefit_Options.pdf", AUTH_CLAIMS)
+
+    async def check():
+        return True
+
+    await first_worker.get_or_check(key, check)
+    await second_worker.get_or_check(key, check)
+    first_worker.invalidate_path("Salaries.pdf")
+    assert len(first_worker.decisions) == 1
+
+    async def revoked_check():
+        return False
+
+    assert await second_worker.get_or_check(key, revoked_check) is False
+    # A worker does not clear its cache again for its own invalidation
+    assert await first_worker.get_or_check(key, revoked_check) is True
+    second_worker.clear()
+    assert await first_worker.get_or_check(key, revoked_check) is False
+
+
+@pytest.mark.asyncio
+async def test_failed_check_is_not_cached():
+    cache = PathAuthCache()
+    key = PathAuthCache.make_key("Benefit_Options.pdf", AUTH_CLAIMS)
+
+    async def failing_check():
+        raise ValueError("search unavailable")
+
+    with pytest.raises(ValueError):
+        await cache.get_or_check(key, failing_check)
+    assert key not in cache.pending
+    assert len(cache.decisions) == 0
+
+
+@pytest.mark.asyncio
+async def test_check_path_auth_uses_cache(monkeypatch, mock_confidential_client_success, mock_validate_token_success):
+    auth_helper = AuthenticationHelper(
+        search_index=MockSearchIndex,
+        use_authentication=True,
+        server_app_id="SERVER_APP",
+        server_app_secret="SERVER_SECRET",
+        client_app_id="CLIENT_APP",
+        tenant_id="TENANT_ID",
+        require_access_control=True,
+        path_auth_cache=PathAuthCache(),
+    )
+    filters = []
+
+    async def mock_search(self, *args, **kwargs):
+        filters.append(kwargs.get("filter"))
+        return MockAsyncPageIterator(data=[{"sourcefile": "Benefit_Options.pdf"}])
+
+    monkeypatch.setattr(SearchClient, "search", mock_search)
+    search_client = create_search_client()
+
+    for path in ["Benefit_Options.pdf#page=1", "Benefit_Options.pdf#page=2"]:
+        assert await auth_helper.check_path_auth(path, AUTH_CLAIMS, search_client) is True
+    assert len(filters) == 1
+
+    await auth_helper.check_path_auth("Benefit_Options.pdf", {"oid": "OID_OTHER", "groups": []}, search_client)
+    assert len(filters) == 2
+
+    auth_helper.path_auth_cache.invalidate_path("Benefit_Options.pdf#page=1")
+    assert await auth_helper.check_path_auth("Benefit_Options.pdf", AUTH_CLAIMS, search_client) is True
+    assert len(filters) == 3
+
+
+@pytest.mark.asyncio
+async def test_clear_endpoint_requires_admin(auth_client):
+    path_auth_cache = PathAuthCache()
+    auth_client.config[app.CONFIG_AUTH_CLIENT].path_auth_cache = path_auth_cache
+    key = PathAuthCache.make_key("Benefit_Options.pdf", AUTH_CLAIMS)
+
+    async def check():
+        return True
+
+    await path_auth_cache.get_or_check(key, check)
+    headers = {"Authorization": "Bearer MockToken"}
+    response = await auth_client.post("/admin/path_auth_cache/clear", headers=headers)
+    assert response.status_code == 403
+    assert len(path_auth_cache.decisions) == 1
+
+    auth_client.config[app.CONFIG_ADMIN_USER_OIDS] = {"OID_X"}
+    response = await auth_client.post("/admin/path_auth_cache/clear", headers=headers)
+    assert response.status_code == 200
+    assert (await response.get_json())["cleared"] is True
+    assert len(path_auth_cache.decisions) == 0
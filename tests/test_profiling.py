@@ -0,0 +1,139 @@
+import asyncio
+import sys
+import threading
+import time
+import uuid
+
+import pytest
+
+import app
+from core.profiling import (
+    ProfiledStream,
+    ProfileStore,
+    RequestProfiler,
+    start_request_profiler,
+)
+
+
+def busy_wait(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_request_profiler():
+    switch_interval = sys.getswitchinterval()
+    profiler = RequestProfiler(interval_seconds=0.001)
+    profiler.start()
+    assert sys.getswitchinterval() == 0.001
+    busy_wait(0.05)
+    profiler.stop()
+    assert profiler.thread is None
+    assert sys.getswitchinterval() == switch_interval
+
+    profile = profiler.to_speedscope("test")
+    frames = profile["shared"]["frames"]
+    sampled = profile["profiles"][0]
+    assert sampled["type"] == "sampled"
+    assert len(sampled["samples"]) == len(sampled["weights"]) > 0
+    assert sampled["endValue"] == pytest.approx(50, abs=25)
+    # The outermost frame comes first, and the sampled function is the innermost frame of most samples
+    leaves = [frames[sample[-1]]["name"] for sample in sampled["samples"]]
+    assert leaves.count("busy_wait") > len(leaves) / 2
+    assert frames[sampled["samples"][0][-2]]["name"] == "test_request_profiler"
+    assert threading.current_thread().ident == profiler.target_thread_id
+
+
+def test_profile_store(tmp_path):
+    store = ProfileStore(str(tmp_path), max_files=2)
+    request_ids = [str(uuid.uuid4()) for _ in range(3)]
+    for request_id in request_ids:
+        assert store.save(request_id, {"name": request_id}) == tmp_path / f"{request_id}.speedscope.json"
+        time.sleep(0.01)
+    assert store.load(request_ids[0]) is None
+    assert store.load(request_ids[2]) == f'{{"name": "{request_ids[2]}"}}'.encode()
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(
+        f"{request_id}.speedscope.json" for request_id in request_ids[1:]
+    )
+    # Only request ids are accepted, so a path cannot point outside the directory
+    assert store.save("../profile", {}) is None
+    assert store.load("../" + request_ids[2]) is None
+
+
+CHAT_REQUEST = {"messages": [{"content": "What is the capital of France?", "role": "user"}]}
+
+
+@pytest.mark.asyncio
+async def test_chat_profile(client, tmp_path):
+    client.app.config[app.CONFIG_PROFILE_STORE] = ProfileStore(str(tmp_path), sample_interval_seconds=0.0005)
+    response = await client.post("/chat", json=CHAT_REQUEST, headers={"X-Profile-Request": "true"})
+    assert response.status_code == 200
+    assert "X-Profile-Url" not in response.headers
+    assert list(tmp_path.iterdir()) == []
+
+    client.app.config[app.CONFIG_DEVELOPER_FEATURES_ENABLED] = True
+    response = await client.post("/chat", json=CHAT_REQUEST)
+    assert "X-Profile-Url" not in response.headers
+
+    response = await client.post("/chat", json=CHAT_REQUEST, headers={"X-Profile-Request": "true"})
+    assert response.status_code == 200
+    request_id = (await response.get_json())["tracking"]["request_id"]
+    assert response.headers["X-Profile-Url"] == f"/admin/profiles/{request_id}"
+
+    response = await client.get(f"/admin/profiles/{request_id}")
+    assert response.status_code == 200
+    assert response.headers["Content-Disposition"] == f'attachment; filename="{request_id}.speedscope.json"'
+    profile = await response.get_json()
+    assert profile["name"] == f"/chat {request_id}"
+    assert profile["profiles"][0]["type"] == "sampled"
+
+    response = await client.get(f"/admin/profiles/{uuid.uuid4()}")
+    assert response.status_code == 404
+
+    client.app.config[app.CONFIG_DEVELOPER_FEATURES_ENABLED] = False
+    response = await client.get(f"/admin/profiles/{request_id}")
+    assert response.status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_profile(client, tmp_path):
+    client.app.config[app.CONFIG_PROFILE_STORE] = ProfileStore(str(tmp_path))
+    client.app.config[app.CONFIG_DEVELOPER_FEATURES_ENABLED] = True
+    response = await client.post("/chat/stream", json=CHAT_REQUEST, headers={"X-Profile-Request": "true"})
+    assert response.status_code == 200
+    await response.get_data()
+
+    # The stream saves its profile once its body is closed
+    for _ in range(100):
+        if profiles := list(tmp_path.glob("*.speedscope.json")):
+            break
+        await asyncio.sleep(0.01)
+    assert len(profiles) == 1
+    assert client.app.config[app.CONFIG_PROFILE_STORE].active is None
+
+
+@pytest.mark.asyncio
+async def test_profiled_stream_closed_before_start(tmp_path):
+    switch_interval = sys.getswitchinterval()
+    store = ProfileStore(str(tmp_path))
+    profiler = start_request_profiler(store)
+    assert profiler is not None
+    profiler.request_id = str(uuid.uuid4())
+    stream_finished = False
+
+    async def body():
+        nonlocal stream_finished
+        try:
+            yield b"{}"
+        finally:
+            stream_finished = True
+
+    # Closed without being read, like a response body whose client disconnected before it started
+    stream = ProfiledStream(body(), store, profiler, "/chat/stream")
+    await stream.aclose()
+    # The finally block of a generator that never started does not run
+    assert not stream_finished
+    assert not profiler.is_sampling()
+    assert sys.getswitchinterval() == switch_interval
+    assert store.active is None
+    assert [path.name for path in tmp_path.iterdir()] == [f"{profiler.request_id}.speedscope.json"]
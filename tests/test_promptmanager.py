@@ -0,0 +1,114 @@
+import asyncio
+import os
+import shutil
+
+import prompty
+import pytest
+
+from approaches.promptmanager import PromptReference, PromptyManager
+
+RENDER_DATA = {
+    "include_follow_up_questions": True,
+    "past_messages": [
+        {"role": "user", "content": "What does my plan cover?"},
+        {"role": "assistant", "content": "Medical, vision and dental [Benefit_Options-2.pdf](link1)."},
+    ],
+    "user_query": "Is dental included?",
+    "text_sources": ["[Benefit_Options-2.pdf](link1): Northwind Health Plus covers dental."],
+    "image_sources": [],
+}
+
+
+@pytest.fixture
+def prompts_directory(tmp_path, monkeypatch):
+    for name in ["chat_answer_question.prompty", "chat_query_rewrite_tools.json"]:
+        shutil.copy(PromptyManager.PROMPTS_DIRECTORY / name, tmp_path / name)
+    monkeypatch.setattr(PromptyManager, "PROMPTS_DIRECTORY", tmp_path)
+    return tmp_path
+
+
+def edit_file(path, old, new):
+    path.write_text(path.read_text().replace(old, new))
+    # Make sure the change is visible even on file systems with coarse modification times
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+@pytest.mark.parametrize(
+    "prompt_name", sorted(path.name for path in PromptyManager.PROMPTS_DIRECTORY.glob("*.prompty"))
+)
+def test_compiled_prompt_matches_prepare(prompt_name):
+    prompt_manager = PromptyManager()
+    prompt = prompt_manager.load_prompt(prompt_name)
+    assert prompt == PromptReference(prompt_name)
+    loaded = prompt_manager.current.prompts[prompt_name].prompt
+    assert prompt_manager.render_prompt(prompt, RENDER_DATA) == prompty.prepare(loaded, RENDER_DATA)
+
+
+def test_render_prompt_accepts_prompty_objects():
+    prompt_manager = PromptyManager()
+    prompt = prompty.load(PromptyManager.PROMPTS_DIRECTORY / "chat_answer_question.prompty")
+    assert prompt_manager.render_prompt(prompt, RENDER_DATA) == prompty.prepare(prompt, RENDER_DATA)
+
+
+def test_reload_swaps_in_new_version(prompts_directory):
+    prompt_manager = PromptyManager()
+    prompt = prompt_manager.load_prompt("chat_answer_question.prompty")
+    tools = prompt_manager.load_tools("chat_query_rewrite_tools.json")
+    assert prompt_manager.reload_if_changed() is None
+
+    edit_file(prompts_directory / "chat_answer_question.prompty", "Te cheamă MihAI", "Reloaded MihAI")
+    edit_file(prompts_directory / "chat_query_rewrite_tools.json", "search_sources", "search_documents")
+    assert sorted(prompt_manager.changed_files()) == ["chat_answer_question.prompty", "chat_query_rewrite_tools.json"]
+
+    version = prompt_manager.reload_if_changed()
+    assert version.number == 1
+    assert prompt_manager.changed_files() == []
+    assert "Reloaded MihAI" in prompt_manager.render_prompt(prompt, RENDER_DATA)[0]["content"]
+    assert prompt_manager.resolve_tools(tools)[0]["function"]["name"] == "search_documents"
+
+
+def test_reload_failure_keeps_current_version(prompts_directory):
+    prompt_manager = PromptyManager()
+    prompt = prompt_manager.load_prompt("chat_answer_question.prompty")
+    prompt_manager.load_tools("chat_query_rewrite_tools.json")
+    edit_file(prompts_directory / "chat_answer_question.prompty", "Te cheamă MihAI", "Reloaded MihAI")
+    edit_file(prompts_directory / "chat_query_rewrite_tools.json", "[", "{")
+
+    with pytest.raises(ValueError):
+        prompt_manager.reload()
+    assert prompt_manager.current.number == 0
+    assert "Reloaded" not in prompt_manager.render_prompt(prompt, RENDER_DATA)[0]["content"]
+
+
+@pytest.mark.asyncio
+async def test_pinned_version_survives_reload(prompts_directory):
+    prompt_manager = PromptyManager()
+    prompt = prompt_manager.load_prompt("chat_answer_question.prompty")
+    pinned = asyncio.Event()
+    reloaded = asyncio.Event()
+
+    async def in_flight_request():
+        prompt_manager.pin_version()
+        pinned.set()
+        await reloaded.wait()
+        return prompt_manager.render_prompt(prompt, RENDER_DATA)[0]["content"]
+
+    request_task = asyncio.create_task(in_flight_request())
+    await pinned.wait()
+    edit_file(prompts_directory / "chat_answer_question.prompty", "Te cheamă MihAI", "Reloaded MihAI")
+    prompt_manager.reload()
+    reloaded.set()
+
+    assert "Reloaded" not in await request_task
+    assert "Reloaded MihAI" in prompt_manager.render_prompt(prompt, RENDER_DATA)[0]["content"]
+
+
+def test_pinned_version_belongs_to_its_manager():
+    prompt_manager = PromptyManager()
+    prompt_manager.load_prompt("chat_answer_question.prompty")
+    other_manager = PromptyManager()
+    other_manager.load_prompt("chat_query_rewrite.prompty")
+
+    assert prompt_manager.pin_version() is prompt_manager.active_version()
+    assert other_manager.active_version() is other_manager.current
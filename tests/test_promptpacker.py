@@ -0,0 +1,100 @@
+import pytest
+
+from approaches.promptpacker import InvalidPromptBudgetError, PromptPacker
+from core.tokencounter import count_message_tokens, count_text_tokens
+
+PAST_MESSAGES = [
+    {"role": "user", "content": "What does my plan cover? " * 10},
+    {"role": "assistant", "content": "It covers medical, vision and dental. " * 10},
+    {"role": "user", "content": "Is dental included?"},
+    {"role": "assistant", "content": "Yes, dental is included."},
+]
+TEXT_SOURCES = [
+    "[Benefit_Options-2.pdf](link1): Northwind Health Plus covers dental. " * 5,
+    "[Benefit_Options-3.pdf](link2): Northwind Standard does not cover dental. " * 5,
+    "[Handbook-1.pdf](link3): Employees can enroll during open enrollment. " * 5,
+]
+USER_QUERY = "What about vision?"
+
+
+def input_tokens(past_messages, text_sources, reserved_tokens=0):
+    return (
+        reserved_tokens
+        + count_message_tokens({"role": "user", "content": USER_QUERY})
+        + sum(count_message_tokens(message) for message in past_messages)
+        + sum(count_text_tokens(source) for source in text_sources)
+    )
+
+
+def test_packer_disabled_by_default():
+    packed = PromptPacker().pack(PAST_MESSAGES, TEXT_SOURCES, USER_QUERY)
+    assert packed.past_messages is PAST_MESSAGES
+    assert packed.text_sources is TEXT_SOURCES
+    assert packed.max_input_tokens == 0
+
+
+def test_packer_keeps_inputs_within_budget():
+    budget = input_tokens(PAST_MESSAGES, TEXT_SOURCES)
+    packed = PromptPacker(max_input_tokens=budget, reserved_tokens=0).pack(PAST_MESSAGES, TEXT_SOURCES, USER_QUERY)
+    assert packed.past_messages == PAST_MESSAGES
+    assert packed.text_sources == TEXT_SOURCES
+    assert packed.tokens_saved == 0
+    assert packed.to_props()["tokens_after"] == budget
+
+
+def test_packer_drops_oldest_turns_first():
+    budget = input_tokens(PAST_MESSAGES[2:], TEXT_SOURCES)
+    packed = PromptPacker(max_input_tokens=budget, reserved_tokens=0).pack(PAST_MESSAGES, TEXT_SOURCES, USER_QUERY)
+    assert packed.past_messages == PAST_MESSAGES[2:]
+    assert packed.text_sources == TEXT_SOURCES
+    assert packed.dropped_messages == 2
+    assert packed.dropped_sources == 0
+    assert packed.tokens_after == budget
+    assert packed.tokens_saved == sum(count_message_tokens(message) for message in PAST_MESSAGES[:2])
+
+
+def test_packer_never_starts_with_assistant_message():
+    # Dropping only the first user message would leave its answer at the start, so the whole turn goes
+    budget = input_tokens(PAST_MESSAGES[1:], TEXT_SOURCES)
+    packed = PromptPacker(max_input_tokens=budget, reserved_tokens=0).pack(PAST_MESSAGES, TEXT_SOURCES, USER_QUERY)
+    assert packed.past_messages == PAST_MESSAGES[2:]
+    assert packed.dropped_messages == 2
+
+
+def test_packer_trims_lowest_ranked_sources_after_history():
+    budget = input_tokens([], TEXT_SOURCES[:2])
+    packed = PromptPacker(max_input_tokens=budget, reserved_tokens=0).pack(PAST_MESSAGES, TEXT_SOURCES, USER_QUERY)
+    assert packed.past_messages == []
+    assert packed.text_sources == TEXT_SOURCES[:2]
+    assert packed.dropped_messages == 4
+    assert packed.dropped_sources == 1
+
+
+def test_packer_keeps_best_source():
+    packed = PromptPacker(max_input_tokens=1, reserved_tokens=0).pack(PAST_MESSAGES, TEXT_SOURCES, USER_QUERY)
+    assert packed.past_messages == []
+    assert packed.text_sources == TEXT_SOURCES[:1]
+    assert packed.tokens_after > packed.max_input_tokens
+
+
+def test_packer_budget_override_and_fixed_tokens():
+    packer = PromptPacker(max_input_tokens=0, reserved_tokens=0)
+    budget = input_tokens([], TEXT_SOURCES)
+    packed = packer.pack([], TEXT_SOURCES, USER_QUERY, max_input_tokens=budget)
+    assert packed.text_sources == TEXT_SOURCES
+    # Image parts count against the budget too
+    packed = packer.pack([], TEXT_SOURCES, USER_QUERY, max_input_tokens=budget, fixed_tokens=85)
+    assert packed.text_sources == TEXT_SOURCES[:2]
+
+
+def test_packer_budget_override_is_clamped_and_validated():
+    budget = input_tokens([], TEXT_SOURCES)
+    packer = PromptPacker(max_input_tokens=budget - 1, reserved_tokens=0)
+    # A request can only lower the server's budget
+    packed = packer.pack([], TEXT_SOURCES, USER_QUERY, max_input_tokens=budget * 10)
+    assert packed.max_input_tokens == budget - 1
+    assert packed.text_sources == TEXT_SOURCES[:2]
+    assert packer.pack([], TEXT_SOURCES, USER_QUERY, max_input_tokens=10).max_input_tokens == 10
+    for invalid in (0, -1, "1000", 10.5, True):
+        with pytest.raises(InvalidPromptBudgetError):
+            packer.pack([], TEXT_SOURCES, USER_QUERY, max_input_tokens=invalid)
@@ -0,0 +1,74 @@
+import pytest
+
+from approaches.queryrewritepolicy import QueryRewritePolicy
+
+
+def test_policy_disabled_by_default():
+    policy = QueryRewritePolicy()
+    decision = policy.decide("What is the whistleblower policy?", [])
+    assert decision.skip is False
+    assert policy.get_cached("What is the whistleblower policy?", []) is None
+
+
+@pytest.mark.parametrize(
+    "user_query, past_messages, expected_skip, expected_reason",
+    [
+        ("What is the whistleblower policy?", [], True, "short first-turn query"),
+        ("Care este politica de concediu?", [], True, "short first-turn query"),
+        ("Does it cover dental?", [], False, "reference to earlier context"),
+        ("Ce acoperă asta?", [], False, "reference to earlier context"),
+        # Common words that are not anaphora do not count as references
+        ("Tell me more about parental leave", [], True, "short first-turn query"),
+        ("Mai am zile de concediu?", [], True, "short first-turn query"),
+        (
+            "What are all the benefits included in the Northwind Health Plus plan for employees and their families?",
+            [],
+            False,
+            "long query",
+        ),
+        (
+            "What about vision?",
+            [{"role": "user", "content": "Does my plan cover dental?"}, {"role": "assistant", "content": "Yes."}],
+            False,
+            "follow-up turn",
+        ),
+    ],
+)
+def test_policy_heuristics(user_query, past_messages, expected_skip, expected_reason):
+    policy = QueryRewritePolicy(skip_enabled=True)
+    decision = policy.decide(user_query, past_messages)
+    assert decision.skip is expected_skip
+    assert decision.reason == expected_reason
+
+
+def test_policy_classifier_overrides_heuristics():
+    policy = QueryRewritePolicy(skip_enabled=True, classifier=lambda user_query, past_messages: "dental" in user_query)
+    assert policy.decide("Does it cover vision?", []).skip is True
+    assert policy.decide("Is dental covered?", []).skip is False
+
+
+def test_policy_cache_keyed_on_recent_turns():
+    policy = QueryRewritePolicy(cache_size=10, history_turns=2)
+    history = [
+        {"role": "user", "content": "Does my plan cover dental?"},
+        {"role": "assistant", "content": "Yes."},
+    ]
+    policy.put_cached("What about vision?", history, "vision coverage plan")
+
+    assert policy.get_cached("What about vision?", history) == "vision coverage plan"
+    # Only the last history_turns messages are part of the key
+    assert (
+        policy.get_cached("What about vision?", [{"role": "system", "content": "x"}] + history)
+        == "vision coverage plan"
+    )
+    assert policy.get_cached("What about vision?", history[:1]) is None
+    assert policy.stats() == {"skipped": 0, "executed": 0, "cached": 2}
+
+
+def test_policy_cache_keyed_on_prompt_version():
+    policy = QueryRewritePolicy(cache_size=10)
+    policy.put_cached("What is the whistleblower policy?", [], "whistleblower policy", prompt_version=1)
+
+    assert policy.get_cached("What is the whistleblower policy?", [], prompt_version=1) == "whistleblower policy"
+    # A reloaded rewrite prompt does not reuse the rewrites of the previous one
+    assert policy.get_cached("What is the whistleblower policy?", [], prompt_version=2) is None
@@ -0,0 +1,83 @@
+import threading
+from types import SimpleNamespace
+
+import azure.cognitiveservices.speech
+import pytest
+
+from core.speechsynthesis import (
+    SpeechAudioCache,
+    SpeechSynthesisError,
+    SpeechSynthesisService,
+)
+
+from .mocks import MockAudio, MockAudioCancelled, MockSynthesisResult
+
+VOICE = "en-US-AndrewMultilingualNeural"
+
+
+def create_service(**kwargs) -> SpeechSynthesisService:
+    return SpeechSynthesisService(resource_id="test-id", location="eastus", voice=VOICE, **kwargs)
+
+
+async def collect(service: SpeechSynthesisService, text: str, token: str = "token") -> list[bytes]:
+    return [chunk async for chunk in service.stream_audio(text, token)]
+
+
+def test_audio_cache_is_bounded_by_bytes():
+    cache = SpeechAudioCache(max_bytes=10)
+    first, second = SpeechAudioCache.make_key(VOICE, "first"), SpeechAudioCache.make_key(VOICE, "second")
+    assert first != SpeechAudioCache.make_key("en-US-AvaNeural", "first")
+    cache.put(first, b"123456")
+    cache.put(second, b"123456")
+    assert cache.get(first) is None
+    assert cache.get(second) == b"123456"
+    assert cache.current_bytes == 6
+    cache.put(first, b"too long for the cache")
+    assert len(cache) == 1
+
+
+@pytest.mark.asyncio
+async def test_stream_audio_streams_chunks_and_caches(monkeypatch):
+    service = create_service(max_workers=1, audio_cache=SpeechAudioCache())
+    synthesizers = []
+
+    def mock_speak_text(self, text):
+        synthesizers.append(self)
+
+        # Like the SDK, which signals synthesizing events on its own thread rather than the caller's
+        def signal_chunks():
+            for chunk in (b"chunk1", b"chunk2"):
+                self.synthesizing.signal(SimpleNamespace(result=SimpleNamespace(audio_data=chunk)))
+
+        sdk_thread = threading.Thread(target=signal_chunks)
+        sdk_thread.start()
+        sdk_thread.join()
+        return MockSynthesisResult(MockAudio(b"chunk1chunk2"))
+
+    monkeypatch.setattr(azure.cognitiveservices.speech.SpeechSynthesizer, "speak_text_async", mock_speak_text)
+
+    assert await collect(service, "Hello") == [b"chunk1", b"chunk2"]
+    assert await collect(service, "Hello") == [b"chunk1chunk2"]
+    assert len(synthesizers) == 1
+
+    assert await collect(service, "Goodbye") == [b"chunk1", b"chunk2"]
+    assert synthesizers[1] is synthesizers[0]
+    # The callback of a synthesis is disconnected once it ends, so a reused synthesizer only streams to its request
+    assert not synthesizers[0].synthesizing.is_connected()
+    await collect(service, "Hello again", token="new-token")
+    assert synthesizers[2] is not synthesizers[0]
+    service.close()
+
+
+@pytest.mark.asyncio
+async def test_stream_audio_canceled(monkeypatch):
+    service = create_service(audio_cache=SpeechAudioCache())
+    monkeypatch.setattr(
+        azure.cognitiveservices.speech.SpeechSynthesizer,
+        "speak_text_async",
+        lambda self, text: MockSynthesisResult(MockAudioCancelled(b"")),
+    )
+    with pytest.raises(SpeechSynthesisError, match="canceled"):
+        await collect(service, "Hello")
+    assert len(service.audio_cache) == 0
+    service.close()
@@ -0,0 +1,63 @@
+import json
+import logging
+
+from core.structuredlogging import (
+    SamplingFilter,
+    StructuredFormatter,
+    configure_logging,
+    parse_category_settings,
+    stop_logging,
+)
+
+
+def make_record(name="approaches.timing", level=logging.INFO, msg="Retrieval took: %.3f s", args=(1.5,), **extra):
+    record = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_parse_category_settings():
+    assert parse_category_settings("approaches.timing=DEBUG, chat_logging = WARNING,,invalid") == {
+        "approaches.timing": "DEBUG",
+        "chat_logging": "WARNING",
+    }
+    assert parse_category_settings(None) == {}
+
+
+def test_structured_formatter_fields():
+    record = make_record(request_id="request-1", duration_seconds=1.5)
+    entry = json.loads(StructuredFormatter(json_output=True).format(record))
+    assert entry["message"] == "Retrieval took: 1.500 s"
+    assert entry["logger"] == "approaches.timing"
+    assert entry["request_id"] == "request-1"
+    assert entry["duration_seconds"] == 1.5
+
+    text = StructuredFormatter().format(make_record(request_id="request-1"))
+    assert text.endswith("INFO approaches.timing: Retrieval took: 1.500 s request_id=request-1")
+
+
+def test_sampling_filter_keeps_an_even_fraction():
+    sampling = SamplingFilter({"approaches": 1.0, "approaches.timing": 0.25})
+    kept = [sampling.filter(make_record()) for _ in range(8)]
+    assert kept == [False, False, False, True, False, False, False, True]
+    assert sampling.filter(make_record(name="approaches.chatreadretrieveread"))
+    assert sampling.filter(make_record(name="app"))
+    assert sampling.filter(make_record(level=logging.WARNING))
+
+
+def test_configure_logging_writes_through_listener(capsys):
+    non_blocking_logging = configure_logging(
+        app_level="INFO", category_levels={"chat_logging": "WARNING"}, json_output=True
+    )
+    try:
+        assert logging.getLogger("chat_logging.chat_logger").getEffectiveLevel() == logging.WARNING
+        logging.getLogger("approaches.chatreadretrieveread").info("Feedback %s", "up", extra={"request_id": "r1"})
+        logging.getLogger("chat_logging.chat_logger").info("Chat start")
+        assert non_blocking_logging.queue_handler in logging.getLogger().handlers
+    finally:
+        stop_logging()
+    assert non_blocking_logging.queue_handler not in logging.getLogger().handlers
+
+    lines = [json.loads(line) for line in capsys.readouterr().err.splitlines()]
+    assert [(line["logger"], line["message"]) for line in lines] == [("approaches.chatreadretrieveread", "Feedback up")]
+    assert lines[0]["request_id"] == "r1"
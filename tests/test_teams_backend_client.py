@@ -0,0 +1,78 @@
+import json
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from backend_client import BackendClient
+
+THOUGHTS = [{"title": "Search results", "description": "x" * 100_000}]
+
+
+async def start_backend(events: list[dict], requests: list[dict]) -> TestServer:
+    async def chat_stream(request: web.Request) -> web.StreamResponse:
+        requests.append(await request.json())
+        response = web.StreamResponse(headers={"Content-Type": "application/json-lines"})
+        await response.prepare(request)
+        body = "".join(json.dumps(event) + "\n" for event in events).encode()
+        # Chunk boundaries that don't line up with the lines
+        for start in range(0, len(body), 7000):
+            await response.write(body[start : start + 7000])
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_post("/chat/stream", chat_stream)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_yields_events_and_sends_only_new_message():
+    events = [
+        {"delta": {"role": "assistant"}, "context": {"thoughts": THOUGHTS}, "session_state": "session-1"},
+        {"delta": {"content": "Hello"}},
+        {"delta": {"content": " world"}},
+    ]
+    requests = []
+    server = await start_backend(events, requests)
+    client = BackendClient(str(server.make_url("/")), read_timeout=5)
+    try:
+        received = [
+            event
+            async for event in client.chat_stream(
+                "Next question",
+                history=[{"user": "First question", "assistant": "First answer"}],
+                context={"overrides": {"top": 3}},
+                session_state="session-1",
+                server_side_history=True,
+            )
+        ]
+    finally:
+        await client.close()
+        await server.close()
+
+    assert received == events
+    assert requests == [
+        {
+            "messages": [{"role": "user", "content": "Next question"}],
+            "context": {"overrides": {"top": 3}},
+            "session_state": "session-1",
+            "server_side_history": True,
+        }
+    ]
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_raises_backend_error():
+    server = await start_backend([{"delta": {"content": "Hel"}}, {"error": "The app encountered an error"}], [])
+    client = BackendClient(str(server.make_url("/")))
+    received = []
+    try:
+        with pytest.raises(Exception, match="Backend error: The app encountered an error"):
+            async for event in client.chat_stream("Question", history=[{"user": "Earlier", "assistant": "Answer"}]):
+                received.append(event)
+    finally:
+        await client.close()
+        await server.close()
+    assert received == [{"delta": {"content": "Hel"}}]
@@ -0,0 +1,64 @@
+import pytest
+from teams_formatting import format_for_teams
+
+LINK_MAPPING = {
+    "link1": "https://account.blob.core.windows.net/content/Regulament.pdf?sig=abc%3D#page=2",
+    "link2": "https://account.blob.core.windows.net/content/Manual.pdf?sig=def%3D#page=7",
+}
+
+ANSWER = (
+    "<p>Angajatul are dreptul la <strong>21 de zile</strong> de concediu de odihnă pe an<sup>**1**</sup>.</p>\n"
+    "<p>Cererea se depune cu <em>cel puțin 5 zile</em> înainte<sup>**1; 2**</sup>:<br>"
+    "- la <b>managerul direct</b>;<br/>\n"
+    "- la <i>departamentul HR</i>.</p>\n"
+    '<div class="sources">Surse:<br />\n'
+    "1. [Regulament.pdf#page=2](link1)<br>\n"
+    "2. [Manual.pdf#page=7](link2)<br>\n"
+    "3. [Anexa.pdf](link3)</div>"
+)
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("Fără formatare.", "Fără formatare."),
+        ("<strong>bold</strong> și <b>bold</b>", "**bold** și **bold**"),
+        ("<em>italic</em> și <i>italic</i>", "*italic* și *italic*"),
+        ("<sup>1</sup>", "**¹**"),
+        ("<sup>**1; 2**</sup>", "****¹; ²****"),
+        ("<sup> 12 (3-4) </sup>", "**¹² ⁽³⁻⁴⁾**"),
+        ("<sup> </sup>gol", "gol"),
+        ("<sup>1\n2</sup>", "**¹\n²**"),
+        ("<sup><b>3</b></sup>", "**³**"),
+        ("a<br>b<br/>c<br />d<p>e</p>", "a\nb\nc\nd\ne\n"),
+        ("<strong><em>ambele</em></strong>", "***ambele***"),
+        ("<strong>fără închidere", "fără închidere"),
+        ("<strong>pe două\nrânduri</strong>", "pe două\nrânduri"),
+        ("<div class='x'><span>text</span></div>", "text"),
+        ("</b>text<b>", "text"),
+        ("a < b", "a < b"),
+        ("<b>1<2</b>", "**1<2**"),
+        ("x<3 și y>2", "x<3 și y>2"),
+        ("a <> b", "a <> b"),
+    ],
+)
+def test_format_for_teams(text, expected):
+    assert format_for_teams(text) == expected
+
+
+def test_format_for_teams_links():
+    text = "Vezi [Regulament.pdf](link1), [<b>Manual</b>](link2) și [Anexa.pdf](link3)."
+    assert format_for_teams(text, LINK_MAPPING) == (
+        f"Vezi [Regulament.pdf]({LINK_MAPPING['link1']}), [**Manual**]({LINK_MAPPING['link2']}) și [Anexa.pdf](link3)."
+    )
+    assert format_for_teams(text) == "Vezi [Regulament.pdf](link1), [**Manual**](link2) și [Anexa.pdf](link3)."
+
+
+def test_format_for_teams_answer(snapshot):
+    snapshot.assert_match(format_for_teams(ANSWER, LINK_MAPPING), "answer.md")
+
+
+def test_format_for_teams_partial_answer():
+    # Streamed partial answers can end inside a tag or before its closing tag
+    assert format_for_teams("Dreptul la <strong>21 de") == "Dreptul la 21 de"
+    assert format_for_teams("Dreptul la <stro") == "Dreptul la <stro"